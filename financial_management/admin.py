@@ -7,7 +7,12 @@ from .models import (
     Expense,
     FinancialRecord,
     Invoice,
+    PeriodBalance,
+    BudgetLedgerEntry,
+    BudgetLedgerSnapshot,
+    ClientAgeing,
 )
+from . import budget_ledger
 from django.utils.translation import gettext_lazy as _
 
 # Administration pour Budget
@@ -32,23 +37,31 @@ class BudgetAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         if not change:
             obj.remaining_amount = obj.total_amount
-        super().save_model(request, obj, form, change)
+            super().save_model(request, obj, form, change)
+            return
+        # Le reste disponible n'est modifié que par le journal du budget
+        fields = [name for name in form.changed_data if name != 'total_amount']
+        if fields:
+            obj.save(update_fields=fields + ['updated_at'])
+        if 'total_amount' in form.changed_data:
+            budget_ledger.set_total(obj.pk, obj.total_amount, user=request.user)
 
 # Administration pour Revenue
 @admin.register(Revenue)
 class RevenueAdmin(admin.ModelAdmin):
     list_display = (
         'source',
+        'dimension',
         'amount',
         'date',
         'description',
         'recorded_by',
         'created_at',
     )
-    search_fields = ('source', 'recorded_by__username', 'description')
+    search_fields = ('source', 'dimension', 'recorded_by__username', 'description')
     list_filter = ('source', 'date', 'recorded_by')
     ordering = ('-date',)
-    readonly_fields = ('created_at',)
+    readonly_fields = ('created_at', 'reconciliation_key')
 
 # Administration pour Expense
 @admin.register(Expense)
@@ -137,3 +150,65 @@ class InvoiceAdmin(admin.ModelAdmin):
     def client_name(self, obj):
         return obj.client_name
     client_name.short_description = 'Nom du Client'
+
+# Administration pour PeriodBalance
+@admin.register(PeriodBalance)
+class PeriodBalanceAdmin(admin.ModelAdmin):
+    list_display = (
+        'month',
+        'kind',
+        'dimension',
+        'budget',
+        'amount',
+        'entry_count',
+        'reconciled_at',
+    )
+    list_filter = ('kind', 'dimension', 'month')
+    ordering = ('-month', 'kind', 'dimension')
+    readonly_fields = ('reconciled_at', 'updated_at')
+
+# Administration pour BudgetLedgerEntry (journal en lecture seule)
+@admin.register(BudgetLedgerEntry)
+class BudgetLedgerEntryAdmin(admin.ModelAdmin):
+    list_display = (
+        'budget',
+        'entry_type',
+        'amount',
+        'balance_after',
+        'reference',
+        'created_by',
+        'created_at',
+    )
+    search_fields = ('budget__name', 'reference', 'description')
+    list_filter = ('entry_type', 'created_at')
+    ordering = ('-id',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+# Administration pour BudgetLedgerSnapshot
+@admin.register(BudgetLedgerSnapshot)
+class BudgetLedgerSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('budget', 'balance', 'entry_count', 'last_entry_id', 'taken_at')
+    readonly_fields = ('budget', 'balance', 'entry_count', 'last_entry_id', 'taken_at')
+
+# Administration pour ClientAgeing
+@admin.register(ClientAgeing)
+class ClientAgeingAdmin(admin.ModelAdmin):
+    list_display = (
+        'client',
+        'as_of',
+        'days_0_30',
+        'days_31_60',
+        'days_61_90',
+        'days_over_90',
+        'invoice_count',
+    )
+    search_fields = ('client__username',)
+    readonly_fields = ('as_of', 'days_0_30', 'days_31_60', 'days_61_90', 'days_over_90', 'invoice_count', 'updated_at')
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class FinancialManagementConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "financial_management"
+
+    def ready(self):
+        import financial_management.signals
@@ -0,0 +1,158 @@
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Budget, BudgetLedgerEntry, BudgetLedgerSnapshot
+from .charts import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+# Les identifiants sont attribués à l'insertion mais visibles au commit : une écriture plus
+# récente que ce délai peut encore précéder une écriture d'identifiant inférieur non validée.
+# Les instantanés s'arrêtent avant, sinon cette écriture serait ignorée par ledger_balance.
+SNAPSHOT_LAG = timedelta(minutes=5)
+
+
+class InsufficientBudget(Exception):
+    """Reste disponible insuffisant (ou budget inexistant) pour la dépense"""
+
+
+def _amount(value):
+    amount = Decimal(str(value))
+    if amount <= 0:
+        raise ValueError("Amount must be positive")
+    return amount
+
+
+def _append(budget_id, entry_type, amount, user=None, description='', reference=''):
+    """Ajoute l'écriture au journal avec le reste disponible lu dans la transaction du mouvement"""
+    balance = Budget.objects.filter(pk=budget_id).values_list('remaining_amount', flat=True).get()
+    transaction.on_commit(bump_data_version)
+    return BudgetLedgerEntry.objects.create(
+        budget_id=budget_id, entry_type=entry_type, amount=amount, balance_after=balance,
+        description=description, reference=reference, created_by=user
+    )
+
+
+def record_allocation(budget):
+    """Écriture d'ouverture d'un budget créé"""
+    return BudgetLedgerEntry.objects.create(
+        budget_id=budget.pk, entry_type='allocation', amount=Decimal(str(budget.remaining_amount)),
+        balance_after=Decimal(str(budget.remaining_amount)), created_by=budget.created_by
+    )
+
+
+def record_expense(budget_id, amount, user=None, description='', reference=''):
+    """
+    Impute une dépense : le reste disponible est décrémenté par un seul UPDATE conditionnel
+    (reste >= montant), sans lecture préalable, puis l'écriture est ajoutée au journal dans
+    la même transaction. Des imputations concurrentes ne peuvent ni s'écraser ni rendre le
+    reste négatif. InsufficientBudget si la condition échoue.
+    """
+    amount = _amount(amount)
+    with transaction.atomic():
+        updated = Budget.objects.filter(pk=budget_id, remaining_amount__gte=amount).update(
+            remaining_amount=F('remaining_amount') - amount, updated_at=timezone.now()
+        )
+        if not updated:
+            raise InsufficientBudget(f"Insufficient budget for {amount}")
+        return _append(budget_id, 'expense', -amount, user, description, reference)
+
+
+def reverse_expense(budget_id, amount, user=None, description='', reference=''):
+    """Restitue au budget le montant d'une dépense annulée"""
+    amount = _amount(amount)
+    with transaction.atomic():
+        Budget.objects.filter(pk=budget_id).update(
+            remaining_amount=F('remaining_amount') + amount, updated_at=timezone.now()
+        )
+        return _append(budget_id, 'reversal', amount, user, description, reference)
+
+
+def set_total(budget_id, total_amount, user=None):
+    """
+    Change le montant total ; l'écart est reporté sur le reste disponible. Opération rare :
+    la ligne est verrouillée le temps de lire l'ancien total.
+    """
+    total_amount = Decimal(str(total_amount))
+    with transaction.atomic():
+        current = Budget.objects.select_for_update().filter(pk=budget_id).values_list('total_amount', flat=True).get()
+        difference = total_amount - current
+        if not difference:
+            return None
+        Budget.objects.filter(pk=budget_id).update(
+            total_amount=total_amount, remaining_amount=F('remaining_amount') + difference, updated_at=timezone.now()
+        )
+        return _append(budget_id, 'adjustment', difference, user, f"Total {current} -> {total_amount}")
+
+
+# ----------------------------------------------------------------------
+# Soldes et instantanés
+# ----------------------------------------------------------------------
+
+def ledger_balance(budget_id):
+    """Solde du journal : dernier instantané plus les écritures postérieures"""
+    last_entry_id, balance = BudgetLedgerSnapshot.objects.filter(budget_id=budget_id).values_list(
+        'last_entry_id', 'balance'
+    ).first() or (0, Decimal('0'))
+    delta = BudgetLedgerEntry.objects.filter(budget_id=budget_id, id__gt=last_entry_id).aggregate(
+        total=Sum('amount')
+    )['total']
+    return balance + (delta or 0)
+
+
+def _after_snapshot():
+    snapshot_entry = BudgetLedgerSnapshot.objects.filter(budget_id=OuterRef('budget_id')).values('last_entry_id')
+    return BudgetLedgerEntry.objects.filter(id__gt=Coalesce(Subquery(snapshot_entry), Value(0))).order_by()
+
+
+def take_snapshots(now=None):
+    """
+    Arrête le solde du journal des budgets ayant de nouvelles écritures antérieures à
+    SNAPSHOT_LAG (une requête pour les écritures nouvelles, un upsert groupé) et signale
+    les budgets dont le reste disponible ne correspond plus au journal. Retourne le
+    nombre d'instantanés écrits.
+    """
+    cutoff = (now or timezone.now()) - SNAPSHOT_LAG
+    new_entries = _after_snapshot().filter(created_at__lt=cutoff).values('budget_id').annotate(
+        total=Sum('amount'), count=Count('id'), last=Max('id')
+    )
+    new_entries = {row['budget_id']: row for row in new_entries}
+    if not new_entries:
+        return 0
+
+    previous = {
+        snapshot.budget_id: snapshot
+        for snapshot in BudgetLedgerSnapshot.objects.filter(budget_id__in=new_entries)
+    }
+    taken_at = timezone.now()
+    snapshots = []
+    for budget_id, row in new_entries.items():
+        before = previous.get(budget_id)
+        snapshots.append(BudgetLedgerSnapshot(
+            budget_id=budget_id, last_entry_id=row['last'], taken_at=taken_at,
+            balance=(before.balance if before else 0) + row['total'],
+            entry_count=(before.entry_count if before else 0) + row['count'],
+        ))
+    # MySQL (ON DUPLICATE KEY UPDATE) n'accepte pas de cible de conflit : la clé unique du budget s'applique
+    BudgetLedgerSnapshot.objects.bulk_create(
+        snapshots, batch_size=500, update_conflicts=True,
+        unique_fields=['budget'] if connection.features.supports_update_conflicts_with_target else None,
+        update_fields=['last_entry_id', 'balance', 'entry_count', 'taken_at']
+    )
+
+    # Solde du journal : instantané plus les écritures trop récentes pour y figurer
+    pending = dict(_after_snapshot().filter(budget_id__in=new_entries).values('budget_id').annotate(
+        total=Sum('amount')
+    ).values_list('budget_id', 'total'))
+    remaining = dict(Budget.objects.filter(pk__in=new_entries).values_list('id', 'remaining_amount'))
+    drifted = [
+        snapshot.budget_id for snapshot in snapshots
+        if remaining.get(snapshot.budget_id) != snapshot.balance + pending.get(snapshot.budget_id, 0)
+    ]
+    if drifted:
+        logger.warning(f"Budget ledger out of balance for budgets {drifted}")
+    return len(snapshots)
@@ -0,0 +1,87 @@
+from decimal import Decimal
+from django.db import connection
+from django.db.models import Case, DecimalField, F, Func, Sum, Value, When, Window
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from .models import FinancialRecord
+
+PERIODS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+CHUNK_SIZE = 2000
+
+# Signe de chaque type d'enregistrement dans la trésorerie : un transfert est un mouvement
+# interne (sans effet sur le solde), un ajustement est saisi déjà signé.
+SIGNS = {
+    'income': 1,
+    'expense': -1,
+    'transfer': 0,
+    'adjustment': 1,
+}
+
+AMOUNT_FIELD = DecimalField(max_digits=18, decimal_places=2)
+
+
+class RunningTotal(Func):
+    """SUM(<agrégat>) utilisable dans une fenêtre : cumul des totaux par période (SUM(SUM(x)) OVER ...)"""
+    function = 'SUM'
+    window_compatible = True
+    output_field = AMOUNT_FIELD
+
+
+def signed_amount(record_type, amount):
+    return amount * SIGNS.get(record_type, 0)
+
+
+def signed_amount_expression():
+    """Montant signé selon le type d'enregistrement, calculé par la base"""
+    return Case(
+        *[When(record_type=record_type, then=F('amount') * sign) for record_type, sign in SIGNS.items() if sign],
+        default=Value(0), output_field=AMOUNT_FIELD
+    )
+
+
+def _typed_amount(record_type):
+    return Case(When(record_type=record_type, then=F('amount')), default=Value(0), output_field=AMOUNT_FIELD)
+
+
+def cash_flow_series(start_date, end_date, period='day'):
+    """
+    Flux de trésorerie agrégés par période (jour, semaine ou mois) : entrées, sorties, solde
+    net et cumul depuis le début de la plage. L'agrégation et le cumul (fonction de fenêtre)
+    sont faits par la base ; sans fenêtres, le cumul est tenu à la lecture. Générateur lu par
+    paquets : la mémoire ne dépend pas de la longueur de la plage.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {sorted(PERIODS)}")
+    buckets = FinancialRecord.objects.filter(date__range=[start_date, end_date]).annotate(
+        period_start=PERIODS[period]('date')
+    ).order_by().values('period_start').annotate(
+        inflow=Sum(_typed_amount('income')),
+        outflow=Sum(_typed_amount('expense')),
+        net=Sum(signed_amount_expression()),
+    ).order_by('period_start')
+
+    windowed = connection.features.supports_over_clause
+    if windowed:
+        buckets = buckets.annotate(cumulative_cash=Window(
+            RunningTotal(Sum(signed_amount_expression())), order_by=F('period_start').asc()
+        ))
+
+    cumulative = Decimal('0')
+    for bucket in buckets.iterator(chunk_size=CHUNK_SIZE):
+        cumulative = bucket['cumulative_cash'] if windowed else cumulative + bucket['net']
+        yield {
+            'date': bucket['period_start'],
+            'inflow': bucket['inflow'],
+            'outflow': bucket['outflow'],
+            'net': bucket['net'],
+            'cumulative_cash': cumulative,
+        }
+
+
+def opening_balance(start_date):
+    """Solde de trésorerie cumulé avant la plage"""
+    total = FinancialRecord.objects.filter(date__lt=start_date).aggregate(total=Sum(signed_amount_expression()))
+    return total['total'] or Decimal('0')
@@ -0,0 +1,129 @@
+import hashlib
+import json
+from io import BytesIO
+from urllib.parse import urlencode
+from django.core.cache import cache
+from django.urls import reverse
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+# Version des données financières : incrémentée à chaque écriture (signals.py), elle fait
+# partie de la clé des graphiques en cache, qui deviennent ainsi caducs sans purge explicite.
+DATA_VERSION_KEY = 'financial_data_version'
+CHART_TIMEOUT = 24 * 3600
+
+
+def data_version():
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        cache.add(DATA_VERSION_KEY, 1, timeout=None)
+        version = cache.get(DATA_VERSION_KEY, 1)
+    return version
+
+
+def bump_data_version():
+    try:
+        cache.incr(DATA_VERSION_KEY)
+    except ValueError:
+        cache.add(DATA_VERSION_KEY, 2, timeout=None)
+
+
+def chart_params(start_date, end_date, **extra):
+    params = {'start_date': str(start_date), 'end_date': str(end_date)}
+    params.update({name: str(value) for name, value in extra.items() if value not in (None, '')})
+    return params
+
+
+def chart_url(report, params):
+    """URL du graphique, rendu au premier affichage seulement"""
+    return f"{reverse('financial-chart', kwargs={'report': report})}?{urlencode(sorted(params.items()))}"
+
+
+def chart_etag(report, params, version=None):
+    """Empreinte du graphique : rapport, paramètres et version des données"""
+    digest = hashlib.sha1(json.dumps([report, params], sort_keys=True).encode()).hexdigest()
+    return f"{digest}-{version or data_version()}"
+
+
+def chart_key(report, params, version=None):
+    return f"financial_chart:{chart_etag(report, params, version)}"
+
+
+def get_chart(report, params):
+    """PNG du graphique (None si aucune donnée), servi depuis le cache tant que les données n'ont pas changé"""
+    key = chart_key(report, params)
+    png = cache.get(key)
+    if png is None:
+        figure = CHARTS[report](params)
+        png = render_png(figure) if figure is not None else b''
+        cache.set(key, png, timeout=CHART_TIMEOUT)
+    return png or None
+
+
+def render_png(figure):
+    """Rendu Agg d'une Figure autonome (hors de l'état global de pyplot, libérée après usage)"""
+    canvas = FigureCanvasAgg(figure)
+    buffer = BytesIO()
+    canvas.print_png(buffer)
+    figure.clear()
+    return buffer.getvalue()
+
+
+def budget_chart(params):
+    from .financial_reports import budget_rows
+    rows = budget_rows(params['start_date'], params['end_date'])
+    if not rows:
+        return None
+    figure = Figure(figsize=(10, 6))
+    ax = figure.add_subplot()
+    positions = range(len(rows))
+    width = 0.27
+    for offset, (field, label) in enumerate([('total_amount', 'Total'), ('spent', 'Dépensé'), ('remaining', 'Restant')]):
+        ax.bar([position + (offset - 1) * width for position in positions], [row[field] for row in rows], width, label=label)
+    ax.set_xticks(list(positions), [row['name'] for row in rows])
+    ax.set_title('Aperçu des budgets')
+    ax.set_xlabel('Budgets')
+    ax.set_ylabel('Montant')
+    ax.legend()
+    return figure
+
+
+def revenue_expense_chart(params):
+    from .financial_reports import revenue_expense_rows
+    revenues, expenses = revenue_expense_rows(params['start_date'], params['end_date'])
+    if not revenues and not expenses:
+        return None
+    figure = Figure(figsize=(15, 7))
+    revenue_ax, expense_ax = figure.subplots(1, 2)
+    for ax, rows, label, title in [
+        (revenue_ax, revenues, 'source', 'Répartition des revenus'),
+        (expense_ax, expenses, 'category', 'Répartition des dépenses'),
+    ]:
+        if rows:
+            ax.pie([float(row['total']) for row in rows], labels=[row[label] for row in rows], autopct='%1.1f%%')
+            ax.set_title(title)
+        else:
+            ax.axis('off')
+    return figure
+
+
+def cash_flow_chart(params):
+    from .financial_reports import cash_flow_rows
+    rows = cash_flow_rows(params['start_date'], params['end_date'], params.get('period', 'day'))
+    if not rows:
+        return None
+    figure = Figure(figsize=(12, 6))
+    ax = figure.add_subplot()
+    ax.plot([row['date'] for row in rows], [float(row['cumulative_cash']) for row in rows])
+    ax.set_title('Flux de trésorerie cumulé')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Montant cumulé')
+    figure.autofmt_xdate()
+    return figure
+
+
+CHARTS = {
+    'budget': budget_chart,
+    'revenue_expense': revenue_expense_chart,
+    'cash_flow': cash_flow_chart,
+}
@@ -0,0 +1,142 @@
+import logging
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from membership_management.models import Payment, Transaction
+from transport_management.models import PassengerTripHistory, TransactionScan
+from .models import Revenue
+from .charts import bump_data_version
+from . import period_balances
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2000
+BATCH_SIZE = 500
+RECONCILED_DESCRIPTION = 'Recettes rapprochées automatiquement'
+
+
+def day_range(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def reconciliation_key(day, source, dimension):
+    return f"{day.isoformat()}:{source}:{dimension}"
+
+
+def fare_revenue(day):
+    """
+    Recettes de la journée agrégées par la base : {(source, dimension): (montant, nombre)}.
+    Tarifs des voyages effectués par ligne, abonnements par formule, frais d'inscription.
+    Les rechargements de solde sont des avances, pas des recettes.
+    """
+    start, end = day_range(day)
+    revenue = {}
+
+    def add(key, total, count):
+        amount, entries = revenue.get(key, (Decimal('0'), 0))
+        revenue[key] = (amount + (total or 0), entries + count)
+
+    fares = PassengerTripHistory.objects.filter(
+        trip_date__gte=start, trip_date__lt=end, status='completed', fare_paid__gt=0
+    ).order_by().values_list('trip__route_id').annotate(total=Sum('fare_paid'), count=Count('id'))
+    for route_id, total, count in fares.iterator(chunk_size=CHUNK_SIZE):
+        add(('ticket_sales', f"route:{route_id}"), total, count)
+
+    payments = Payment.objects.filter(
+        payment_date__gte=start, payment_date__lt=end, status='completed',
+        payment_type__in=('subscription', 'registration')
+    ).order_by().values_list('payment_type', 'subscription__plan_id').annotate(total=Sum('amount'), count=Count('id'))
+    for payment_type, plan_id, total, count in payments.iterator(chunk_size=CHUNK_SIZE):
+        if payment_type == 'subscription':
+            add(('subscription', f"plan:{plan_id or 'none'}"), total, count)
+        else:
+            add(('other', 'registration'), total, count)
+    return revenue
+
+
+def mismatches(day):
+    """Écarts entre flux à rapprocher : scans réussis / voyages payés par ligne, rechargements / crédits de solde"""
+    start, end = day_range(day)
+    scans = dict(
+        TransactionScan.objects.filter(timestamp__gte=start, timestamp__lt=end, scan_status='successful')
+        .order_by().values_list('trip__route_id').annotate(count=Count('id')).iterator(chunk_size=CHUNK_SIZE)
+    )
+    fare_trips = dict(
+        PassengerTripHistory.objects.filter(trip_date__gte=start, trip_date__lt=end, status='completed')
+        .order_by().values_list('trip__route_id').annotate(count=Count('id')).iterator(chunk_size=CHUNK_SIZE)
+    )
+    routes = [
+        {'route_id': route_id, 'scans': scans.get(route_id, 0), 'paid_trips': fare_trips.get(route_id, 0)}
+        for route_id in sorted(set(scans) | set(fare_trips), key=lambda route_id: (route_id is None, route_id or 0))
+        if scans.get(route_id, 0) != fare_trips.get(route_id, 0)
+    ]
+
+    top_ups = Payment.objects.filter(
+        payment_date__gte=start, payment_date__lt=end, status='completed', payment_type='top_up'
+    ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
+    credits = Transaction.objects.filter(
+        timestamp__gte=start, timestamp__lt=end, transaction_type='credit'
+    ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
+    return {
+        'routes': routes,
+        'top_ups': {'payments': top_ups, 'credits': credits, 'difference': top_ups - credits},
+    }
+
+
+def reconcile(day, dry_run=False):
+    """
+    Rapproche les recettes d'une journée : upsert groupé des lignes Revenue clés par
+    (date, source, dimension), suppression des clés disparues, puis rapport d'écarts
+    (montants déjà rapprochés qui changent, flux qui ne concordent pas). Rejouable.
+    """
+    revenue = fare_revenue(day)
+    rows = [
+        Revenue(
+            source=source, dimension=dimension, amount=amount, date=day,
+            description=f"{RECONCILED_DESCRIPTION} ({count})",
+            reconciliation_key=reconciliation_key(day, source, dimension)
+        )
+        for (source, dimension), (amount, count) in sorted(revenue.items())
+    ]
+    keys = {row.reconciliation_key for row in rows}
+    previous = dict(
+        Revenue.objects.filter(date=day, reconciliation_key__isnull=False).values_list('reconciliation_key', 'amount')
+    )
+    report = {
+        'date': day.isoformat(),
+        'rows': len(rows),
+        'total': sum((row.amount for row in rows), Decimal('0')),
+        'changed': [
+            {'key': row.reconciliation_key, 'previous': previous[row.reconciliation_key], 'current': row.amount}
+            for row in rows
+            if row.reconciliation_key in previous and previous[row.reconciliation_key] != row.amount
+        ],
+        'removed': sorted(set(previous) - keys),
+        **mismatches(day),
+    }
+    if dry_run:
+        return report
+
+    with transaction.atomic():
+        # MySQL (ON DUPLICATE KEY UPDATE) n'accepte pas de cible de conflit : la clé de rapprochement,
+        # seule clé unique de Revenue hors pk, s'applique
+        Revenue.objects.bulk_create(
+            rows, batch_size=BATCH_SIZE, update_conflicts=True,
+            unique_fields=['reconciliation_key'] if connection.features.supports_update_conflicts_with_target else None,
+            update_fields=['source', 'dimension', 'amount', 'date', 'description']
+        )
+        if report['removed']:
+            Revenue.objects.filter(reconciliation_key__in=report['removed']).delete()
+        # L'upsert groupé ne passe pas par les signaux : soldes du mois et graphiques rafraîchis ici
+        period_balances.reconcile_month(day)
+        transaction.on_commit(bump_data_version)
+
+    if report['changed'] or report['removed'] or report['routes'] or report['top_ups']['difference']:
+        logger.warning(
+            f"Fare reconciliation {day}: {len(report['changed'])} changed, {len(report['removed'])} removed, "
+            f"{len(report['routes'])} route mismatches, top-up difference {report['top_ups']['difference']}"
+        )
+    return report
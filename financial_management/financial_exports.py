@@ -0,0 +1,44 @@
+from .financial_reports import budget_rows, revenue_expense_rows, cash_flow_rows, generate_financial_health_report
+
+# Mise en forme tabulaire (en-tête, lignes) des données des rapports, lues par financial_reports
+
+BUDGET_COLUMNS = ['name', 'type', 'start_date', 'end_date', 'total_amount', 'spent', 'remaining', 'percentage_used']
+CASH_FLOW_COLUMNS = ['date', 'inflow', 'outflow', 'net', 'cumulative_cash']
+
+
+def _table(columns, rows):
+    return columns, ([row[column] for column in columns] for row in rows)
+
+
+def budget_table(start_date, end_date):
+    return _table(BUDGET_COLUMNS, budget_rows(start_date, end_date))
+
+
+def revenue_expense_table(start_date, end_date):
+    revenues, expenses = revenue_expense_rows(start_date, end_date)
+
+    def rows():
+        for row in revenues:
+            yield ['revenue', row['source'], row['total']]
+        for row in expenses:
+            yield ['expense', row['category'], row['total']]
+
+    return ['kind', 'category', 'total'], rows()
+
+
+def cash_flow_table(start_date, end_date):
+    """Flux de trésorerie par jour, avec le cumul signé (voir cash_flow.SIGNS) des rapports"""
+    return _table(CASH_FLOW_COLUMNS, cash_flow_rows(start_date, end_date))
+
+
+def financial_health_table(start_date=None, end_date=None):
+    report = generate_financial_health_report()
+    return ['metric', 'value'], ([name, value] for name, value in report.items())
+
+
+EXPORTS = {
+    'budget': budget_table,
+    'revenue_expense': revenue_expense_table,
+    'cash_flow': cash_flow_table,
+    'financial_health': financial_health_table,
+}
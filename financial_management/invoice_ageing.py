@@ -0,0 +1,109 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Q, Sum, Value, When
+from django.utils import timezone
+from .models import Invoice, ClientAgeing
+from .period_balances import as_date
+
+OUTSTANDING = ('sent', 'overdue')
+# Tranches d'ancienneté (jours depuis l'échéance, bornes incluses) ; une facture non échue compte dans la première
+BUCKETS = (
+    ('days_0_30', None, 30),
+    ('days_31_60', 31, 60),
+    ('days_61_90', 61, 90),
+    ('days_over_90', 91, None),
+)
+BUCKET_FIELDS = tuple(field for field, _, _ in BUCKETS)
+
+
+def bucket_for(due_date, as_of):
+    days = (as_of - due_date).days
+    for field, low, high in BUCKETS:
+        if high is None or days <= high:
+            return field
+
+
+def ageing_state(instance):
+    """(client, échéance, montant) d'une facture en attente de paiement, sinon None"""
+    values = instance.__dict__
+    if any(name not in values for name in ('client_id', 'status', 'due_date', 'total_amount')):
+        return None
+    if values['status'] not in OUTSTANDING or values['due_date'] is None or values['total_amount'] is None:
+        return None
+    return values['client_id'], as_date(values['due_date']), Decimal(str(values['total_amount']))
+
+
+def apply_change(previous, current):
+    """Reporte le changement d'une facture (paiement, annulation, montant...) dans la balance âgée du client"""
+    if previous == current:
+        return
+    if previous is not None:
+        _apply(previous, -1)
+    if current is not None:
+        _apply(current, 1)
+
+
+def _apply(state, sign):
+    client_id, due_date, amount = state
+    with transaction.atomic():
+        row, _ = ClientAgeing.objects.get_or_create(client_id=client_id, defaults={'as_of': timezone.localdate()})
+        field = bucket_for(due_date, row.as_of)
+        ClientAgeing.objects.filter(pk=row.pk).update(**{
+            field: F(field) + sign * amount, 'invoice_count': F('invoice_count') + sign
+        })
+
+
+# ----------------------------------------------------------------------
+# Traitement quotidien
+# ----------------------------------------------------------------------
+
+def mark_overdue(today=None):
+    """Passe en retard, en un UPDATE sur l'index (statut, échéance), les factures envoyées échues"""
+    today = today or timezone.localdate()
+    return Invoice.objects.filter(status='sent', due_date__lt=today).update(status='overdue', updated_at=timezone.now())
+
+
+def _bucket_sum(as_of, low, high):
+    condition = Q()
+    if high is not None:
+        condition &= Q(due_date__gte=as_of - timedelta(days=high))
+    if low is not None:
+        condition &= Q(due_date__lte=as_of - timedelta(days=low))
+    return Sum(Case(
+        When(condition, then=F('total_amount')), default=Value(0),
+        output_field=DecimalField(max_digits=17, decimal_places=2)
+    ))
+
+
+def rebuild(as_of=None):
+    """Recalcule la balance âgée de tous les clients en une requête groupée ; retourne le nombre de clients"""
+    as_of = as_of or timezone.localdate()
+    totals = Invoice.objects.filter(status__in=OUTSTANDING).order_by().values('client_id').annotate(
+        invoice_count=Count('id'),
+        **{field: _bucket_sum(as_of, low, high) for field, low, high in BUCKETS}
+    )
+    rows = [ClientAgeing(as_of=as_of, **row) for row in totals]
+    with transaction.atomic():
+        ClientAgeing.objects.all().delete()
+        ClientAgeing.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
+
+
+def age_invoices(today=None):
+    today = today or timezone.localdate()
+    return {'overdue': mark_overdue(today), 'clients': rebuild(today)}
+
+
+# ----------------------------------------------------------------------
+# Lecture
+# ----------------------------------------------------------------------
+
+def summary():
+    """Totaux par tranche sur l'ensemble des clients, depuis la balance âgée"""
+    totals = ClientAgeing.objects.aggregate(
+        invoice_count=Sum('invoice_count'), **{field: Sum(field) for field in BUCKET_FIELDS}
+    )
+    totals = {name: value or 0 for name, value in totals.items()}
+    totals['total_outstanding'] = sum(totals[field] for field in BUCKET_FIELDS)
+    return totals
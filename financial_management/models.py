@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 
@@ -34,9 +35,12 @@ class Revenue(models.Model):
     ]
 
     source = models.CharField(max_length=50, choices=REVENUE_SOURCES)
+    dimension = models.CharField(max_length=100, blank=True, default='')  # Ligne, formule... (revenus rapprochés)
     amount = models.DecimalField(max_digits=15, decimal_places=2)
     date = models.DateField()
     description = models.TextField(blank=True)
+    # Clé « date:source:dimension » des lignes écrites par le rapprochement des recettes
+    reconciliation_key = models.CharField(max_length=150, unique=True, null=True, blank=True)
     recorded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -92,6 +96,88 @@ class FinancialRecord(models.Model):
     def __str__(self):
         return f"{self.record_type} - {self.amount} on {self.date}"
 
+class BudgetLedgerEntry(models.Model):
+    """
+    Mouvement du solde d'un budget (journal en ajout seul). Le montant est signé : une
+    dépense est négative. balance_after est le reste disponible juste après le mouvement.
+    """
+    ENTRY_TYPES = [
+        ('allocation', 'Allocation'),
+        ('expense', 'Expense'),
+        ('adjustment', 'Adjustment'),
+        ('reversal', 'Reversal'),
+    ]
+
+    budget = models.ForeignKey(Budget, on_delete=models.CASCADE, related_name='ledger_entries')
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPES)
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    balance_after = models.DecimalField(max_digits=15, decimal_places=2)
+    description = models.TextField(blank=True)
+    reference = models.CharField(max_length=100, blank=True)  # Pièce d'origine (dépense, facture...)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['budget', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.budget_id} {self.entry_type} {self.amount}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Budget ledger entries are append-only")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Budget ledger entries are append-only")
+
+class BudgetLedgerSnapshot(models.Model):
+    """Solde du journal d'un budget arrêté à une écriture : le solde courant n'additionne que les écritures suivantes"""
+    budget = models.OneToOneField(Budget, on_delete=models.CASCADE, related_name='ledger_snapshot')
+    last_entry_id = models.BigIntegerField(default=0)
+    balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    entry_count = models.IntegerField(default=0)
+    taken_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.budget_id} @ {self.last_entry_id}: {self.balance}"
+
+class PeriodBalance(models.Model):
+    """
+    Totaux mensuels matérialisés des écritures financières (revenus par source, dépenses
+    par catégorie, enregistrements par type et budget). Tenus à jour à chaque écriture
+    (signals.py) et reconstruits périodiquement depuis les tables sources.
+    """
+    KINDS = [
+        ('revenue', 'Revenue'),
+        ('expense', 'Expense'),
+        ('record', 'Financial Record'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    dimension = models.CharField(max_length=50)  # Source, catégorie ou type d'enregistrement
+    budget = models.ForeignKey(Budget, on_delete=models.CASCADE, null=True, blank=True, related_name='period_balances')
+    month = models.DateField()  # Premier jour du mois
+    amount = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    entry_count = models.IntegerField(default=0)
+    reconciled_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # Budget absent ramené à 0 : unicité garantie aussi sans index partiel (MySQL)
+            models.UniqueConstraint('kind', 'dimension', Coalesce('budget', models.Value(0)), 'month',
+                                    name='unique_period_balance'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'month']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.dimension} {self.month:%Y-%m}: {self.amount}"
+
 class Invoice(models.Model):
     STATUS_CHOICES = [
         ('draft', 'Draft'),
@@ -113,9 +199,42 @@ class Invoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'due_date']),
+        ]
+
     def __str__(self):
         return f"Invoice {self.invoice_number} - {self.client.username} ({self.status})"
 
     @property
     def client_name(self):
-        return self.client.username if not self.client_name_text else self.client_name_text
\ No newline at end of file
+        return self.client.username if not self.client_name_text else self.client_name_text
+
+class ClientAgeing(models.Model):
+    """
+    Balance âgée des factures en attente de paiement (envoyées ou en retard) d'un client,
+    par ancienneté de l'échéance à la date as_of. Reconstruite chaque nuit, ajustée à
+    chaque changement de facture (paiement, annulation...).
+    """
+    client = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='invoice_ageing')
+    as_of = models.DateField()
+    days_0_30 = models.DecimalField(max_digits=17, decimal_places=2, default=0)  # Échéance non dépassée incluse
+    days_31_60 = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    days_61_90 = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    days_over_90 = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    invoice_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # Une seule ligne par client, factures sans client comprises
+            models.UniqueConstraint(Coalesce('client', models.Value(0)), name='unique_client_ageing'),
+        ]
+
+    def __str__(self):
+        return f"Ageing {self.client_id} ({self.as_of}): {self.total_outstanding}"
+
+    @property
+    def total_outstanding(self):
+        return self.days_0_30 + self.days_31_60 + self.days_61_90 + self.days_over_90
@@ -0,0 +1,141 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from .models import Revenue, Expense, FinancialRecord, PeriodBalance
+
+# Tables sources : type de solde, champ de dimension et champ de budget
+SOURCES = {
+    Revenue: ('revenue', 'source', None),
+    Expense: ('expense', 'category', None),
+    FinancialRecord: ('record', 'record_type', 'related_budget_id'),
+}
+RECONCILE_MONTHS = 2  # Mois courant et précédent, reconstruits chaque nuit
+
+
+def month_start(value):
+    return value.replace(day=1)
+
+
+def as_date(value):
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def balance_state(instance):
+    """(type, dimension, budget, mois, montant) de l'écriture, ou None si un champ est différé"""
+    kind, dimension_field, budget_field = SOURCES[type(instance)]
+    values = instance.__dict__
+    fields = [dimension_field, 'date', 'amount'] + ([budget_field] if budget_field else [])
+    if any(name not in values for name in fields) or values['date'] is None or values['amount'] is None:
+        return None
+    return (
+        kind,
+        values[dimension_field],
+        values[budget_field] if budget_field else None,
+        month_start(as_date(values['date'])),
+        Decimal(str(values['amount'])),
+    )
+
+
+def apply_change(previous, current):
+    """Reporte le passage d'un état d'écriture à un autre (None : absente) dans les soldes"""
+    if previous == current:
+        return
+    if previous is not None:
+        _apply(previous[:4], -previous[4], -1)
+    if current is not None:
+        _apply(current[:4], current[4], 1)
+
+
+def _apply(key, amount, count):
+    kind, dimension, budget_id, month = key
+    with transaction.atomic():
+        row, _ = PeriodBalance.objects.get_or_create(kind=kind, dimension=dimension, budget_id=budget_id, month=month)
+        PeriodBalance.objects.filter(pk=row.pk).update(
+            amount=F('amount') + amount, entry_count=F('entry_count') + count
+        )
+
+
+# ----------------------------------------------------------------------
+# Réconciliation
+# ----------------------------------------------------------------------
+
+def reconcile_month(month):
+    """Reconstruit les soldes d'un mois depuis les tables sources ; retourne le nombre de lignes"""
+    month = month_start(month)
+    next_month = month_start(month + timedelta(days=31))
+    now = timezone.now()
+    rows = []
+    for model, (kind, dimension_field, budget_field) in SOURCES.items():
+        fields = [dimension_field] + ([budget_field] if budget_field else [])
+        totals = model.objects.filter(date__gte=month, date__lt=next_month).order_by().values(*fields).annotate(
+            total=Sum('amount'), count=Count('id')
+        )
+        rows.extend(
+            PeriodBalance(
+                kind=kind, dimension=row[dimension_field], budget_id=row.get(budget_field), month=month,
+                amount=row['total'], entry_count=row['count'], reconciled_at=now
+            )
+            for row in totals
+        )
+    with transaction.atomic():
+        PeriodBalance.objects.filter(month=month).delete()
+        PeriodBalance.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
+
+
+def reconcile_recent(months=RECONCILE_MONTHS):
+    month = month_start(timezone.localdate())
+    count = 0
+    for _ in range(months):
+        count += reconcile_month(month)
+        month = month_start(month - timedelta(days=1))
+    return count
+
+
+def reconcile_all():
+    """Reconstruit tous les mois présents dans les tables sources ou les soldes"""
+    months = set(PeriodBalance.objects.order_by().values_list('month', flat=True).distinct())
+    for model in SOURCES:
+        months.update(
+            model.objects.annotate(month=TruncMonth('date')).order_by().values_list('month', flat=True).distinct()
+        )
+    return sum(reconcile_month(month) for month in sorted(months))
+
+
+# ----------------------------------------------------------------------
+# Lecture
+# ----------------------------------------------------------------------
+
+def balances(kind, **filters):
+    return PeriodBalance.objects.filter(kind=kind, entry_count__gt=0, **filters).order_by()
+
+
+def total(kind, **filters):
+    return balances(kind, **filters).aggregate(total=Sum('amount'))['total'] or 0
+
+
+def total_as_of(kind, dimension, as_of):
+    """Cumul jusqu'à as_of inclus : mois clos depuis les soldes, mois en cours depuis les écritures"""
+    model = next(model for model, source in SOURCES.items() if source[0] == kind)
+    dimension_field = SOURCES[model][1]
+    current_month = month_start(as_of)
+    closed = total(kind, dimension=dimension, month__lt=current_month)
+    open_period = model.objects.filter(
+        **{dimension_field: dimension}, date__gte=current_month, date__lte=as_of
+    ).aggregate(total=Sum('amount'))['total'] or 0
+    return closed + open_period
+
+
+def monthly(kind, by_dimension=False):
+    """Totaux par mois (et par dimension) : [{'month', ['dimension',] 'total'}]"""
+    fields = ['month', 'dimension'] if by_dimension else ['month']
+    return balances(kind).values(*fields).annotate(total=Sum('amount')).order_by(*fields)
+
+
+def by_dimension(kind):
+    return balances(kind).values('dimension').annotate(total=Sum('amount')).order_by('dimension')
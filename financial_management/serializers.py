@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Budget, Revenue ,FinancialRecord,Expense,Invoice
+from .models import Budget, BudgetLedgerEntry, Revenue ,FinancialRecord,Expense,Invoice
 
 class BudgetSerializer(serializers.ModelSerializer):
     spent_amount = serializers.SerializerMethodField(read_only=True)
@@ -19,12 +19,25 @@ class BudgetSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         validated_data['remaining_amount'] = validated_data['total_amount']
         return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        # Seuls les champs modifiés sont écrits : le reste disponible n'est tenu que par le journal
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
+
+class BudgetLedgerEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BudgetLedgerEntry
+        fields = ['id', 'entry_type', 'amount', 'balance_after', 'description', 'reference', 'created_by', 'created_at']
+        read_only_fields = fields
     
 class RevenueSerializer(serializers.ModelSerializer):
     class Meta:
         model = Revenue
-        fields = ['id', 'source', 'amount', 'date', 'description', 'recorded_by', 'created_at']
-        read_only_fields = ['id', 'recorded_by', 'created_at']
+        fields = ['id', 'source', 'dimension', 'amount', 'date', 'description', 'reconciliation_key', 'recorded_by', 'created_at']
+        read_only_fields = ['id', 'reconciliation_key', 'recorded_by', 'created_at']
 
     def create(self, validated_data):
         validated_data['recorded_by'] = self.context['request'].user
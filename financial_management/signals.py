@@ -0,0 +1,97 @@
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from .models import Budget, Revenue, Expense, FinancialRecord, PeriodBalance, Invoice
+from .charts import bump_data_version
+from . import period_balances, budget_ledger, invoice_ageing
+
+
+@receiver(post_save, sender=Budget)
+@receiver(post_save, sender=Revenue)
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=FinancialRecord)
+@receiver(post_delete, sender=Budget)
+@receiver(post_delete, sender=Revenue)
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=FinancialRecord)
+def financial_data_changed(sender, instance, **kwargs):
+    """Les graphiques en cache des rapports financiers deviennent caducs."""
+    transaction.on_commit(bump_data_version)
+
+
+@receiver(post_init, sender=Revenue)
+@receiver(post_init, sender=Expense)
+@receiver(post_init, sender=FinancialRecord)
+def store_balance_state(sender, instance, **kwargs):
+    instance._balance_state = period_balances.balance_state(instance)
+
+
+@receiver(post_save, sender=Revenue)
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=FinancialRecord)
+def balance_entry_saved(sender, instance, created, **kwargs):
+    """
+    Reporte l'écriture dans les soldes mensuels, dans la même transaction.
+    """
+    previous = None if created else getattr(instance, '_balance_state', None)
+    current = period_balances.balance_state(instance)
+    if current is None or (previous is None and not created):
+        # État incomplet (champs différés) : le mois actuel est reconstruit depuis la base,
+        # un ancien mois inconnu l'est par la réconciliation périodique
+        current = period_balances.balance_state(sender.objects.get(pk=instance.pk))
+        period_balances.reconcile_month(current[3])
+    else:
+        period_balances.apply_change(previous, current)
+    instance._balance_state = current
+
+
+@receiver(post_delete, sender=Revenue)
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=FinancialRecord)
+def balance_entry_deleted(sender, instance, **kwargs):
+    state = getattr(instance, '_balance_state', None)
+    if state is None:
+        # Mois inconnu : rattrapé par la réconciliation
+        return
+    period_balances.apply_change(state, None)
+
+
+@receiver(post_save, sender=Budget)
+def budget_allocated(sender, instance, created, **kwargs):
+    """Ouvre le journal du budget créé"""
+    if created:
+        budget_ledger.record_allocation(instance)
+
+
+@receiver(pre_delete, sender=Budget)
+def budget_balances_deleted(sender, instance, **kwargs):
+    """
+    Les enregistrements du budget supprimé passent sans budget (SET_NULL, sans signal) :
+    leurs mois sont reconstruits après la suppression.
+    """
+    months = set(PeriodBalance.objects.filter(budget=instance).values_list('month', flat=True))
+    transaction.on_commit(lambda: [period_balances.reconcile_month(month) for month in sorted(months)])
+
+
+@receiver(post_init, sender=Invoice)
+def store_ageing_state(sender, instance, **kwargs):
+    instance._ageing_state = invoice_ageing.ageing_state(instance)
+
+
+@receiver(post_save, sender=Invoice)
+def invoice_ageing_saved(sender, instance, created, **kwargs):
+    """
+    Ajuste la balance âgée du client (facture envoyée, payée, annulée, modifiée).
+    """
+    previous = None if created else getattr(instance, '_ageing_state', None)
+    current = invoice_ageing.ageing_state(instance)
+    if current is None and not created and instance.get_deferred_fields():
+        # Champs différés : état réel relu en base
+        current = invoice_ageing.ageing_state(sender.objects.get(pk=instance.pk))
+    invoice_ageing.apply_change(previous, current)
+    instance._ageing_state = current
+
+
+@receiver(post_delete, sender=Invoice)
+def invoice_ageing_deleted(sender, instance, **kwargs):
+    invoice_ageing.apply_change(getattr(instance, '_ageing_state', None), None)
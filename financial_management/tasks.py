@@ -0,0 +1,39 @@
+from celery import shared_task
+from celery.utils.log import get_task_logger
+
+logger = get_task_logger(__name__)
+
+
+@shared_task(ignore_result=True)
+def reconcile_period_balances():
+    """Reconstruit les soldes mensuels des mois récents depuis les écritures"""
+    from .period_balances import reconcile_recent
+    rows = reconcile_recent()
+    logger.info(f"Soldes mensuels réconciliés : {rows} lignes")
+
+
+@shared_task(ignore_result=True)
+def snapshot_budget_ledgers():
+    """Arrête le solde des journaux de budget ayant de nouvelles écritures"""
+    from .budget_ledger import take_snapshots
+    snapshots = take_snapshots()
+    logger.info(f"Journaux de budget : {snapshots} instantanés")
+
+
+@shared_task(ignore_result=True)
+def reconcile_fare_revenue(day=None):
+    """Rapproche les recettes voyageurs de la veille (ou du jour ISO donné) dans Revenue"""
+    from datetime import date, timedelta
+    from django.utils import timezone
+    from .fare_reconciliation import reconcile
+    day = date.fromisoformat(day) if day else timezone.localdate() - timedelta(days=1)
+    report = reconcile(day)
+    logger.info(f"Recettes du {day} rapprochées : {report['rows']} lignes, {report['total']}")
+
+
+@shared_task(ignore_result=True)
+def age_invoices():
+    """Passe en retard les factures échues et recalcule la balance âgée des clients"""
+    from .invoice_ageing import age_invoices as run
+    result = run()
+    logger.info(f"Échéancier des factures : {result['overdue']} en retard, {result['clients']} clients")
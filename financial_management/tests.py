@@ -1,15 +1,24 @@
+import io
+from decimal import Decimal
+from unittest.mock import patch
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
+from openpyxl import load_workbook
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from .models import Budget, Revenue ,FinancialRecord,Expense,Invoice
-from datetime import date, timedelta
+from django.utils import timezone
+from .models import Budget, Revenue ,FinancialRecord,Expense,Invoice, PeriodBalance, BudgetLedgerSnapshot, ClientAgeing
+from .serializers import BudgetSerializer
+from . import period_balances, budget_ledger, fare_reconciliation, invoice_ageing
+from datetime import date, datetime, timedelta
 from .financial_reports import (
     generate_budget_report,
     generate_revenue_expense_report,
     generate_financial_health_report,
-    generate_cash_flow_report
+    generate_cash_flow_report,
+    cash_flow_rows
 )
 
 User = get_user_model()
@@ -513,6 +522,40 @@ class FinancialReportsTestCase(TestCase):
         self.assertIn('graph', report)
         self.assertEqual(len(report['dataframe']), 2)  # We created 2 financial records
 
+    def test_cash_flow_series_signed_and_aggregated(self):
+        FinancialRecord.objects.create(
+            record_type="expense", amount=500, date=self.start_date + timedelta(days=10),
+            description="Second Expense", created_by=self.user
+        )
+        FinancialRecord.objects.create(
+            record_type="transfer", amount=800, date=self.start_date + timedelta(days=12),
+            description="Transfer", created_by=self.user
+        )
+        FinancialRecord.objects.create(
+            record_type="income", amount=1000, date=self.start_date - timedelta(days=3),
+            description="Earlier Income", created_by=self.user
+        )
+
+        report = generate_cash_flow_report(self.start_date, self.end_date)
+        rows = report['dataframe']
+        self.assertEqual([row['date'] for row in rows], [
+            self.start_date + timedelta(days=offset) for offset in (5, 10, 12)
+        ])
+        self.assertEqual([row['net'] for row in rows], [Decimal('5000'), Decimal('-2500'), Decimal('0')])
+        self.assertEqual(rows[1]['outflow'], Decimal('2500'))
+        self.assertEqual([row['cumulative_cash'] for row in rows], [Decimal('5000'), Decimal('2500'), Decimal('2500')])
+        self.assertEqual(report['opening_balance'], Decimal('1000'))
+        self.assertEqual(report['closing_balance'], Decimal('3500'))
+
+        # Cumul tenu à la lecture sur les bases sans fonctions de fenêtre
+        with patch.object(connection.features, 'supports_over_clause', False):
+            self.assertEqual(cash_flow_rows(self.start_date, self.end_date), rows)
+
+        monthly = cash_flow_rows(self.start_date, self.end_date, period='month')
+        self.assertEqual(sum(row['net'] for row in monthly), Decimal('2500'))
+        self.assertEqual(monthly[-1]['cumulative_cash'], Decimal('2500'))
+        self.assertTrue(all(row['date'].day == 1 for row in monthly))
+
     def test_financial_report_view(self):
         url = reverse('financial-reports')
         response = self.client.get(url, {
@@ -547,6 +590,56 @@ class FinancialReportsTestCase(TestCase):
         self.assertNotIn('cash_flow', response.data)
         self.assertIsNotNone(response.data['budget']['graph'])
 
+    def test_financial_report_export(self):
+        url = reverse('financial-reports-export')
+        response = self.client.get(url, {
+            'type': 'cash_flow',
+            'start_date': self.start_date,
+            'end_date': self.end_date
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0], 'date,inflow,outflow,net,cumulative_cash')
+        # Mêmes lignes que le rapport de trésorerie
+        report = generate_cash_flow_report(self.start_date, self.end_date)
+        self.assertEqual(len(lines) - 1, len(report['dataframe']))
+        self.assertEqual(
+            [Decimal(line.split(',')[4]) for line in lines[1:]], [row['cumulative_cash'] for row in report['dataframe']]
+        )
+
+        response = self.client.get(url, {
+            'type': 'budget',
+            'start_date': self.start_date,
+            'end_date': self.end_date,
+            'file_format': 'xlsx'
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        workbook = load_workbook(io.BytesIO(b''.join(response.streaming_content)), read_only=True)
+        rows = list(workbook.active.values)
+        self.assertEqual(rows[1][0], "Test Budget")
+        self.assertEqual(rows[1][7], 50.0)
+
+    def test_chart_rendered_lazily_and_cached(self):
+        report = generate_budget_report(self.start_date, self.end_date)
+        response = self.client.get(report['graph'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        etag = response['ETag']
+
+        response = self.client.get(report['graph'], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Une écriture financière rend le graphique caduc
+        with self.captureOnCommitCallbacks(execute=True):
+            Budget.objects.create(
+                name="Second Budget", start_date=self.start_date, end_date=self.end_date,
+                total_amount=2000, remaining_amount=2000, created_by=self.user
+            )
+        response = self.client.get(report['graph'], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
     def test_unauthorized_access(self):
         self.client.force_authenticate(user=None)
         url = reverse('financial-reports')
@@ -555,4 +648,304 @@ class FinancialReportsTestCase(TestCase):
             'start_date': self.start_date,
             'end_date': self.end_date
         })
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+class PeriodBalanceTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.budget = Budget.objects.create(
+            name='Fleet', type='annual', start_date='2023-01-01', end_date='2023-12-31',
+            total_amount=10000, remaining_amount=10000, created_by=self.user
+        )
+        self.revenue = Revenue.objects.create(source='ticket_sales', amount=300, date='2023-01-10', recorded_by=self.user)
+        Revenue.objects.create(source='ticket_sales', amount=200, date='2023-01-20', recorded_by=self.user)
+        Expense.objects.create(category='fuel', amount=150, date='2023-02-03', description='Fuel', recorded_by=self.user)
+        FinancialRecord.objects.create(
+            record_type='expense', amount=80, date='2023-02-05', description='Parts',
+            related_budget=self.budget, created_by=self.user
+        )
+        FinancialRecord.objects.create(
+            record_type='expense', amount=20, date='2023-02-07', description='Misc', created_by=self.user
+        )
+
+    def snapshot(self):
+        return list(
+            PeriodBalance.objects.filter(entry_count__gt=0).order_by('kind', 'dimension', 'budget_id', 'month').values_list(
+                'kind', 'dimension', 'budget_id', 'month', 'amount', 'entry_count'
+            )
+        )
+
+    def test_balances_maintained_incrementally(self):
+        self.assertIn(('revenue', 'ticket_sales', None, date(2023, 1, 1), Decimal('500'), 2), self.snapshot())
+        self.assertIn(('record', 'expense', self.budget.id, date(2023, 2, 1), Decimal('80'), 1), self.snapshot())
+        self.assertIn(('record', 'expense', None, date(2023, 2, 1), Decimal('20'), 1), self.snapshot())
+
+        # Changement de montant et de mois, puis suppression
+        self.revenue.amount = 350
+        self.revenue.date = date(2023, 3, 1)
+        self.revenue.save()
+        Expense.objects.get().delete()
+        incremental = self.snapshot()
+        self.assertIn(('revenue', 'ticket_sales', None, date(2023, 1, 1), Decimal('200'), 1), incremental)
+        self.assertIn(('revenue', 'ticket_sales', None, date(2023, 3, 1), Decimal('350'), 1), incremental)
+        self.assertFalse([row for row in incremental if row[0] == 'expense'])
+
+        period_balances.reconcile_all()
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_budget_deletion_moves_records_to_unbudgeted_balance(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.budget.delete()
+        self.assertIn(('record', 'expense', None, date(2023, 2, 1), Decimal('100'), 2), self.snapshot())
+
+    def test_unbudgeted_balance_is_unique(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PeriodBalance.objects.create(kind='revenue', dimension='ticket_sales', month=date(2023, 1, 1))
+
+    def test_health_report_combines_balances_and_open_period(self):
+        today = timezone.localdate()
+        FinancialRecord.objects.create(record_type='income', amount=1000, date='2023-01-02', description='Old')
+        FinancialRecord.objects.create(record_type='income', amount=40, date=today.replace(day=1), description='Now')
+        if today.day < 28:
+            FinancialRecord.objects.create(
+                record_type='income', amount=9999, date=today.replace(day=28), description='Later this month'
+            )
+
+        report = generate_financial_health_report()
+        self.assertEqual(report['total_revenue'], Decimal('500'))
+        self.assertEqual(report['total_expense'], Decimal('150'))
+        self.assertEqual(report['current_assets'], Decimal('1040'))
+        self.assertEqual(report['current_liabilities'], Decimal('100'))
+
+    def test_period_endpoints_read_balances(self):
+        response = self.client.get(reverse('financialrecord-by-period'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['month'], row['type'], Decimal(row['total'])) for row in response.data],
+            [('2023-02-01', 'expense', Decimal('100'))]
+        )
+        response = self.client.get(reverse('revenue-by-source-and-period'))
+        self.assertEqual(
+            [(row['month'], row['source'], Decimal(row['total'])) for row in response.data],
+            [('2023-01-01', 'ticket_sales', Decimal('500'))]
+        )
+
+
+class BudgetLedgerTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.budget = Budget.objects.create(
+            name='Fuel', type='annual', start_date='2023-01-01', end_date='2023-12-31',
+            total_amount=1000, remaining_amount=1000, created_by=self.user
+        )
+
+    def entries(self):
+        return list(self.budget.ledger_entries.order_by('id').values_list('entry_type', 'amount', 'balance_after'))
+
+    def test_expenses_are_conditional_and_journaled(self):
+        entry = budget_ledger.record_expense(self.budget.pk, 400, user=self.user, reference='EXP-1')
+        self.assertEqual(entry.balance_after, Decimal('600'))
+        with self.assertRaises(budget_ledger.InsufficientBudget):
+            budget_ledger.record_expense(self.budget.pk, 601)
+        with self.assertRaises(ValueError):
+            budget_ledger.record_expense(self.budget.pk, -5)
+        budget_ledger.record_expense(self.budget.pk, 600)
+
+        self.budget.refresh_from_db()
+        self.assertEqual(self.budget.remaining_amount, Decimal('0'))
+        self.assertEqual(self.entries(), [
+            ('allocation', Decimal('1000'), Decimal('1000')),
+            ('expense', Decimal('-400'), Decimal('600')),
+            ('expense', Decimal('-600'), Decimal('0')),
+        ])
+        self.assertEqual(budget_ledger.ledger_balance(self.budget.pk), Decimal('0'))
+        with self.assertRaises(ValueError):
+            entry.save()
+
+    def test_stale_update_does_not_overwrite_remaining_amount(self):
+        stale = Budget.objects.get(pk=self.budget.pk)
+        budget_ledger.record_expense(self.budget.pk, 250)
+
+        serializer = BudgetSerializer(stale, data={'name': 'Fuel 2023'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        response = self.client.patch(
+            reverse('budget-detail', kwargs={'pk': self.budget.pk}), {'total_amount': '1200.00'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Decimal(response.data['remaining_amount']), Decimal('950'))
+
+        self.budget.refresh_from_db()
+        self.assertEqual(self.budget.name, 'Fuel 2023')
+        self.assertEqual(self.budget.remaining_amount, Decimal('950'))
+        self.assertEqual(self.entries()[-1], ('adjustment', Decimal('200'), Decimal('950')))
+
+    def test_snapshots_bound_balance_reads(self):
+        budget_ledger.record_expense(self.budget.pk, 100)
+        # Écritures trop récentes : une écriture d'identifiant inférieur peut encore être validée
+        self.assertEqual(budget_ledger.take_snapshots(), 0)
+        later = timezone.now() + budget_ledger.SNAPSHOT_LAG
+        self.assertEqual(budget_ledger.take_snapshots(later), 1)
+        self.assertEqual(budget_ledger.take_snapshots(later), 0)
+        snapshot = BudgetLedgerSnapshot.objects.get(budget=self.budget)
+        self.assertEqual((snapshot.balance, snapshot.entry_count), (Decimal('900'), 2))
+
+        budget_ledger.record_expense(self.budget.pk, 50)
+        with self.assertNumQueries(2):
+            self.assertEqual(budget_ledger.ledger_balance(self.budget.pk), Decimal('850'))
+
+        # Reste disponible modifié hors du journal : signalé au prochain instantané
+        budget_ledger.record_expense(self.budget.pk, 10)
+        Budget.objects.filter(pk=self.budget.pk).update(remaining_amount=5000)
+        with self.assertLogs('financial_management.budget_ledger', level='WARNING'):
+            budget_ledger.take_snapshots(timezone.now() + budget_ledger.SNAPSHOT_LAG)
+
+        response = self.client.get(reverse('budget-ledger', kwargs={'pk': self.budget.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Decimal(response.data['ledger_balance']), Decimal('840'))
+        self.assertEqual(len(response.data['entries']), 4)
+
+
+class FareReconciliationTests(TestCase):
+    def setUp(self):
+        from transport_management.models import Trip, PassengerTripHistory, TransactionScan
+        from transport_management.tests import create_route
+        from membership_management.models import CardAssignmentid, CardInfo, SubscriptionPlan, Subscription, Payment, Transaction
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='passenger', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.day = date(2030, 1, 7)
+        morning = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+        self.route = create_route('L1')
+        trip = Trip.objects.create(route=self.route, planned_departure=morning, planned_arrival=morning + timedelta(minutes=30))
+        self.history = [
+            PassengerTripHistory.objects.create(user=self.user, trip=trip, trip_date=morning, fare_paid=Decimal(fare))
+            for fare in ('25.00', '25.00', '30.00')
+        ]
+        PassengerTripHistory.objects.create(user=self.user, trip=trip, trip_date=morning, fare_paid=50, status='refunded')
+
+        card = CardInfo.objects.create(
+            card_assignment=CardAssignmentid.objects.create(unique_code='CARD-1'),
+            passenger=self.user.passenger_profile, card_type='nfc', expiry_date=date(2031, 1, 1)
+        )
+        for index in range(2):
+            TransactionScan.objects.create(
+                user=self.user, card=card, trip=trip, scan_type='nfc_physical', scan_status='successful', timestamp=morning
+            )
+
+        plan = SubscriptionPlan.objects.create(user_type='student', circuit='A', locality='Centre', duration='monthly', price=1500)
+        subscription = Subscription.objects.create(
+            passenger=self.user.passenger_profile, plan=plan, start_date=self.day, end_date=date(2030, 2, 7)
+        )
+        self.plan = plan
+        Payment.objects.create(user=self.user, amount=1500, payment_type='subscription', payment_date=morning,
+                               status='completed', subscription=subscription)
+        Payment.objects.create(user=self.user, amount=1000, payment_type='registration', payment_date=morning, status='completed')
+        Payment.objects.create(user=self.user, amount=999, payment_type='subscription', payment_date=morning, status='failed')
+        Payment.objects.create(user=self.user, amount=200, payment_type='top_up', payment_date=morning, status='completed')
+        credit = Transaction.objects.create(user=self.user, amount=150, transaction_type='credit', description='Rechargement')
+        Transaction.objects.filter(pk=credit.pk).update(timestamp=morning)
+
+    def test_reconciliation_upserts_revenue_idempotently(self):
+        report = fare_reconciliation.reconcile(self.day)
+        self.assertEqual(report['rows'], 3)
+        self.assertEqual(report['total'], Decimal('2580'))
+        revenue = dict(Revenue.objects.values_list('reconciliation_key', 'amount'))
+        self.assertEqual(revenue, {
+            f'2030-01-07:ticket_sales:route:{self.route.id}': Decimal('80'),
+            f'2030-01-07:subscription:plan:{self.plan.id}': Decimal('1500'),
+            '2030-01-07:other:registration': Decimal('1000'),
+        })
+        self.assertEqual(period_balances.total('revenue'), Decimal('2580'))
+
+        # Mismatch report: 2 successful scans for 3 paid trips, top-ups not matched by credits
+        self.assertEqual(report['routes'], [{'route_id': self.route.id, 'scans': 2, 'paid_trips': 3}])
+        self.assertEqual(report['top_ups']['difference'], Decimal('50'))
+
+        # A second run rewrites the same rows and reports late changes
+        self.history[0].status = 'refunded'
+        self.history[0].save()
+        report = fare_reconciliation.reconcile(self.day)
+        self.assertEqual(Revenue.objects.count(), 3)
+        self.assertEqual(report['changed'], [{
+            'key': f'2030-01-07:ticket_sales:route:{self.route.id}', 'previous': Decimal('80'), 'current': Decimal('55')
+        }])
+        self.assertEqual(period_balances.total('revenue'), Decimal('2555'))
+
+    def test_dry_run_endpoint_writes_nothing(self):
+        url = reverse('fare-reconciliation')
+        response = self.client.get(url, {'date': '2030-01-07'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rows'], 3)
+        self.assertFalse(Revenue.objects.exists())
+
+        response = self.client.post(url + '?date=2030-01-07')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Revenue.objects.count(), 3)
+        self.assertEqual(self.client.get(url, {'date': '07/01/2030'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class InvoiceAgeingTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.customer = User.objects.create_user(username='customer', password='12345')
+        self.other = User.objects.create_user(username='other', password='12345')
+        self.today = timezone.localdate()
+        self.invoices = {
+            due: self.invoice(f'INV-{index}', self.customer, due, amount)
+            for index, (due, amount) in enumerate([(10, 100), (-45, 200), (-100, 400)])
+        }
+        self.invoice('INV-DRAFT', self.customer, -45, 999, status='draft')
+        self.invoice('INV-OTHER', self.other, -70, 50)
+
+    def invoice(self, number, client, due_in_days, amount, status='sent'):
+        return Invoice.objects.create(
+            invoice_number=number, client=client, issue_date=self.today - timedelta(days=120),
+            due_date=self.today + timedelta(days=due_in_days), total_amount=amount, status=status, created_by=self.user
+        )
+
+    def ageing(self):
+        return list(ClientAgeing.objects.order_by('client_id').values_list(
+            'client_id', 'days_0_30', 'days_31_60', 'days_61_90', 'days_over_90', 'invoice_count'
+        ))
+
+    def test_ageing_maintained_incrementally(self):
+        self.assertEqual(self.ageing(), [
+            (self.customer.id, Decimal('100'), Decimal('200'), Decimal('0'), Decimal('400'), 3),
+            (self.other.id, Decimal('0'), Decimal('0'), Decimal('50'), Decimal('0'), 1),
+        ])
+        incremental = self.ageing()
+        invoice_ageing.rebuild()
+        self.assertEqual(self.ageing(), incremental)
+
+        # Paiement : retiré de sa tranche sans recalcul
+        response = self.client.post(
+            reverse('invoice-update-status', kwargs={'pk': self.invoices[-45].pk}), {'status': 'paid'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.ageing()[0], (self.customer.id, Decimal('100'), Decimal('0'), Decimal('0'), Decimal('400'), 2))
+
+    def test_overdue_transition_is_batched(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(invoice_ageing.mark_overdue(), 3)
+        self.assertEqual(
+            sorted(Invoice.objects.filter(status='overdue').values_list('invoice_number', flat=True)),
+            ['INV-1', 'INV-2', 'INV-OTHER']
+        )
+        # Échue depuis le dernier passage de la tâche : toujours listée
+        self.invoice('INV-LATE', self.customer, -1, 10)
+        response = self.client.get(reverse('invoice-overdue'))
+        self.assertEqual(len(response.data), 4)
+
+        response = self.client.get(reverse('invoice-ageing'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['summary']['total_outstanding'], Decimal('760'))
+        self.assertEqual(response.data['summary']['invoice_count'], 5)
+        self.assertEqual(len(response.data['clients']), 2)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import BudgetViewSet, RevenueViewSet, ExpenseViewSet, FinancialRecordViewSet, InvoiceViewSet , FinancialReportView
+from .views import BudgetViewSet, RevenueViewSet, ExpenseViewSet, FinancialRecordViewSet, InvoiceViewSet , FinancialReportView, FinancialReportExportView, FinancialChartView, FareReconciliationView
 
 router = DefaultRouter()
 router.register(r'budgets', BudgetViewSet)
@@ -12,4 +12,7 @@ router.register(r'invoices', InvoiceViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('financial-reports/', FinancialReportView.as_view(), name='financial-reports'),
+    path('financial-reports/export/', FinancialReportExportView.as_view(), name='financial-reports-export'),
+    path('financial-reports/charts/<str:report>/', FinancialChartView.as_view(), name='financial-chart'),
+    path('financial-reports/fare-reconciliation/', FareReconciliationView.as_view(), name='fare-reconciliation'),
 ]
\ No newline at end of file
@@ -1,40 +1,47 @@
 from django.shortcuts import render
 from rest_framework.views import APIView
-from .models import Budget, Revenue ,FinancialRecord,Expense,Invoice
+from .models import Budget, Revenue ,FinancialRecord,Expense,Invoice, ClientAgeing
 from django.utils import timezone
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from .models import Budget
-from django.db.models import Sum
-from django.db.models.functions import TruncMonth
-from .serializers import BudgetSerializer, RevenueSerializer, ExpenseSerializer ,FinancialRecordSerializer ,InvoiceSerializer
+from .serializers import BudgetSerializer, BudgetLedgerEntrySerializer, RevenueSerializer, ExpenseSerializer ,FinancialRecordSerializer ,InvoiceSerializer
 from .financial_reports import (
     generate_budget_report,
     generate_revenue_expense_report,
     generate_financial_health_report,
     generate_cash_flow_report
 )
+from .financial_exports import EXPORTS
+from .cash_flow import PERIODS as CASH_FLOW_PERIODS
+from . import period_balances, budget_ledger, fare_reconciliation, invoice_ageing
+from datetime import date, timedelta
+from django.db import transaction
+from .charts import CHARTS, chart_etag, chart_params, get_chart
+from django.http import HttpResponse
+from transport_management.services.export.tabular_export import tabular_exporter
 
 
 class BudgetViewSet(viewsets.ModelViewSet):
     queryset = Budget.objects.all()
     serializer_class = BudgetSerializer
     permission_classes = [permissions.IsAuthenticated]
+    LEDGER_PAGE_SIZE = 100
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
 
     def perform_update(self, serializer):
-        instance = self.get_object()
-        new_total = serializer.validated_data.get('total_amount', instance.total_amount)
-        if new_total != instance.total_amount:
-            difference = new_total - instance.total_amount
-            new_remaining = instance.remaining_amount + difference
-            serializer.save(remaining_amount=new_remaining)
-        else:
-            serializer.save()
+        # Le total passe par le journal (écart reporté atomiquement sur le reste disponible) ;
+        # les autres champs sont enregistrés sans réécrire les montants
+        new_total = serializer.validated_data.pop('total_amount', None)
+        with transaction.atomic():
+            budget = serializer.save()
+            if new_total is not None:
+                budget_ledger.set_total(budget.pk, new_total, user=self.request.user)
+                budget.refresh_from_db()
 
     @action(detail=True, methods=['get'])
     def budget_status(self, request, pk=None):
@@ -49,15 +56,26 @@ class BudgetViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def record_expense(self, request, pk=None):
         budget = self.get_object()
-        amount = request.data.get('amount', 0)
-        if amount <= 0:
+        try:
+            entry = budget_ledger.record_expense(
+                budget.pk, request.data.get('amount', 0), user=request.user,
+                description=request.data.get('description', ''), reference=request.data.get('reference', '')
+            )
+        except (ValueError, TypeError, ArithmeticError):
             return Response({'error': 'Amount must be positive'}, status=status.HTTP_400_BAD_REQUEST)
-        if amount > budget.remaining_amount:
+        except budget_ledger.InsufficientBudget:
             return Response({'error': 'Insufficient budget'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        budget.remaining_amount -= amount
-        budget.save()
-        return Response({'message': 'Expense recorded successfully', 'remaining_amount': budget.remaining_amount})
+        return Response({'message': 'Expense recorded successfully', 'remaining_amount': entry.balance_after})
+
+    @action(detail=True, methods=['get'])
+    def ledger(self, request, pk=None):
+        budget = self.get_object()
+        entries = budget.ledger_entries.order_by('-id')[:self.LEDGER_PAGE_SIZE]
+        return Response({
+            'remaining_amount': budget.remaining_amount,
+            'ledger_balance': budget_ledger.ledger_balance(budget.pk),
+            'entries': BudgetLedgerEntrySerializer(entries, many=True).data,
+        })
     
 
 class RevenueViewSet(viewsets.ModelViewSet):
@@ -70,18 +88,18 @@ class RevenueViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def by_source(self, request):
-        revenues = Revenue.objects.values('source').annotate(total=Sum('amount'))
-        return Response([{'source': r['source'], 'total': str(r['total'])} for r in revenues])
+        revenues = period_balances.by_dimension('revenue')
+        return Response([{'source': r['dimension'], 'total': str(r['total'])} for r in revenues])
 
     @action(detail=False, methods=['get'])
     def by_period(self, request):
-        revenues = Revenue.objects.annotate(month=TruncMonth('date')).values('month').annotate(total=Sum('amount')).order_by('month')
+        revenues = period_balances.monthly('revenue')
         return Response([{'month': r['month'].strftime('%Y-%m-%d'), 'total': str(r['total'])} for r in revenues])
 
     @action(detail=False, methods=['get'])
     def by_source_and_period(self, request):
-        revenues = Revenue.objects.annotate(month=TruncMonth('date')).values('month', 'source').annotate(total=Sum('amount')).order_by('month', 'source')
-        return Response([{'month': r['month'].strftime('%Y-%m-%d'), 'source': r['source'], 'total': str(r['total'])} for r in revenues])
+        revenues = period_balances.monthly('revenue', by_dimension=True)
+        return Response([{'month': r['month'].strftime('%Y-%m-%d'), 'source': r['dimension'], 'total': str(r['total'])} for r in revenues])
     
 class ExpenseViewSet(viewsets.ModelViewSet):
     queryset = Expense.objects.all()
@@ -109,18 +127,18 @@ class ExpenseViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def by_category(self, request):
-        expenses = Expense.objects.values('category').annotate(total=Sum('amount'))
-        return Response([{'category': e['category'], 'total': str(e['total'])} for e in expenses])
+        expenses = period_balances.by_dimension('expense')
+        return Response([{'category': e['dimension'], 'total': str(e['total'])} for e in expenses])
 
     @action(detail=False, methods=['get'])
     def by_period(self, request):
-        expenses = Expense.objects.annotate(month=TruncMonth('date')).values('month').annotate(total=Sum('amount')).order_by('month')
+        expenses = period_balances.monthly('expense')
         return Response([{'month': e['month'].strftime('%Y-%m-%d'), 'total': str(e['total'])} for e in expenses])
 
     @action(detail=False, methods=['get'])
     def by_category_and_period(self, request):
-        expenses = Expense.objects.annotate(month=TruncMonth('date')).values('month', 'category').annotate(total=Sum('amount')).order_by('month', 'category')
-        return Response([{'month': e['month'].strftime('%Y-%m-%d'), 'category': e['category'], 'total': str(e['total'])} for e in expenses])
+        expenses = period_balances.monthly('expense', by_dimension=True)
+        return Response([{'month': e['month'].strftime('%Y-%m-%d'), 'category': e['dimension'], 'total': str(e['total'])} for e in expenses])
     
 class FinancialRecordViewSet(viewsets.ModelViewSet):
     queryset = FinancialRecord.objects.all()
@@ -132,8 +150,8 @@ class FinancialRecordViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def by_type(self, request):
-        records = FinancialRecord.objects.values('record_type').annotate(total=Sum('amount'))
-        return Response([{'type': r['record_type'], 'total': str(r['total'])} for r in records])
+        records = period_balances.by_dimension('record')
+        return Response([{'type': r['dimension'], 'total': str(r['total'])} for r in records])
 
     @action(detail=False, methods=['get'])
     def by_budget(self, request):
@@ -152,8 +170,8 @@ class FinancialRecordViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def by_period(self, request):
-        records = FinancialRecord.objects.annotate(month=TruncMonth('date')).values('month', 'record_type').annotate(total=Sum('amount')).order_by('month', 'record_type')
-        return Response([{'month': r['month'].strftime('%Y-%m-%d'), 'type': r['record_type'], 'total': str(r['total'])} for r in records])
+        records = period_balances.monthly('record', by_dimension=True)
+        return Response([{'month': r['month'].strftime('%Y-%m-%d'), 'type': r['dimension'], 'total': str(r['total'])} for r in records])
     
 class InvoiceViewSet(viewsets.ModelViewSet):
     queryset = Invoice.objects.all()
@@ -186,10 +204,30 @@ class InvoiceViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def overdue(self, request):
+        # Factures passées en retard par la tâche d'échéancier, et celles échues depuis son dernier passage
         today = timezone.now().date()
-        overdue_invoices = Invoice.objects.filter(status='sent', due_date__lt=today)
+        overdue_invoices = Invoice.objects.filter(status__in=invoice_ageing.OUTSTANDING, due_date__lt=today)
         serializer = self.get_serializer(overdue_invoices, many=True)
         return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def ageing(self, request):
+        """Balance âgée précalculée : totaux par tranche et détail par client"""
+        clients = ClientAgeing.objects.select_related('client').order_by('client_id')
+        return Response({
+            'summary': invoice_ageing.summary(),
+            'clients': [
+                {
+                    'client': row.client_id,
+                    'client_name': row.client.username if row.client else None,
+                    'as_of': row.as_of,
+                    'invoice_count': row.invoice_count,
+                    **{field: getattr(row, field) for field in invoice_ageing.BUCKET_FIELDS},
+                    'total_outstanding': row.total_outstanding,
+                }
+                for row in clients if row.invoice_count
+            ],
+        })
     
 class FinancialReportView(APIView):
     permission_classes = [IsAuthenticated]
@@ -201,6 +239,9 @@ class FinancialReportView(APIView):
 
         if not start_date or not end_date:
             return Response({"error": "start_date and end_date are required"}, status=status.HTTP_400_BAD_REQUEST)
+        period = request.query_params.get('period', 'day')
+        if period not in CASH_FLOW_PERIODS:
+            return Response({"error": f"period must be one of {sorted(CASH_FLOW_PERIODS)}"}, status=status.HTTP_400_BAD_REQUEST)
 
         reports = {}
 
@@ -214,6 +255,82 @@ class FinancialReportView(APIView):
             reports['financial_health'] = generate_financial_health_report()
 
         if report_type in ['cash_flow', 'all']:
-            reports['cash_flow'] = generate_cash_flow_report(start_date, end_date)
+            reports['cash_flow'] = generate_cash_flow_report(start_date, end_date, period)
+
+        return Response(reports)
+
 
-        return Response(reports)
\ No newline at end of file
+class FinancialReportExportView(APIView):
+    """Export CSV / XLSX d'un rapport financier (type, start_date, end_date, file_format)"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        report_type = request.query_params.get('type')
+        start_date = request.query_params.get('start_date')
+        end_date = request.query_params.get('end_date')
+        export_format = request.query_params.get('file_format', 'csv')
+
+        if report_type not in EXPORTS:
+            return Response({"error": f"type must be one of {sorted(EXPORTS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if report_type != 'financial_health' and (not start_date or not end_date):
+            return Response({"error": "start_date and end_date are required"}, status=status.HTTP_400_BAD_REQUEST)
+        if export_format not in tabular_exporter.FORMATS:
+            return Response({"error": "file_format must be csv or xlsx"}, status=status.HTTP_400_BAD_REQUEST)
+
+        header, rows = EXPORTS[report_type](start_date, end_date)
+        filename = f"{report_type}_{start_date}_{end_date}" if start_date else report_type
+        return tabular_exporter.response(export_format, filename, header, rows, title=report_type)
+
+
+class FinancialChartView(APIView):
+    """
+    Graphique PNG d'un rapport financier (budget, revenue_expense, cash_flow), rendu à la
+    première demande puis servi depuis le cache jusqu'à la prochaine écriture financière.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, report):
+        start_date = request.query_params.get('start_date')
+        end_date = request.query_params.get('end_date')
+        if report not in CHARTS:
+            return Response({"error": f"report must be one of {sorted(CHARTS)}"}, status=status.HTTP_404_NOT_FOUND)
+        if not start_date or not end_date:
+            return Response({"error": "start_date and end_date are required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        period = request.query_params.get('period') if report == 'cash_flow' else None
+        if period is not None and period not in CASH_FLOW_PERIODS:
+            return Response({"error": f"period must be one of {sorted(CASH_FLOW_PERIODS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        params = chart_params(start_date, end_date, period=period)
+        etag = f'"{chart_etag(report, params)}"'
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            png = get_chart(report, params)
+            if png is None:
+                return Response({"error": "No data for this chart"}, status=status.HTTP_404_NOT_FOUND)
+            response = HttpResponse(png, content_type='image/png')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class FareReconciliationView(APIView):
+    """
+    Rapprochement des recettes voyageurs d'une journée (date, défaut : hier). GET calcule
+    le rapport d'écarts sans rien écrire ; POST écrit les lignes Revenue et retourne le rapport.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return self.reconcile(request, dry_run=True)
+
+    def post(self, request):
+        return self.reconcile(request, dry_run=False)
+
+    def reconcile(self, request, dry_run):
+        value = request.query_params.get('date') or request.data.get('date')
+        try:
+            day = date.fromisoformat(value) if value else timezone.localdate() - timedelta(days=1)
+        except ValueError:
+            return Response({"error": "date must be YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(fare_reconciliation.reconcile(day, dry_run=dry_run))
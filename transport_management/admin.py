@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.db import models 
 from .models import (
     OperationalRule, RuleExecution, RuleParameter, RuleSet, RuleSetMembership,
-    Destination, Route, Stop, RouteStop, Schedule, ScheduleException, ResourceAvailability,
+    Destination, Route, Stop, RouteStop, Geofence, RouteKPIRollup, ReportJob, TripTrackSummary, Schedule, ScheduleException, ResourceAvailability,
     Driver, DriverSchedule, DriverVehicleAssignment, Trip, PassengerTrip, Incident,
     EventLog, TripStatus, DisplaySchedule, BusPosition, BusTracking, DriverNavigation,
     PassengerTripHistory, TransactionScan
@@ -94,6 +94,38 @@ class RouteStopAdmin(admin.ModelAdmin):
     ordering = ('route', 'order')
     search_fields = ('route__name', 'stop__name')
 
+@admin.register(Geofence)
+class GeofenceAdmin(admin.ModelAdmin):
+    list_display = ('name', 'code', 'fence_type', 'shape', 'stop', 'dwell_threshold_seconds', 'is_active')
+    list_filter = ('fence_type', 'shape', 'severity', 'is_active')
+    search_fields = ('name', 'code', 'stop__name')
+    ordering = ('fence_type', 'name')
+    filter_horizontal = ('routes', 'vehicles')
+    readonly_fields = ('min_latitude', 'max_latitude', 'min_longitude', 'max_longitude', 'created_at', 'updated_at')
+
+@admin.register(RouteKPIRollup)
+class RouteKPIRollupAdmin(admin.ModelAdmin):
+    list_display = ('service_date', 'hour', 'route', 'schedule', 'trip_count', 'completed_count',
+                    'cancelled_count', 'on_time_count', 'incident_count', 'reconciled_at')
+    list_filter = ('service_date', 'route')
+    ordering = ('-service_date', 'hour', 'route')
+    readonly_fields = ('updated_at', 'reconciled_at')
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ('job_id', 'report_type', 'status', 'file_size', 'hit_count', 'requested_by', 'created_at', 'expires_at')
+    list_filter = ('report_type', 'status')
+    search_fields = ('job_id', 'params_hash')
+    readonly_fields = ('job_id', 'params_hash', 'file_path', 'file_size', 'hit_count',
+                       'created_at', 'started_at', 'completed_at', 'expires_at')
+
+@admin.register(TripTrackSummary)
+class TripTrackSummaryAdmin(admin.ModelAdmin):
+    list_display = ('trip', 'position_count', 'distance_km', 'moving_seconds', 'stopped_seconds',
+                    'max_speed', 'gap_count', 'computed_at')
+    search_fields = ('trip__id',)
+    readonly_fields = ('computed_at',)
+
 class ScheduleExceptionInline(admin.TabularInline):
     model = ScheduleException
     extra = 1
@@ -25,3 +25,49 @@ class TripStatusConsumer(AsyncWebsocketConsumer):
     async def send_status(self, event):
         status = event['status']
         await self.send(text_data=json.dumps(status))
+
+
+class StopArrivalsConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        self.stop_id = self.scope['url_route']['kwargs']['stop_id']
+        self.group_name = f'stop_arrivals_{self.stop_id}'
+
+        # Rejoindre le groupe de l'arrêt
+        await self.channel_layer.group_add(
+            self.group_name,
+            self.channel_name
+        )
+
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(
+            self.group_name,
+            self.channel_name
+        )
+
+    # Prévision d'arrivée nouvelle, modifiée ou retirée
+    async def send_arrivals(self, event):
+        await self.send(text_data=json.dumps(event['arrivals']))
+
+
+class EmergencyAlertsConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        self.group_name = 'emergency_alerts'
+
+        # Canal des urgences graves (salle de régulation)
+        await self.channel_layer.group_add(
+            self.group_name,
+            self.channel_name
+        )
+
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(
+            self.group_name,
+            self.channel_name
+        )
+
+    async def send_emergency(self, event):
+        await self.send(text_data=json.dumps(event['emergency']))
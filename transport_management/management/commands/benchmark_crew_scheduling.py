@@ -0,0 +1,98 @@
+# transport_management/management/commands/benchmark_crew_scheduling.py
+import random
+import time
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from transport_management.services.trip_scheduler.block_builder import VehicleBlockBuilder
+from transport_management.services.trip_scheduler.crew_scheduler import CrewSchedulingEngine
+
+
+class Command(BaseCommand):
+    help = "Mesure le temps de résolution du planning chauffeurs sur un réseau synthétique (sans base de données)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=500, help="Nombre de chauffeurs disponibles")
+        parser.add_argument('--routes', type=int, default=25, help="Nombre de lignes du réseau")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        trips = self._synthetic_trips(rng, options['routes'])
+        drivers = [
+            {
+                'id': driver_id,
+                'remaining_minutes': rng.choice([40, 40, 40, 35, 45]) * 60 - rng.randint(0, 4) * 480,
+                'busy': [],
+                'daily_minutes': {},
+                'restricted_routes': set(),
+                'min_break_minutes': 0,
+            }
+            for driver_id in range(1, options['drivers'] + 1)
+        ]
+
+        builder = VehicleBlockBuilder()
+        engine = CrewSchedulingEngine()
+
+        started = time.perf_counter()
+        blocks = builder.chain_trips(trips)
+        blocks_elapsed = time.perf_counter() - started
+
+        trip_by_id = {trip['id']: trip for trip in trips}
+        pieces = [
+            {
+                'trip_ids': [trip_id],
+                'route_ids': [trip_by_id[trip_id]['route_id']],
+                'block': block['block_number'],
+                'start': trip_by_id[trip_id]['departure'],
+                'end': trip_by_id[trip_id]['arrival'],
+            }
+            for block in blocks for trip_id in block['trip_ids']
+        ]
+
+        started = time.perf_counter()
+        duties = engine.build_duties(pieces)
+        duties_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        engine.assign_drivers(duties, drivers)
+        assign_elapsed = time.perf_counter() - started
+
+        assigned = sum(1 for duty in duties if duty['driver_id'] is not None)
+        average_driving = sum(duty['driving_minutes'] for duty in duties) / max(len(duties), 1)
+        self.stdout.write(f"Trips: {len(trips)} sur {options['routes']} lignes")
+        self.stdout.write(f"Blocs véhicule: {len(blocks)} ({blocks_elapsed:.3f}s)")
+        self.stdout.write(f"Services chauffeur: {len(duties)} ({duties_elapsed:.3f}s)")
+        self.stdout.write(
+            f"Affectation: {assigned}/{len(duties)} services sur {len(drivers)} chauffeurs ({assign_elapsed:.3f}s)"
+        )
+        self.stdout.write(f"Conduite moyenne par service: {average_driving / 60:.1f}h")
+        self.stdout.write(self.style.SUCCESS(
+            f"Temps total: {blocks_elapsed + duties_elapsed + assign_elapsed:.3f}s"
+        ))
+
+    def _synthetic_trips(self, rng, route_count):
+        """Lignes aller-retour de 05:00 à 23:00 avec des fréquences de 10 à 30 minutes"""
+        day = timezone.make_aware(datetime.combine(timezone.now().date(), datetime.min.time()))
+        trips = []
+        for route_id in range(1, route_count + 1):
+            origin = (18.5 + rng.uniform(-0.1, 0.1), -72.3 + rng.uniform(-0.1, 0.1))
+            terminus = (18.5 + rng.uniform(-0.1, 0.1), -72.3 + rng.uniform(-0.1, 0.1))
+            duration = rng.randint(25, 70)
+            headway = rng.choice([10, 12, 15, 20, 30])
+            for direction, (start, end) in enumerate([(origin, terminus), (terminus, origin)]):
+                minute = 5 * 60 + direction * rng.randint(0, headway)
+                while minute < 23 * 60:
+                    departure = day + timedelta(minutes=minute)
+                    trips.append({
+                        'id': len(trips) + 1,
+                        'route_id': route_id,
+                        'departure': departure,
+                        'arrival': departure + timedelta(minutes=duration),
+                        'start': start,
+                        'end': end,
+                        'layover': 5,
+                        'capacity': None,
+                    })
+                    minute += headway
+        return trips
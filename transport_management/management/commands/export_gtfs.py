@@ -0,0 +1,27 @@
+# transport_management/management/commands/export_gtfs.py
+from datetime import datetime
+from django.core.management.base import BaseCommand
+from transport_management.services.gtfs.feed_export import GTFSFeedExporter
+
+
+class Command(BaseCommand):
+    help = "Exporte le réseau (arrêts, routes, horaires, tracés) en flux GTFS statique."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='gtfs.zip', help="Chemin du zip à produire")
+        parser.add_argument('--start-date', help="Début de la période des trips ponctuels (YYYY-MM-DD)")
+        parser.add_argument('--end-date', help="Fin de la période des trips ponctuels (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        start_date = self._parse_date(options['start_date'])
+        end_date = self._parse_date(options['end_date'])
+
+        with open(options['output'], 'wb') as output:
+            size = GTFSFeedExporter().write_to(output, start_date, end_date)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Flux GTFS écrit dans {options['output']} ({size / 1024:.1f} Ko)"
+        ))
+
+    def _parse_date(self, value):
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
@@ -0,0 +1,20 @@
+# transport_management/management/commands/import_gtfs.py
+from django.core.management.base import BaseCommand
+from transport_management.services.gtfs.feed_import import GTFSFeedImporter
+
+
+class Command(BaseCommand):
+    help = "Importe un flux GTFS statique (arrêts, routes, séquences d'arrêts, horaires)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Chemin du zip GTFS")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Objets par bulk_create")
+
+    def handle(self, *args, **options):
+        importer = GTFSFeedImporter()
+        importer.BATCH_SIZE = options['batch_size']
+        summary = importer.import_feed(options['path'])
+
+        for name, count in summary.items():
+            self.stdout.write(f"{name}: {count}")
+        self.stdout.write(self.style.SUCCESS("Import GTFS terminé"))
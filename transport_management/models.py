@@ -1,6 +1,9 @@
+import bisect
+import math
 from django.db import models
 from django.conf import settings
 from django.db.models import Avg
+from django.db.models.functions import Coalesce
 from geopy.distance import geodesic
 from django.contrib.auth import get_user_model
 from django.utils import timezone
@@ -370,6 +373,99 @@ class RouteStop(models.Model):
         return f"{self.route.name} - Stop {self.stop.name} (Order: {self.order})"
 
 
+class Geofence(models.Model):
+    FENCE_TYPE_CHOICES = [
+        ('depot', 'Dépôt'),
+        ('terminal', 'Terminal'),
+        ('stop_area', "Zone d'arrêt"),
+        ('school_zone', 'Zone scolaire'),
+        ('restricted', 'Zone interdite'),
+        ('custom', 'Personnalisée')
+    ]
+
+    SHAPE_CHOICES = [
+        ('polygon', 'Polygone'),
+        ('circle', 'Cercle')
+    ]
+
+    # Informations de base
+    name = models.CharField(max_length=255)
+    code = models.CharField(max_length=50, unique=True)
+    fence_type = models.CharField(max_length=50, choices=FENCE_TYPE_CHOICES, default='custom')
+    shape = models.CharField(max_length=20, choices=SHAPE_CHOICES)
+
+    # Géométrie : polygone [[lat, lon], ...] ou cercle (centre + rayon)
+    polygon = models.JSONField(default=list, blank=True,
+                               help_text="Sommets [[latitude, longitude], ...] du polygone")
+    center_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    center_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    radius_meters = models.FloatField(null=True, blank=True)
+
+    # Emprise (calculée à l'enregistrement, utilisée par l'index spatial)
+    min_latitude = models.FloatField(editable=False, default=0)
+    max_latitude = models.FloatField(editable=False, default=0)
+    min_longitude = models.FloatField(editable=False, default=0)
+    max_longitude = models.FloatField(editable=False, default=0)
+
+    # Portée : toutes les routes / tous les véhicules si vide
+    stop = models.ForeignKey(Stop, on_delete=models.CASCADE, null=True, blank=True,
+                             related_name='geofences')
+    routes = models.ManyToManyField(Route, blank=True, related_name='geofences')
+    vehicles = models.ManyToManyField(Vehicle, blank=True, related_name='geofences')
+
+    # Événements
+    dwell_threshold_seconds = models.PositiveIntegerField(default=300,
+                                                          help_text="Présence continue avant l'événement de stationnement")
+    severity = models.CharField(max_length=20, choices=[
+        ('info', 'Information'),
+        ('warning', 'Avertissement'),
+        ('error', 'Erreur'),
+        ('critical', 'Critique')
+    ], default='info', help_text="Gravité des événements d'entrée")
+
+    # Métadonnées
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        ordering = ['fence_type', 'name']
+        indexes = [
+            models.Index(fields=['is_active', 'fence_type']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.get_shape_display()})"
+
+    def clean(self):
+        if self.shape == 'polygon':
+            if not isinstance(self.polygon, list) or len(self.polygon) < 3:
+                raise ValidationError("Un polygone doit avoir au moins 3 sommets.")
+            for vertex in self.polygon:
+                if not isinstance(vertex, (list, tuple)) or len(vertex) != 2:
+                    raise ValidationError("Chaque sommet doit être [latitude, longitude].")
+        elif self.shape == 'circle':
+            if self.center_latitude is None or self.center_longitude is None or not self.radius_meters:
+                raise ValidationError("Un cercle doit avoir un centre et un rayon positif.")
+
+    def compute_bounds(self):
+        """Emprise (lat/lon min et max) de la zone"""
+        if self.shape == 'circle':
+            latitude, longitude = float(self.center_latitude), float(self.center_longitude)
+            delta_latitude = self.radius_meters / 111320.0
+            delta_longitude = self.radius_meters / (111320.0 * max(abs(math.cos(math.radians(latitude))), 0.01))
+            return (latitude - delta_latitude, latitude + delta_latitude,
+                    longitude - delta_longitude, longitude + delta_longitude)
+        latitudes = [float(vertex[0]) for vertex in self.polygon]
+        longitudes = [float(vertex[1]) for vertex in self.polygon]
+        return min(latitudes), max(latitudes), min(longitudes), max(longitudes)
+
+    def save(self, *args, **kwargs):
+        self.min_latitude, self.max_latitude, self.min_longitude, self.max_longitude = self.compute_bounds()
+        super().save(*args, **kwargs)
+
+
 class Schedule(models.Model):
     # Relations
     route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='schedules')
@@ -505,6 +601,13 @@ class Schedule(models.Model):
         """
         Génère les horaires pour une date spécifique en tenant compte des ajustements.
         """
+        self.timepoints = self.compute_timepoints(date)
+        self.save()
+
+    def compute_timepoints(self, date):
+        """
+        Calcule les horaires ('HH:MM:SS') d'une date sans les enregistrer.
+        """
         times = []
         current_datetime = datetime.combine(date, self.start_time)
         end_datetime = datetime.combine(date, self.end_time)
@@ -529,8 +632,7 @@ class Schedule(models.Model):
             else:
                 frequency = self.frequency
 
-        self.timepoints = times
-        self.save()
+        return times
 
     def apply_weather_adjustment(self, datetime_obj):
         """
@@ -691,25 +793,28 @@ class Schedule(models.Model):
         )
 
     def update_schedule_metrics(self):
-        """Met à jour les métriques de performance"""
-        today = timezone.now().date()
-        daily_trips = self.trips.filter(planned_departure__date=today)
-        
-        metrics = {
+        """Métriques de performance du jour, lues dans les agrégats KPI (une seule requête)"""
+        today = timezone.localdate()
+        totals = RouteKPIRollup.objects.filter(schedule=self, service_date=today).aggregate(
+            total_trips=models.Sum('trip_count'),
+            completed_trips=models.Sum('completed_count'),
+            on_time_trips=models.Sum('on_time_count'),
+            delay_samples=models.Sum('delay_sample_count'),
+            cancelled_trips=models.Sum('cancelled_count'),
+            total_delay=models.Sum('total_delay_seconds')
+        )
+        delay_samples = totals['delay_samples'] or 0
+
+        return {
             'date': today.isoformat(),
-            'total_trips': daily_trips.count(),
-            'completed_trips': daily_trips.filter(status='completed').count(),
-            'on_time_trips': daily_trips.filter(schedule_adherence='on_time').count(),
-            'delayed_trips': daily_trips.filter(schedule_adherence='delayed').count(),
-            'cancelled_trips': daily_trips.filter(status='cancelled').count(),
-            'average_delay': daily_trips.aggregate(
-                Avg('delay_minutes')
-            )['delay_minutes__avg'] or 0
+            'total_trips': totals['total_trips'] or 0,
+            'completed_trips': totals['completed_trips'] or 0,
+            'on_time_trips': totals['on_time_trips'] or 0,
+            'delayed_trips': delay_samples - (totals['on_time_trips'] or 0),
+            'cancelled_trips': totals['cancelled_trips'] or 0,
+            'average_delay': (totals['total_delay'] or 0) / delay_samples / 60 if delay_samples else 0
         }
 
-        self.schedule_metrics[today.isoformat()] = metrics
-        self.save()
-
     def check_resource_availability(self, date):
         """Vérifie la disponibilité des ressources"""
         required_resources = self.resource_requirements.get('daily', {})
@@ -734,15 +839,15 @@ class Schedule(models.Model):
     def get_next_departure(self, from_time=None):
         """Trouve le prochain départ à partir d'une heure donnée."""
         if from_time is None:
-            from_time = timezone.now().time()
+            from_time = timezone.localtime().time()
 
-        if not self.timepoints:
-            self.generate_timepoints_for_date(timezone.now().date())
+        # Lecture seule : les horaires manquants sont calculés sans être enregistrés
+        timepoints = self.timepoints or self.compute_timepoints(timezone.localdate())
 
-        for timepoint in self.timepoints:
-            departure_time = datetime.strptime(timepoint, '%H:%M:%S').time()
-            if departure_time > from_time:
-                return departure_time
+        # Horaires 'HH:MM:SS' triés : l'ordre lexicographique est l'ordre chronologique
+        position = bisect.bisect_right(timepoints, from_time.strftime('%H:%M:%S'))
+        if position < len(timepoints):
+            return time.fromisoformat(timepoints[position])
         return None
 
     def get_validation_history(self):
@@ -935,9 +1040,34 @@ class Driver(models.Model):
     def is_license_valid(self):
         return timezone.now().date() < self.license_expiry_date
 
-    def update_performance_metrics(self):
-        # Logique pour mettre à jour les métriques de performance
-        pass
+    def update_performance_metrics(self, days=30):
+        """Métriques de conduite des trips récents, agrégées depuis les synthèses de trace"""
+        since = timezone.now() - timedelta(days=days)
+        totals = TripTrackSummary.objects.filter(
+            trip__driver=self, first_position_at__gte=since
+        ).aggregate(
+            trips=models.Count('id'),
+            distance_km=models.Sum('distance_km'),
+            moving_seconds=models.Sum('moving_seconds'),
+            stopped_seconds=models.Sum('stopped_seconds'),
+            max_speed=models.Max('max_speed'),
+            gap_count=models.Sum('gap_count')
+        )
+        moving_seconds = totals['moving_seconds'] or 0
+        metrics = dict(self.performance_metrics or {})
+        metrics['tracking'] = {
+            'period_days': days,
+            'trips': totals['trips'],
+            'distance_km': round(totals['distance_km'] or 0, 2),
+            'moving_hours': round(moving_seconds / 3600, 2),
+            'stopped_hours': round((totals['stopped_seconds'] or 0) / 3600, 2),
+            'average_moving_speed': round((totals['distance_km'] or 0) / moving_seconds * 3600, 1) if moving_seconds else 0,
+            'max_speed': totals['max_speed'] or 0,
+            'tracking_gaps': totals['gap_count'] or 0,
+            'updated_at': timezone.now().isoformat(),
+        }
+        self.performance_metrics = metrics
+        return metrics
 
     def check_availability(self, date, start_time, end_time):
         # Logique pour vérifier la disponibilité
@@ -2095,6 +2225,111 @@ class Incident(models.Model):
         """Récupère les incidents par type"""
         return cls.objects.filter(type=incident_type).order_by('-date')
 
+class RouteKPIRollup(models.Model):
+    """
+    Indicateurs agrégés par (route, horaire, jour de service, heure de départ prévue).
+    Tenus à jour par différence à chaque transition de trip et d'incident, puis
+    recalculés par la réconciliation nocturne.
+    """
+
+    # Clé d'agrégation
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='kpi_rollups')
+    schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='kpi_rollups')
+    service_date = models.DateField()
+    hour = models.PositiveSmallIntegerField(validators=[MaxValueValidator(23)])
+
+    # Compteurs
+    trip_count = models.IntegerField(default=0)
+    completed_count = models.IntegerField(default=0)
+    cancelled_count = models.IntegerField(default=0)
+    on_time_count = models.IntegerField(default=0)
+    delay_sample_count = models.IntegerField(default=0, help_text="Trips dont le retard est connu")
+    total_delay_seconds = models.BigIntegerField(default=0)
+    max_delay_seconds = models.IntegerField(default=0)
+    passenger_count = models.IntegerField(default=0)
+    incident_count = models.IntegerField(default=0)
+
+    # Métadonnées
+    reconciled_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['service_date', 'hour', 'route']
+        constraints = [
+            # Horaire absent ramené à 0 : unicité garantie aussi sans index partiel (MySQL)
+            models.UniqueConstraint('route', Coalesce('schedule', models.Value(0)), 'service_date', 'hour',
+                                    name='unique_route_kpi_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['service_date', 'route']),
+            models.Index(fields=['schedule', 'service_date']),
+        ]
+
+    def __str__(self):
+        return f"{self.route_id} - {self.service_date} {self.hour:02d}h ({self.trip_count} trips)"
+
+    @property
+    def average_delay_seconds(self):
+        return self.total_delay_seconds / self.delay_sample_count if self.delay_sample_count else 0
+
+
+class ReportJob(models.Model):
+    """
+    Rapport calculé en arrière-plan. Les demandes identiques (même type, mêmes paramètres)
+    partagent le même job tant qu'il est en cours, puis son fichier tant qu'il n'a pas expiré.
+    """
+
+    REPORT_TYPE_CHOICES = [
+        ('trip_analysis', 'Analyse des trajets'),
+        ('kpi', "KPI d'exploitation"),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'En attente'),
+        ('running', 'En cours'),
+        ('completed', 'Terminé'),
+        ('failed', 'Échoué'),
+    ]
+
+    job_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    report_type = models.CharField(max_length=30, choices=REPORT_TYPE_CHOICES)
+    params = models.JSONField(default=dict)
+    params_hash = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Hash des paramètres tant que le job est en attente ou en cours, NULL ensuite :
+    # un seul job en cours par demande, garanti par un index unique simple (sans index partiel)
+    in_flight_hash = models.CharField(max_length=64, null=True, blank=True, unique=True, editable=False)
+
+    # Résultat
+    file_path = models.CharField(max_length=255, blank=True)
+    file_size = models.PositiveIntegerField(null=True, blank=True, help_text="Taille compressée en octets")
+    error_message = models.TextField(blank=True)
+    hit_count = models.PositiveIntegerField(default=0, help_text="Demandes servies par ce job")
+
+    # Métadonnées
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='report_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['params_hash', 'status']),
+            models.Index(fields=['status', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.report_type} {self.job_id} ({self.status})"
+
+    @property
+    def is_available(self):
+        return self.status == 'completed' and (self.expires_at is None or self.expires_at > timezone.now())
+
+
 class EventLog(models.Model):
     EVENT_TYPE_CHOICES = [
         ('trip_start', 'Départ du voyage'),
@@ -2111,7 +2346,12 @@ class EventLog(models.Model):
         ('weather_alert', 'Alerte météo'),
         ('system_alert', 'Alerte système'),
         ('rule_violation', 'Violation de règle'),
-        ('schedule_change', 'Changement d\'horaire')
+        ('schedule_change', 'Changement d\'horaire'),
+        ('bus_bunching', 'Regroupement de bus'),
+        ('headway_gap', 'Trou de service'),
+        ('geofence_enter', 'Entrée en zone'),
+        ('geofence_exit', 'Sortie de zone'),
+        ('geofence_dwell', 'Stationnement en zone')
     ]
 
     SEVERITY_LEVELS = [
@@ -2926,6 +3166,50 @@ class BusPosition(models.Model):
         cls.objects.filter(timestamp__lt=threshold).delete()
         
         
+class TripTrackSummary(models.Model):
+    """
+    Synthèse de la trace GPS d'un trip (positions valides), calculée en colonnes par
+    services/tracking/track_analytics.py. Rapports, métriques chauffeur et tableaux de
+    bord lisent cette ligne au lieu de reparcourir les positions.
+    """
+
+    trip = models.OneToOneField(Trip, on_delete=models.CASCADE, related_name='track_summary')
+
+    # Couverture
+    position_count = models.IntegerField(default=0)
+    first_position_at = models.DateTimeField(null=True, blank=True)
+    last_position_at = models.DateTimeField(null=True, blank=True)
+
+    # Distance et temps
+    distance_km = models.FloatField(default=0)
+    duration_seconds = models.FloatField(default=0, help_text="De la première à la dernière position")
+    moving_seconds = models.FloatField(default=0)
+    stopped_seconds = models.FloatField(default=0)
+
+    # Vitesses (km/h)
+    average_moving_speed = models.FloatField(default=0)
+    max_speed = models.FloatField(default=0)
+    speed_profile = models.JSONField(default=dict, help_text="Secondes passées par tranche de vitesse")
+
+    # Arrêts et trous de suivi
+    stop_dwells = models.JSONField(default=list, help_text="[{'stop_id', 'seconds'}] temps passé à chaque arrêt")
+    total_dwell_seconds = models.FloatField(default=0)
+    gap_count = models.IntegerField(default=0)
+    longest_gap_seconds = models.FloatField(default=0)
+
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Trip Track Summary"
+        verbose_name_plural = "Trip Track Summaries"
+        indexes = [
+            models.Index(fields=['computed_at']),
+        ]
+
+    def __str__(self):
+        return f"Track {self.trip_id}: {self.distance_km:.1f} km, {self.position_count} positions"
+
+
 class BusTracking(models.Model):
     LOCATION_SOURCE_CHOICES = [
         ('GPS', 'GPS'),
@@ -1,7 +1,9 @@
 # transport_management/routing.py
 from django.urls import re_path
-from .consumers import TripStatusConsumer
+from .consumers import TripStatusConsumer, StopArrivalsConsumer, EmergencyAlertsConsumer
 
 websocket_urlpatterns = [
     re_path(r'ws/trip/(?P<trip_id>\d+)/$', TripStatusConsumer.as_asgi()),
+    re_path(r'ws/stop/(?P<stop_id>\d+)/$', StopArrivalsConsumer.as_asgi()),
+    re_path(r'ws/emergencies/$', EmergencyAlertsConsumer.as_asgi()),
 ]
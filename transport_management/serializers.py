@@ -1,12 +1,14 @@
 # transport_api/serializers.py
 from django.utils import timezone
 from rest_framework import serializers
+from django.urls import reverse
 from django.contrib.auth import get_user_model
 from inventory_management.models import Vehicle
 from .models import (
     OperationalRule, RuleExecution, RuleParameter, RuleSet, RuleSetMembership,
-    Destination, Route, Stop, RouteStop, Schedule, ScheduleException,
-    ResourceAvailability, Driver, EventLog, Trip, BusPosition, DisplaySchedule
+    Destination, Route, Stop, RouteStop, Geofence, Schedule, ScheduleException,
+    ResourceAvailability, Driver, EventLog, Trip, BusPosition, DisplaySchedule, ReportJob,
+    TripTrackSummary
 )
 User = get_user_model()
 
@@ -205,6 +207,79 @@ class StoparretSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Le temps d'attente moyen doit être positif.")
         return value
     
+class GeofenceSerializer(serializers.ModelSerializer):
+    polygon = serializers.JSONField(required=False)
+
+    class Meta:
+        model = Geofence
+        fields = [
+            'id', 'name', 'code', 'fence_type', 'shape',
+            'polygon', 'center_latitude', 'center_longitude', 'radius_meters',
+            'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude',
+            'stop', 'routes', 'vehicles', 'dwell_threshold_seconds', 'severity',
+            'is_active', 'created_at', 'updated_at', 'created_by'
+        ]
+        read_only_fields = [
+            'id', 'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude',
+            'created_at', 'updated_at', 'created_by'
+        ]
+
+    def create(self, validated_data):
+        validated_data['created_by'] = self.context['request'].user
+        return super().create(validated_data)
+
+    def validate(self, data):
+        shape = data.get('shape', getattr(self.instance, 'shape', None))
+        if shape == 'polygon':
+            polygon = data.get('polygon', getattr(self.instance, 'polygon', None))
+            if not isinstance(polygon, list) or len(polygon) < 3:
+                raise serializers.ValidationError({'polygon': "Un polygone doit avoir au moins 3 sommets."})
+            for vertex in polygon:
+                if (not isinstance(vertex, (list, tuple)) or len(vertex) != 2
+                        or not all(isinstance(value, (int, float)) for value in vertex)):
+                    raise serializers.ValidationError({'polygon': "Chaque sommet doit être [latitude, longitude]."})
+                if not (-90 <= vertex[0] <= 90 and -180 <= vertex[1] <= 180):
+                    raise serializers.ValidationError({'polygon': "Coordonnées de sommet invalides."})
+        elif shape == 'circle':
+            for field in ('center_latitude', 'center_longitude', 'radius_meters'):
+                if data.get(field, getattr(self.instance, field, None)) is None:
+                    raise serializers.ValidationError({field: "Requis pour une zone circulaire."})
+            if data.get('radius_meters', getattr(self.instance, 'radius_meters', None)) <= 0:
+                raise serializers.ValidationError({'radius_meters': "Le rayon doit être positif."})
+        return data
+
+class TripTrackSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TripTrackSummary
+        fields = [
+            'trip', 'position_count', 'first_position_at', 'last_position_at', 'distance_km',
+            'duration_seconds', 'moving_seconds', 'stopped_seconds', 'average_moving_speed', 'max_speed',
+            'speed_profile', 'stop_dwells', 'total_dwell_seconds', 'gap_count', 'longest_gap_seconds',
+            'computed_at'
+        ]
+        read_only_fields = fields
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = [
+            'job_id', 'report_type', 'params', 'status', 'file_size', 'error_message',
+            'hit_count', 'created_at', 'started_at', 'completed_at', 'expires_at', 'download_url'
+        ]
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        request = self.context.get('request')
+        if not obj.is_available or request is None:
+            return None
+        return request.build_absolute_uri(reverse('report-job-download', kwargs={'job_id': obj.job_id}))
+
+class ReportJobRequestSerializer(serializers.Serializer):
+    report_type = serializers.ChoiceField(choices=ReportJob.REPORT_TYPE_CHOICES)
+    params = serializers.DictField(required=False, default=dict)
+
 class RouteStoparretSerializer(serializers.ModelSerializer):
     route = serializers.PrimaryKeyRelatedField(queryset=Route.objects.all())
     stop = serializers.PrimaryKeyRelatedField(queryset=Stop.objects.all())
@@ -1,13 +1,31 @@
 # transport_management/services/emergency/emergency_manager.py
 
+import uuid
+import numpy as np
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
 from django.utils import timezone
-from datetime import datetime, timedelta
-from django.db.models import Q, Avg, Count
-from ...models import Trip, BusPosition, EventLog, Incident, Stop
+from ...models import Trip, Stop, BusPosition, EventLog, Incident
 from ..base.service_base import ServiceBase
+from ..timetable.journey_planner import journey_planner
+from ..timetable.stop_times import load_route_patterns
+from ..trip_scheduler.deadhead import haversine_km, distance_to_polyline_meters, load_route_lines
+
 
 class EmergencyManager(ServiceBase):
+    """
+    Détection des situations d'urgence à chaque position acceptée.
+    Chaque règle est évaluée de façon incrémentale contre l'état glissant du trip
+    (dernière position, vitesses récentes, début de l'arrêt en cours, alertes ouvertes)
+    gardé en cache : aucune requête sur l'historique des positions.
+    Une alerte n'est levée qu'une fois par épisode, ou à nouveau si sa gravité augmente.
+    Les situations graves partent sur la file Celery prioritaire et le canal websocket
+    des urgences ; les autres sont enregistrées sur la file par défaut.
+    """
+
     def __init__(self):
         super().__init__()
         # Seuils de détection
@@ -15,7 +33,18 @@ class EmergencyManager(ServiceBase):
         self.MAJOR_DEVIATION_THRESHOLD = 200  # mètres
         self.SPEED_ANOMALY_THRESHOLD = 20  # km/h au-dessus de la moyenne
         self.SUDDEN_STOP_THRESHOLD = 30  # km/h/s (décélération brutale)
-        self.EMERGENCY_CHECK_INTERVAL = 60  # secondes
+        self.STOPPED_SPEED = 5  # km/h
+        self.SCHEDULED_STOP_RADIUS = 50  # mètres
+        self.SPEED_WINDOW = 300  # secondes de vitesses gardées pour la moyenne
+        self.MIN_SPEED_SAMPLES = 3
+        self.SUDDEN_STOP_COOLDOWN = 60  # secondes entre deux alertes de freinage
+        self.STATE_TIMEOUT = 6 * 3600
+        self.STATE_KEY = 'emergency_state_{trip_id}'
+
+        # Files et canal des urgences
+        self.EMERGENCY_QUEUE = getattr(settings, 'CELERY_EMERGENCY_QUEUE', 'emergency')
+        self.ALERT_GROUP = 'emergency_alerts'
+        self.URGENT_SEVERITIES = ['high', 'critical']
 
         # Niveaux de gravité
         self.SEVERITY_LEVELS = {
@@ -24,288 +53,342 @@ class EmergencyManager(ServiceBase):
             'high': 3,
             'critical': 4
         }
+        self.INCIDENT_SEVERITIES = {'low': 'minor', 'medium': 'moderate', 'high': 'major', 'critical': 'critical'}
+        self.INCIDENT_PRIORITIES = {'low': 'medium', 'medium': 'medium', 'high': 'high', 'critical': 'urgent'}
+        self.EVENT_SEVERITIES = {'low': 'info', 'medium': 'warning', 'high': 'error', 'critical': 'critical'}
+        self.INCIDENT_TYPES = {
+            'unplanned_stop': 'traffic',
+            'major_deviation': 'traffic',
+            'excessive_speed': 'security',
+            'sudden_stop': 'accident'
+        }
+
+        self._geometries = {}
+        self._network_version = None
+
+    # ------------------------------------------------------------------
+    # Évaluation à l'ingestion
+    # ------------------------------------------------------------------
+
+    def evaluate_position(self, position):
+        """
+        Applique les règles à une position acceptée et envoie les urgences détectées.
+        Retourne la liste des urgences levées.
+        """
+        try:
+            trip = position.trip
+            key = self.STATE_KEY.format(trip_id=trip.id)
+            state = cache.get(key) or self._initial_state()
+            fix = {
+                'ts': position.timestamp.timestamp(),
+                'speed': float(position.speed or 0),
+                'lat': float(position.latitude),
+                'lon': float(position.longitude),
+            }
+            # Position reçue dans le désordre : l'état glissant n'est pas rejoué
+            if state['last'] is not None and fix['ts'] <= state['last']['ts']:
+                return []
+
+            emergencies = []
+            for rule in (self._check_unplanned_stop, self._check_major_deviation,
+                         self._check_excessive_speed, self._check_sudden_stop):
+                emergency = rule(trip, state, fix)
+                if emergency:
+                    emergency['details']['timestamp'] = position.timestamp.isoformat()
+                    emergencies.append(emergency)
+
+            self._advance_state(state, fix)
+            cache.set(key, state, self.STATE_TIMEOUT)
+
+            if emergencies:
+                self._dispatch(trip.id, emergencies)
+            return emergencies
+
+        except Exception as e:
+            self.log_error(f"Error evaluating emergencies for trip {position.trip_id}: {str(e)}", exc=e)
+            return []
 
     def check_emergencies(self, trip_id=None):
-        """Vérifie les situations d'urgence"""
+        """Réévalue la dernière position des trips actifs (reprise manuelle, hors ingestion)"""
         try:
+            trips = Trip.objects.filter(status__in=['in_progress', 'delayed'])
             if trip_id:
-                trips = Trip.objects.filter(id=trip_id)
-            else:
-                trips = Trip.objects.filter(status__in=['in_progress', 'delayed'])
-
+                trips = trips.filter(id=trip_id)
             for trip in trips:
-                self._process_emergency_checks(trip)
+                position = BusPosition.objects.filter(trip=trip).order_by('-timestamp').first()
+                if position:
+                    # L'état glissant est réinitialisé : la position est réappliquée
+                    cache.delete(self.STATE_KEY.format(trip_id=trip.id))
+                    self.evaluate_position(position)
 
         except Exception as e:
             self.log_error(f"Error checking emergencies: {str(e)}", exc=e)
 
-    def _process_emergency_checks(self, trip):
-        """Traite les vérifications d'urgence pour un trip"""
-        try:
-            latest_position = self._get_latest_position(trip)
-            if not latest_position:
-                return
-
-            emergency_situations = []
+    def forget_trip(self, trip_id):
+        cache.delete(self.STATE_KEY.format(trip_id=trip_id))
+
+    def _initial_state(self):
+        return {'last': None, 'speeds': [], 'stopped_since': None, 'alerts': {}, 'sudden_stop_at': None}
+
+    def _advance_state(self, state, fix):
+        """Met à jour la fenêtre glissante après l'évaluation des règles"""
+        state['speeds'] = [
+            sample for sample in state['speeds'] if fix['ts'] - sample[0] <= self.SPEED_WINDOW
+        ] + [(fix['ts'], fix['speed'])]
+        if fix['speed'] > self.STOPPED_SPEED:
+            state['stopped_since'] = None
+        elif state['stopped_since'] is None:
+            state['stopped_since'] = fix['ts']
+        state['last'] = fix
+
+    def _raise(self, state, emergency_type, severity):
+        """Vrai si l'alerte est nouvelle pour l'épisode ou plus grave que celle déjà levée"""
+        raised = state['alerts'].get(emergency_type)
+        if raised is not None and self.SEVERITY_LEVELS[raised] >= self.SEVERITY_LEVELS[severity]:
+            return False
+        state['alerts'][emergency_type] = severity
+        return True
 
-            # 1. Vérifier les arrêts non prévus
-            unplanned_stop = self._check_unplanned_stop(trip, latest_position)
-            if unplanned_stop:
-                emergency_situations.append(unplanned_stop)
+    def _clear(self, state, emergency_type):
+        state['alerts'].pop(emergency_type, None)
 
-            # 2. Vérifier les déviations
-            deviation = self._check_major_deviation(trip, latest_position)
-            if deviation:
-                emergency_situations.append(deviation)
+    # ------------------------------------------------------------------
+    # Règles
+    # ------------------------------------------------------------------
 
-            # 3. Vérifier les anomalies de vitesse
-            speed_anomaly = self._check_speed_anomaly(trip, latest_position)
-            if speed_anomaly:
-                emergency_situations.append(speed_anomaly)
+    def _check_unplanned_stop(self, trip, state, fix):
+        """Détecte les arrêts non prévus (arrêt prolongé hors des arrêts de la route)"""
+        if fix['speed'] > self.STOPPED_SPEED:
+            self._clear(state, 'unplanned_stop')
+            return None
 
-            # 4. Gérer les situations d'urgence détectées
-            if emergency_situations:
-                self._handle_emergencies(trip, emergency_situations)
+        stopped_since = state['stopped_since'] if state['stopped_since'] is not None else fix['ts']
+        stop_duration = fix['ts'] - stopped_since
+        if stop_duration < self.UNPLANNED_STOP_THRESHOLD:
+            return None
 
-        except Exception as e:
-            self.log_error(f"Error processing emergency checks for trip {trip.id}: {str(e)}", exc=e)
+        if self._is_at_scheduled_stop(trip.route_id, fix):
+            return None
 
-    def _check_unplanned_stop(self, trip, position):
-        """Détecte les arrêts non prévus"""
-        try:
-            if position.speed > 5:  # km/h
-                return None
-
-            # Vérifier si le véhicule est arrêté depuis un moment
-            stop_duration = self._calculate_stop_duration(trip, position)
-            if stop_duration < self.UNPLANNED_STOP_THRESHOLD:
-                return None
-
-            # Vérifier si l'arrêt est prévu
-            if self._is_at_scheduled_stop(trip, position):
-                return None
-
-            severity = self._calculate_stop_severity(stop_duration)
-            
-            return {
-                'type': 'unplanned_stop',
-                'severity': severity,
-                'details': {
-                    'duration': stop_duration,
-                    'location': {
-                        'lat': position.latitude,
-                        'lon': position.longitude
-                    },
-                    'timestamp': position.timestamp.isoformat()
-                }
+        severity = self._calculate_stop_severity(stop_duration)
+        if not self._raise(state, 'unplanned_stop', severity):
+            return None
+        return {
+            'type': 'unplanned_stop',
+            'severity': severity,
+            'details': {
+                'duration': round(stop_duration),
+                'location': {'lat': fix['lat'], 'lon': fix['lon']},
             }
+        }
 
-        except Exception as e:
-            self.log_error(f"Error checking unplanned stop: {str(e)}", exc=e)
+    def _check_major_deviation(self, trip, state, fix):
+        """Détecte les déviations importantes (distance au tracé de la route)"""
+        deviation = self._calculate_route_deviation(trip.route_id, fix)
+        if deviation is None or deviation < self.MAJOR_DEVIATION_THRESHOLD:
+            self._clear(state, 'major_deviation')
             return None
 
-    def _check_major_deviation(self, trip, position):
-        """Détecte les déviations importantes"""
-        try:
-            deviation = self._calculate_route_deviation(trip, position)
-            if deviation < self.MAJOR_DEVIATION_THRESHOLD:
-                return None
-
-            # Vérifier si la déviation est déjà connue
-            if self._is_known_deviation(trip, position):
-                return None
-
-            severity = self._calculate_deviation_severity(deviation)
-
-            return {
-                'type': 'major_deviation',
-                'severity': severity,
-                'details': {
-                    'deviation_distance': deviation,
-                    'location': {
-                        'lat': position.latitude,
-                        'lon': position.longitude
-                    },
-                    'timestamp': position.timestamp.isoformat()
-                }
+        severity = self._calculate_deviation_severity(deviation)
+        if not self._raise(state, 'major_deviation', severity):
+            return None
+        return {
+            'type': 'major_deviation',
+            'severity': severity,
+            'details': {
+                'deviation_distance': round(deviation),
+                'location': {'lat': fix['lat'], 'lon': fix['lon']},
             }
+        }
 
-        except Exception as e:
-            self.log_error(f"Error checking major deviation: {str(e)}", exc=e)
+    def _check_excessive_speed(self, trip, state, fix):
+        """Vitesse nettement supérieure à la moyenne glissante du trip"""
+        recent = [speed for ts, speed in state['speeds'] if fix['ts'] - ts <= self.SPEED_WINDOW]
+        if len(recent) < self.MIN_SPEED_SAMPLES:
+            return None
+        average = sum(recent) / len(recent)
+        if fix['speed'] <= average + self.SPEED_ANOMALY_THRESHOLD:
+            self._clear(state, 'excessive_speed')
             return None
 
-    def _check_speed_anomaly(self, trip, position):
-        """Détecte les anomalies de vitesse"""
-        try:
-            # 1. Vérifier la vitesse excessive
-            if self._check_excessive_speed(trip, position):
-                return {
-                    'type': 'excessive_speed',
-                    'severity': 'high',
-                    'details': {
-                        'speed': position.speed,
-                        'location': {
-                            'lat': position.latitude,
-                            'lon': position.longitude
-                        },
-                        'timestamp': position.timestamp.isoformat()
-                    }
-                }
+        if not self._raise(state, 'excessive_speed', 'high'):
+            return None
+        return {
+            'type': 'excessive_speed',
+            'severity': 'high',
+            'details': {
+                'speed': fix['speed'],
+                'average_speed': round(average, 1),
+                'location': {'lat': fix['lat'], 'lon': fix['lon']},
+            }
+        }
 
-            # 2. Vérifier les arrêts brusques
-            sudden_stop = self._check_sudden_stop(trip, position)
-            if sudden_stop:
-                return {
-                    'type': 'sudden_stop',
-                    'severity': 'critical',
-                    'details': sudden_stop
-                }
+    def _check_sudden_stop(self, trip, state, fix):
+        """Décélération brutale depuis la position précédente"""
+        previous = state['last']
+        if previous is None:
+            return None
+        time_diff = fix['ts'] - previous['ts']
+        deceleration = (previous['speed'] - fix['speed']) / time_diff
+        if deceleration <= self.SUDDEN_STOP_THRESHOLD:
+            return None
 
+        # Un seul freinage signalé par fenêtre de refroidissement
+        raised_at = state['sudden_stop_at']
+        if raised_at is not None and fix['ts'] - raised_at < self.SUDDEN_STOP_COOLDOWN:
             return None
+        state['sudden_stop_at'] = fix['ts']
+        return {
+            'type': 'sudden_stop',
+            'severity': 'critical',
+            'details': {
+                'deceleration': round(deceleration, 1),
+                'initial_speed': previous['speed'],
+                'final_speed': fix['speed'],
+                'time_interval': time_diff,
+                'location': {'lat': fix['lat'], 'lon': fix['lon']},
+            }
+        }
 
-        except Exception as e:
-            self.log_error(f"Error checking speed anomaly: {str(e)}", exc=e)
+    def _calculate_stop_severity(self, duration):
+        if duration >= 3 * self.UNPLANNED_STOP_THRESHOLD:
+            return 'high'
+        if duration >= 2 * self.UNPLANNED_STOP_THRESHOLD:
+            return 'medium'
+        return 'low'
+
+    def _calculate_deviation_severity(self, deviation):
+        if deviation >= 5 * self.MAJOR_DEVIATION_THRESHOLD:
+            return 'high'
+        if deviation >= 2.5 * self.MAJOR_DEVIATION_THRESHOLD:
+            return 'medium'
+        return 'low'
+
+    # ------------------------------------------------------------------
+    # Géométrie des routes (par processus, rechargée si le réseau change)
+    # ------------------------------------------------------------------
+
+    def _geometry(self, route_id):
+        """Tracé (tableau [lat, lon]) et coordonnées des arrêts de la route"""
+        network_version = journey_planner.versions(timezone.localdate())[0]
+        if network_version != self._network_version:
+            self._geometries = {}
+            self._network_version = network_version
+
+        if route_id not in self._geometries:
+            stop_ids = [stop['stop_id'] for stop in load_route_patterns([route_id]).get(route_id, [])]
+            coordinates = Stop.objects.in_bulk(stop_ids)
+            stops = np.asarray(
+                [(float(coordinates[stop_id].latitude), float(coordinates[stop_id].longitude)) for stop_id in stop_ids],
+                dtype=float
+            ).reshape(-1, 2)
+            line = load_route_lines([route_id]).get(route_id, np.empty((0, 2)))
+            self._geometries[route_id] = {'line': line, 'stops': stops}
+        return self._geometries[route_id]
+
+    def _calculate_route_deviation(self, route_id, fix):
+        """Distance (m) de la position au tracé, None si la route n'a pas de tracé"""
+        line = self._geometry(route_id)['line']
+        if len(line) < 2:
             return None
+        return float(distance_to_polyline_meters(fix['lat'], fix['lon'], line)[0])
 
-    def _handle_emergencies(self, trip, emergencies):
-        """Gère les situations d'urgence détectées"""
+    def _is_at_scheduled_stop(self, route_id, fix):
+        """Vérifie si la position est à un arrêt de la route"""
+        stops = self._geometry(route_id)['stops']
+        if not len(stops):
+            return False
+        distances = haversine_km(fix['lat'], fix['lon'], stops[:, 0], stops[:, 1]) * 1000
+        return bool(distances.min() <= self.SCHEDULED_STOP_RADIUS)
+
+    # ------------------------------------------------------------------
+    # Acheminement et traitement
+    # ------------------------------------------------------------------
+
+    def _dispatch(self, trip_id, emergencies):
+        """Urgences graves sur la file prioritaire, les autres sur la file par défaut"""
+        from ...tasks import handle_trip_emergencies
+        urgent = [e for e in emergencies if e['severity'] in self.URGENT_SEVERITIES]
+        routine = [e for e in emergencies if e['severity'] not in self.URGENT_SEVERITIES]
+        if urgent:
+            handle_trip_emergencies.apply_async(args=[trip_id, urgent], queue=self.EMERGENCY_QUEUE, priority=9)
+        if routine:
+            handle_trip_emergencies.apply_async(args=[trip_id, routine])
+
+    def handle_emergencies(self, trip_id, emergencies):
+        """Enregistre les urgences (incident, événement), alerte et interrompt le trip si nécessaire"""
         try:
+            trip = Trip.objects.get(id=trip_id)
+            highest_severity = max(emergencies, key=lambda e: self.SEVERITY_LEVELS[e['severity']])['severity']
+
             with transaction.atomic():
-                highest_severity = max(e['severity'] for e in emergencies)
-                
-                # Créer un incident pour chaque urgence
                 for emergency in emergencies:
-                    incident = self._create_emergency_incident(trip, emergency)
-                    
-                    # Enregistrer l'événement
+                    self._create_emergency_incident(trip, emergency)
                     self._log_emergency_event(trip, emergency)
-                    
-                    # Notifier les parties concernées
-                    self._send_emergency_notifications(trip, emergency)
 
                 # Mettre à jour le statut du trip si nécessaire
-                if highest_severity in ['high', 'critical']:
+                if highest_severity in self.URGENT_SEVERITIES and trip.status in ['in_progress', 'delayed']:
                     trip.status = 'interrupted'
                     trip.save()
 
+            for emergency in emergencies:
+                if emergency['severity'] in self.URGENT_SEVERITIES:
+                    self._send_immediate_notification(trip, emergency)
+
         except Exception as e:
-            self.log_error(f"Error handling emergencies: {str(e)}", exc=e)
+            self.log_error(f"Error handling emergencies for trip {trip_id}: {str(e)}", exc=e)
 
     def _create_emergency_incident(self, trip, emergency):
         """Crée un incident d'urgence"""
+        # Incident.save() enregistre deux fois (identifiant dérivé de la clé) : pas de create()
+        incident = Incident(
+            trip=trip,
+            type=self.INCIDENT_TYPES.get(emergency['type'], 'other'),
+            severity=self.INCIDENT_SEVERITIES[emergency['severity']],
+            priority=self.INCIDENT_PRIORITIES[emergency['severity']],
+            description=self._generate_emergency_description(emergency),
+            date=timezone.now(),
+            status='reported',
+            location=emergency['details'].get('location', {}),
+            detailed_report={'emergency_type': emergency['type'], **emergency['details']}
+        )
+        incident.save()
+        return incident
+
+    def _log_emergency_event(self, trip, emergency):
+        now = timezone.now()
+        return EventLog.objects.create(
+            trip=trip,
+            event_id=f"EMR-{now.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}",
+            event_type='incident',
+            severity=self.EVENT_SEVERITIES[emergency['severity']],
+            timestamp=now,
+            description=self._generate_emergency_description(emergency),
+            event_data={'emergency_type': emergency['type'], **emergency['details']},
+            requires_action=emergency['severity'] in self.URGENT_SEVERITIES,
+            source='emergency_manager'
+        )
+
+    def _send_immediate_notification(self, trip, emergency):
+        """Diffuse l'urgence sur le canal websocket des urgences"""
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
         try:
-            return Incident.objects.create(
-                trip=trip,
-                type=emergency['type'],
-                severity=emergency['severity'],
-                description=self._generate_emergency_description(emergency),
-                date=timezone.now(),
-                status='reported',
-                location=emergency['details'].get('location', {}),
-                detailed_report=emergency['details']
-            )
-        except Exception as e:
-            self.log_error(f"Error creating emergency incident: {str(e)}", exc=e)
-            return None
-
-    def _calculate_stop_duration(self, trip, position):
-        """Calcule la durée d'un arrêt"""
-        try:
-            stop_positions = BusPosition.objects.filter(
-                trip=trip,
-                speed__lte=5,
-                timestamp__lte=position.timestamp,
-                timestamp__gte=position.timestamp - timedelta(minutes=10)
-            ).order_by('timestamp')
-
-            if not stop_positions:
-                return 0
-
-            first_stop = stop_positions.first()
-            return (position.timestamp - first_stop.timestamp).total_seconds()
-
-        except Exception as e:
-            self.log_error(f"Error calculating stop duration: {str(e)}", exc=e)
-            return 0
-
-    def _is_at_scheduled_stop(self, trip, position):
-        """Vérifie si la position est à un arrêt prévu"""
-        try:
-            return Stop.objects.filter(
-                route=trip.route
-            ).extra(
-                select={'distance': 'ST_Distance_Sphere(location, Point(%s, %s))'},
-                select_params=[position.longitude, position.latitude]
-            ).filter(distance__lte=50).exists()
-
-        except Exception as e:
-            self.log_error(f"Error checking scheduled stop: {str(e)}", exc=e)
-            return False
-
-    def _check_excessive_speed(self, trip, position):
-        """Vérifie si la vitesse est excessive"""
-        try:
-            # Calculer la vitesse moyenne récente
-            avg_speed = BusPosition.objects.filter(
-                trip=trip,
-                timestamp__gte=timezone.now() - timedelta(minutes=5)
-            ).aggregate(Avg('speed'))['speed__avg'] or 0
-
-            return position.speed > (avg_speed + self.SPEED_ANOMALY_THRESHOLD)
-
-        except Exception as e:
-            self.log_error(f"Error checking excessive speed: {str(e)}", exc=e)
-            return False
-
-    def _check_sudden_stop(self, trip, position):
-        """Vérifie s'il y a eu un arrêt brusque"""
-        try:
-            previous_position = BusPosition.objects.filter(
-                trip=trip,
-                timestamp__lt=position.timestamp
-            ).order_by('-timestamp').first()
-
-            if not previous_position:
-                return None
-
-            time_diff = (position.timestamp - previous_position.timestamp).total_seconds()
-            if time_diff == 0:
-                return None
-
-            speed_change = previous_position.speed - position.speed
-            deceleration = speed_change / time_diff
-
-            if deceleration > self.SUDDEN_STOP_THRESHOLD:
-                return {
-                    'deceleration': deceleration,
-                    'initial_speed': previous_position.speed,
-                    'final_speed': position.speed,
-                    'time_interval': time_diff
+            async_to_sync(channel_layer.group_send)(self.ALERT_GROUP, {
+                'type': 'send_emergency',
+                'emergency': {
+                    'trip_id': trip.id,
+                    'route_id': trip.route_id,
+                    'vehicle_id': trip.vehicle_id,
+                    'type': emergency['type'],
+                    'severity': emergency['severity'],
+                    'description': self._generate_emergency_description(emergency),
+                    'details': emergency['details'],
                 }
-
-            return None
-
+            })
         except Exception as e:
-            self.log_error(f"Error checking sudden stop: {str(e)}", exc=e)
-            return None
-
-    def _send_emergency_notifications(self, trip, emergency):
-        """Envoie les notifications d'urgence"""
-        try:
-            if emergency['severity'] in ['high', 'critical']:
-                # Notification immédiate
-                self._send_immediate_notification(trip, emergency)
-
-            # Enregistrer dans les logs
-            EventLog.objects.create(
-                trip=trip,
-                event_type='emergency_notification',
-                description=f"Emergency {emergency['type']} detected",
-                details=emergency['details']
-            )
-
-        except Exception as e:
-            self.log_error(f"Error sending emergency notifications: {str(e)}", exc=e)
+            self.log_warning(f"Emergency notification failed for trip {trip.id}: {str(e)}")
 
     def _generate_emergency_description(self, emergency):
         """Génère une description détaillée de l'urgence"""
@@ -328,4 +411,7 @@ class EmergencyManager(ServiceBase):
         elif emergency['type'] == 'sudden_stop':
             return f"{base_description} - Décélération: {details['deceleration']:.1f} km/h/s"
 
-        return base_description
\ No newline at end of file
+        return base_description
+
+
+emergency_manager = EmergencyManager()
@@ -0,0 +1,167 @@
+# transport_management/services/export/tabular_export.py
+
+import csv
+import io
+import json
+import math
+import tempfile
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from ...models import BusPosition, EventLog, TransactionScan, PassengerTripHistory
+from ..base.service_base import ServiceBase
+
+
+# Jeux de données exportables : modèle, champ de date, colonnes (values_list) et filtres autorisés
+EXPORT_DATASETS = {
+    'positions': {
+        'model': BusPosition,
+        'date_field': 'timestamp',
+        'order_by': ('trip_id', 'timestamp', 'position_id'),
+        'columns': (
+            'position_id', 'trip_id', 'trip__vehicle_id', 'timestamp', 'latitude', 'longitude', 'altitude',
+            'speed', 'heading', 'is_moving', 'position_status', 'accuracy', 'hdop', 'is_valid', 'data_source'
+        ),
+        'filters': {'trip': 'trip_id', 'vehicle': 'trip__vehicle_id', 'route': 'trip__route_id'},
+    },
+    'events': {
+        'model': EventLog,
+        'date_field': 'timestamp',
+        'order_by': ('timestamp', 'id'),
+        'columns': (
+            'event_id', 'trip_id', 'event_type', 'severity', 'timestamp', 'description', 'source',
+            'processing_status', 'requires_action', 'event_data'
+        ),
+        'filters': {'trip': 'trip_id', 'event_type': 'event_type', 'severity': 'severity', 'route': 'trip__route_id'},
+    },
+    'transaction-scans': {
+        'model': TransactionScan,
+        'date_field': 'timestamp',
+        'order_by': ('timestamp', 'id'),
+        'columns': (
+            'scan_id', 'user_id', 'card_id', 'trip_id', 'scan_type', 'scan_status', 'verification_status',
+            'timestamp', 'verification_timestamp', 'is_valid'
+        ),
+        'filters': {'trip': 'trip_id', 'user': 'user_id', 'scan_type': 'scan_type', 'route': 'trip__route_id'},
+    },
+    'passenger-trips': {
+        'model': PassengerTripHistory,
+        'date_field': 'trip_date',
+        'order_by': ('trip_date', 'id'),
+        'columns': (
+            'id', 'user_id', 'trip_id', 'trip_date', 'boarding_time', 'alighting_time', 'origin_stop_id',
+            'destination_stop_id', 'status', 'fare_paid', 'payment_method', 'satisfaction_rating'
+        ),
+        'filters': {'trip': 'trip_id', 'user': 'user_id', 'status': 'status', 'route': 'trip__route_id'},
+    },
+}
+
+
+class TabularExporter(ServiceBase):
+    """
+    Exports CSV / XLSX à mémoire constante. Les lignes sont lues par paquets
+    (.iterator(chunk_size)) et encodées au fil de l'eau : le CSV part directement dans une
+    StreamingHttpResponse, le XLSX est écrit en mode write_only dans un fichier temporaire
+    (lignes vidées sur disque au fur et à mesure) puis servi par FileResponse.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.CHUNK_SIZE = 2000
+        self.FORMATS = ('csv', 'xlsx')
+        self.XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        self.DEFAULT_PERIOD = timedelta(days=1)
+
+    # ------------------------------------------------------------------
+    # Jeux de données
+    # ------------------------------------------------------------------
+
+    def dataset_rows(self, dataset, date_from=None, date_to=None, **filters):
+        """(en-tête, générateur de lignes) d'un jeu de données ; ValueError si inconnu"""
+        spec = EXPORT_DATASETS.get(dataset)
+        if spec is None:
+            raise ValueError(f"Unknown export dataset: {dataset}")
+
+        # Bornes en jours locaux inclusifs ; défaut : la dernière journée
+        today = timezone.localdate()
+        date_to = date_to or today
+        date_from = date_from or date_to - self.DEFAULT_PERIOD + timedelta(days=1)
+        start = timezone.make_aware(datetime.combine(date_from, time.min))
+        end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+
+        queryset = spec['model'].objects.filter(**{
+            f"{spec['date_field']}__gte": start,
+            f"{spec['date_field']}__lt": end,
+        })
+        for name, value in filters.items():
+            if value in (None, ''):
+                continue
+            if name not in spec['filters']:
+                raise ValueError(f"Unknown filter for {dataset}: {name}")
+            queryset = queryset.filter(**{spec['filters'][name]: value})
+
+        rows = queryset.order_by(*spec['order_by']).values_list(*spec['columns'])
+        return list(spec['columns']), rows.iterator(chunk_size=self.CHUNK_SIZE)
+
+    # ------------------------------------------------------------------
+    # Encodage
+    # ------------------------------------------------------------------
+
+    def cell(self, value):
+        """Valeur sérialisable par csv et openpyxl (datetimes locales naïves, JSON et infinis en texte)"""
+        if isinstance(value, datetime):
+            return timezone.localtime(value).replace(tzinfo=None) if timezone.is_aware(value) else value
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False, default=str)
+        if isinstance(value, Decimal):
+            return float(value)
+        if isinstance(value, float) and not math.isfinite(value):
+            return str(value)
+        return value
+
+    def csv_chunks(self, header, rows):
+        """Morceaux d'octets CSV de CHUNK_SIZE lignes (BOM UTF-8 pour les tableurs)"""
+        text = io.StringIO()
+        writer = csv.writer(text)
+        text.write('\ufeff')
+        writer.writerow(header)
+        count = 0
+        for row in rows:
+            writer.writerow([self.cell(value) for value in row])
+            count += 1
+            if count % self.CHUNK_SIZE == 0:
+                yield text.getvalue().encode('utf-8')
+                text.seek(0)
+                text.truncate()
+        if text.tell():
+            yield text.getvalue().encode('utf-8')
+
+    def xlsx_file(self, header, rows, title='Export'):
+        """Classeur write_only dans un fichier temporaire, rembobiné et prêt à être lu"""
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(title=title[:31])
+        sheet.append(header)
+        for row in rows:
+            sheet.append([self.cell(value) for value in row])
+        output = tempfile.TemporaryFile(suffix='.xlsx')
+        workbook.save(output)
+        output.seek(0)
+        return output
+
+    def response(self, export_format, filename, header, rows, title='Export'):
+        """Réponse HTTP de téléchargement ; ValueError si le format est inconnu"""
+        if export_format == 'csv':
+            response = StreamingHttpResponse(self.csv_chunks(header, rows), content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+            return response
+        if export_format == 'xlsx':
+            return FileResponse(
+                self.xlsx_file(header, rows, title), as_attachment=True,
+                filename=f"{filename}.xlsx", content_type=self.XLSX_CONTENT_TYPE
+            )
+        raise ValueError(f"Unknown export format: {export_format}")
+
+
+tabular_exporter = TabularExporter()
@@ -0,0 +1,312 @@
+# transport_management/services/geofencing/geofence_engine.py
+
+import math
+import threading
+import uuid
+import numpy as np
+from django.core.cache import cache
+from ...models import Geofence, Stop, EventLog
+from ..base.service_base import ServiceBase
+from ..trip_scheduler.deadhead import haversine_km
+
+
+def point_in_polygon(latitude, longitude, vertices):
+    """Test de parité (lancer de rayon) d'un point dans un polygone [[lat, lon], ...] en NumPy"""
+    y, x = vertices[:, 0], vertices[:, 1]
+    y_next, x_next = np.roll(y, -1), np.roll(x, -1)
+    crosses = (y > latitude) != (y_next > latitude)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x + (latitude - y) * (x_next - x) / (y_next - y)
+    return bool(np.count_nonzero(crosses & (longitude < x_cross)) % 2)
+
+
+class GeofenceIndex:
+    """
+    Index spatial compilé des zones actives.
+    Chaque zone est rangée dans les cellules de grille couvertes par son emprise ; les zones
+    trop étendues vont dans une liste commune. Une recherche ne lit qu'une cellule, filtre
+    les candidats par emprise en une opération NumPy puis teste la géométrie exacte.
+    """
+
+    def __init__(self, fences, cell_degrees, max_cells_per_fence):
+        self.cell_degrees = cell_degrees
+        self.ids = np.array([fence['id'] for fence in fences], dtype=np.int64)
+        self.bounds = np.array(
+            [fence['bounds'] for fence in fences], dtype=float
+        ).reshape(-1, 4)  # min_lat, max_lat, min_lon, max_lon
+        self.is_circle = np.array([fence['shape'] == 'circle' for fence in fences], dtype=bool)
+        self.centers = np.array([fence['center'] or (np.nan, np.nan) for fence in fences], dtype=float).reshape(-1, 2)
+        self.radii = np.array([fence['radius'] or 0 for fence in fences], dtype=float)
+        self.polygons = [fence['polygon'] for fence in fences]
+        self.fences = fences
+        self.position = {fence['id']: index for index, fence in enumerate(fences)}
+
+        self.by_stop = {}
+        cells = {}
+        spanning = []
+        for index, fence in enumerate(fences):
+            if fence['stop_id'] is not None:
+                self.by_stop.setdefault(fence['stop_id'], []).append(index)
+            min_row, min_col = self._cell(fence['bounds'][0], fence['bounds'][2])
+            max_row, max_col = self._cell(fence['bounds'][1], fence['bounds'][3])
+            if (max_row - min_row + 1) * (max_col - min_col + 1) > max_cells_per_fence:
+                spanning.append(index)
+                continue
+            for row in range(min_row, max_row + 1):
+                for column in range(min_col, max_col + 1):
+                    cells.setdefault((row, column), []).append(index)
+        self.cells = {cell: np.asarray(indices, dtype=np.int64) for cell, indices in cells.items()}
+        self.spanning = np.asarray(spanning, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cell(self, latitude, longitude):
+        return (int(math.floor(latitude / self.cell_degrees)), int(math.floor(longitude / self.cell_degrees)))
+
+    def candidates(self, latitude, longitude):
+        """Zones dont l'emprise contient le point (cellule du point + zones étendues)"""
+        indices = self.cells.get(self._cell(latitude, longitude))
+        if indices is None:
+            indices = self.spanning
+        elif len(self.spanning):
+            indices = np.concatenate([indices, self.spanning])
+        if not len(indices):
+            return indices
+        bounds = self.bounds[indices]
+        inside = (
+            (bounds[:, 0] <= latitude) & (latitude <= bounds[:, 1]) &
+            (bounds[:, 2] <= longitude) & (longitude <= bounds[:, 3])
+        )
+        return indices[inside]
+
+    def contains(self, indices, latitude, longitude):
+        """Sous-ensemble des zones candidates qui contiennent réellement le point"""
+        if not len(indices):
+            return indices
+        circles = self.is_circle[indices]
+        inside = np.zeros(len(indices), dtype=bool)
+        if circles.any():
+            circle_indices = indices[circles]
+            distances = haversine_km(
+                latitude, longitude, self.centers[circle_indices, 0], self.centers[circle_indices, 1]
+            ) * 1000
+            inside[circles] = distances <= self.radii[circle_indices]
+        for position in np.flatnonzero(~circles):
+            inside[position] = point_in_polygon(latitude, longitude, self.polygons[indices[position]])
+        return indices[inside]
+
+    def relevant(self, indices, route_id, vehicle_id):
+        """Zones qui s'appliquent à la route et au véhicule (portée vide : tous)"""
+        return np.asarray([
+            index for index in indices
+            if (self.fences[index]['routes'] is None or route_id in self.fences[index]['routes'])
+            and (self.fences[index]['vehicles'] is None or vehicle_id in self.fences[index]['vehicles'])
+        ], dtype=np.int64)
+
+    def locate(self, latitude, longitude, route_id=None, vehicle_id=None):
+        """Identifiants des zones pertinentes contenant le point"""
+        indices = self.candidates(latitude, longitude)
+        indices = self.relevant(indices, route_id, vehicle_id)
+        return self.ids[self.contains(indices, latitude, longitude)]
+
+
+class GeofenceEngine(ServiceBase):
+    """
+    Évaluation des zones géographiques (dépôts, terminus, zones scolaires, zones interdites)
+    à chaque position reçue. L'index est compilé une fois par processus et reconstruit
+    quand la version partagée change (signaux sur Geofence). L'état par véhicule
+    (zones occupées, heure d'entrée) est gardé en cache pour produire les événements
+    d'entrée, de sortie et de stationnement.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.CELL_DEGREES = 0.01                # ~1,1 km
+        self.MAX_CELLS_PER_FENCE = 256          # Au-delà, zone placée dans la liste commune
+        self.DEFAULT_STOP_RADIUS = 100          # Mètres, arrêts sans zone propre
+        self.STATE_TIMEOUT = 24 * 3600
+        self.VERSION_KEY = 'geofence_index_version'
+        self.STATE_KEY = 'geofence_state_{vehicle_id}'
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+
+    # ------------------------------------------------------------------
+    # Index
+    # ------------------------------------------------------------------
+
+    def get_index(self):
+        cache.add(self.VERSION_KEY, 0, None)
+        version = cache.get(self.VERSION_KEY, 0)
+        if self._index is None or self._version != version:
+            with self._lock:
+                if self._index is None or self._version != version:
+                    self._index = self._build()
+                    self._version = version
+        return self._index
+
+    def invalidate(self):
+        """Force la recompilation de l'index (zone créée, modifiée ou supprimée)"""
+        cache.add(self.VERSION_KEY, 0, None)
+        try:
+            cache.incr(self.VERSION_KEY)
+        except ValueError:
+            pass
+        self._index = None
+
+    def _build(self):
+        rows = list(Geofence.objects.filter(is_active=True).values(
+            'id', 'code', 'name', 'fence_type', 'shape', 'polygon', 'center_latitude', 'center_longitude',
+            'radius_meters', 'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude',
+            'stop_id', 'dwell_threshold_seconds', 'severity'
+        ))
+        fence_ids = [row['id'] for row in rows]
+        routes, vehicles = {}, {}
+        for fence_id, route_id in Geofence.routes.through.objects.filter(
+                geofence_id__in=fence_ids).values_list('geofence_id', 'route_id'):
+            routes.setdefault(fence_id, set()).add(route_id)
+        for fence_id, vehicle_id in Geofence.vehicles.through.objects.filter(
+                geofence_id__in=fence_ids).values_list('geofence_id', 'vehicle_id'):
+            vehicles.setdefault(fence_id, set()).add(vehicle_id)
+
+        fences = []
+        for row in rows:
+            is_circle = row['shape'] == 'circle'
+            fences.append({
+                'id': row['id'],
+                'code': row['code'],
+                'name': row['name'],
+                'fence_type': row['fence_type'],
+                'shape': row['shape'],
+                'bounds': (row['min_latitude'], row['max_latitude'], row['min_longitude'], row['max_longitude']),
+                'center': (float(row['center_latitude']), float(row['center_longitude'])) if is_circle else None,
+                'radius': row['radius_meters'] if is_circle else None,
+                'polygon': None if is_circle else np.asarray(row['polygon'], dtype=float).reshape(-1, 2),
+                'stop_id': row['stop_id'],
+                'dwell_threshold': row['dwell_threshold_seconds'],
+                'severity': row['severity'],
+                'routes': routes.get(row['id']),
+                'vehicles': vehicles.get(row['id']),
+            })
+        self.log_info(f"Geofence index compiled with {len(fences)} fences")
+        return GeofenceIndex(fences, self.CELL_DEGREES, self.MAX_CELLS_PER_FENCE)
+
+    # ------------------------------------------------------------------
+    # Requêtes
+    # ------------------------------------------------------------------
+
+    def fences_at(self, latitude, longitude, route_id=None, vehicle_id=None):
+        """Zones pertinentes contenant le point"""
+        index = self.get_index()
+        fence_ids = index.locate(float(latitude), float(longitude), route_id, vehicle_id)
+        return [index.fences[index.position[int(fence_id)]] for fence_id in fence_ids]
+
+    def is_at_stop(self, stop_id, latitude, longitude):
+        """
+        Le point est-il dans la zone de l'arrêt ?
+        Zones rattachées à l'arrêt si elles existent, sinon cercle de DEFAULT_STOP_RADIUS.
+        """
+        index = self.get_index()
+        indices = index.by_stop.get(stop_id)
+        if indices:
+            return len(index.contains(np.asarray(indices, dtype=np.int64), float(latitude), float(longitude))) > 0
+
+        stop = Stop.objects.filter(id=stop_id).values_list('latitude', 'longitude').first()
+        if stop is None:
+            return False
+        distance = haversine_km(float(latitude), float(longitude), float(stop[0]), float(stop[1])) * 1000
+        return bool(distance <= self.DEFAULT_STOP_RADIUS)
+
+    # ------------------------------------------------------------------
+    # Évaluation des positions
+    # ------------------------------------------------------------------
+
+    def process_position(self, position):
+        """Évalue une position reçue ; retourne les événements de zone créés"""
+        try:
+            trip = position.trip
+            if not trip.vehicle_id:
+                return []
+            return self.evaluate(
+                trip.vehicle_id, trip.id, trip.route_id,
+                position.latitude, position.longitude, position.timestamp
+            )
+
+        except Exception as e:
+            self.log_error(f"Error evaluating geofences for position {position.pk}: {str(e)}", exc=e)
+            return []
+
+    def evaluate(self, vehicle_id, trip_id, route_id, latitude, longitude, timestamp):
+        """
+        Compare les zones occupées par le véhicule à son état précédent :
+        entrée (nouvelle zone), sortie (zone quittée), stationnement (présence
+        continue au-delà du seuil de la zone, signalée une fois par visite).
+        """
+        index = self.get_index()
+        key = self.STATE_KEY.format(vehicle_id=vehicle_id)
+        state = cache.get(key) or {'observed_at': None, 'fences': {}}
+        observed_at = timestamp.timestamp()
+        # Position plus ancienne que la dernière traitée : ignorée
+        if state['observed_at'] is not None and observed_at < state['observed_at']:
+            return []
+
+        inside = {int(fence_id) for fence_id in index.locate(float(latitude), float(longitude), route_id, vehicle_id)}
+        previous = state['fences']
+        events = []
+
+        for fence_id in inside - previous.keys():
+            previous[fence_id] = {'entered_at': observed_at, 'dwell_reported': False}
+            events.append(self._event('geofence_enter', index, fence_id, trip_id, vehicle_id, timestamp, 0))
+
+        for fence_id in previous.keys() - inside:
+            visit = previous.pop(fence_id)
+            if fence_id in index.position:
+                events.append(self._event(
+                    'geofence_exit', index, fence_id, trip_id, vehicle_id, timestamp,
+                    observed_at - visit['entered_at']
+                ))
+
+        for fence_id in inside:
+            visit = previous[fence_id]
+            duration = observed_at - visit['entered_at']
+            fence = index.fences[index.position[fence_id]]
+            if not visit['dwell_reported'] and duration >= fence['dwell_threshold']:
+                visit['dwell_reported'] = True
+                events.append(self._event('geofence_dwell', index, fence_id, trip_id, vehicle_id, timestamp, duration))
+
+        state['observed_at'] = observed_at
+        cache.set(key, state, self.STATE_TIMEOUT)
+
+        if events:
+            EventLog.objects.bulk_create(events)
+        return events
+
+    def _event(self, event_type, index, fence_id, trip_id, vehicle_id, timestamp, duration):
+        fence = index.fences[index.position[fence_id]]
+        labels = {'geofence_enter': 'entered', 'geofence_exit': 'left', 'geofence_dwell': 'dwelling in'}
+        severity = fence['severity']
+        # Une sortie de zone n'est pas plus grave qu'une information
+        if event_type == 'geofence_exit':
+            severity = 'info'
+        return EventLog(
+            trip_id=trip_id,
+            event_id=f"{event_type[:3].upper()}-{timestamp.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}",
+            event_type=event_type,
+            severity=severity,
+            timestamp=timestamp,
+            description=f"Vehicle {vehicle_id} {labels[event_type]} {fence['name']} ({fence['code']})",
+            event_data={
+                'geofence_id': fence_id,
+                'geofence_code': fence['code'],
+                'fence_type': fence['fence_type'],
+                'vehicle_id': vehicle_id,
+                'duration_seconds': round(duration),
+            },
+            related_entities={'geofences': [fence_id], 'vehicles': [vehicle_id]},
+            requires_action=fence['fence_type'] == 'restricted' and event_type != 'geofence_exit',
+            source='geofence_engine',
+        )
+
+
+geofence_engine = GeofenceEngine()
@@ -0,0 +1,300 @@
+# transport_management/services/gtfs/feed_export.py
+
+import csv
+import io
+import zipfile
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from ...models import Stop, Route, Schedule, ScheduleException, Trip
+from ..base.service_base import ServiceBase
+from ..timetable.stop_times import DAY_NAMES, load_route_patterns, parse_timepoint, format_timepoint
+
+GTFS_FILES = {
+    'agency.txt': ['agency_id', 'agency_name', 'agency_url', 'agency_timezone',
+                   'agency_lang', 'agency_phone'],
+    'stops.txt': ['stop_id', 'stop_code', 'stop_name', 'stop_desc', 'stop_lat', 'stop_lon',
+                  'zone_id', 'location_type', 'platform_code'],
+    'routes.txt': ['route_id', 'agency_id', 'route_short_name', 'route_long_name',
+                   'route_desc', 'route_type', 'route_color'],
+    'trips.txt': ['route_id', 'service_id', 'trip_id', 'trip_headsign', 'shape_id'],
+    'stop_times.txt': ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence',
+                       'pickup_type', 'drop_off_type', 'shape_dist_traveled', 'timepoint'],
+    'calendar.txt': ['service_id'] + DAY_NAMES + ['start_date', 'end_date'],
+    'calendar_dates.txt': ['service_id', 'date', 'exception_type'],
+    'shapes.txt': ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence'],
+}
+
+GTFS_BUS_ROUTE_TYPE = 3
+
+
+def path_points(path):
+    """
+    Extrait la liste des points (lat, lon) de Route.path.
+    Formats acceptés : [[lat, lon], ...], [{'lat'|'latitude', 'lng'|'lon'|'longitude'}, ...],
+    GeoJSON LineString ({'coordinates': [[lon, lat], ...]}) ou {'points': [...]}.
+    """
+    if isinstance(path, dict):
+        if path.get('type') == 'Feature':
+            path = path.get('geometry') or {}
+        if 'coordinates' in path:
+            return [(float(lat), float(lon)) for lon, lat, *_ in path['coordinates']]
+        path = path.get('points') or path.get('path') or []
+
+    points = []
+    for point in path or []:
+        try:
+            if isinstance(point, dict):
+                lat = point.get('lat', point.get('latitude'))
+                lon = point.get('lng', point.get('lon', point.get('longitude')))
+            else:
+                lat, lon = point[0], point[1]
+            points.append((float(lat), float(lon)))
+        except (TypeError, ValueError, IndexError):
+            continue
+    return points
+
+
+class _ZipStream:
+    """Tampon d'écriture non seekable : zipfile y écrit, le flux le vide au fil de l'eau"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class GTFSFeedExporter(ServiceBase):
+    """
+    Export du réseau au format GTFS statique.
+    Le zip est produit fichier par fichier et par paquets de lignes :
+    la mémoire reste bornée quelle que soit la taille du réseau.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.CHUNK_SIZE = 2000          # Lignes lues / écrites par paquet
+        self.DEFAULT_HORIZON_DAYS = 30  # Trips ponctuels exportés par défaut
+        self.AGENCY = {
+            'agency_id': 'core',
+            'agency_name': 'Transport',
+            'agency_url': 'https://example.com',
+            'agency_timezone': settings.TIME_ZONE,
+            'agency_lang': 'fr',
+            'agency_phone': '',
+            **getattr(settings, 'GTFS_AGENCY', {}),
+        }
+
+    def stream(self, start_date=None, end_date=None):
+        """
+        Générateur de morceaux d'octets du zip GTFS (compatible StreamingHttpResponse).
+        Les trips issus d'un horaire sont exportés par motif (calendar.txt) ;
+        les trips sans horaire de la période sont exportés en service daté.
+        """
+        start_date = start_date or timezone.localdate()
+        end_date = end_date or start_date + timedelta(days=self.DEFAULT_HORIZON_DAYS)
+        buffer = _ZipStream()
+
+        try:
+            with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+                shaped_routes = set()
+                writers = [
+                    ('agency.txt', self._agency_rows()),
+                    ('stops.txt', self._stop_rows()),
+                    ('routes.txt', self._route_rows()),
+                    ('shapes.txt', self._shape_rows(shaped_routes)),
+                    ('calendar.txt', self._calendar_rows()),
+                    ('calendar_dates.txt', self._calendar_date_rows(start_date, end_date)),
+                ]
+                trip_rows, stop_time_rows = self._trip_rows(start_date, end_date, shaped_routes)
+                writers += [('trips.txt', trip_rows), ('stop_times.txt', stop_time_rows)]
+
+                for name, rows in writers:
+                    with archive.open(name, mode='w', force_zip64=True) as entry:
+                        for chunk in self._csv_chunks(GTFS_FILES[name], rows):
+                            entry.write(chunk)
+                            data = buffer.drain()
+                            if data:
+                                yield data
+            data = buffer.drain()
+            if data:
+                yield data
+        except Exception as e:
+            self.log_error(f"Error exporting GTFS feed: {str(e)}", exc=e)
+            raise
+
+    def write_to(self, fileobj, start_date=None, end_date=None):
+        """Écrit le zip dans un fichier ouvert en binaire, retourne la taille écrite"""
+        size = 0
+        for chunk in self.stream(start_date, end_date):
+            fileobj.write(chunk)
+            size += len(chunk)
+        return size
+
+    def _csv_chunks(self, header, rows):
+        """Encode les lignes CSV par paquets de CHUNK_SIZE"""
+        text = io.StringIO()
+        writer = csv.writer(text, lineterminator='\n')
+        writer.writerow(header)
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+            if count % self.CHUNK_SIZE == 0:
+                yield text.getvalue().encode('utf-8')
+                text.seek(0)
+                text.truncate()
+        if text.tell():
+            yield text.getvalue().encode('utf-8')
+
+    def _agency_rows(self):
+        yield [self.AGENCY[field] for field in GTFS_FILES['agency.txt']]
+
+    def _stop_rows(self):
+        rows = Stop.objects.filter(is_active=True).order_by('id').values_list(
+            'stop_code', 'name', 'description', 'latitude', 'longitude',
+            'zone_code', 'stop_type', 'platform_number'
+        )
+        for code, name, description, latitude, longitude, zone, stop_type, platform in \
+                rows.iterator(chunk_size=self.CHUNK_SIZE):
+            yield [code, code, name, description, latitude, longitude, zone,
+                   1 if stop_type == 'station' else 0, platform]
+
+    def _route_rows(self):
+        rows = Route.objects.filter(is_active=True).order_by('id').values_list(
+            'route_code', 'name', 'description', 'route_color'
+        )
+        for code, name, description, color in rows.iterator(chunk_size=self.CHUNK_SIZE):
+            yield [code, self.AGENCY['agency_id'], code, name, description,
+                   GTFS_BUS_ROUTE_TYPE, (color or '').lstrip('#')]
+
+    def _shape_rows(self, shaped_routes):
+        """Une forme par route, identifiée par son code ; shaped_routes reçoit les routes exportées"""
+        rows = Route.objects.filter(is_active=True).order_by('id').values_list('id', 'route_code', 'path')
+        for route_id, code, path in rows.iterator(chunk_size=self.CHUNK_SIZE):
+            for sequence, (lat, lon) in enumerate(path_points(path), start=1):
+                shaped_routes.add(route_id)
+                yield [code, f"{lat:.6f}", f"{lon:.6f}", sequence]
+
+    def _exported_schedules(self):
+        return Schedule.objects.filter(
+            is_active=True,
+            route__is_active=True,
+            status__in=['active', 'validated']
+        )
+
+    @staticmethod
+    def schedule_service_id(schedule_code, schedule_version):
+        return f"{schedule_code}-{schedule_version}"
+
+    @staticmethod
+    def dated_service_id(service_date):
+        return f"D{service_date:%Y%m%d}"
+
+    @staticmethod
+    def schedule_trip_id(service_id, seconds):
+        """Identifiant d'un départ d'horaire : service et heure de départ"""
+        return f"{service_id}-{format_timepoint(seconds).replace(':', '')}"
+
+    @staticmethod
+    def adhoc_trip_id(trip_pk):
+        return f"T{trip_pk}"
+
+    def _calendar_rows(self):
+        rows = self._exported_schedules().order_by('id').values_list(
+            'schedule_code', 'schedule_version', 'day_of_week', 'start_date', 'end_date'
+        )
+        for code, version, day_of_week, start_date, end_date in rows.iterator(chunk_size=self.CHUNK_SIZE):
+            days = [1 if day == day_of_week else 0 for day in DAY_NAMES]
+            yield ([self.schedule_service_id(code, version)] + days +
+                   [f"{start_date:%Y%m%d}", f"{end_date:%Y%m%d}"])
+
+    def _calendar_date_rows(self, start_date, end_date):
+        cancelled = ScheduleException.objects.filter(
+            is_cancelled=True,
+            schedule__in=self._exported_schedules()
+        ).order_by('exception_date').values_list(
+            'schedule__schedule_code', 'schedule__schedule_version', 'exception_date'
+        )
+        for code, version, exception_date in cancelled.iterator(chunk_size=self.CHUNK_SIZE):
+            yield [self.schedule_service_id(code, version), f"{exception_date:%Y%m%d}", 2]
+
+        for service_date in self._adhoc_trips(start_date, end_date).dates('planned_departure', 'day'):
+            yield [self.dated_service_id(service_date), f"{service_date:%Y%m%d}", 1]
+
+    def _adhoc_trips(self, start_date, end_date):
+        return Trip.objects.filter(
+            schedule__isnull=True,
+            route__is_active=True,
+            planned_departure__date__gte=start_date,
+            planned_departure__date__lte=end_date
+        ).exclude(status='cancelled')
+
+    def _trip_rows(self, start_date, end_date, shaped_routes):
+        """
+        Produit deux générateurs (trips.txt, stop_times.txt) parcourant les mêmes
+        départs : horaires actifs par motif, puis trips ponctuels datés.
+        """
+        route_codes = dict(Route.objects.filter(is_active=True).values_list('id', 'route_code'))
+        stop_codes = dict(Stop.objects.filter(is_active=True).values_list('id', 'stop_code'))
+        patterns = load_route_patterns(route_codes.keys())
+
+        def departures():
+            schedules = self._exported_schedules().select_related('destination').order_by('id')
+            for schedule in schedules.iterator(chunk_size=self.CHUNK_SIZE):
+                service_id = self.schedule_service_id(schedule.schedule_code, schedule.schedule_version)
+                headsign = schedule.destination.name if schedule.destination else ''
+                for timepoint in schedule.compute_timepoints(schedule.start_date):
+                    seconds = parse_timepoint(timepoint)
+                    yield (schedule.route_id, service_id, self.schedule_trip_id(service_id, seconds),
+                           headsign, seconds)
+
+            local_tz = timezone.get_current_timezone()
+            trips = self._adhoc_trips(start_date, end_date).order_by('planned_departure').values_list(
+                'id', 'route_id', 'planned_departure', 'destination__name'
+            )
+            for trip_id, route_id, departure, headsign in trips.iterator(chunk_size=self.CHUNK_SIZE):
+                departure = timezone.localtime(departure, local_tz)
+                seconds = departure.hour * 3600 + departure.minute * 60 + departure.second
+                yield (route_id, self.dated_service_id(departure.date()), self.adhoc_trip_id(trip_id),
+                       headsign or '', seconds)
+
+        def trip_rows():
+            for route_id, service_id, trip_id, headsign, _ in departures():
+                code = route_codes[route_id]
+                yield [code, service_id, trip_id, headsign, code if route_id in shaped_routes else '']
+
+        def stop_time_rows():
+            for route_id, _, trip_id, _, seconds in departures():
+                for stop in patterns.get(route_id, []):
+                    stop_code = stop_codes.get(stop['stop_id'])
+                    if stop_code is None:
+                        continue
+                    yield [
+                        trip_id,
+                        format_timepoint(seconds + stop['arrival_offset']),
+                        format_timepoint(seconds + stop['departure_offset']),
+                        stop_code,
+                        stop['stop_sequence'],
+                        stop['pickup_type'],
+                        stop['drop_off_type'],
+                        f"{stop['distance']:.2f}",
+                        1 if stop['is_timepoint'] else 0,
+                    ]
+
+        return trip_rows(), stop_time_rows()
@@ -0,0 +1,442 @@
+# transport_management/services/gtfs/feed_import.py
+
+import csv
+import hashlib
+import io
+import statistics
+import zipfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+import numpy as np
+from django.db import transaction
+from ...models import Stop, Route, RouteStop, Schedule, ScheduleException
+from ..base.service_base import ServiceBase
+from ..timetable.stop_times import DAY_NAMES, date_range, parse_timepoint, format_timepoint, seconds_to_time
+from ..trip_scheduler.deadhead import haversine_km
+
+
+class GTFSFeedImporter(ServiceBase):
+    """
+    Chargement d'un flux GTFS statique.
+    Les fichiers sont lus en flux depuis le zip et les objets créés par lots
+    avec bulk_create ; les éléments déjà présents (même code) sont conservés.
+    Les identifiants trop longs pour les codes locaux sont écartés et signalés.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.BATCH_SIZE = 1000           # Objets par bulk_create
+        self.SCHEDULE_VERSION = 'gtfs'   # Version des horaires importés
+        self.DEFAULT_FREQUENCY = 60      # Fréquence (min) d'un horaire à départ unique
+
+    def import_feed(self, source, created_by=None):
+        """
+        Importe un flux GTFS (chemin ou fichier binaire).
+        Retourne le nombre d'objets créés par type.
+        """
+        try:
+            with zipfile.ZipFile(source) as archive, transaction.atomic():
+                stops, stop_names, created_stops, rejected_stops = self._import_stops(archive, created_by)
+                shapes = self._read_shapes(archive)
+                services = self._read_services(archive)
+                trips, route_trips = self._read_trips(archive)
+                timings, patterns = self._read_stop_times(archive, trips, route_trips)
+                routes, created_routes, rejected_routes = self._import_routes(
+                    archive, shapes, trips, route_trips, timings, patterns, services, created_by
+                )
+                route_stops = self._import_route_stops(created_routes, routes, patterns, stops, stop_names)
+                schedules, exceptions = self._import_schedules(
+                    created_routes, routes, trips, timings, services, created_by
+                )
+
+            summary = {
+                'stops': created_stops,
+                'routes': len(created_routes),
+                'route_stops': route_stops,
+                'schedules': schedules,
+                'schedule_exceptions': exceptions,
+                'skipped_routes': len(routes) - len(created_routes),
+                'rejected_stops': rejected_stops,
+                'rejected_routes': rejected_routes,
+            }
+            if rejected_stops or rejected_routes:
+                self.log_warning(
+                    f"GTFS ids too long, not imported: stops {rejected_stops}, routes {rejected_routes}"
+                )
+            self.log_info(f"GTFS feed imported: {summary}")
+            return summary
+
+        except Exception as e:
+            self.log_error(f"Error importing GTFS feed: {str(e)}", exc=e)
+            raise
+
+    def _rows(self, archive, name):
+        """Lecture en flux d'un fichier du zip (absent : aucune ligne)"""
+        if name not in archive.namelist():
+            return
+        with archive.open(name) as raw:
+            for row in csv.DictReader(io.TextIOWrapper(raw, encoding='utf-8-sig')):
+                yield {key.strip(): (value or '').strip() for key, value in row.items() if key}
+
+    def _batches(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _split_codes(self, ids, model, field):
+        """Sépare les codes qui tiennent dans le champ du modèle des identifiants à écarter"""
+        max_length = model._meta.get_field(field).max_length
+        codes = {gtfs_id: code for gtfs_id, code in ids.items() if len(code) <= max_length}
+        return codes, sorted(set(ids) - set(codes))
+
+    def _import_stops(self, archive, created_by):
+        """
+        Crée les arrêts absents ; retourne {gtfs_stop_id: pk}, les noms, le nombre créé
+        et les arrêts écartés (code trop long)
+        """
+        stop_ids = {}
+        stop_names = {}
+        created = 0
+        rejected = []
+        platforms = (row for row in self._rows(archive, 'stops.txt')
+                     if row.get('location_type', '') in ('', '0', '1'))
+
+        for batch in self._batches(platforms):
+            codes, too_long = self._split_codes(
+                {row['stop_id']: row.get('stop_code') or row['stop_id'] for row in batch}, Stop, 'stop_code'
+            )
+            rejected.extend(too_long)
+            existing = dict(Stop.objects.filter(stop_code__in=codes.values()).values_list('stop_code', 'id'))
+            new_stops = []
+            for row in batch:
+                if row['stop_id'] not in codes:
+                    continue
+                code = codes[row['stop_id']]
+                stop_names[row['stop_id']] = row.get('stop_name', '')
+                if code in existing:
+                    continue
+                existing[code] = None
+                new_stops.append(Stop(
+                    name=row.get('stop_name') or code,
+                    stop_code=code,
+                    description=row.get('stop_desc', ''),
+                    latitude=Decimal(row['stop_lat']).quantize(Decimal('0.000001')),
+                    longitude=Decimal(row['stop_lon']).quantize(Decimal('0.000001')),
+                    address=row.get('stop_desc', '')[:255],
+                    service_zone=row.get('zone_id', ''),
+                    zone_code=row.get('zone_id', '')[:10],
+                    platform_number=row.get('platform_code', '')[:5],
+                    stop_type='station' if row.get('location_type') == '1' else 'bus_stop',
+                    boarding_type='standard',
+                    status='operational',
+                    created_by=created_by,
+                ))
+            Stop.objects.bulk_create(new_stops, batch_size=self.BATCH_SIZE)
+            created += len(new_stops)
+
+            # Les pk ne sont pas renvoyés par tous les SGBD après bulk_create
+            pks = dict(Stop.objects.filter(stop_code__in=codes.values()).values_list('stop_code', 'id'))
+            stop_ids.update({stop_id: pks[code] for stop_id, code in codes.items()})
+
+        return stop_ids, stop_names, created, rejected
+
+    def _read_shapes(self, archive):
+        shapes = {}
+        for row in self._rows(archive, 'shapes.txt'):
+            shapes.setdefault(row['shape_id'], []).append((
+                int(row['shape_pt_sequence']), float(row['shape_pt_lat']), float(row['shape_pt_lon'])
+            ))
+        return {shape_id: [[lat, lon] for _, lat, lon in sorted(points)]
+                for shape_id, points in shapes.items()}
+
+    def _read_services(self, archive):
+        """
+        {service_id: {'days', 'start', 'end', 'added', 'removed', 'inactive'}} depuis
+        calendar et calendar_dates ; 'inactive' liste par jour les dates non desservies.
+        """
+        def parse_date(value):
+            return datetime.strptime(value, '%Y%m%d').date()
+
+        services = {}
+        for row in self._rows(archive, 'calendar.txt'):
+            services[row['service_id']] = {
+                'days': {day for day in DAY_NAMES if row.get(day) == '1'},
+                'start': parse_date(row['start_date']),
+                'end': parse_date(row['end_date']),
+                'added': set(),
+                'removed': set(),
+            }
+
+        for row in self._rows(archive, 'calendar_dates.txt'):
+            service_date = parse_date(row['date'])
+            service = services.setdefault(row['service_id'], {
+                'days': set(), 'start': service_date, 'end': service_date,
+                'added': set(), 'removed': set(),
+            })
+            if row['exception_type'] == '1':
+                service['added'].add(service_date)
+                service['start'] = min(service['start'], service_date)
+                service['end'] = max(service['end'], service_date)
+            else:
+                service['removed'].add(service_date)
+
+        # Un horaire couvre chaque jour de semaine sur toute la période : les dates
+        # ajoutées hors motif y ajoutent leur jour, les dates non desservies deviennent des exceptions
+        for service in services.values():
+            active = {
+                service_date for service_date in date_range(service['start'], service['end'])
+                if DAY_NAMES[service_date.weekday()] in service['days']
+            }
+            active = (active - service['removed']) | service['added']
+            service['days'] = {DAY_NAMES[service_date.weekday()] for service_date in active}
+            service['inactive'] = {}
+            for service_date in date_range(service['start'], service['end']):
+                day = DAY_NAMES[service_date.weekday()]
+                if day in service['days'] and service_date not in active:
+                    service['inactive'].setdefault(day, set()).add(service_date)
+        return services
+
+    def _read_trips(self, archive):
+        trips = {}
+        route_trips = {}
+        for row in self._rows(archive, 'trips.txt'):
+            trips[row['trip_id']] = (row['route_id'], row['service_id'], row.get('shape_id', ''))
+            route_trips.setdefault(row['route_id'], []).append(row['trip_id'])
+        return trips, route_trips
+
+    def _read_stop_times(self, archive, trips, route_trips):
+        """
+        Parcourt stop_times en flux : heure de début (arrivée au premier arrêt) et
+        dernière arrivée de chaque trip,
+        séquence d'arrêts complète pour le trip représentatif de chaque route.
+        """
+        representatives = {trip_ids[0] for trip_ids in route_trips.values()}
+        timings = {}
+        patterns = {}
+
+        for row in self._rows(archive, 'stop_times.txt'):
+            trip_id = row['trip_id']
+            if trip_id not in trips:
+                continue
+            sequence = int(row['stop_sequence'])
+            arrival = row.get('arrival_time') or row.get('departure_time')
+            departure = row.get('departure_time') or arrival
+            arrival = parse_timepoint(arrival) if arrival else None
+            departure = parse_timepoint(departure) if departure else None
+
+            first_sequence, first_arrival, last_sequence, last_arrival = timings.get(
+                trip_id, (None, None, None, None)
+            )
+            if arrival is not None and (first_sequence is None or sequence < first_sequence):
+                first_sequence, first_arrival = sequence, arrival
+            if arrival is not None and (last_sequence is None or sequence > last_sequence):
+                last_sequence, last_arrival = sequence, arrival
+            timings[trip_id] = (first_sequence, first_arrival, last_sequence, last_arrival)
+
+            if trip_id in representatives:
+                patterns.setdefault(trips[trip_id][0], []).append({
+                    'stop_sequence': sequence,
+                    'stop_id': row['stop_id'],
+                    'arrival': arrival,
+                    'departure': departure,
+                    'distance': float(row['shape_dist_traveled']) if row.get('shape_dist_traveled') else None,
+                    'pickup_type': int(row.get('pickup_type') or 0),
+                    'drop_off_type': int(row.get('drop_off_type') or 0),
+                    'is_timepoint': row.get('timepoint', '1') != '0',
+                })
+
+        for stops in patterns.values():
+            stops.sort(key=lambda stop: stop['stop_sequence'])
+        return timings, patterns
+
+    def _route_departures(self, trip_ids, trips, timings, service_id=None):
+        return sorted({
+            timings[trip_id][1] for trip_id in trip_ids
+            if trip_id in timings and timings[trip_id][1] is not None
+            and (service_id is None or trips[trip_id][1] == service_id)
+        })
+
+    def _headway(self, departures):
+        if len(departures) < 2:
+            return self.DEFAULT_FREQUENCY
+        return max(1, int(round(statistics.median(np.diff(departures)) / 60)))
+
+    def _import_routes(self, archive, shapes, trips, route_trips, timings, patterns, services, created_by):
+        """
+        Crée les routes absentes ; retourne {gtfs_route_id: pk}, l'ensemble des routes créées
+        et les routes écartées (identifiant trop long)
+        """
+        route_ids = {}
+        created_routes = set()
+        rejected = []
+
+        for batch in self._batches(self._rows(archive, 'routes.txt')):
+            codes, too_long = self._split_codes({row['route_id']: row['route_id'] for row in batch}, Route, 'route_code')
+            rejected.extend(too_long)
+            existing = set(Route.objects.filter(route_code__in=codes.values()).values_list('route_code', flat=True))
+            new_routes = []
+            for row in batch:
+                gtfs_id = row['route_id']
+                if gtfs_id not in codes:
+                    continue
+                code = codes[gtfs_id]
+                trip_ids = route_trips.get(gtfs_id, [])
+                if code in existing or not trip_ids:
+                    continue
+                existing.add(code)
+
+                path = shapes.get(trips[trip_ids[0]][2], [])
+                pattern = patterns.get(gtfs_id, [])
+                departures = self._route_departures(trip_ids, trips, timings)
+                _, first_arrival, _, last_arrival = timings.get(trip_ids[0], (None,) * 4)
+                duration = last_arrival - first_arrival if first_arrival is not None else 0
+                headway = self._headway(departures)
+                days = sorted(
+                    {day for trip_id in trip_ids for day in services.get(trips[trip_id][1], {}).get('days', ())},
+                    key=DAY_NAMES.index
+                )
+
+                new_routes.append(Route(
+                    name=row.get('route_long_name') or row.get('route_short_name') or code,
+                    description=row.get('route_desc', ''),
+                    route_code=code,
+                    circuit=(row.get('agency_id') or 'GTFS')[:50],
+                    route_category='local',
+                    difficulty_level='medium',
+                    type='bus',
+                    direction='',
+                    total_distance=Decimal(f"{self._path_length(path, pattern):.2f}"),
+                    estimated_duration=timedelta(seconds=max(duration, 0)),
+                    service_hours=(
+                        f"{format_timepoint(departures[0])[:5]}-{format_timepoint(departures[-1])[:5]}"
+                        if departures else ''
+                    ),
+                    operating_days=days,
+                    peak_frequency=headway,
+                    off_peak_frequency=headway,
+                    weekend_frequency=headway,
+                    path=path,
+                    route_color=f"#{row['route_color']}" if row.get('route_color') else '#000000',
+                    status='active',
+                    created_by=created_by,
+                ))
+                created_routes.add(gtfs_id)
+            Route.objects.bulk_create(new_routes, batch_size=self.BATCH_SIZE)
+
+            pks = dict(Route.objects.filter(route_code__in=codes.values()).values_list('route_code', 'id'))
+            route_ids.update({gtfs_id: pks[code] for gtfs_id, code in codes.items() if code in pks})
+
+        return route_ids, {gtfs_id for gtfs_id in created_routes if gtfs_id in route_ids}, rejected
+
+    def _path_length(self, path, pattern):
+        """Longueur en km : shape_dist_traveled si fourni, sinon longueur du tracé"""
+        distances = [stop['distance'] for stop in pattern if stop['distance'] is not None]
+        if distances:
+            return max(distances)
+        if len(path) < 2:
+            return 0.0
+        points = np.asarray(path, dtype=float)
+        return float(haversine_km(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1]).sum())
+
+    def _import_route_stops(self, created_routes, routes, patterns, stops, stop_names):
+        new_route_stops = []
+        for gtfs_id in created_routes:
+            pattern = [stop for stop in patterns.get(gtfs_id, []) if stop['stop_id'] in stops]
+            if not pattern:
+                continue
+            origin = pattern[0]['arrival'] or 0
+            for order, stop in enumerate(pattern):
+                arrival = stop['arrival'] if stop['arrival'] is not None else origin
+                departure = stop['departure'] if stop['departure'] is not None else arrival
+                new_route_stops.append(RouteStop(
+                    route_id=routes[gtfs_id],
+                    stop_id=stops[stop['stop_id']],
+                    order=order,
+                    stop_sequence=stop['stop_sequence'],
+                    distance_from_start=Decimal(f"{stop['distance'] or 0:.2f}"),
+                    estimated_time=int(round((arrival - origin) / 60)),
+                    dwell_time=max(departure - arrival, 0),
+                    is_timepoint=stop['is_timepoint'],
+                    stop_announcement=stop_names.get(stop['stop_id'], '')[:255],
+                    pickup_type=stop['pickup_type'] if stop['pickup_type'] in (0, 1, 2, 3) else 0,
+                    drop_off_type=stop['drop_off_type'] if stop['drop_off_type'] in (0, 1, 2, 3) else 0,
+                ))
+        RouteStop.objects.bulk_create(new_route_stops, batch_size=self.BATCH_SIZE)
+        return len(new_route_stops)
+
+    def _schedule_code(self, route_id, service_id, day):
+        digest = hashlib.md5(f"{route_id}|{service_id}|{day}".encode('utf-8')).hexdigest()
+        return f"G{digest[:15]}"
+
+    def _import_schedules(self, created_routes, routes, trips, timings, services, created_by):
+        """
+        Un horaire par (route, service, jour) : bornes et fréquence médiane issues
+        des départs réels, conservés tels quels dans timepoints.
+        """
+        service_trips = {}
+        for trip_id, (route_id, service_id, _) in trips.items():
+            if route_id in created_routes and service_id in services:
+                service_trips.setdefault((route_id, service_id), []).append(trip_id)
+
+        new_schedules = []
+        removed_by_code = {}
+        for (route_id, service_id), trip_ids in service_trips.items():
+            departures = self._route_departures(trip_ids, trips, timings)
+            if not departures:
+                continue
+            service = services[service_id]
+            for day in sorted(service['days'], key=DAY_NAMES.index):
+                code = self._schedule_code(route_id, service_id, day)
+                new_schedules.append(Schedule(
+                    route_id=routes[route_id],
+                    schedule_code=code,
+                    schedule_version=self.SCHEDULE_VERSION,
+                    season='regular',
+                    day_of_week=day,
+                    start_date=service['start'],
+                    end_date=service['end'],
+                    start_time=seconds_to_time(departures[0]),
+                    end_time=seconds_to_time(departures[-1]),
+                    frequency=self._headway(departures),
+                    trip_template={'gtfs_service_id': service_id},
+                    status='active',
+                    is_active=True,
+                    is_current_version=True,
+                    timepoints=[format_timepoint(seconds) for seconds in departures if seconds < 24 * 3600],
+                    created_by=created_by,
+                ))
+                removed = service['inactive'].get(day)
+                if removed:
+                    removed_by_code[code] = removed
+
+        Schedule.objects.bulk_create(new_schedules, batch_size=self.BATCH_SIZE, ignore_conflicts=True)
+        created = Schedule.objects.filter(
+            schedule_code__in=[schedule.schedule_code for schedule in new_schedules],
+            schedule_version=self.SCHEDULE_VERSION
+        ).count()
+
+        new_exceptions = []
+        schedule_pks = dict(Schedule.objects.filter(
+            schedule_code__in=removed_by_code.keys(),
+            schedule_version=self.SCHEDULE_VERSION
+        ).values_list('schedule_code', 'id'))
+        for code, removed in removed_by_code.items():
+            for exception_date in sorted(removed):
+                new_exceptions.append(ScheduleException(
+                    schedule_id=schedule_pks[code],
+                    exception_date=exception_date,
+                    exception_type='other',
+                    is_cancelled=True,
+                    requires_approval=False,
+                    reason='GTFS calendar_dates',
+                    impact_level='medium',
+                    created_by=created_by,
+                ))
+        ScheduleException.objects.bulk_create(new_exceptions, batch_size=self.BATCH_SIZE, ignore_conflicts=True)
+
+        return created, len(new_exceptions)
@@ -0,0 +1,99 @@
+# transport_management/services/gtfs/protobuf.py
+
+"""
+Encodeur minimal du format binaire protobuf (wire format), suffisant pour
+produire les messages GTFS-Realtime sans dépendance externe.
+Un message est décrit par une liste de (numéro de champ, type, valeur).
+"""
+
+import struct
+
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+
+def encode_varint(value):
+    """Varint protobuf ; les entiers négatifs sont encodés sur 64 bits (int32/int64)"""
+    if value < 0:
+        value += 1 << 64
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _key(field_number, wire_type):
+    return encode_varint((field_number << 3) | wire_type)
+
+
+def encode_message(fields):
+    """
+    Encode une liste de (field_number, kind, value).
+    kind : 'varint', 'bool', 'float', 'double', 'string', 'bytes' ou 'message'
+    (value est alors elle-même une liste de champs). Les valeurs None sont ignorées.
+    """
+    out = bytearray()
+    for field_number, kind, value in fields:
+        if value is None:
+            continue
+        if kind == 'varint':
+            out += _key(field_number, VARINT) + encode_varint(int(value))
+        elif kind == 'bool':
+            out += _key(field_number, VARINT) + encode_varint(1 if value else 0)
+        elif kind == 'float':
+            out += _key(field_number, FIXED32) + struct.pack('<f', float(value))
+        elif kind == 'double':
+            out += _key(field_number, FIXED64) + struct.pack('<d', float(value))
+        else:
+            if kind == 'string':
+                payload = str(value).encode('utf-8')
+            elif kind == 'message':
+                payload = encode_message(value)
+            else:
+                payload = bytes(value)
+            out += _key(field_number, LENGTH_DELIMITED) + encode_varint(len(payload)) + payload
+    return bytes(out)
+
+
+def decode_message(data):
+    """
+    Décode un message en {field_number: [valeurs brutes]} (varint en entier,
+    fixed32/fixed64 en octets, length-delimited en octets). Utile aux tests et au débogage.
+    """
+    fields = {}
+    position = 0
+    while position < len(data):
+        key, position = _read_varint(data, position)
+        field_number, wire_type = key >> 3, key & 0x07
+        if wire_type == VARINT:
+            value, position = _read_varint(data, position)
+        elif wire_type == FIXED64:
+            value, position = data[position:position + 8], position + 8
+        elif wire_type == FIXED32:
+            value, position = data[position:position + 4], position + 4
+        elif wire_type == LENGTH_DELIMITED:
+            length, position = _read_varint(data, position)
+            value, position = data[position:position + length], position + length
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type}")
+        fields.setdefault(field_number, []).append(value)
+    return fields
+
+
+def _read_varint(data, position):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
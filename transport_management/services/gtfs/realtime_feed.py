@@ -0,0 +1,276 @@
+# transport_management/services/gtfs/realtime_feed.py
+
+import hashlib
+import json
+from datetime import timedelta
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
+from ...models import Trip, BusPosition, Stop
+from ..base.service_base import ServiceBase
+from ..timetable.stop_times import load_route_patterns, format_timepoint, current_delay
+from .feed_export import GTFSFeedExporter
+from .protobuf import encode_message
+
+GTFS_RT_VERSION = '2.0'
+VEHICLE_STOP_STATUS = {'INCOMING_AT': 0, 'STOPPED_AT': 1, 'IN_TRANSIT_TO': 2}
+SCHEDULE_RELATIONSHIP = {'SCHEDULED': 0, 'ADDED': 1, 'UNSCHEDULED': 2, 'CANCELED': 3}
+
+
+class GTFSRealtimeFeedBuilder(ServiceBase):
+    """
+    Flux GTFS-Realtime (VehiclePositions + TripUpdates) des trips en cours.
+    Le flux est reconstruit périodiquement en une passe et mis en cache sous
+    forme d'octets (protobuf et JSON) : chaque requête ne fait qu'une lecture de cache.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.CACHE_KEY = 'gtfs_realtime_feed'
+        self.CACHE_TIMEOUT = 60                 # Un flux périmé n'est plus servi au-delà
+        self.ACTIVE_STATUSES = ['in_progress', 'delayed']
+        self.POSITION_MAX_AGE_MINUTES = 10      # Positions plus anciennes ignorées
+        self.STOPPED_RADIUS_SECONDS = 30        # Fenêtre "à l'arrêt" autour de l'heure prévue
+        self.exporter = GTFSFeedExporter()
+
+    def refresh(self, now=None):
+        """Reconstruit le flux et le met en cache ; retourne l'entrée de cache"""
+        try:
+            feed = self.build(now)
+            payload = encode_feed(feed)
+            # L'horodatage de l'en-tête change à chaque reconstruction : l'ETag ne porte que sur les entités
+            entities = json.dumps(feed['entity'], sort_keys=True, separators=(',', ':')).encode('utf-8')
+            entry = {
+                'pb': payload,
+                'json': json.dumps(feed, separators=(',', ':')).encode('utf-8'),
+                'etag': hashlib.md5(entities).hexdigest(),
+                'timestamp': feed['header']['timestamp'],
+                'entities': len(feed['entity']),
+            }
+            cache.set(self.CACHE_KEY, entry, self.CACHE_TIMEOUT)
+            return entry
+
+        except Exception as e:
+            self.log_error(f"Error refreshing GTFS-Realtime feed: {str(e)}", exc=e)
+            raise
+
+    def get_feed(self):
+        """Entrée de cache courante, reconstruite si absente (démarrage, worker arrêté)"""
+        return cache.get(self.CACHE_KEY) or self.refresh()
+
+    def build(self, now=None):
+        """
+        Construit le FeedMessage (forme JSON GTFS-Realtime) à partir des dernières
+        positions connues et du retard courant de chaque trip actif.
+        """
+        now = now or timezone.now()
+        local_tz = timezone.get_current_timezone()
+        trips = list(Trip.objects.filter(status__in=self.ACTIVE_STATUSES).values(
+            'id', 'route_id', 'route__route_code', 'schedule__schedule_code',
+            'schedule__schedule_version', 'planned_departure', 'actual_start_time',
+            'departure_time', 'delay_duration', 'vehicle_id', 'vehicle__vehicle_number',
+            'vehicle__license_plate'
+        ))
+
+        positions = self._latest_positions([trip['id'] for trip in trips], now)
+        patterns = load_route_patterns({trip['route_id'] for trip in trips})
+        stop_codes = dict(Stop.objects.filter(
+            id__in={stop['stop_id'] for pattern in patterns.values() for stop in pattern}
+        ).values_list('id', 'stop_code'))
+
+        entities = []
+        for trip in trips:
+            departure = timezone.localtime(trip['planned_departure'], local_tz)
+            descriptor = self._trip_descriptor(trip, departure)
+            delay = current_delay(
+                trip['delay_duration'], trip['planned_departure'], trip['actual_start_time'] or trip['departure_time']
+            )
+            vehicle = self._vehicle_descriptor(trip)
+            position = positions.get(trip['id'])
+
+            stop_updates, next_stop = self._stop_time_updates(
+                patterns.get(trip['route_id'], []), stop_codes, trip['planned_departure'], delay, now
+            )
+            trip_update = {
+                'trip': descriptor,
+                'vehicle': vehicle,
+                'stopTimeUpdate': stop_updates,
+                'delay': delay,
+            }
+            # Horodatage issu des données (dernière position) : sans position, le champ
+            # optionnel est omis plutôt que remplacé par l'heure de construction
+            if position:
+                trip_update['timestamp'] = int(position['timestamp'].timestamp())
+            entities.append({'id': f"trip-{trip['id']}", 'tripUpdate': trip_update})
+
+            if position:
+                vehicle_position = {
+                    'trip': descriptor,
+                    'vehicle': vehicle,
+                    'position': {
+                        'latitude': float(position['latitude']),
+                        'longitude': float(position['longitude']),
+                        'bearing': float(position['heading']) if position['heading'] is not None else None,
+                        'speed': round(float(position['speed']) / 3.6, 2),
+                    },
+                    'timestamp': trip_update['timestamp'],
+                }
+                if next_stop:
+                    vehicle_position.update(next_stop)
+                entities.append({'id': f"vehicle-{trip['id']}", 'vehicle': vehicle_position})
+
+        return {
+            'header': {
+                'gtfsRealtimeVersion': GTFS_RT_VERSION,
+                'incrementality': 'FULL_DATASET',
+                'timestamp': int(now.timestamp()),
+            },
+            'entity': entities,
+        }
+
+    def _latest_positions(self, trip_ids, now):
+        """Dernière position valide de chaque trip (deux requêtes quel que soit le nombre de trips)"""
+        latest_ids = BusPosition.objects.filter(
+            trip_id__in=trip_ids,
+            is_valid=True,
+            timestamp__gte=now - timedelta(minutes=self.POSITION_MAX_AGE_MINUTES)
+        ).values('trip_id').annotate(last_id=Max('position_id')).values_list('last_id', flat=True)
+
+        return {
+            row['trip_id']: row
+            for row in BusPosition.objects.filter(position_id__in=list(latest_ids)).values(
+                'trip_id', 'latitude', 'longitude', 'speed', 'heading', 'timestamp'
+            )
+        }
+
+    def _trip_descriptor(self, trip, departure):
+        seconds = departure.hour * 3600 + departure.minute * 60 + departure.second
+        if trip['schedule__schedule_code']:
+            service_id = self.exporter.schedule_service_id(
+                trip['schedule__schedule_code'], trip['schedule__schedule_version']
+            )
+            trip_id = self.exporter.schedule_trip_id(service_id, seconds)
+        else:
+            trip_id = self.exporter.adhoc_trip_id(trip['id'])
+        return {
+            'tripId': trip_id,
+            'routeId': trip['route__route_code'],
+            'startTime': format_timepoint(seconds),
+            'startDate': departure.strftime('%Y%m%d'),
+            'scheduleRelationship': 'SCHEDULED',
+        }
+
+    def _vehicle_descriptor(self, trip):
+        if not trip['vehicle_id']:
+            return None
+        return {
+            'id': str(trip['vehicle_id']),
+            'label': trip['vehicle__vehicle_number'],
+            'licensePlate': trip['vehicle__license_plate'],
+        }
+
+    def _stop_time_updates(self, pattern, stop_codes, planned_departure, delay, now):
+        """
+        Prévisions des arrêts restants (retard courant propagé) et arrêt
+        courant du véhicule (current_stop_sequence, stop_id, current_status).
+        """
+        updates = []
+        next_stop = None
+        for stop in pattern:
+            stop_code = stop_codes.get(stop['stop_id'])
+            if stop_code is None:
+                continue
+            predicted_departure = planned_departure + timedelta(seconds=stop['departure_offset'] + delay)
+            if predicted_departure < now:
+                continue
+            predicted_arrival = planned_departure + timedelta(seconds=stop['arrival_offset'] + delay)
+            if next_stop is None:
+                stopped = predicted_arrival <= now + timedelta(seconds=self.STOPPED_RADIUS_SECONDS)
+                next_stop = {
+                    'currentStopSequence': stop['stop_sequence'],
+                    'stopId': stop_code,
+                    'currentStatus': 'STOPPED_AT' if stopped else 'IN_TRANSIT_TO',
+                }
+            updates.append({
+                'stopSequence': stop['stop_sequence'],
+                'stopId': stop_code,
+                'arrival': {'delay': delay, 'time': int(predicted_arrival.timestamp())},
+                'departure': {'delay': delay, 'time': int(predicted_departure.timestamp())},
+                'scheduleRelationship': 'SCHEDULED',
+            })
+        return updates, next_stop
+
+
+def _trip_fields(trip):
+    return [
+        (1, 'string', trip['tripId']),
+        (2, 'string', trip['startTime']),
+        (3, 'string', trip['startDate']),
+        (4, 'varint', SCHEDULE_RELATIONSHIP[trip['scheduleRelationship']]),
+        (5, 'string', trip['routeId']),
+    ]
+
+
+def _vehicle_fields(vehicle):
+    if not vehicle:
+        return None
+    return [
+        (1, 'string', vehicle['id']),
+        (2, 'string', vehicle['label']),
+        (3, 'string', vehicle['licensePlate']),
+    ]
+
+
+def _stop_time_event(event):
+    return [(1, 'varint', event['delay']), (2, 'varint', event['time'])]
+
+
+def encode_feed(feed):
+    """Encode le FeedMessage (forme JSON) au format protobuf GTFS-Realtime"""
+    header = feed['header']
+    fields = [(1, 'message', [
+        (1, 'string', header['gtfsRealtimeVersion']),
+        (2, 'varint', 0),  # FULL_DATASET
+        (3, 'varint', header['timestamp']),
+    ])]
+
+    for entity in feed['entity']:
+        entity_fields = [(1, 'string', entity['id'])]
+        if 'tripUpdate' in entity:
+            update = entity['tripUpdate']
+            entity_fields.append((3, 'message', [
+                (1, 'message', _trip_fields(update['trip'])),
+                *[(2, 'message', [
+                    (1, 'varint', stop['stopSequence']),
+                    (2, 'message', _stop_time_event(stop['arrival'])),
+                    (3, 'message', _stop_time_event(stop['departure'])),
+                    (4, 'string', stop['stopId']),
+                    (5, 'varint', SCHEDULE_RELATIONSHIP[stop['scheduleRelationship']]),
+                ]) for stop in update['stopTimeUpdate']],
+                (3, 'message', _vehicle_fields(update['vehicle'])),
+                (4, 'varint', update.get('timestamp')),
+                (5, 'varint', update['delay']),
+            ]))
+        if 'vehicle' in entity:
+            vehicle = entity['vehicle']
+            position = vehicle['position']
+            entity_fields.append((4, 'message', [
+                (1, 'message', _trip_fields(vehicle['trip'])),
+                (2, 'message', [
+                    (1, 'float', position['latitude']),
+                    (2, 'float', position['longitude']),
+                    (3, 'float', position['bearing']),
+                    (5, 'float', position['speed']),
+                ]),
+                (3, 'varint', vehicle.get('currentStopSequence')),
+                (4, 'varint', VEHICLE_STOP_STATUS.get(vehicle.get('currentStatus'))),
+                (5, 'varint', vehicle['timestamp']),
+                (7, 'string', vehicle.get('stopId')),
+                (8, 'message', _vehicle_fields(vehicle['vehicle'])),
+            ]))
+        fields.append((2, 'message', entity_fields))
+
+    return encode_message(fields)
+
+
+gtfs_realtime_feed = GTFSRealtimeFeedBuilder()
@@ -0,0 +1,167 @@
+# transport_management/services/monitoring/headway_monitor.py
+
+import uuid
+import numpy as np
+from django.core.cache import cache
+from django.utils import timezone
+from ...models import Trip, EventLog
+from ..base.service_base import ServiceBase
+from ..tracking.arrival_predictions import arrival_predictions
+
+
+class HeadwayMonitor(ServiceBase):
+    """
+    Surveillance de la régularité des intervalles par route.
+    Les véhicules actifs sont ordonnés par distance parcourue sur le tracé (dernier
+    état connu des prévisions d'arrivée), puis les intervalles réels entre véhicules
+    consécutifs sont comparés aux intervalles prévus en une passe vectorisée.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ACTIVE_STATUSES = ['in_progress', 'delayed']
+        self.BUNCHING_RATIO = 0.5           # Intervalle réel < 50% du prévu : regroupement
+        self.SEVERE_BUNCHING_RATIO = 0.25
+        self.GAP_RATIO = 1.5                # Intervalle réel > 150% du prévu : trou de service
+        self.MIN_HEADWAY_SECONDS = 60       # En dessous, toujours un regroupement
+        self.MAX_HOLD_SECONDS = 300         # Temps de régulation maximal suggéré
+        self.STALE_SECONDS = 600            # États plus anciens ignorés
+        self.EVENT_COOLDOWN = 300           # Pas de nouvel événement pour la même paire avant ce délai
+        self.COOLDOWN_KEY = 'headway_event_{event_type}_{leader}_{follower}'
+
+    def check_routes(self, now=None):
+        """Détecte regroupements et trous de service ; retourne les événements créés"""
+        try:
+            now = now or timezone.now()
+            vehicles = self._vehicles(now)
+            if len(vehicles['trips']) < 2:
+                return []
+
+            pairs = self._headways(vehicles)
+            holds = self._holding_times(vehicles, pairs)
+            events = self._events(vehicles, pairs, holds, now)
+            if events:
+                EventLog.objects.bulk_create(events)
+                self.log_info(f"Headway monitor raised {len(events)} events")
+            return events
+
+        except Exception as e:
+            self.log_error(f"Error checking route headways: {str(e)}", exc=e)
+            return []
+
+    def _vehicles(self, now):
+        """Trips actifs positionnés sur leur tracé, triés par route puis du plus avancé au moins avancé"""
+        trips = dict(Trip.objects.filter(status__in=self.ACTIVE_STATUSES).values_list('id', 'route_id'))
+        states = arrival_predictions.trip_states(trips.keys())
+        rows = [
+            (trip_id, trips[trip_id], state['progress_seconds'], state['distance'], state['planned_departure'])
+            for trip_id, state in states.items()
+            if state['route_id'] == trips[trip_id] and now.timestamp() - state['observed_at'] <= self.STALE_SECONDS
+        ]
+        if not rows:
+            return {'trips': np.empty(0, dtype=np.int64)}
+
+        trip_ids, routes, progress, distances, planned = (np.asarray(column) for column in zip(*rows))
+        order = np.lexsort((-progress, -distances, routes))
+        return {
+            'trips': trip_ids[order].astype(np.int64),
+            'routes': routes[order].astype(np.int64),
+            'progress': progress[order].astype(float),
+            'distances': distances[order].astype(float),
+            'planned': planned[order].astype(float),
+        }
+
+    def _headways(self, vehicles):
+        """Paires (meneur, suiveur) consécutives d'une même route avec intervalles réel et prévu (secondes)"""
+        leaders = np.flatnonzero(vehicles['routes'][:-1] == vehicles['routes'][1:])
+        followers = leaders + 1
+        # Temps de parcours prévu entre les deux véhicules : délai avant que le suiveur
+        # n'atteigne la position actuelle du meneur
+        actual = vehicles['progress'][leaders] - vehicles['progress'][followers]
+        scheduled = vehicles['planned'][followers] - vehicles['planned'][leaders]
+        # Intervalle prévu nul ou négatif (départs simultanés, suiveur parti avant le meneur
+        # qui l'a dépassé) : ratio nul, la paire est signalée comme regroupement
+        ratio = np.divide(actual, scheduled, out=np.zeros_like(actual), where=scheduled > 0)
+        return {
+            'leaders': leaders,
+            'followers': followers,
+            'actual': actual,
+            'scheduled': scheduled,
+            'ratio': ratio,
+            'out_of_order': scheduled <= 0,
+        }
+
+    def _holding_times(self, vehicles, pairs):
+        """
+        Régulation à intervalles égaux : chaque véhicule est retenu de la moitié de l'écart
+        entre l'intervalle derrière lui et celui devant lui (prévu à défaut de voisin).
+        """
+        count = len(vehicles['trips'])
+        front = np.full(count, np.nan)
+        back = np.full(count, np.nan)
+        front_scheduled = np.full(count, np.nan)
+        back_scheduled = np.full(count, np.nan)
+        front[pairs['followers']] = pairs['actual']
+        front_scheduled[pairs['followers']] = pairs['scheduled']
+        back[pairs['leaders']] = pairs['actual']
+        back_scheduled[pairs['leaders']] = pairs['scheduled']
+
+        front = np.where(np.isnan(front), back_scheduled, front)
+        back = np.where(np.isnan(back), front_scheduled, back)
+        holds = np.clip((back - front) / 2, 0, self.MAX_HOLD_SECONDS)
+        return np.nan_to_num(holds).round().astype(int)
+
+    def _events(self, vehicles, pairs, holds, now):
+        trips = vehicles['trips']
+        bunching = (
+            (pairs['ratio'] < self.BUNCHING_RATIO) | (pairs['actual'] < self.MIN_HEADWAY_SECONDS) | pairs['out_of_order']
+        )
+        gaps = pairs['ratio'] > self.GAP_RATIO
+
+        events = []
+        for index in np.flatnonzero(bunching | gaps):
+            leader = int(pairs['leaders'][index])
+            follower = int(pairs['followers'][index])
+            is_bunching = bool(bunching[index])
+            event_type = 'bus_bunching' if is_bunching else 'headway_gap'
+            key = self.COOLDOWN_KEY.format(event_type=event_type, leader=trips[leader], follower=trips[follower])
+            if not cache.add(key, True, self.EVENT_COOLDOWN):
+                continue
+
+            # Regroupement : le suiveur est retenu ; trou : le meneur est retenu pour que le suiveur le rattrape
+            held = follower if is_bunching else leader
+            actual = float(pairs['actual'][index])
+            scheduled = float(pairs['scheduled'][index])
+            ratio = float(pairs['ratio'][index])
+            severity = 'error' if is_bunching and ratio < self.SEVERE_BUNCHING_RATIO else 'warning'
+            events.append(EventLog(
+                trip_id=int(trips[follower]),
+                event_id=f"{event_type[:3].upper()}-{now.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}",
+                event_type=event_type,
+                severity=severity,
+                timestamp=now,
+                description=(
+                    f"{'Bus bunching' if is_bunching else 'Headway gap'} on route {int(vehicles['routes'][follower])}: "
+                    f"{round(actual / 60, 1)} min actual vs {round(scheduled / 60, 1)} min scheduled"
+                ),
+                event_data={
+                    'route_id': int(vehicles['routes'][follower]),
+                    'leader_trip_id': int(trips[leader]),
+                    'follower_trip_id': int(trips[follower]),
+                    'actual_headway_seconds': round(actual),
+                    'scheduled_headway_seconds': round(scheduled),
+                    'headway_ratio': round(ratio, 2),
+                    'out_of_order': bool(pairs['out_of_order'][index]),
+                    'suggested_holding': {
+                        'trip_id': int(trips[held]),
+                        'seconds': int(holds[held]),
+                    },
+                },
+                related_entities={'trips': [int(trips[leader]), int(trips[follower])]},
+                requires_action=int(holds[held]) > 0,
+                source='headway_monitor',
+            ))
+        return events
+
+
+headway_monitor = HeadwayMonitor()
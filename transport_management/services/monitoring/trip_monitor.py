@@ -6,6 +6,7 @@ from datetime import datetime, timedelta
 from django.db.models import Avg, F, Q
 from ...models import Trip, BusPosition, Stop, Schedule, EventLog
 from ..base.service_base import ServiceBase
+from .headway_monitor import headway_monitor
 
 class TripMonitoringService(ServiceBase):
     def __init__(self):
@@ -25,6 +26,9 @@ class TripMonitoringService(ServiceBase):
             for trip in active_trips:
                 self._process_trip_monitoring(trip)
 
+            # Régularité des intervalles par route (même cycle de surveillance)
+            headway_monitor.check_routes()
+
         except Exception as e:
             self.log_error(f"Error monitoring active trips: {str(e)}", exc=e)
 
@@ -0,0 +1,271 @@
+# transport_management/services/reporting/kpi_rollup.py
+
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from ...models import Trip, Incident, RouteKPIRollup
+from ..base.service_base import ServiceBase
+
+
+class KPIRollupService(ServiceBase):
+    """
+    Agrégats KPI par (route, horaire, jour, heure de départ prévue).
+    Chaque transition de trip retire l'ancienne contribution de son créneau et ajoute la
+    nouvelle (UPDATE F()), les incidents incrémentent le créneau de leur trip ; la
+    réconciliation recalcule une journée entière depuis les lignes brutes et corrige les
+    écarts (mises à jour en masse, états inconnus). Les lectures ne parcourent que les
+    agrégats : un an de KPI coûte une requête, comme un jour.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ON_TIME_THRESHOLD = 300  # 5 minutes, comme l'analyse de ponctualité
+        self.RECONCILE_DAYS = 2  # Hier et aujourd'hui
+        self.STATE_FIELDS = (
+            'route_id', 'schedule_id', 'planned_departure', 'status',
+            'delay_duration', 'actual_start_time', 'passenger_count'
+        )
+        self.COUNTERS = (
+            'trip_count', 'completed_count', 'cancelled_count', 'on_time_count',
+            'delay_sample_count', 'total_delay_seconds', 'passenger_count', 'incident_count'
+        )
+        self.GROUP_FIELDS = {
+            'day': 'service_date',
+            'hour': 'hour',
+            'route': 'route_id',
+            'schedule': 'schedule_id',
+        }
+
+    # ------------------------------------------------------------------
+    # Contributions
+    # ------------------------------------------------------------------
+
+    def trip_state(self, trip):
+        """État KPI du trip lu via __dict__ ; None si un champ est différé"""
+        fields = trip.__dict__
+        if any(name not in fields for name in self.STATE_FIELDS):
+            return None
+        return tuple(fields[name] for name in self.STATE_FIELDS)
+
+    def bucket_key(self, state):
+        if state is None or state[0] is None or state[2] is None:
+            return None
+        local = timezone.localtime(state[2])
+        return (state[0], state[1], local.date(), local.hour)
+
+    def contribution(self, state):
+        """(créneau, compteurs, retard en secondes ou None) apportés par un trip"""
+        key = self.bucket_key(state)
+        if key is None:
+            return None, {}, None
+        _, _, planned, status, delay_duration, started, passengers = state
+
+        delay = None
+        if status != 'cancelled':
+            if delay_duration is not None:
+                delay = int(delay_duration.total_seconds())
+            elif started is not None:
+                delay = int((started - planned).total_seconds())
+            if delay is not None:
+                delay = max(delay, 0)
+
+        counters = {
+            'trip_count': 1,
+            'completed_count': int(status == 'completed'),
+            'cancelled_count': int(status == 'cancelled'),
+            'on_time_count': int(delay is not None and delay <= self.ON_TIME_THRESHOLD),
+            'delay_sample_count': int(delay is not None),
+            'total_delay_seconds': delay or 0,
+            'passenger_count': passengers or 0,
+        }
+        return key, counters, delay
+
+    def _aggregate(self, states, incidents_by_trip):
+        """Agrège [(trip_id, état)] en {créneau: compteurs} ; sert aux recalculs complets"""
+        buckets = {}
+        for trip_id, state in states:
+            key, counters, delay = self.contribution(state)
+            if key is None:
+                continue
+            bucket = buckets.setdefault(key, dict.fromkeys(self.COUNTERS + ('max_delay_seconds',), 0))
+            for name, value in counters.items():
+                bucket[name] += value
+            bucket['incident_count'] += incidents_by_trip.get(trip_id, 0)
+            if delay is not None:
+                bucket['max_delay_seconds'] = max(bucket['max_delay_seconds'], delay)
+        return buckets
+
+    def _bucket_range(self, service_date, hour=None):
+        start = timezone.make_aware(datetime.combine(service_date, time(hour or 0)))
+        end = start + (timedelta(hours=1) if hour is not None else timedelta(days=1))
+        return start, end
+
+    # ------------------------------------------------------------------
+    # Mise à jour incrémentale
+    # ------------------------------------------------------------------
+
+    def apply_transition(self, trip_id, previous, current):
+        """
+        Applique la différence entre deux états du trip (None : trip absent).
+        À appeler dans la transaction de l'écriture du trip.
+        """
+        if previous == current:
+            return
+        old_key, old_counters, old_delay = self.contribution(previous)
+        new_key, new_counters, new_delay = self.contribution(current)
+
+        deltas = {}
+        for key, counters, sign in ((old_key, old_counters, -1), (new_key, new_counters, 1)):
+            if key is None:
+                continue
+            delta = deltas.setdefault(key, dict.fromkeys(self.COUNTERS, 0))
+            for name, value in counters.items():
+                delta[name] += sign * value
+
+        # Les incidents suivent le trip quand il change de créneau
+        if old_key is not None and new_key is not None and old_key != new_key:
+            incidents = Incident.objects.filter(trip_id=trip_id).count()
+            deltas[old_key]['incident_count'] -= incidents
+            deltas[new_key]['incident_count'] += incidents
+
+        for key, delta in deltas.items():
+            raised = new_delay if key == new_key else None
+            self._apply(key, delta, raised)
+
+        # Un maximum ne se décrémente pas : le créneau qui perd un retard est recalculé
+        if old_delay and (old_key != new_key or new_delay is None or new_delay < old_delay):
+            self._refresh_max_delay(old_key)
+
+    def record_incident(self, trip_id, delta):
+        """Ajoute (ou retire) un incident au créneau de son trip"""
+        state = Trip.objects.filter(pk=trip_id).values_list(*self.STATE_FIELDS).first()
+        key = self.bucket_key(state)
+        if key is not None:
+            self._apply(key, {'incident_count': delta}, None)
+
+    def _apply(self, key, delta, raised_max_delay):
+        updates = {name: F(name) + value for name, value in delta.items() if value}
+        if raised_max_delay:
+            updates['max_delay_seconds'] = Greatest(F('max_delay_seconds'), raised_max_delay)
+        if not updates:
+            return
+        route_id, schedule_id, service_date, hour = key
+        with transaction.atomic():
+            row, _ = RouteKPIRollup.objects.get_or_create(
+                route_id=route_id, schedule_id=schedule_id, service_date=service_date, hour=hour
+            )
+            RouteKPIRollup.objects.filter(pk=row.pk).update(**updates)
+
+    def _bucket_trips(self, key):
+        route_id, schedule_id, service_date, hour = key
+        start, end = self._bucket_range(service_date, hour)
+        return Trip.objects.filter(
+            route_id=route_id, schedule_id=schedule_id,
+            planned_departure__gte=start, planned_departure__lt=end
+        ).order_by()
+
+    def _refresh_max_delay(self, key):
+        states = self._bucket_trips(key).values_list(*self.STATE_FIELDS)
+        delays = [delay for _, _, delay in map(self.contribution, states) if delay is not None]
+        route_id, schedule_id, service_date, hour = key
+        RouteKPIRollup.objects.filter(
+            route_id=route_id, schedule_id=schedule_id, service_date=service_date, hour=hour
+        ).update(max_delay_seconds=max(delays, default=0))
+
+    def refresh_trip(self, trip_id, *states):
+        """Recalcule le créneau actuel du trip et ceux des états connus"""
+        current = Trip.objects.filter(pk=trip_id).values_list(*self.STATE_FIELDS).first()
+        for key in {self.bucket_key(state) for state in states + (current,)} - {None}:
+            self.refresh_bucket(key)
+
+    def refresh_bucket(self, key):
+        """Recalcule un créneau depuis les lignes brutes (état précédent inconnu)"""
+        trips = self._bucket_trips(key)
+        states = list(trips.values_list('id', *self.STATE_FIELDS))
+        incidents = dict(
+            Incident.objects.filter(trip__in=trips).order_by()
+            .values_list('trip_id').annotate(count=Count('id'))
+        )
+        counters = self._aggregate([(row[0], row[1:]) for row in states], incidents).get(
+            key, dict.fromkeys(self.COUNTERS + ('max_delay_seconds',), 0)
+        )
+        route_id, schedule_id, service_date, hour = key
+        RouteKPIRollup.objects.update_or_create(
+            route_id=route_id, schedule_id=schedule_id, service_date=service_date, hour=hour,
+            defaults=counters
+        )
+
+    # ------------------------------------------------------------------
+    # Réconciliation
+    # ------------------------------------------------------------------
+
+    def reconcile(self, service_date):
+        """Reconstruit les agrégats d'une journée ; retourne le nombre de créneaux"""
+        start, end = self._bucket_range(service_date)
+        trips = Trip.objects.filter(planned_departure__gte=start, planned_departure__lt=end).order_by()
+        states = [(row[0], row[1:]) for row in trips.values_list('id', *self.STATE_FIELDS)]
+        incidents = dict(
+            Incident.objects.filter(trip__in=trips).order_by()
+            .values_list('trip_id').annotate(count=Count('id'))
+        )
+        buckets = self._aggregate(states, incidents)
+
+        now = timezone.now()
+        rows = [
+            RouteKPIRollup(
+                route_id=route_id, schedule_id=schedule_id, service_date=day, hour=hour,
+                reconciled_at=now, **counters
+            )
+            for (route_id, schedule_id, day, hour), counters in buckets.items()
+        ]
+        with transaction.atomic():
+            RouteKPIRollup.objects.filter(service_date=service_date).delete()
+            RouteKPIRollup.objects.bulk_create(rows, batch_size=500)
+
+        self.log_info(f"KPI rollups reconciled for {service_date}: {len(rows)} buckets")
+        return len(rows)
+
+    def reconcile_recent(self):
+        today = timezone.localdate()
+        return sum(self.reconcile(today - timedelta(days=offset)) for offset in range(self.RECONCILE_DAYS))
+
+    # ------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------
+
+    def summary(self, date_from, date_to, route_id=None, schedule_id=None, group_by=None):
+        """
+        KPI sur une période en une requête, éventuellement regroupés par
+        'day', 'hour', 'route' ou 'schedule'.
+        """
+        rollups = RouteKPIRollup.objects.filter(service_date__range=(date_from, date_to)).order_by()
+        if route_id:
+            rollups = rollups.filter(route_id=route_id)
+        if schedule_id:
+            rollups = rollups.filter(schedule_id=schedule_id)
+
+        totals = {name: Sum(name) for name in self.COUNTERS}
+        totals['max_delay_seconds'] = Max('max_delay_seconds')
+
+        if group_by is None:
+            return self._rates(rollups.aggregate(**totals))
+        field = self.GROUP_FIELDS[group_by]
+        rows = rollups.values(field).annotate(**totals).order_by(field)
+        return [{group_by: row[field], **self._rates(row)} for row in rows]
+
+    def _rates(self, row):
+        counters = {name: row.get(name) or 0 for name in self.COUNTERS + ('max_delay_seconds',)}
+        trips = counters['trip_count']
+        samples = counters['delay_sample_count']
+        counters.update({
+            'completion_rate': counters['completed_count'] / trips * 100 if trips else 0,
+            'cancellation_rate': counters['cancelled_count'] / trips * 100 if trips else 0,
+            'on_time_rate': counters['on_time_count'] / samples * 100 if samples else 0,
+            'average_delay_seconds': counters['total_delay_seconds'] / samples if samples else 0,
+        })
+        return counters
+
+
+kpi_rollups = KPIRollupService()
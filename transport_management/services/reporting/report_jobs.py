@@ -0,0 +1,232 @@
+# transport_management/services/reporting/report_jobs.py
+
+import gzip
+import hashlib
+import json
+import os
+from datetime import date, timedelta
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from ...models import ReportJob
+from ..base.service_base import ServiceBase
+from .reporting_service import ReportingService
+
+
+class ReportJSONEncoder(DjangoJSONEncoder):
+    """Sérialise aussi les scalaires et tableaux NumPy produits par les analyses"""
+
+    def default(self, o):
+        if isinstance(o, np.generic):
+            return o.item()
+        if isinstance(o, np.ndarray):
+            return o.tolist()
+        return super().default(o)
+
+
+class ReportJobService(ServiceBase):
+    """
+    Rapports calculés par un worker et stockés en JSON compressé (gzip) sur disque.
+    Une demande est identifiée par le hash de ses paramètres normalisés : tant qu'un job
+    identique est en cours il est partagé, puis son fichier est servi jusqu'à expiration
+    (index hash -> job en cache). Seuls le statut et le chemin du fichier transitent par
+    la base ; le résultat ne passe plus par le backend de résultats Celery.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.PARAMS = {
+            'trip_analysis': ('trip_id', 'date_from', 'date_to'),
+            'kpi': ('date_from', 'date_to', 'route_id'),
+        }
+        self.IN_FLIGHT = ('pending', 'running')
+        self.CLOSED_PERIOD_TTL = timedelta(days=30)  # Période révolue : le résultat ne bouge plus
+        self.OPEN_PERIOD_TTL = timedelta(minutes=15)  # Période incluant aujourd'hui
+        self.FAILED_RETENTION = timedelta(days=1)
+        self.STALE_AFTER = timedelta(hours=1)  # Job jamais pris (tâche perdue) ou abandonné par un worker
+        self.INDEX_KEY = 'report_artifact_{}'
+
+    @property
+    def storage(self):
+        return FileSystemStorage(location=settings.REPORT_ARTIFACT_ROOT)
+
+    # ------------------------------------------------------------------
+    # Demandes
+    # ------------------------------------------------------------------
+
+    def normalize_params(self, report_type, params):
+        """Paramètres connus sous forme canonique (dates ISO, identifiants entiers) ; ValueError sinon"""
+        if report_type not in self.PARAMS:
+            raise ValueError(f"Unknown report type: {report_type}")
+        normalized = {}
+        for name in self.PARAMS[report_type]:
+            value = params.get(name)
+            if value in (None, ''):
+                continue
+            if name.startswith('date_'):
+                normalized[name] = (value if isinstance(value, date) else date.fromisoformat(str(value))).isoformat()
+            else:
+                normalized[name] = int(value)
+
+        # Les dates par défaut sont figées dans les paramètres : le hash désigne une période précise
+        if 'trip_id' not in normalized:
+            today = timezone.localdate().isoformat()
+            normalized.setdefault('date_from', today)
+            normalized.setdefault('date_to', today)
+            if normalized['date_from'] > normalized['date_to']:
+                raise ValueError("date_from must not be after date_to")
+        return normalized
+
+    def params_hash(self, report_type, params):
+        canonical = json.dumps({'report_type': report_type, 'params': params}, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def request(self, report_type, params, user=None):
+        """
+        Retourne (job, créé) : le job dont le fichier est encore valide, le job identique
+        en cours, ou un nouveau job mis en file après la transaction.
+        """
+        params = self.normalize_params(report_type, params)
+        params_hash = self.params_hash(report_type, params)
+
+        job = self.find(params_hash)
+        if job is not None:
+            ReportJob.objects.filter(pk=job.pk).update(hit_count=F('hit_count') + 1)
+            return job, False
+
+        try:
+            with transaction.atomic():
+                job = ReportJob.objects.create(
+                    report_type=report_type, params=params, params_hash=params_hash,
+                    in_flight_hash=params_hash, requested_by=user
+                )
+        except IntegrityError:
+            # Demande identique enregistrée en parallèle (terminée entre-temps : nouvelle recherche)
+            job = ReportJob.objects.filter(in_flight_hash=params_hash).first()
+            if job is None:
+                return self.request(report_type, params, user)
+            return job, False
+
+        transaction.on_commit(lambda: self.enqueue(job))
+        return job, True
+
+    def find(self, params_hash):
+        """Job réutilisable pour ce hash : artefact indexé en cache, sinon recherche en base"""
+        index_key = self.INDEX_KEY.format(params_hash)
+        job_id = cache.get(index_key)
+        if job_id:
+            job = ReportJob.objects.filter(job_id=job_id).first()
+            if job is not None and job.is_available and self.storage.exists(job.file_path):
+                return job
+            cache.delete(index_key)
+
+        job = ReportJob.objects.filter(params_hash=params_hash).filter(
+            Q(status__in=self.IN_FLIGHT) | Q(status='completed', expires_at__gt=timezone.now())
+        ).order_by('-created_at').first()
+        if job is not None and job.status == 'completed' and not self.storage.exists(job.file_path):
+            return None
+        return job
+
+    def enqueue(self, job):
+        from ...tasks import run_report_job
+        run_report_job.delay(job.pk)
+
+    # ------------------------------------------------------------------
+    # Exécution
+    # ------------------------------------------------------------------
+
+    def run(self, job_pk):
+        """Calcule le rapport et écrit son fichier ; ignore un job déjà pris ou terminé"""
+        claimed = ReportJob.objects.filter(pk=job_pk, status='pending').update(
+            status='running', started_at=timezone.now()
+        )
+        if not claimed:
+            return None
+        job = ReportJob.objects.get(pk=job_pk)
+
+        try:
+            result = self.generate(job.report_type, job.params)
+            if result is None:
+                raise RuntimeError("Report generation returned no result")
+            job.file_path, job.file_size = self.write_artifact(job, result)
+        except Exception as e:
+            self.log_error(f"Report job {job.job_id} failed: {str(e)}", exc=e)
+            job.status = 'failed'
+            job.in_flight_hash = None
+            job.error_message = str(e)
+            job.completed_at = timezone.now()
+            job.save(update_fields=['status', 'in_flight_hash', 'error_message', 'completed_at'])
+            return job
+
+        ttl = self.artifact_ttl(job.params)
+        job.status = 'completed'
+        job.in_flight_hash = None
+        job.completed_at = timezone.now()
+        job.expires_at = job.completed_at + ttl
+        job.save(update_fields=['status', 'in_flight_hash', 'file_path', 'file_size', 'completed_at', 'expires_at'])
+        cache.set(self.INDEX_KEY.format(job.params_hash), str(job.job_id), timeout=int(ttl.total_seconds()))
+
+        self.log_info(f"Report job {job.job_id} completed ({job.file_size} bytes)")
+        return job
+
+    def generate(self, report_type, params):
+        service = ReportingService()
+        date_from = date.fromisoformat(params['date_from']) if params.get('date_from') else None
+        date_to = date.fromisoformat(params['date_to']) if params.get('date_to') else None
+        if report_type == 'trip_analysis':
+            return service.generate_trip_analysis(trip_id=params.get('trip_id'), date_from=date_from, date_to=date_to)
+        return service.generate_kpi_report(date_from, date_to, route_id=params.get('route_id'))
+
+    def artifact_ttl(self, params):
+        date_to = params.get('date_to')
+        if date_to and 'trip_id' not in params and date.fromisoformat(date_to) < timezone.localdate():
+            return self.CLOSED_PERIOD_TTL
+        return self.OPEN_PERIOD_TTL
+
+    def write_artifact(self, job, result):
+        """Écrit le résultat en JSON gzip (fichier temporaire puis renommage) ; retourne (nom, taille)"""
+        name = f"{job.report_type}/{job.params_hash[:2]}/{job.params_hash}-{job.job_id.hex[:8]}.json.gz"
+        path = self.storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.tmp"
+        with gzip.open(temporary, 'wt', encoding='utf-8') as artifact:
+            json.dump(result, artifact, cls=ReportJSONEncoder, separators=(',', ':'))
+        os.replace(temporary, path)
+        return name, os.path.getsize(path)
+
+    def open_artifact(self, job):
+        """Fichier gzip du job (ouvert en binaire)"""
+        return self.storage.open(job.file_path, 'rb')
+
+    # ------------------------------------------------------------------
+    # Nettoyage
+    # ------------------------------------------------------------------
+
+    def purge(self):
+        """Supprime les artefacts expirés, les échecs anciens et libère les jobs perdus ou abandonnés"""
+        now = timezone.now()
+        ReportJob.objects.filter(status='pending', created_at__lt=now - self.STALE_AFTER).update(
+            status='failed', in_flight_hash=None, error_message="Job jamais pris par un worker", completed_at=now
+        )
+        ReportJob.objects.filter(status='running', started_at__lt=now - self.STALE_AFTER).update(
+            status='failed', in_flight_hash=None, error_message='Job abandonné par le worker', completed_at=now
+        )
+        expired = ReportJob.objects.filter(
+            Q(status='completed', expires_at__lte=now)
+            | Q(status='failed', completed_at__lt=now - self.FAILED_RETENTION)
+        )
+        storage = self.storage
+        for file_path in expired.exclude(file_path='').values_list('file_path', flat=True):
+            storage.delete(file_path)
+        deleted, _ = expired.delete()
+        if deleted:
+            self.log_info(f"{deleted} report jobs purged")
+        return deleted
+
+
+report_jobs = ReportJobService()
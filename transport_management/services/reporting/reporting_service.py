@@ -1,17 +1,33 @@
 # transport_management/services/reporting/reporting_service.py
 
-from django.db import transaction
+from datetime import datetime, timezone as dt_timezone
+import numpy as np
+import pandas as pd
 from django.utils import timezone
-from datetime import datetime, timedelta
-from django.db.models import Avg, Count, Sum, F, Q, ExpressionWrapper, fields
-from ...models import Trip, BusPosition, EventLog, Stop, Route
+from django.db.models import Count, Sum, Max
+from ...models import Trip, BusPosition, EventLog, Stop, Incident, TripTrackSummary
 from ..base.service_base import ServiceBase
+from ..timetable.stop_times import load_route_patterns
+from .kpi_rollup import kpi_rollups
+from ..trip_scheduler.deadhead import distance_to_polyline_meters, load_route_lines
+
 
 class ReportingService(ServiceBase):
+    """
+    Analyse des trajets en colonnes : trips, événements d'arrêt, positions et incidents
+    sont chargés en quelques requêtes (values_list), regroupés par trip avec pandas et
+    chaque section est calculée de façon vectorisée ; seule la mise en forme des détails
+    parcourt les trips.
+    """
+
     def __init__(self):
         super().__init__()
         self.PUNCTUALITY_THRESHOLD = 300  # 5 minutes
         self.ROUTE_CONFORMITY_THRESHOLD = 100  # 100 mètres
+        self.MAJOR_DEVIATION_THRESHOLD = 500  # mètres
+        self.TRACKING_GAP_SECONDS = 60  # Trou de plus d'une minute
+        self.EXPECTED_POSITION_INTERVAL = 30  # secondes
+        self.DELAY_CATEGORIES = ['on_time', 'slightly_late', 'late', 'very_late']
 
     def generate_trip_analysis(self, trip_id=None, date_from=None, date_to=None):
         """Génère une analyse complète des trajets"""
@@ -21,57 +37,188 @@ class ReportingService(ServiceBase):
                 trips = Trip.objects.filter(id=trip_id)
             else:
                 trips = Trip.objects.filter(
-                    created_at__range=(date_from or timezone.now().date(), 
-                                     date_to or timezone.now().date())
+                    created_at__range=(date_from or timezone.now().date(),
+                                       date_to or timezone.now().date())
                 )
 
-            analysis = {
-                'punctuality': self._analyze_punctuality(trips),
-                'route_conformity': self._analyze_route_conformity(trips),
-                'service_quality': self._analyze_service_quality(trips),
-                'position_history': self._analyze_position_history(trips),
-                'summary': self._generate_summary(trips),
+            data = self._load_trips(trips)
+            positions = self._load_positions(trips, data)
+            stop_events = self._load_stop_events(trips, data)
+
+            punctuality = self._analyze_punctuality(data, stop_events)
+            route_conformity = self._analyze_route_conformity(data, positions)
+            service_quality = self._analyze_service_quality(trips, data, positions, stop_events)
+            position_history = self._analyze_position_history(data, positions)
+
+            return {
+                'punctuality': punctuality,
+                'route_conformity': route_conformity,
+                'service_quality': service_quality,
+                'position_history': position_history,
+                'summary': self._generate_summary(data, route_conformity, position_history),
                 'generated_at': timezone.now().isoformat()
             }
 
-            return analysis
-
         except Exception as e:
             self.log_error(f"Error generating trip analysis: {str(e)}", exc=e)
             return None
 
-    def _analyze_punctuality(self, trips):
-        """Analyse la ponctualité des trajets"""
+    def generate_kpi_report(self, date_from, date_to, route_id=None):
+        """KPI d'exploitation d'une période, lus dans les agrégats et les synthèses de trace (quatre requêtes)"""
         try:
-            punctuality_stats = {
-                'on_time': 0,
-                'slightly_late': 0,
-                'late': 0,
-                'very_late': 0,
-                'details': []
+            return {
+                'totals': kpi_rollups.summary(date_from, date_to, route_id=route_id),
+                'by_day': kpi_rollups.summary(date_from, date_to, route_id=route_id, group_by='day'),
+                'by_route': kpi_rollups.summary(date_from, date_to, route_id=route_id, group_by='route'),
+                'tracking': self._tracking_totals(date_from, date_to, route_id),
+                'generated_at': timezone.now().isoformat()
             }
+        except Exception as e:
+            self.log_error(f"Error generating KPI report: {str(e)}", exc=e)
+            return None
 
-            for trip in trips:
-                delay = self._calculate_trip_delay(trip)
-                stats = self._classify_delay(delay)
-                punctuality_stats[stats['category']] += 1
-
+    def _tracking_totals(self, date_from, date_to, route_id=None):
+        summaries = TripTrackSummary.objects.filter(
+            trip__planned_departure__date__range=(date_from, date_to)
+        )
+        if route_id:
+            summaries = summaries.filter(trip__route_id=route_id)
+        totals = summaries.aggregate(
+            trips=Count('id'),
+            distance_km=Sum('distance_km'),
+            moving_seconds=Sum('moving_seconds'),
+            stopped_seconds=Sum('stopped_seconds'),
+            dwell_seconds=Sum('total_dwell_seconds'),
+            tracking_gaps=Sum('gap_count'),
+            max_speed=Max('max_speed')
+        )
+        return {name: value or 0 for name, value in totals.items()}
+
+    # ------------------------------------------------------------------
+    # Chargement en colonnes
+    # ------------------------------------------------------------------
+
+    def _load_trips(self, trips):
+        rows = list(trips.order_by('id').values_list(
+            'id', 'route_id', 'status', 'planned_departure', 'actual_start_time', 'actual_end_time', 'created_at'
+        ))
+        ids, route_ids, statuses, planned, started, ended, created = zip(*rows) if rows else ([],) * 7
+        return {
+            'ids': np.asarray(ids, dtype=np.int64),
+            'route_ids': np.asarray(route_ids, dtype=np.int64),
+            'statuses': np.asarray(statuses, dtype=object),
+            'planned': list(planned),
+            'started': list(started),
+            'ended': list(ended),
+            'created': list(created),
+            'planned_ts': self._epoch(planned),
+            'started_ts': self._epoch(started),
+            'ended_ts': self._epoch(ended),
+        }
+
+    def _load_positions(self, trips, data):
+        """Positions des trips triées par trip puis horodatage, avec l'index du trip"""
+        rows = list(BusPosition.objects.filter(trip__in=trips).order_by('trip_id', 'timestamp').values_list(
+            'trip_id', 'timestamp', 'is_valid', 'latitude', 'longitude', 'speed'
+        ))
+        frame = pd.DataFrame(rows, columns=['trip_id', 'timestamp', 'is_valid', 'latitude', 'longitude', 'speed'])
+        frame['trip'] = np.searchsorted(data['ids'], frame['trip_id'].to_numpy(dtype=np.int64))
+        frame['ts'] = self._epoch(frame['timestamp'])
+        for column in ('latitude', 'longitude', 'speed'):
+            frame[column] = frame[column].astype(float)
+        frame['is_valid'] = frame['is_valid'].astype(bool)
+        return frame
+
+    def _load_stop_events(self, trips, data):
+        """Arrivées aux arrêts (arrêt dans event_data) avec l'heure prévue issue de la séquence de la route"""
+        rows = list(EventLog.objects.filter(
+            trip__in=trips,
+            event_type='stop_arrival'
+        ).order_by('trip_id', 'timestamp').values_list('trip_id', 'timestamp', 'event_data'))
+        frame = pd.DataFrame(
+            [(trip_id, timestamp, (event_data or {}).get('stop_id')) for trip_id, timestamp, event_data in rows],
+            columns=['trip_id', 'timestamp', 'stop_id']
+        )
+        frame = frame.dropna(subset=['stop_id'])
+        frame['stop_id'] = frame['stop_id'].astype(np.int64)
+        frame['trip'] = np.searchsorted(data['ids'], frame['trip_id'].to_numpy(dtype=np.int64))
+        frame['route_id'] = data['route_ids'][frame['trip'].to_numpy()]
+
+        # Décalage prévu de chaque arrêt depuis le départ du trip (premier passage)
+        patterns = load_route_patterns(set(frame['route_id']))
+        offsets = pd.DataFrame(
+            [(route_id, stop['stop_id'], stop['arrival_offset'])
+             for route_id, stops in patterns.items() for stop in stops],
+            columns=['route_id', 'stop_id', 'offset']
+        ).drop_duplicates(['route_id', 'stop_id'])
+        frame = frame.merge(offsets, on=['route_id', 'stop_id'], how='inner').sort_values(['trip', 'timestamp'])
+
+        frame['ts'] = self._epoch(frame['timestamp'])
+        frame['scheduled_ts'] = data['planned_ts'][frame['trip'].to_numpy()] + frame['offset'].to_numpy(dtype=float)
+        frame['delay'] = frame['ts'] - frame['scheduled_ts']
+        frame['category'] = self._categories(frame['delay'].to_numpy())
+        names = dict(Stop.objects.filter(id__in=set(frame['stop_id'])).values_list('id', 'name'))
+        frame['stop_name'] = frame['stop_id'].map(names)
+        return frame
+
+    def _epoch(self, values):
+        """Horodatages en secondes (NaN pour les valeurs absentes)"""
+        return np.asarray([value.timestamp() if value is not None else np.nan for value in values], dtype=float)
+
+    def _categories(self, delays):
+        threshold = self.PUNCTUALITY_THRESHOLD
+        return np.select(
+            [delays <= threshold, delays <= threshold * 2, delays <= threshold * 4],
+            self.DELAY_CATEGORIES[:3],
+            default=self.DELAY_CATEGORIES[3]
+        )
+
+    def _groups(self, frame, count):
+        """Bornes [début, fin) des lignes de chaque trip dans un tableau trié par trip"""
+        trips = frame['trip'].to_numpy() if len(frame) else np.empty(0, dtype=np.int64)
+        starts = np.searchsorted(trips, np.arange(count), side='left')
+        ends = np.searchsorted(trips, np.arange(count), side='right')
+        return starts, ends
+
+    # ------------------------------------------------------------------
+    # Sections
+    # ------------------------------------------------------------------
+
+    def _analyze_punctuality(self, data, stop_events):
+        """Analyse la ponctualité des trajets"""
+        try:
+            delays = self._trip_delays(data)
+            categories = self._categories(delays)
+            punctuality_stats = {category: int((categories == category).sum()) for category in self.DELAY_CATEGORIES}
+            punctuality_stats['details'] = []
+
+            starts, ends = self._groups(stop_events, len(data['ids']))
+            records = stop_events.to_dict('records')
+            for index, trip_id in enumerate(data['ids']):
+                started = data['started'][index]
                 punctuality_stats['details'].append({
-                    'trip_id': trip.id,
-                    'planned_departure': trip.planned_departure.isoformat(),
-                    'actual_departure': trip.actual_start_time.isoformat() if trip.actual_start_time else None,
-                    'delay_minutes': delay // 60,
-                    'status': stats['category'],
-                    'stops_punctuality': self._analyze_stop_punctuality(trip)
+                    'trip_id': int(trip_id),
+                    'planned_departure': data['planned'][index].isoformat(),
+                    'actual_departure': started.isoformat() if started else None,
+                    'delay_minutes': float(delays[index] // 60),
+                    'status': str(categories[index]),
+                    'stops_punctuality': [
+                        {
+                            'stop_id': int(event['stop_id']),
+                            'stop_name': event['stop_name'],
+                            'scheduled_time': datetime.fromtimestamp(event['scheduled_ts'], tz=dt_timezone.utc).isoformat(),
+                            'actual_time': event['timestamp'].isoformat(),
+                            'delay_seconds': float(event['delay']),
+                            'status': str(event['category'])
+                        }
+                        for event in records[starts[index]:ends[index]]
+                    ]
                 })
 
-            total_trips = len(trips)
+            total_trips = len(data['ids'])
             if total_trips > 0:
                 punctuality_stats['percentages'] = {
-                    'on_time': (punctuality_stats['on_time'] / total_trips) * 100,
-                    'slightly_late': (punctuality_stats['slightly_late'] / total_trips) * 100,
-                    'late': (punctuality_stats['late'] / total_trips) * 100,
-                    'very_late': (punctuality_stats['very_late'] / total_trips) * 100
+                    category: (punctuality_stats[category] / total_trips) * 100 for category in self.DELAY_CATEGORIES
                 }
 
             return punctuality_stats
@@ -80,7 +227,12 @@ class ReportingService(ServiceBase):
             self.log_error(f"Error analyzing punctuality: {str(e)}", exc=e)
             return None
 
-    def _analyze_route_conformity(self, trips):
+    def _trip_delays(self, data):
+        """Retard au départ de chaque trip en secondes (0 si non démarré ou en avance)"""
+        delays = data['started_ts'] - data['planned_ts']
+        return np.where(np.isnan(delays), 0, np.maximum(delays, 0))
+
+    def _analyze_route_conformity(self, data, positions):
         """Analyse la conformité à l'itinéraire"""
         try:
             conformity_stats = {
@@ -90,18 +242,29 @@ class ReportingService(ServiceBase):
                 'details': []
             }
 
-            for trip in trips:
-                deviations = self._calculate_route_deviations(trip)
-                stats = self._classify_deviations(deviations)
-                conformity_stats[stats['category']] += 1
+            deviating = self._route_deviations(data, positions)
+            starts, ends = self._groups(deviating, len(data['ids']))
+            distances = deviating['deviation'].to_numpy() if len(deviating) else np.empty(0)
+            records = deviating.to_dict('records')
 
+            for index, trip_id in enumerate(data['ids']):
+                trip_distances = distances[starts[index]:ends[index]]
+                stats = self._classify_deviations(trip_distances)
+                conformity_stats[stats['category']] += 1
                 conformity_stats['details'].append({
-                    'trip_id': trip.id,
-                    'total_deviations': len(deviations),
+                    'trip_id': int(trip_id),
+                    'total_deviations': len(trip_distances),
                     'max_deviation': stats['max_deviation'],
                     'avg_deviation': stats['avg_deviation'],
                     'status': stats['category'],
-                    'deviation_points': deviations
+                    'deviation_points': [
+                        {
+                            'timestamp': point['timestamp'].isoformat(),
+                            'position': {'lat': point['latitude'], 'lon': point['longitude']},
+                            'deviation_meters': float(point['deviation'])
+                        }
+                        for point in records[starts[index]:ends[index]]
+                    ]
                 })
 
             return conformity_stats
@@ -110,40 +273,76 @@ class ReportingService(ServiceBase):
             self.log_error(f"Error analyzing route conformity: {str(e)}", exc=e)
             return None
 
-    def _analyze_service_quality(self, trips):
+    def _route_deviations(self, data, positions):
+        """Positions valides à plus de ROUTE_CONFORMITY_THRESHOLD du tracé de leur route"""
+        valid = positions[positions['is_valid']].copy()
+        valid['route_id'] = data['route_ids'][valid['trip'].to_numpy()] if len(valid) else []
+        valid['deviation'] = 0.0
+        for route_id, line in load_route_lines(set(valid['route_id'])).items():
+            mask = (valid['route_id'] == route_id).to_numpy()
+            valid.loc[mask, 'deviation'] = distance_to_polyline_meters(
+                valid['latitude'].to_numpy()[mask], valid['longitude'].to_numpy()[mask], line
+            )
+        return valid[valid['deviation'] > self.ROUTE_CONFORMITY_THRESHOLD]
+
+    def _classify_deviations(self, distances):
+        """Classe un trip selon ses points hors tracé"""
+        if not len(distances):
+            return {'category': 'compliant', 'max_deviation': 0, 'avg_deviation': 0}
+        max_deviation = float(distances.max())
+        return {
+            'category': 'major_deviations' if max_deviation > self.MAJOR_DEVIATION_THRESHOLD else 'minor_deviations',
+            'max_deviation': max_deviation,
+            'avg_deviation': float(distances.mean())
+        }
+
+    def _analyze_service_quality(self, trips, data, positions, stop_events):
         """Analyse la qualité du service"""
         try:
+            count = len(data['ids'])
+            statuses = data['statuses']
+            incidents = dict(
+                Incident.objects.filter(trip__in=trips).order_by().values('trip_id').annotate(total=Count('id'))
+                .values_list('trip_id', 'total')
+            )
+            incident_counts = np.asarray([incidents.get(int(trip_id), 0) for trip_id in data['ids']], dtype=np.int64)
+
+            valid = positions[positions['is_valid']]
+            speed = valid.groupby('trip')['speed'].mean().reindex(range(count)).to_numpy()
+            position_counts = positions.groupby('trip').size().reindex(range(count), fill_value=0).to_numpy()
+            on_time = stop_events.assign(on_time=stop_events['category'] == 'on_time').groupby('trip')['on_time']
+            stop_accuracy = (on_time.mean() * 100).reindex(range(count)).to_numpy()
+            stop_arrivals = on_time.size().reindex(range(count), fill_value=0).to_numpy()
+            durations = (data['ended_ts'] - data['started_ts']) / 60
+
             quality_stats = {
-                'completed_trips': 0,
-                'cancelled_trips': 0,
-                'interrupted_trips': 0,
-                'incidents': 0,
-                'avg_speed': 0,
-                'stop_accuracy': 0,
+                'completed_trips': int((statuses == 'completed').sum()),
+                'cancelled_trips': int((statuses == 'cancelled').sum()),
+                'interrupted_trips': int((statuses == 'interrupted').sum()),
+                'incidents': int(incident_counts.sum()),
+                'avg_speed': float(np.nanmean(speed)) if np.isfinite(speed).any() else 0,
+                'stop_accuracy': float(np.nanmean(stop_accuracy)) if np.isfinite(stop_accuracy).any() else 0,
                 'details': []
             }
 
-            for trip in trips:
-                stats = self._calculate_service_metrics(trip)
-                quality_stats['completed_trips'] += 1 if trip.status == 'completed' else 0
-                quality_stats['cancelled_trips'] += 1 if trip.status == 'cancelled' else 0
-                quality_stats['interrupted_trips'] += 1 if trip.status == 'interrupted' else 0
-                quality_stats['incidents'] += stats['incident_count']
-                
+            for index, trip_id in enumerate(data['ids']):
                 quality_stats['details'].append({
-                    'trip_id': trip.id,
-                    'status': trip.status,
-                    'incident_count': stats['incident_count'],
-                    'avg_speed': stats['avg_speed'],
-                    'stop_accuracy': stats['stop_accuracy'],
-                    'service_metrics': stats['metrics']
+                    'trip_id': int(trip_id),
+                    'status': statuses[index],
+                    'incident_count': int(incident_counts[index]),
+                    'avg_speed': float(speed[index]) if np.isfinite(speed[index]) else 0,
+                    'stop_accuracy': float(stop_accuracy[index]) if np.isfinite(stop_accuracy[index]) else 0,
+                    'service_metrics': {
+                        'duration_minutes': float(durations[index]) if np.isfinite(durations[index]) else None,
+                        'position_count': int(position_counts[index]),
+                        'stop_arrivals': int(stop_arrivals[index])
+                    }
                 })
 
-            total_trips = len(trips)
-            if total_trips > 0:
-                quality_stats['completion_rate'] = (quality_stats['completed_trips'] / total_trips) * 100
-                quality_stats['cancellation_rate'] = (quality_stats['cancelled_trips'] / total_trips) * 100
-                quality_stats['interruption_rate'] = (quality_stats['interrupted_trips'] / total_trips) * 100
+            if count > 0:
+                quality_stats['completion_rate'] = (quality_stats['completed_trips'] / count) * 100
+                quality_stats['cancellation_rate'] = (quality_stats['cancelled_trips'] / count) * 100
+                quality_stats['interruption_rate'] = (quality_stats['interrupted_trips'] / count) * 100
 
             return quality_stats
 
@@ -151,30 +350,48 @@ class ReportingService(ServiceBase):
             self.log_error(f"Error analyzing service quality: {str(e)}", exc=e)
             return None
 
-    def _analyze_position_history(self, trips):
+    def _analyze_position_history(self, data, positions):
         """Analyse l'historique des positions"""
         try:
+            count = len(data['ids'])
+            totals = positions.groupby('trip').size().reindex(range(count), fill_value=0).to_numpy()
+            valid_counts = positions.groupby('trip')['is_valid'].sum().reindex(range(count), fill_value=0).to_numpy()
+
+            # Trous de suivi : écart entre deux positions consécutives d'un même trip
+            trips = positions['trip'].to_numpy()
+            timestamps = positions['ts'].to_numpy()
+            gap_seconds = np.diff(timestamps)
+            gap_rows = np.flatnonzero((trips[1:] == trips[:-1]) & (gap_seconds > self.TRACKING_GAP_SECONDS))
+            gap_counts = np.bincount(trips[1:][gap_rows], minlength=count) if count else np.empty(0, dtype=np.int64)
+            gap_starts = np.searchsorted(trips[1:][gap_rows], np.arange(count), side='left')
+            gap_ends = np.searchsorted(trips[1:][gap_rows], np.arange(count), side='right')
+            moments = positions['timestamp'].tolist()
+
+            coverage = self._coverage(data, valid_counts)
+            qualities = self._tracking_qualities(coverage)
+
             position_stats = {
-                'total_positions': 0,
-                'valid_positions': 0,
-                'invalid_positions': 0,
-                'tracking_gaps': 0,
+                'total_positions': int(totals.sum()),
+                'valid_positions': int(valid_counts.sum()),
+                'invalid_positions': int((totals - valid_counts).sum()),
+                'tracking_gaps': int(gap_counts.sum()),
                 'details': []
             }
 
-            for trip in trips:
-                stats = self._analyze_trip_positions(trip)
-                position_stats['total_positions'] += stats['total_positions']
-                position_stats['valid_positions'] += stats['valid_positions']
-                position_stats['invalid_positions'] += stats['invalid_positions']
-                position_stats['tracking_gaps'] += stats['tracking_gaps']
-
+            for index, trip_id in enumerate(data['ids']):
                 position_stats['details'].append({
-                    'trip_id': trip.id,
-                    'position_count': stats['total_positions'],
-                    'tracking_quality': stats['tracking_quality'],
-                    'gaps': stats['gap_details'],
-                    'coverage': stats['coverage_percentage']
+                    'trip_id': int(trip_id),
+                    'position_count': int(totals[index]),
+                    'tracking_quality': str(qualities[index]),
+                    'gaps': [
+                        {
+                            'start': moments[row].isoformat(),
+                            'end': moments[row + 1].isoformat(),
+                            'duration_seconds': float(gap_seconds[row])
+                        }
+                        for row in gap_rows[gap_starts[index]:gap_ends[index]]
+                    ],
+                    'coverage': float(coverage[index])
                 })
 
             return position_stats
@@ -183,163 +400,44 @@ class ReportingService(ServiceBase):
             self.log_error(f"Error analyzing position history: {str(e)}", exc=e)
             return None
 
-    def _calculate_trip_delay(self, trip):
-        """Calcule le retard d'un trip en secondes"""
-        try:
-            if not trip.actual_start_time:
-                return 0
-
-            delay = (trip.actual_start_time - trip.planned_departure).total_seconds()
-            return max(0, delay)
-
-        except Exception as e:
-            self.log_error(f"Error calculating trip delay: {str(e)}", exc=e)
-            return 0
-
-    def _classify_delay(self, delay_seconds):
-        """Classifie le retard"""
-        if delay_seconds <= self.PUNCTUALITY_THRESHOLD:
-            return {'category': 'on_time', 'description': 'À l\'heure'}
-        elif delay_seconds <= self.PUNCTUALITY_THRESHOLD * 2:
-            return {'category': 'slightly_late', 'description': 'Légèrement en retard'}
-        elif delay_seconds <= self.PUNCTUALITY_THRESHOLD * 4:
-            return {'category': 'late', 'description': 'En retard'}
-        else:
-            return {'category': 'very_late', 'description': 'Très en retard'}
-
-    def _analyze_stop_punctuality(self, trip):
-        """Analyse la ponctualité aux arrêts"""
-        try:
-            stop_events = EventLog.objects.filter(
-                trip=trip,
-                event_type='stop_arrival'
-            ).order_by('timestamp')
-
-            stop_stats = []
-            for event in stop_events:
-                scheduled_time = self._get_scheduled_stop_time(trip, event.stop)
-                if scheduled_time:
-                    delay = (event.timestamp - scheduled_time).total_seconds()
-                    stop_stats.append({
-                        'stop_id': event.stop.id,
-                        'stop_name': event.stop.name,
-                        'scheduled_time': scheduled_time.isoformat(),
-                        'actual_time': event.timestamp.isoformat(),
-                        'delay_seconds': delay,
-                        'status': self._classify_delay(delay)['category']
-                    })
-
-            return stop_stats
-
-        except Exception as e:
-            self.log_error(f"Error analyzing stop punctuality: {str(e)}", exc=e)
-            return []
-
-    def _calculate_route_deviations(self, trip):
-        """Calcule les déviations de l'itinéraire"""
-        try:
-            positions = BusPosition.objects.filter(
-                trip=trip,
-                is_valid=True
-            ).order_by('timestamp')
-
-            deviations = []
-            for pos in positions:
-                deviation = self._calculate_position_deviation(pos, trip.route)
-                if deviation > self.ROUTE_CONFORMITY_THRESHOLD:
-                    deviations.append({
-                        'timestamp': pos.timestamp.isoformat(),
-                        'position': {
-                            'lat': pos.latitude,
-                            'lon': pos.longitude
-                        },
-                        'deviation_meters': deviation
-                    })
-
-            return deviations
-
-        except Exception as e:
-            self.log_error(f"Error calculating route deviations: {str(e)}", exc=e)
-            return []
-
-    def _analyze_trip_positions(self, trip):
-        """Analyse les positions d'un trip"""
+    def _coverage(self, data, valid_counts):
+        """Positions valides rapportées aux positions attendues (une toutes les 30 s), en %"""
+        expected = (data['ended_ts'] - data['started_ts']) / self.EXPECTED_POSITION_INTERVAL
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coverage = valid_counts / expected * 100
+        return np.where(np.isfinite(coverage) & (expected > 0), coverage, 0)
+
+    def _tracking_qualities(self, coverage):
+        return np.select(
+            [coverage >= 90, coverage >= 75, coverage >= 50],
+            ['excellent', 'good', 'fair'],
+            default='poor'
+        )
+
+    def _generate_summary(self, data, route_conformity, position_history):
+        """Génère un résumé des analyses à partir des colonnes déjà calculées"""
         try:
-            positions = BusPosition.objects.filter(
-                trip=trip
-            ).order_by('timestamp')
-
-            stats = {
-                'total_positions': positions.count(),
-                'valid_positions': positions.filter(is_valid=True).count(),
-                'invalid_positions': positions.filter(is_valid=False).count(),
-                'tracking_gaps': 0,
-                'gap_details': [],
-                'tracking_quality': 'good',
-                'coverage_percentage': 0
-            }
-
-            # Détecter les trous dans le tracking
-            last_timestamp = None
-            for pos in positions:
-                if last_timestamp:
-                    gap = (pos.timestamp - last_timestamp).total_seconds()
-                    if gap > 60:  # Trou de plus d'une minute
-                        stats['tracking_gaps'] += 1
-                        stats['gap_details'].append({
-                            'start': last_timestamp.isoformat(),
-                            'end': pos.timestamp.isoformat(),
-                            'duration_seconds': gap
-                        })
-                last_timestamp = pos.timestamp
-
-            # Calculer le pourcentage de couverture
-            if trip.actual_end_time and trip.actual_start_time:
-                expected_positions = (trip.actual_end_time - trip.actual_start_time).total_seconds() / 30
-                stats['coverage_percentage'] = (stats['valid_positions'] / expected_positions) * 100
-
-            # Évaluer la qualité du tracking
-            if stats['coverage_percentage'] >= 90:
-                stats['tracking_quality'] = 'excellent'
-            elif stats['coverage_percentage'] >= 75:
-                stats['tracking_quality'] = 'good'
-            elif stats['coverage_percentage'] >= 50:
-                stats['tracking_quality'] = 'fair'
-            else:
-                stats['tracking_quality'] = 'poor'
-
-            return stats
+            total_trips = len(data['ids'])
+            completed_trips = int((data['statuses'] == 'completed').sum())
+            coverage = np.asarray([detail['coverage'] for detail in position_history['details']], dtype=float) \
+                if position_history else np.empty(0)
+            created = [moment for moment in data['created'] if moment is not None]
 
-        except Exception as e:
-            self.log_error(f"Error analyzing trip positions: {str(e)}", exc=e)
-            return {
-                'total_positions': 0,
-                'valid_positions': 0,
-                'invalid_positions': 0,
-                'tracking_gaps': 0,
-                'gap_details': [],
-                'tracking_quality': 'unknown',
-                'coverage_percentage': 0
-            }
-
-    def _generate_summary(self, trips):
-        """Génère un résumé des analyses"""
-        try:
-            total_trips = len(trips)
-            completed_trips = sum(1 for trip in trips if trip.status == 'completed')
-            
             return {
                 'total_trips': total_trips,
                 'completion_rate': (completed_trips / total_trips * 100) if total_trips > 0 else 0,
-                'average_delay': self._calculate_average_delay(trips),
-                'route_conformity_rate': self._calculate_conformity_rate(trips),
-                'tracking_quality': self._calculate_overall_tracking_quality(trips),
+                'average_delay': float(self._trip_delays(data).mean() / 60) if total_trips > 0 else 0,
+                'route_conformity_rate': (
+                    route_conformity['compliant'] / total_trips * 100
+                ) if total_trips > 0 and route_conformity else 0,
+                'tracking_quality': str(self._tracking_qualities(np.asarray([coverage.mean()]))[0])
+                if len(coverage) else 'unknown',
                 'period': {
-                    'start': trips.order_by('created_at').first().created_at.isoformat() if trips else None,
-                    'end': trips.order_by('-created_at').first().created_at.isoformat() if trips else None
+                    'start': min(created).isoformat() if created else None,
+                    'end': max(created).isoformat() if created else None
                 }
             }
 
         except Exception as e:
             self.log_error(f"Error generating summary: {str(e)}", exc=e)
-            return {}
\ No newline at end of file
+            return {}
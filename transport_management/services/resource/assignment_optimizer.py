@@ -0,0 +1,190 @@
+# transport_management/services/resource/assignment_optimizer.py
+
+import numpy as np
+from django.db import transaction
+from ...models import Trip, DriverVehicleAssignment
+from ..base.service_base import ServiceBase
+from ..trip_scheduler.deadhead import haversine_km
+from .conflict_index import conflict_index
+
+
+def solve_assignment(cost):
+    """
+    Affectation de coût minimal (problème d'affectation linéaire rectangulaire),
+    par plus courts chemins augmentants avec potentiels (Jonker-Volgenant / Crouse).
+    Chaque étape de Dijkstra relâche toutes les colonnes en une opération NumPy.
+    Retourne (lignes, colonnes) : chaque ligne (ou colonne, si moins nombreuses) est affectée.
+    Les coûts infinis sont interdits ; ValueError si aucune affectation complète n'existe.
+    """
+    cost = np.asarray(cost, dtype=float)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    rows, columns = cost.shape
+    if rows == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+    u = np.zeros(rows)
+    v = np.zeros(columns)
+    col_for_row = np.full(rows, -1)
+    row_for_col = np.full(columns, -1)
+
+    for current_row in range(rows):
+        shortest = np.full(columns, np.inf)
+        path = np.full(columns, -1)
+        visited_rows = [current_row]
+        remaining = np.ones(columns, dtype=bool)
+        min_value = 0.0
+        row = current_row
+        sink = -1
+
+        while sink < 0:
+            reduced = min_value + cost[row] - u[row] - v
+            better = remaining & (reduced < shortest)
+            path[better] = row
+            shortest[better] = reduced[better]
+
+            candidates = np.where(remaining, shortest, np.inf)
+            min_value = candidates.min()
+            if min_value == np.inf:
+                raise ValueError("Cost matrix is infeasible")
+            ties = np.flatnonzero(candidates == min_value)
+            # À égalité, une colonne libre termine le chemin immédiatement
+            free = ties[row_for_col[ties] < 0]
+            column = int(free[0]) if len(free) else int(ties[0])
+            remaining[column] = False
+            if row_for_col[column] < 0:
+                sink = column
+            else:
+                row = int(row_for_col[column])
+                visited_rows.append(row)
+
+        # Mise à jour des potentiels
+        u[current_row] += min_value
+        others = np.asarray(visited_rows[1:], dtype=int)
+        if len(others):
+            u[others] += min_value - shortest[col_for_row[others]]
+        scanned = ~remaining
+        v[scanned] -= min_value - shortest[scanned]
+
+        # Augmentation le long du chemin
+        column = sink
+        while True:
+            row = int(path[column])
+            row_for_col[column] = row
+            col_for_row[row], column = column, col_for_row[row]
+            if row == current_row:
+                break
+
+    row_indices = np.arange(rows)
+    if transposed:
+        order = np.argsort(col_for_row)
+        return col_for_row[order], row_indices[order]
+    return row_indices, col_for_row
+
+
+class AssignmentOptimizer(ServiceBase):
+    """
+    Affectation des couples chauffeur/véhicule disponibles aux trips à venir.
+    La matrice de coûts (trips x couples) combine le haut-le-pied jusqu'au terminus de
+    départ, la charge horaire des chauffeurs et l'adéquation capacité / charge attendue ;
+    les couples qui ne peuvent pas arriver à temps ou sont déjà occupés sont exclus.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.DEADHEAD_SPEED_KMH = 30.0
+        self.DEADHEAD_COST_PER_KM = 1.0
+        self.UNKNOWN_POSITION_KM = 10.0         # Couple sans position connue
+        self.DRIVER_LOAD_WEIGHT = 5.0           # Coût quand le chauffeur atteint son volume hebdomadaire
+        self.MISSING_SEAT_COST = 0.5            # Par place manquante face à la charge attendue
+        self.SPARE_SEAT_COST = 0.02             # Par place inutilisée (véhicule surdimensionné)
+        self.EXTENSION_COST_PER_HOUR = 2.0      # Prolongation de l'affectation au-delà de sa fin
+        self.UNASSIGNED_COST = 1e6              # Affectation impossible (trip laissé sans couple)
+
+    def build_cost_matrix(self, needs, pairs):
+        """
+        needs : dicts 'start', 'end' (secondes), 'origin' (lat, lon), 'expected_load'.
+        pairs : dicts 'available_from', 'assigned_until' (secondes), 'position' (lat, lon) ou None,
+        'capacity', 'driver_minutes', 'driver_max_minutes', 'busy' [(début, fin)].
+        Retourne une matrice (trips x couples), np.inf pour les affectations impossibles.
+        """
+        starts = np.array([need['start'] for need in needs], dtype=float)
+        ends = np.array([need['end'] for need in needs], dtype=float)
+        origins = np.array([need['origin'] or (np.nan, np.nan) for need in needs], dtype=float).reshape(-1, 2)
+        loads = np.array([need.get('expected_load') or 0 for need in needs], dtype=float)
+
+        available = np.array([pair['available_from'] for pair in pairs], dtype=float)
+        until = np.array([pair['assigned_until'] for pair in pairs], dtype=float)
+        positions = np.array([pair['position'] or (np.nan, np.nan) for pair in pairs], dtype=float).reshape(-1, 2)
+        capacities = np.array([pair.get('capacity') or 0 for pair in pairs], dtype=float)
+        driven = np.array([pair.get('driver_minutes') or 0 for pair in pairs], dtype=float)
+        limits = np.array([pair.get('driver_max_minutes') or 2400 for pair in pairs], dtype=float)
+
+        # Haut-le-pied : position courante du couple -> terminus de départ du trip
+        deadhead = haversine_km(
+            origins[:, 0, None], origins[:, 1, None], positions[None, :, 0], positions[None, :, 1]
+        )
+        deadhead = np.where(np.isnan(deadhead), self.UNKNOWN_POSITION_KM, deadhead)
+        arrival = available[None, :] + deadhead / self.DEADHEAD_SPEED_KMH * 3600
+
+        durations = (ends - starts) / 60
+        total_minutes = driven[None, :] + durations[:, None]
+        feasible = (arrival <= starts[:, None]) & (total_minutes <= limits[None, :])
+
+        # Trips déjà confiés au véhicule ou au chauffeur du couple
+        for column, pair in enumerate(pairs):
+            for busy_start, busy_end in pair.get('busy', ()):
+                feasible[:, column] &= ~((starts < busy_end) & (ends > busy_start))
+
+        seats = capacities[None, :] - loads[:, None]
+        cost = (
+            deadhead * self.DEADHEAD_COST_PER_KM
+            + self.DRIVER_LOAD_WEIGHT * total_minutes / limits[None, :]
+            + np.where(seats < 0, -seats * self.MISSING_SEAT_COST, seats * self.SPARE_SEAT_COST)
+            + np.maximum(ends[:, None] - until[None, :], 0) / 3600 * self.EXTENSION_COST_PER_HOUR
+        )
+        return np.where(feasible, cost, np.inf)
+
+    def optimize(self, needs, pairs):
+        """
+        Affectation optimale : retourne [(indice du trip, indice du couple, coût)].
+        Les affectations impossibles reçoivent un coût dissuasif (au lieu de l'infini) : le
+        solveur couvre d'abord le plus de trips possible, puis minimise le coût ; elles sont écartées.
+        """
+        if not needs or not pairs:
+            return []
+        cost = self.build_cost_matrix(needs, pairs)
+        feasible = np.isfinite(cost)
+        trip_indices, pair_indices = solve_assignment(np.where(feasible, cost, self.UNASSIGNED_COST))
+        return [
+            (int(trip), int(pair), float(cost[trip, pair]))
+            for trip, pair in zip(trip_indices, pair_indices)
+            if feasible[trip, pair]
+        ]
+
+    def apply(self, matches, trips, assignments):
+        """Affecte les trips et prolonge les affectations trop courtes, en une transaction"""
+        changed_trips = []
+        extended = {}
+        with transaction.atomic():
+            for trip_index, pair_index, _ in matches:
+                trip = trips[trip_index]
+                assignment = assignments[pair_index]
+                trip.driver_id = assignment.driver_id
+                trip.vehicle_id = assignment.vehicle_id
+                changed_trips.append(trip)
+                if assignment.assigned_until < trip.planned_arrival:
+                    assignment.assigned_until = trip.planned_arrival
+                    extended[assignment.pk] = assignment
+
+            Trip.objects.bulk_update(changed_trips, ['driver', 'vehicle'], batch_size=500)
+            if extended:
+                DriverVehicleAssignment.objects.bulk_update(
+                    list(extended.values()), ['assigned_until'], batch_size=500
+                )
+                # bulk_update ne déclenche pas les signaux de l'index des conflits
+                transaction.on_commit(conflict_index.invalidate)
+
+        self.log_info(f"Assignment optimizer: {len(changed_trips)} trips assigned, {len(extended)} assignments extended")
+        return changed_trips
@@ -0,0 +1,468 @@
+# transport_management/services/resource/conflict_index.py
+
+import heapq
+import random
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.core.cache import cache
+from django.utils import timezone
+from ...models import DriverSchedule, DriverVehicleAssignment, ResourceAvailability
+from ..base.service_base import ServiceBase
+
+
+class IntervalTree:
+    """
+    Arbre d'intervalles (treap augmenté de la fin maximale du sous-arbre).
+    Les intervalles sont semi-ouverts [start, end) et identifiés par une clé.
+    """
+
+    class _Node:
+        __slots__ = ('start', 'end', 'key', 'data', 'priority', 'max_end', 'left', 'right')
+
+        def __init__(self, start, end, key, data):
+            self.start = start
+            self.end = end
+            self.key = key
+            self.data = data
+            self.priority = random.random()
+            self.max_end = end
+            self.left = None
+            self.right = None
+
+    def __init__(self):
+        self._root = None
+        self._bounds = {}
+
+    def __len__(self):
+        return len(self._bounds)
+
+    def __contains__(self, key):
+        return key in self._bounds
+
+    def insert(self, start, end, key, data=None):
+        """Insère (ou remplace) l'intervalle identifié par key"""
+        if end <= start:
+            return
+        if key in self._bounds:
+            self.remove(key)
+        self._bounds[key] = (start, end)
+        self._root = self._insert(self._root, self._Node(start, end, key, data))
+
+    def remove(self, key):
+        """Supprime l'intervalle identifié par key"""
+        bounds = self._bounds.pop(key, None)
+        if bounds is None:
+            return False
+        self._root = self._remove(self._root, (bounds[0], key))
+        return True
+
+    def overlapping(self, start, end):
+        """Intervalles qui chevauchent [start, end), triés par début"""
+        result = []
+        self._search(self._root, start, end, result)
+        return result
+
+    def items(self):
+        """Tous les intervalles triés par début"""
+        result = []
+        stack, node = [], self._root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            result.append((node.start, node.end, node.key, node.data))
+            node = node.right
+        return result
+
+    @staticmethod
+    def _order(node):
+        return (node.start, node.key)
+
+    @staticmethod
+    def _update(node):
+        node.max_end = node.end
+        if node.left and node.left.max_end > node.max_end:
+            node.max_end = node.left.max_end
+        if node.right and node.right.max_end > node.max_end:
+            node.max_end = node.right.max_end
+
+    def _rotate_right(self, node):
+        pivot = node.left
+        node.left = pivot.right
+        pivot.right = node
+        self._update(node)
+        self._update(pivot)
+        return pivot
+
+    def _rotate_left(self, node):
+        pivot = node.right
+        node.right = pivot.left
+        pivot.left = node
+        self._update(node)
+        self._update(pivot)
+        return pivot
+
+    def _insert(self, node, new):
+        if node is None:
+            return new
+        if self._order(new) < self._order(node):
+            node.left = self._insert(node.left, new)
+            if node.left.priority > node.priority:
+                node = self._rotate_right(node)
+        else:
+            node.right = self._insert(node.right, new)
+            if node.right.priority > node.priority:
+                node = self._rotate_left(node)
+        self._update(node)
+        return node
+
+    def _remove(self, node, order):
+        if node is None:
+            return None
+        current = self._order(node)
+        if order < current:
+            node.left = self._remove(node.left, order)
+        elif order > current:
+            node.right = self._remove(node.right, order)
+        else:
+            if node.left is None:
+                return node.right
+            if node.right is None:
+                return node.left
+            if node.left.priority > node.right.priority:
+                node = self._rotate_right(node)
+                node.right = self._remove(node.right, order)
+            else:
+                node = self._rotate_left(node)
+                node.left = self._remove(node.left, order)
+        self._update(node)
+        return node
+
+    def _search(self, node, start, end, result):
+        if node is None or node.max_end <= start:
+            return
+        self._search(node.left, start, end, result)
+        if node.start >= end:
+            return
+        if node.end > start:
+            result.append((node.start, node.end, node.key, node.data))
+        self._search(node.right, start, end, result)
+
+
+def overlapping_pairs(intervals):
+    """
+    Balayage des intervalles (start, end, key, data) triés par début.
+    Retourne toutes les paires qui se chevauchent en O(n log n + k).
+    """
+    pairs = []
+    active = []
+    for index, interval in enumerate(intervals):
+        start = interval[0]
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for _, other in active:
+            pairs.append((intervals[other], interval))
+        heapq.heappush(active, (interval[1], index))
+    return pairs
+
+
+class ResourceConflictIndex(ServiceBase):
+    """
+    Index des fenêtres temporelles par ressource (chauffeur / véhicule)
+    construit à partir des plannings, affectations et disponibilités.
+    """
+
+    # Paires de types de fenêtres qui constituent un conflit
+    CONFLICTING_KINDS = {
+        frozenset(['shift']),
+        frozenset(['assignment']),
+        frozenset(['blocked', 'shift']),
+        frozenset(['blocked', 'assignment']),
+        frozenset(['available']),
+        frozenset(['blocked']),
+        frozenset(['available', 'blocked']),
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.VERSION_CACHE_KEY = 'resource_conflict_index_version'
+        self.DEFAULT_WINDOW_DAYS = 7
+        self.IGNORED_SCHEDULE_STATUSES = ['cancelled']
+        self.IGNORED_ASSIGNMENT_STATUSES = ['cancelled']
+        self._lock = threading.RLock()
+        self._trees = {}
+        self._resources_by_key = {}
+        self._window = None
+        self._version = None
+
+    # ------------------------------------------------------------------
+    # Chargement et mises à jour incrémentales
+    # ------------------------------------------------------------------
+
+    def load(self, range_start, range_end):
+        """Construit l'index pour toutes les fenêtres qui touchent la période"""
+        with self._lock:
+            self._trees = {}
+            self._resources_by_key = {}
+            self._window = (range_start, range_end)
+            self._version = self._shared_version()
+
+            schedules = DriverSchedule.objects.filter(
+                shift_start__lt=range_end,
+                shift_end__gt=range_start
+            ).exclude(
+                status__in=self.IGNORED_SCHEDULE_STATUSES
+            ).values_list('id', 'driver_id', 'shift_start', 'shift_end', 'status')
+            for row in schedules.iterator(chunk_size=2000):
+                self._add_entries(self._schedule_entries(*row))
+
+            assignments = DriverVehicleAssignment.objects.filter(
+                assigned_from__lt=range_end,
+                assigned_until__gt=range_start
+            ).exclude(
+                status__in=self.IGNORED_ASSIGNMENT_STATUSES
+            ).values_list('id', 'driver_id', 'vehicle_id', 'assigned_from', 'assigned_until', 'status')
+            for row in assignments.iterator(chunk_size=2000):
+                self._add_entries(self._assignment_entries(*row))
+
+            availabilities = ResourceAvailability.objects.filter(
+                date__gte=timezone.localtime(range_start).date() - timedelta(days=1),
+                date__lte=timezone.localtime(range_end).date()
+            ).values_list('id', 'driver_id', 'vehicle_id', 'date', 'start_time', 'end_time',
+                          'is_available', 'status')
+            for row in availabilities.iterator(chunk_size=2000):
+                self._add_entries(self._availability_entries(*row))
+
+            self.log_info(
+                f"Conflict index loaded: {len(self._resources_by_key)} windows "
+                f"over {len(self._trees)} resources"
+            )
+
+    def refresh_instance(self, instance):
+        """Met à jour l'index après l'enregistrement d'une ligne"""
+        try:
+            with self._lock:
+                self._discard(self.instance_key(instance))
+                if self._window is not None:
+                    self._add_entries(self._instance_entries(instance))
+                self._bump_version()
+        except Exception as e:
+            self.log_error(f"Error refreshing conflict index: {str(e)}", exc=e)
+
+    def remove(self, key):
+        """Retire une ligne supprimée de l'index (clé issue de instance_key)"""
+        try:
+            with self._lock:
+                self._discard(key)
+                self._bump_version()
+        except Exception as e:
+            self.log_error(f"Error removing from conflict index: {str(e)}", exc=e)
+
+    def invalidate(self):
+        """Force un rechargement (ex. après un bulk_create qui n'émet pas de signaux)"""
+        with self._lock:
+            self._window = None
+            self._bump_version()
+
+    # ------------------------------------------------------------------
+    # Requêtes
+    # ------------------------------------------------------------------
+
+    def detect_conflicts(self, range_start, range_end):
+        """Retourne toutes les paires de fenêtres en conflit sur la période"""
+        with self._lock:
+            self._ensure_window(range_start, range_end)
+            lo, hi = range_start.timestamp(), range_end.timestamp()
+            conflicts = []
+            for (resource_type, resource_id), tree in self._trees.items():
+                intervals = tree.overlapping(lo, hi)
+                if len(intervals) < 2:
+                    continue
+                for first, second in overlapping_pairs(intervals):
+                    if not self._is_conflict(first[3]['kind'], second[3]['kind']):
+                        continue
+                    conflicts.append(self._format_conflict(resource_type, resource_id, first, second))
+
+            conflicts.sort(key=lambda c: (c['overlap_start'], c['resource_type'], c['resource_id']))
+            return conflicts
+
+    def find_conflicts_for(self, resource_type, resource_id, start, end, kind='assignment', exclude_key=None):
+        """Fenêtres existantes qui entrent en conflit avec une fenêtre candidate"""
+        with self._lock:
+            self._ensure_window(start, end)
+            tree = self._trees.get((resource_type, resource_id))
+            if tree is None:
+                return []
+            return [
+                {
+                    'source': key[0],
+                    'id': key[1],
+                    'start': self._to_datetime(s).isoformat(),
+                    'end': self._to_datetime(e).isoformat(),
+                    'kind': data['kind']
+                }
+                for s, e, key, data in tree.overlapping(start.timestamp(), end.timestamp())
+                if key != exclude_key and self._is_conflict(kind, data['kind'])
+            ]
+
+    def occupied_windows(self, resource_type, range_start, range_end, kind='assignment'):
+        """Fenêtres (start, end) incompatibles avec une fenêtre du type donné, par ressource"""
+        with self._lock:
+            self._ensure_window(range_start, range_end)
+            lo, hi = range_start.timestamp(), range_end.timestamp()
+            occupied = {}
+            for (tree_type, resource_id), tree in self._trees.items():
+                if tree_type != resource_type:
+                    continue
+                windows = [
+                    (s, e) for s, e, _, data in tree.overlapping(lo, hi)
+                    if self._is_conflict(kind, data['kind'])
+                ]
+                if windows:
+                    occupied[resource_id] = windows
+            return occupied
+
+    # ------------------------------------------------------------------
+    # Construction des entrées
+    # ------------------------------------------------------------------
+
+    def _schedule_entries(self, pk, driver_id, start, end, status):
+        key = ('driver_schedule', pk)
+        if status in self.IGNORED_SCHEDULE_STATUSES:
+            return key, []
+        return key, [(('driver', driver_id), start, end, {'kind': 'shift', 'status': status})]
+
+    def _assignment_entries(self, pk, driver_id, vehicle_id, start, end, status):
+        key = ('vehicle_assignment', pk)
+        if status in self.IGNORED_ASSIGNMENT_STATUSES:
+            return key, []
+        data = {'kind': 'assignment', 'status': status}
+        return key, [
+            (('driver', driver_id), start, end, data),
+            (('vehicle', vehicle_id), start, end, data),
+        ]
+
+    def _availability_entries(self, pk, driver_id, vehicle_id, day, start_time, end_time, is_available, status):
+        key = ('resource_availability', pk)
+        if driver_id:
+            resource = ('driver', driver_id)
+        elif vehicle_id:
+            resource = ('vehicle', vehicle_id)
+        else:
+            return key, []
+
+        start = timezone.make_aware(datetime.combine(day, start_time))
+        end = timezone.make_aware(datetime.combine(day, end_time))
+        if end <= start:
+            end += timedelta(days=1)
+
+        available = is_available and status in ('available', '', None)
+        kind = 'available' if available else 'blocked'
+        return key, [(resource, start, end, {'kind': kind, 'status': status})]
+
+    def _instance_entries(self, instance):
+        if isinstance(instance, DriverSchedule):
+            return self._schedule_entries(
+                instance.pk, instance.driver_id, instance.shift_start, instance.shift_end, instance.status
+            )
+        if isinstance(instance, DriverVehicleAssignment):
+            return self._assignment_entries(
+                instance.pk, instance.driver_id, instance.vehicle_id,
+                instance.assigned_from, instance.assigned_until, instance.status
+            )
+        return self._availability_entries(
+            instance.pk, instance.driver_id, instance.vehicle_id, instance.date,
+            instance.start_time, instance.end_time, instance.is_available, instance.status
+        )
+
+    def instance_key(self, instance):
+        if isinstance(instance, DriverSchedule):
+            return ('driver_schedule', instance.pk)
+        if isinstance(instance, DriverVehicleAssignment):
+            return ('vehicle_assignment', instance.pk)
+        return ('resource_availability', instance.pk)
+
+    def _add_entries(self, entries):
+        key, windows = entries
+        resources = []
+        for resource, start, end, data in windows:
+            tree = self._trees.get(resource)
+            if tree is None:
+                tree = self._trees[resource] = IntervalTree()
+            tree.insert(start.timestamp(), end.timestamp(), key, data)
+            resources.append(resource)
+        if resources:
+            self._resources_by_key[key] = resources
+
+    def _discard(self, key):
+        for resource in self._resources_by_key.pop(key, []):
+            tree = self._trees.get(resource)
+            if tree is None:
+                continue
+            tree.remove(key)
+            if not len(tree):
+                del self._trees[resource]
+
+    # ------------------------------------------------------------------
+    # Cohérence entre processus
+    # ------------------------------------------------------------------
+
+    def _shared_version(self):
+        cache.add(self.VERSION_CACHE_KEY, 0, None)
+        return cache.get(self.VERSION_CACHE_KEY, 0)
+
+    def _bump_version(self):
+        cache.add(self.VERSION_CACHE_KEY, 0, None)
+        try:
+            new_version = cache.incr(self.VERSION_CACHE_KEY)
+        except ValueError:
+            new_version = None
+        # Un autre processus a modifié les données entre-temps : recharger au prochain appel
+        if self._version is None or new_version != self._version + 1:
+            self._window = None
+        self._version = new_version
+
+    def _ensure_window(self, range_start, range_end):
+        stale = self._window is None or self._shared_version() != self._version
+        if not stale and self._window[0] <= range_start and range_end <= self._window[1]:
+            return
+        # Charger au moins une semaine pour servir les requêtes suivantes sans recharger
+        load_end = max(range_end, range_start + timedelta(days=self.DEFAULT_WINDOW_DAYS))
+        self.load(range_start, load_end)
+
+    # ------------------------------------------------------------------
+    # Utilitaires
+    # ------------------------------------------------------------------
+
+    def _is_conflict(self, first_kind, second_kind):
+        return frozenset([first_kind, second_kind]) in self.CONFLICTING_KINDS
+
+    def _to_datetime(self, timestamp):
+        return timezone.localtime(datetime.fromtimestamp(timestamp, tz=dt_timezone.utc))
+
+    def _format_conflict(self, resource_type, resource_id, first, second):
+        overlap_start = max(first[0], second[0])
+        overlap_end = min(first[1], second[1])
+        return {
+            'resource_type': resource_type,
+            'resource_id': resource_id,
+            'overlap_start': self._to_datetime(overlap_start).isoformat(),
+            'overlap_end': self._to_datetime(overlap_end).isoformat(),
+            'overlap_minutes': round((overlap_end - overlap_start) / 60, 1),
+            'windows': [
+                {
+                    'source': interval[2][0],
+                    'id': interval[2][1],
+                    'kind': interval[3]['kind'],
+                    'status': interval[3]['status'],
+                    'start': self._to_datetime(interval[0]).isoformat(),
+                    'end': self._to_datetime(interval[1]).isoformat(),
+                }
+                for interval in (first, second)
+            ]
+        }
+
+
+# Index partagé par le processus, tenu à jour par les signaux
+conflict_index = ResourceConflictIndex()
@@ -3,17 +3,24 @@
 from django.db import transaction
 from django.utils import timezone
 from datetime import datetime, timedelta
-from django.db.models import Q, Count, Avg
+from django.db.models import Q, Count, Avg, Max
 from ...models import (
     Trip, DriverVehicleAssignment, BusPosition, 
     Driver, Schedule, ResourceAvailability
 )
 from ..base.service_base import ServiceBase
+from .conflict_index import conflict_index
+from .heartbeat_store import vehicle_heartbeats
+from .assignment_optimizer import AssignmentOptimizer
+from ..trip_scheduler.deadhead import load_route_termini
 
 class FleetManager(ServiceBase):
     def __init__(self):
         super().__init__()
         self.ACTIVE_TIMEOUT = 300  # 5 minutes sans données = inactif
+        self.CONFLICT_HORIZON = timedelta(hours=24)
+        self.OPTIMIZATION_HORIZON = timedelta(hours=3)
+        self.optimizer = AssignmentOptimizer()
 
     def monitor_active_fleet(self):
         """Surveillance continue de la flotte active"""
@@ -31,32 +38,70 @@ class FleetManager(ServiceBase):
             self.log_error(f"Error monitoring fleet: {str(e)}", exc=e)
 
     def _update_fleet_status(self):
-        """Mise à jour des statuts de la flotte"""
+        """
+        Passe inactives les affectations des véhicules dont l'échéance de communication
+        est dépassée : seuls les véhicules échus sont lus (O(échus), pas O(flotte)).
+        """
         try:
             current_time = timezone.now()
-            timeout_threshold = current_time - timedelta(seconds=self.ACTIVE_TIMEOUT)
+            expired = vehicle_heartbeats.pop_expired(current_time.timestamp())
+            if not expired:
+                return []
 
-            # Récupérer toutes les assignations actives
-            active_assignments = DriverVehicleAssignment.objects.filter(
+            lost_assignments = DriverVehicleAssignment.objects.filter(
+                vehicle_id__in=expired,
                 status='active',
                 assigned_from__lte=current_time,
                 assigned_until__gte=current_time
             ).select_related('vehicle', 'driver')
 
-            for assignment in active_assignments:
-                # Vérifier la dernière position connue
-                last_position = BusPosition.objects.filter(
-                    trip__vehicle=assignment.vehicle
-                ).order_by('-timestamp').first()
-
-                # Mettre à jour le statut basé sur l'activité récente
-                if last_position and last_position.timestamp > timeout_threshold:
-                    self._update_assignment_status(assignment, 'active', last_position)
-                else:
-                    self._update_assignment_status(assignment, 'inactive')
+            for assignment in lost_assignments:
+                self._update_assignment_status(assignment, 'inactive')
+            return expired
 
         except Exception as e:
             self.log_error(f"Error updating fleet status: {str(e)}", exc=e)
+            return []
+
+    def record_heartbeat(self, vehicle_id, position):
+        """
+        Repousse l'échéance de communication du véhicule à chaque position reçue ;
+        réactive ses affectations si la communication était perdue.
+        """
+        try:
+            deadline = position.timestamp.timestamp() + self.ACTIVE_TIMEOUT
+            if not vehicle_heartbeats.touch(vehicle_id, deadline):
+                return False
+
+            current_time = timezone.now()
+            for assignment in DriverVehicleAssignment.objects.filter(
+                vehicle_id=vehicle_id,
+                status='inactive',
+                assigned_from__lte=current_time,
+                assigned_until__gte=current_time
+            ):
+                self._update_assignment_status(assignment, 'active', position)
+            return True
+
+        except Exception as e:
+            self.log_error(f"Error recording heartbeat for vehicle {vehicle_id}: {str(e)}", exc=e)
+            return False
+
+    def watch_assignment(self, assignment):
+        """
+        Arme l'échéance de communication du véhicule d'une affectation active : sans
+        aucune position, il est considéré perdu ACTIVE_TIMEOUT après le début de l'affectation.
+        """
+        if assignment.status == 'active':
+            start = max(timezone.now(), assignment.assigned_from)
+            vehicle_heartbeats.arm(assignment.vehicle_id, start.timestamp() + self.ACTIVE_TIMEOUT)
+        elif assignment.status in ('completed', 'cancelled'):
+            vehicle_heartbeats.forget(assignment.vehicle_id)
+
+    def _log_status_change(self, assignment, old_status, new_status):
+        self.log_info(
+            f"Assignment {assignment.id} (vehicle {assignment.vehicle_id}): {old_status} -> {new_status}"
+        )
 
     def _verify_assignments(self):
         """Vérifie la validité des assignations actuelles"""
@@ -78,6 +123,30 @@ class FleetManager(ServiceBase):
         except Exception as e:
             self.log_error(f"Error verifying assignments: {str(e)}", exc=e)
 
+    def _check_assignment_conflicts(self):
+        """Détecte les chevauchements d'affectations sur l'horizon à venir"""
+        try:
+            current_time = timezone.now()
+            conflicts = [
+                conflict for conflict in conflict_index.detect_conflicts(
+                    current_time, current_time + self.CONFLICT_HORIZON
+                )
+                if any(window['source'] == 'vehicle_assignment' for window in conflict['windows'])
+            ]
+
+            for conflict in conflicts:
+                windows = ', '.join(f"{w['source']}#{w['id']}" for w in conflict['windows'])
+                self.log_warning(
+                    f"Assignment conflict on {conflict['resource_type']} {conflict['resource_id']}: "
+                    f"{windows} ({conflict['overlap_minutes']} min)"
+                )
+
+            return conflicts
+
+        except Exception as e:
+            self.log_error(f"Error checking assignment conflicts: {str(e)}", exc=e)
+            return []
+
     def _optimize_assignments(self):
         """Optimise les attributions de véhicules"""
         try:
@@ -200,120 +269,150 @@ class FleetManager(ServiceBase):
             self.log_error(f"Error preparing replacement: {str(e)}", exc=e)
 
     def _get_upcoming_resource_needs(self):
-        """Détermine les besoins en ressources à venir"""
+        """Trips planifiés de l'horizon d'optimisation sans véhicule ni chauffeur"""
         try:
-            upcoming_trips = Trip.objects.filter(
+            current_time = timezone.now()
+            trips = list(Trip.objects.filter(
                 status='planned',
-                planned_departure__gte=timezone.now(),
-                planned_departure__lte=timezone.now() + timedelta(hours=24)
-            ).order_by('planned_departure')
-
-            needs = []
-            for trip in upcoming_trips:
-                needs.append({
+                vehicle__isnull=True,
+                driver__isnull=True,
+                planned_departure__gte=current_time,
+                planned_departure__lte=current_time + self.OPTIMIZATION_HORIZON
+            ).order_by('planned_departure'))
+            if not trips:
+                return []
+
+            route_ids = {trip.route_id for trip in trips}
+            termini = load_route_termini(route_ids)
+            # Charge attendue : moyenne des trips terminés récents de la route
+            loads = dict(Trip.objects.filter(
+                route_id__in=route_ids,
+                status='completed',
+                planned_departure__gte=current_time - timedelta(days=28)
+            ).values('route_id').annotate(load=Avg('passenger_count')).values_list('route_id', 'load'))
+
+            return [
+                {
                     'trip': trip,
-                    'start_time': trip.planned_departure,
-                    'end_time': trip.planned_arrival,
-                    'route': trip.route,
-                    'current_assignment': None
-                })
-
-            return needs
+                    'start': trip.planned_departure.timestamp(),
+                    'end': trip.planned_arrival.timestamp(),
+                    'origin': termini.get(trip.route_id, (None, None))[0],
+                    'expected_load': loads.get(trip.route_id) or 0,
+                }
+                for trip in trips
+            ]
 
         except Exception as e:
             self.log_error(f"Error getting upcoming needs: {str(e)}", exc=e)
             return []
 
     def _get_available_assignments(self):
-        """Récupère les assignations disponibles"""
+        """
+        Couples chauffeur/véhicule actifs sur l'horizon avec leur position courante,
+        leur disponibilité, leurs trips déjà confiés et la conduite de la semaine.
+        """
         try:
-            return DriverVehicleAssignment.objects.filter(
+            current_time = timezone.now()
+            horizon_end = current_time + self.OPTIMIZATION_HORIZON
+            assignments = list(DriverVehicleAssignment.objects.filter(
                 status='active',
-                assigned_until__gte=timezone.now()
-            ).select_related('driver', 'vehicle')
+                assigned_from__lte=horizon_end,
+                assigned_until__gte=current_time
+            ).select_related('driver', 'vehicle'))
+            if not assignments:
+                return []
+
+            vehicle_ids = {a.vehicle_id for a in assignments}
+            driver_ids = {a.driver_id for a in assignments}
+
+            # Dernière position connue de chaque véhicule
+            last_ids = BusPosition.objects.filter(
+                trip__vehicle_id__in=vehicle_ids, is_valid=True
+            ).values('trip__vehicle_id').annotate(last_id=Max('position_id')).values_list('last_id', flat=True)
+            positions = {
+                vehicle_id: (float(latitude), float(longitude))
+                for vehicle_id, latitude, longitude in BusPosition.objects.filter(
+                    position_id__in=list(last_ids)
+                ).values_list('trip__vehicle_id', 'latitude', 'longitude')
+            }
+
+            # Trips en cours ou déjà confiés (véhicule ou chauffeur) et conduite de la semaine
+            week_start = current_time - timedelta(days=current_time.weekday())
+            week_start = week_start.replace(hour=0, minute=0, second=0, microsecond=0)
+            committed = Trip.objects.filter(
+                Q(vehicle_id__in=vehicle_ids) | Q(driver_id__in=driver_ids),
+                status__in=['planned', 'in_progress', 'completed'],
+                planned_departure__gte=week_start,
+                planned_departure__lte=horizon_end
+            ).values_list('vehicle_id', 'driver_id', 'route_id', 'status', 'planned_departure', 'planned_arrival')
+
+            busy = {}
+            driven = {}
+            in_progress = {}
+            for vehicle_id, driver_id, route_id, status, departure, arrival in committed:
+                if driver_id:
+                    driven[driver_id] = driven.get(driver_id, 0) + (arrival - departure).total_seconds() / 60
+                if arrival < current_time:
+                    continue
+                window = (departure.timestamp(), arrival.timestamp())
+                busy.setdefault(('vehicle', vehicle_id), []).append(window)
+                busy.setdefault(('driver', driver_id), []).append(window)
+                if status == 'in_progress' and vehicle_id:
+                    in_progress[vehicle_id] = (route_id, arrival)
+
+            termini = load_route_termini({route_id for route_id, _ in in_progress.values()})
+            pairs = []
+            for assignment in assignments:
+                available_from = max(current_time, assignment.assigned_from)
+                position = positions.get(assignment.vehicle_id)
+                if assignment.vehicle_id in in_progress:
+                    # Véhicule en service : disponible au terminus d'arrivée de son trip
+                    route_id, arrival = in_progress[assignment.vehicle_id]
+                    available_from = max(available_from, arrival)
+                    position = termini.get(route_id, (None, position))[1]
+                pairs.append({
+                    'assignment': assignment,
+                    'available_from': available_from.timestamp(),
+                    'assigned_until': assignment.assigned_until.timestamp(),
+                    'position': position,
+                    'capacity': assignment.vehicle.capacity,
+                    'driver_minutes': driven.get(assignment.driver_id, 0),
+                    'driver_max_minutes': assignment.driver.maximum_hours_per_week * 60,
+                    'busy': busy.get(('vehicle', assignment.vehicle_id), []) +
+                            busy.get(('driver', assignment.driver_id), []),
+                })
+            return pairs
 
         except Exception as e:
             self.log_error(f"Error getting available assignments: {str(e)}", exc=e)
             return []
 
     def _calculate_optimizations(self, needs, available):
-        """Calcule les optimisations possibles"""
-        optimizations = []
-        
-        for need in needs:
-            best_assignment = self._find_best_assignment(need, available)
-            if best_assignment:
-                optimizations.append({
-                    'need': need,
-                    'current_assignment': need['current_assignment'],
-                    'proposed_assignment': best_assignment,
-                    'score': self._calculate_optimization_score(need, best_assignment)
-                })
-
-        return sorted(optimizations, key=lambda x: x['score'], reverse=True)
-
-    def _find_best_assignment(self, need, available):
-        """Trouve la meilleure assignation pour un besoin"""
-        best_assignment = None
-        best_score = -1
-
-        for assignment in available:
-            score = self._calculate_assignment_score(need, assignment)
-            if score > best_score:
-                best_score = score
-                best_assignment = assignment
-
-        return best_assignment
-
-    def _calculate_assignment_score(self, need, assignment):
-        """Calcule un score pour une assignation potentielle"""
-        score = 0
-        
-        # Facteur 1: Expérience du chauffeur sur la route
-        if need['route'] in assignment.driver.preferred_routes.all():
-            score += 20
-
-        # Facteur 2: Historique de performance
-        score += min(assignment.driver.rating * 10, 50)
-
-        # Facteur 3: Optimisation du temps
-        if assignment.assigned_until <= need['start_time'] + timedelta(minutes=30):
-            score += 15
-
-        return score
+        """Affectation de coût minimal des couples disponibles aux trips (matrice de coûts vectorisée)"""
+        matches = self.optimizer.optimize(needs, available)
+        return [
+            {
+                'need': needs[trip_index],
+                'proposed_assignment': available[pair_index]['assignment'],
+                'cost': cost,
+            }
+            for trip_index, pair_index, cost in matches
+        ]
 
     def _apply_assignment_changes(self, optimizations):
-        """Applique les changements d'assignation optimisés"""
+        """Applique toutes les affectations en une transaction"""
         try:
-            with transaction.atomic():
-                for opt in optimizations:
-                    if opt['score'] > 50:  # Seuil minimal pour appliquer un changement
-                        self._update_assignment(opt)
+            if not optimizations:
+                return []
+            return self.optimizer.apply(
+                [(index, index, optimization['cost']) for index, optimization in enumerate(optimizations)],
+                [optimization['need']['trip'] for optimization in optimizations],
+                [optimization['proposed_assignment'] for optimization in optimizations]
+            )
 
         except Exception as e:
             self.log_error(f"Error applying assignment changes: {str(e)}", exc=e)
-
-    def _update_assignment(self, optimization):
-        """Met à jour une assignation spécifique"""
-        try:
-            need = optimization['need']
-            new_assignment = optimization['proposed_assignment']
-            
-            # Mettre à jour le trip
-            trip = need['trip']
-            trip.driver = new_assignment.driver
-            trip.vehicle = new_assignment.vehicle
-            trip.save()
-
-            # Mettre à jour l'assignation
-            if new_assignment.assigned_until < need['end_time']:
-                new_assignment.assigned_until = need['end_time']
-                new_assignment.save()
-
-            self.log_info(f"Updated assignment for trip {trip.id}")
-
-        except Exception as e:
-            self.log_error(f"Error updating assignment: {str(e)}", exc=e)
+            return []
 
     def get_fleet_status(self):
         """Retourne un résumé du statut de la flotte"""
@@ -0,0 +1,120 @@
+# transport_management/services/resource/heartbeat_store.py
+
+import heapq
+import threading
+from django.core.cache import cache
+from ..base.service_base import ServiceBase
+
+# Retire atomiquement les véhicules échus et les marque perdus (plusieurs moniteurs possibles)
+POP_EXPIRED_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #ids > 0 then
+    redis.call('ZREM', KEYS[1], unpack(ids))
+    redis.call('SADD', KEYS[2], unpack(ids))
+end
+return ids
+"""
+
+
+class HeartbeatDeadlineStore(ServiceBase):
+    """
+    Échéances de communication par véhicule : chaque position reçue repousse l'échéance
+    du véhicule, le moniteur ne retire que les véhicules dont l'échéance est passée.
+    Sorted set Redis quand le cache est Redis (partagé entre processus), sinon tas
+    binaire en mémoire avec suppression paresseuse (un seul processus).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.DEADLINES_KEY = 'fleet_heartbeat_deadlines'
+        self.LOST_KEY = 'fleet_heartbeat_lost'
+        self.MAX_POP = 500              # Véhicules retirés par appel
+        self._lock = threading.Lock()
+        self._heap = []
+        self._deadlines = {}
+        self._lost = set()
+        self._script = None
+
+    def touch(self, vehicle_id, deadline):
+        """
+        Repousse l'échéance du véhicule (jamais en arrière : positions reçues dans le désordre).
+        Retourne True si le véhicule était considéré perdu : la communication est rétablie.
+        """
+        client = self._client()
+        if client is not None:
+            pipe = client.pipeline()
+            # GT : n'ajoute ou ne repousse que vers une échéance plus tardive
+            pipe.zadd(self._key(self.DEADLINES_KEY), {str(vehicle_id): deadline}, gt=True)
+            pipe.srem(self._key(self.LOST_KEY), str(vehicle_id))
+            return bool(pipe.execute()[-1])
+
+        with self._lock:
+            if deadline > self._deadlines.get(vehicle_id, float('-inf')):
+                self._deadlines[vehicle_id] = deadline
+                heapq.heappush(self._heap, (deadline, vehicle_id))
+            if vehicle_id in self._lost:
+                self._lost.discard(vehicle_id)
+                return True
+            return False
+
+    def arm(self, vehicle_id, deadline):
+        """Pose une échéance initiale sans écraser celle d'un véhicule déjà suivi"""
+        client = self._client()
+        if client is not None:
+            client.zadd(self._key(self.DEADLINES_KEY), {str(vehicle_id): deadline}, nx=True)
+            return
+
+        with self._lock:
+            if vehicle_id not in self._deadlines:
+                self._deadlines[vehicle_id] = deadline
+                heapq.heappush(self._heap, (deadline, vehicle_id))
+
+    def pop_expired(self, now):
+        """Véhicules dont l'échéance est passée, retirés du suivi et marqués perdus"""
+        client = self._client()
+        if client is not None:
+            if self._script is None:
+                self._script = client.register_script(POP_EXPIRED_SCRIPT)
+            ids = self._script(
+                keys=[self._key(self.DEADLINES_KEY), self._key(self.LOST_KEY)],
+                args=[now, self.MAX_POP],
+                client=client
+            )
+            return [int(vehicle_id) for vehicle_id in ids]
+
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(expired) < self.MAX_POP:
+                deadline, vehicle_id = heapq.heappop(self._heap)
+                # Entrée périmée : l'échéance a été repoussée depuis
+                if self._deadlines.get(vehicle_id) != deadline:
+                    continue
+                del self._deadlines[vehicle_id]
+                self._lost.add(vehicle_id)
+                expired.append(vehicle_id)
+        return expired
+
+    def forget(self, vehicle_id):
+        """Arrête le suivi du véhicule (fin d'affectation)"""
+        client = self._client()
+        if client is not None:
+            client.zrem(self._key(self.DEADLINES_KEY), str(vehicle_id))
+            client.srem(self._key(self.LOST_KEY), str(vehicle_id))
+            return
+
+        with self._lock:
+            self._deadlines.pop(vehicle_id, None)
+            self._lost.discard(vehicle_id)
+
+    def _client(self):
+        """Client Redis brut du cache Django (backend redis intégré), None pour les autres backends"""
+        backend = getattr(cache, '_cache', None)
+        if backend is None or not hasattr(backend, 'get_client'):
+            return None
+        return backend.get_client(write=True)
+
+    def _key(self, name):
+        return cache.make_key(name)
+
+
+vehicle_heartbeats = HeartbeatDeadlineStore()
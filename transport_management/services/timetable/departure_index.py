@@ -0,0 +1,175 @@
+# transport_management/services/timetable/departure_index.py
+
+from datetime import datetime, time, timedelta
+import numpy as np
+from django.utils import timezone
+from ...models import Trip, Schedule, ScheduleException, Route
+from ..base.service_base import ServiceBase
+from .journey_planner import journey_planner
+from .stop_times import DAY_NAMES, load_route_patterns, parse_timepoint
+
+
+class StopDepartureIndex(ServiceBase):
+    """
+    Index des départs par arrêt pour un jour de service.
+    Tous les départs (trips du jour, ou horaires sans trips générés) sont projetés
+    sur les arrêts via les décalages RouteStop, puis stockés dans des tableaux NumPy
+    triés par arrêt puis par heure : la recherche des prochains départs est une
+    recherche dichotomique dans la tranche de l'arrêt.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.MAX_CACHED_DAYS = 3
+        self.LIVE_STATUSES = ['in_progress', 'delayed']
+        self.MAX_DELAY_LOOKBACK_MINUTES = 30    # Départs prévus passés mais encore attendus (retard)
+        self._indexes = {}
+
+    def next_departures(self, stop_id, at=None, limit=10, live=True):
+        """
+        Prochains départs à l'arrêt à partir de 'at' (datetime aware, défaut maintenant).
+        Avec live, les retards des trips en cours décalent l'heure attendue.
+        """
+        at = timezone.localtime(at or timezone.now())
+        service_date = at.date()
+        index = self.get_index(service_date)
+        day_start = timezone.make_aware(datetime.combine(service_date, time.min))
+        seconds = int((at - day_start).total_seconds())
+
+        first, last = index['stop_offsets'].get(int(stop_id), (0, 0))
+        times = index['times'][first:last]
+        lookback = self.MAX_DELAY_LOOKBACK_MINUTES * 60 if live else 0
+        start = first + int(np.searchsorted(times, seconds - lookback, side='left'))
+        # Fenêtre élargie : un départ retardé peut repasser devant un départ à l'heure
+        end = min(last, first + int(np.searchsorted(times, seconds, side='left')) + limit)
+        candidates = range(start, end)
+
+        delays = self._live_delays({int(index['trips'][i]) for i in candidates if index['trips'][i] >= 0}) \
+            if live else {}
+        route_codes = index['route_codes']
+
+        departures = []
+        for i in candidates:
+            trip_id = int(index['trips'][i])
+            scheduled = int(index['times'][i])
+            delay = delays.get(trip_id, 0)
+            expected = scheduled + delay
+            if expected < seconds:
+                continue
+            route_id = int(index['routes'][i])
+            departures.append({
+                'trip_id': trip_id if trip_id >= 0 else None,
+                'schedule_id': int(index['schedules'][i]) if index['schedules'][i] >= 0 else None,
+                'route_id': route_id,
+                'route_code': route_codes.get(route_id),
+                'scheduled_departure': (day_start + timedelta(seconds=scheduled)).isoformat(),
+                'expected_departure': (day_start + timedelta(seconds=expected)).isoformat(),
+                'delay_minutes': round(delay / 60, 1),
+                'is_live': trip_id in delays,
+                '_expected': expected,
+            })
+
+        departures.sort(key=lambda departure: departure['_expected'])
+        for departure in departures:
+            del departure['_expected']
+        return departures[:limit]
+
+    def get_index(self, service_date):
+        """Index du jour, reconstruit quand les trips ou le réseau ont changé"""
+        versions = journey_planner.versions(service_date)
+        index = self._indexes.get(service_date)
+        if index is None or index['versions'] != versions:
+            index = self._build(service_date)
+            index['versions'] = versions
+            if service_date not in self._indexes and len(self._indexes) >= self.MAX_CACHED_DAYS:
+                self._indexes.pop(min(self._indexes))
+            self._indexes[service_date] = index
+        return index
+
+    def _build(self, service_date):
+        day_start = timezone.make_aware(datetime.combine(service_date, time.min))
+        patterns = load_route_patterns()
+
+        # (route, trip, horaire, départ en secondes) : trips du jour
+        departures = []
+        covered_schedules = set()
+        trips = Trip.objects.filter(
+            planned_departure__gte=day_start,
+            planned_departure__lt=day_start + timedelta(days=1)
+        ).exclude(status='cancelled').values_list('id', 'route_id', 'schedule_id', 'planned_departure')
+        for trip_id, route_id, schedule_id, departure in trips:
+            departures.append((route_id, trip_id, schedule_id or -1, int((departure - day_start).total_seconds())))
+            if schedule_id:
+                covered_schedules.add(schedule_id)
+
+        # Horaires du jour dont les trips ne sont pas (encore) générés
+        schedules = Schedule.objects.filter(
+            day_of_week=DAY_NAMES[service_date.weekday()],
+            start_date__lte=service_date,
+            end_date__gte=service_date,
+            status='active',
+            is_active=True,
+            is_current_version=True
+        ).exclude(id__in=covered_schedules).exclude(
+            id__in=ScheduleException.objects.filter(
+                exception_date=service_date, is_cancelled=True
+            ).values('schedule_id')
+        )
+        for schedule in schedules:
+            for timepoint in schedule.compute_timepoints(service_date):
+                departures.append((schedule.route_id, -1, schedule.id, parse_timepoint(timepoint)))
+
+        columns = [[], [], [], [], []]
+        by_route = {}
+        for route_id, trip_id, schedule_id, seconds in departures:
+            if route_id in patterns:
+                by_route.setdefault(route_id, []).append((trip_id, schedule_id, seconds))
+
+        for route_id, rows in by_route.items():
+            pattern = patterns[route_id]
+            stops = np.asarray([stop['stop_id'] for stop in pattern], dtype=np.int64)
+            # Le dernier arrêt n'est pas un départ
+            stops, offsets = stops[:-1], np.asarray([stop['departure_offset'] for stop in pattern[:-1]])
+            trip_ids, schedule_ids, bases = (np.asarray(column, dtype=np.int64) for column in zip(*rows))
+            columns[0].append(np.tile(stops, len(rows)))
+            columns[1].append(np.add.outer(bases, offsets).ravel())
+            columns[2].append(np.full(len(rows) * len(stops), route_id, dtype=np.int64))
+            columns[3].append(np.repeat(trip_ids, len(stops)))
+            columns[4].append(np.repeat(schedule_ids, len(stops)))
+
+        stop_ids, times, routes, trip_ids, schedule_ids = (
+            np.concatenate(column) if column else np.empty(0, dtype=np.int64) for column in columns
+        )
+        order = np.lexsort((times, stop_ids))
+        stop_ids, times, routes, trip_ids, schedule_ids = (
+            column[order] for column in (stop_ids, times, routes, trip_ids, schedule_ids)
+        )
+
+        unique_stops, starts = np.unique(stop_ids, return_index=True)
+        ends = np.append(starts[1:], len(stop_ids))
+        self.log_info(f"Stop departure index built for {service_date}: {len(times)} departures")
+        return {
+            'stop_offsets': {
+                int(stop_id): (int(start), int(end)) for stop_id, start, end in zip(unique_stops, starts, ends)
+            },
+            'times': times.astype(np.int32),
+            'routes': routes,
+            'trips': trip_ids,
+            'schedules': schedule_ids,
+            'route_codes': dict(Route.objects.filter(id__in=by_route.keys()).values_list('id', 'route_code')),
+        }
+
+    def _live_delays(self, trip_ids):
+        """Retard courant (secondes) des trips en cours parmi trip_ids"""
+        if not trip_ids:
+            return {}
+        rows = Trip.objects.filter(
+            id__in=trip_ids, status__in=self.LIVE_STATUSES
+        ).values_list('id', 'delay_duration')
+        return {
+            trip_id: int(delay.total_seconds()) if delay else 0
+            for trip_id, delay in rows
+        }
+
+
+departure_index = StopDepartureIndex()
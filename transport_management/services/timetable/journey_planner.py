@@ -0,0 +1,479 @@
+# transport_management/services/timetable/journey_planner.py
+
+import bisect
+from datetime import datetime, time, timedelta
+import numpy as np
+from django.core.cache import cache
+from django.utils import timezone
+from ...models import Trip, Stop, Route
+from ..base.service_base import ServiceBase
+from .stop_grid import StopProximityGrid
+from .stop_times import load_route_patterns
+
+INFINITY = 10 ** 9
+
+
+class ConnectionTimetable:
+    """
+    Table des connexions d'un jour de service (tableaux NumPy triés par heure de départ).
+    Une connexion est le tronçon d'un trip entre deux arrêts consécutifs ; les heures
+    sont en secondes depuis minuit (heure locale) du jour de service.
+    Les correspondances à pied sont stockées en CSR (footpath_offsets / targets / seconds).
+    """
+
+    def __init__(self, service_date, stop_ids, footpaths, min_transfer_seconds=60):
+        self.service_date = service_date
+        self.stop_ids = np.asarray(stop_ids, dtype=np.int64)
+        self.stop_index = {int(stop_id): index for index, stop_id in enumerate(self.stop_ids)}
+        self.min_transfer_seconds = min_transfer_seconds
+
+        sources, targets, seconds = footpaths
+        order = np.argsort(sources, kind='stable')
+        self.footpath_targets = np.asarray(targets, dtype=np.int32)[order]
+        self.footpath_seconds = np.asarray(seconds, dtype=np.int32)[order]
+        self.footpath_offsets = np.searchsorted(
+            np.asarray(sources)[order], np.arange(len(self.stop_ids) + 1)
+        ).astype(np.int32)
+
+        self.trip_ids = np.empty(0, dtype=np.int64)
+        self.trip_routes = np.empty(0, dtype=np.int64)
+        self.trip_index = {}
+        self.set_connections(*(np.empty(0, dtype=np.int32),) * 5)
+
+    def set_connections(self, dep_stop, arr_stop, dep_time, arr_time, trip):
+        order = np.lexsort((arr_time, dep_time))
+        self.dep_stop = np.asarray(dep_stop, dtype=np.int32)[order]
+        self.arr_stop = np.asarray(arr_stop, dtype=np.int32)[order]
+        self.dep_time = np.asarray(dep_time, dtype=np.int32)[order]
+        self.arr_time = np.asarray(arr_time, dtype=np.int32)[order]
+        self.trip = np.asarray(trip, dtype=np.int32)[order]
+        self.by_arrival = np.argsort(self.arr_time, kind='stable').astype(np.int32)
+        # Vues en listes Python : l'accès élément par élément y est bien plus rapide
+        self._scan = None
+
+    def register_trips(self, trip_ids, route_ids):
+        """Indices denses des trips (les trips déjà connus gardent leur indice)"""
+        indices = []
+        new_ids, new_routes = [], []
+        for trip_id, route_id in zip(trip_ids, route_ids):
+            index = self.trip_index.get(trip_id)
+            if index is None:
+                index = self.trip_index[trip_id] = len(self.trip_ids) + len(new_ids)
+                new_ids.append(trip_id)
+                new_routes.append(route_id)
+            else:
+                self.trip_routes[index] = route_id
+            indices.append(index)
+        if new_ids:
+            self.trip_ids = np.concatenate([self.trip_ids, np.asarray(new_ids, dtype=np.int64)])
+            self.trip_routes = np.concatenate([self.trip_routes, np.asarray(new_routes, dtype=np.int64)])
+        return np.asarray(indices, dtype=np.int32)
+
+    def replace_trips(self, trip_indices, connections):
+        """Remplace les connexions des trips donnés (mise à jour incrémentale)"""
+        keep = ~np.isin(self.trip, trip_indices)
+        self.set_connections(*(
+            np.concatenate([current[keep], new])
+            for current, new in zip(
+                (self.dep_stop, self.arr_stop, self.dep_time, self.arr_time, self.trip), connections
+            )
+        ))
+
+    def __len__(self):
+        return len(self.dep_time)
+
+    def _lists(self):
+        if self._scan is None:
+            self._scan = (
+                self.dep_stop.tolist(), self.arr_stop.tolist(), self.dep_time.tolist(),
+                self.arr_time.tolist(), self.trip.tolist(), self.by_arrival.tolist(),
+                self.arr_time[self.by_arrival].tolist(),
+                self.footpath_offsets.tolist(), self.footpath_targets.tolist(),
+                self.footpath_seconds.tolist(),
+            )
+        return self._scan
+
+    def earliest_arrival(self, source, target, departure_time):
+        """
+        Connection Scan : arrivée au plus tôt à target en partant de source
+        à departure_time. Retourne la liste des étapes ou None.
+        """
+        (dep_stop, arr_stop, dep_time, arr_time, trip, _, _,
+         offsets, foot_targets, foot_seconds) = self._lists()
+        arrival = [INFINITY] * len(self.stop_ids)
+        ready = [INFINITY] * len(self.stop_ids)
+        journey = [None] * len(self.stop_ids)
+        boarded = {}
+
+        arrival[source] = ready[source] = departure_time
+        for k in range(offsets[source], offsets[source + 1]):
+            stop, seconds = foot_targets[k], foot_seconds[k]
+            arrival[stop] = ready[stop] = departure_time + seconds
+            journey[stop] = ('walk', source, departure_time, seconds)
+
+        transfer = self.min_transfer_seconds
+        for i in range(bisect.bisect_left(dep_time, departure_time), len(dep_time)):
+            departure = dep_time[i]
+            if departure > arrival[target]:
+                break
+            trip_index = trip[i]
+            if trip_index not in boarded:
+                if ready[dep_stop[i]] > departure:
+                    continue
+                boarded[trip_index] = i
+            stop, time_at_stop = arr_stop[i], arr_time[i]
+            if time_at_stop < arrival[stop]:
+                arrival[stop] = time_at_stop
+                ready[stop] = time_at_stop + transfer
+                journey[stop] = ('ride', boarded[trip_index], i)
+                for k in range(offsets[stop], offsets[stop + 1]):
+                    neighbour, seconds = foot_targets[k], foot_seconds[k]
+                    if time_at_stop + seconds < arrival[neighbour]:
+                        arrival[neighbour] = ready[neighbour] = time_at_stop + seconds
+                        journey[neighbour] = ('walk', stop, time_at_stop, seconds)
+
+        if journey[target] is None:
+            return None
+
+        legs = []
+        stop = target
+        while stop != source:
+            step = journey[stop]
+            if step[0] == 'ride':
+                legs.append(self._ride_leg(step[1], step[2]))
+                stop = dep_stop[step[1]]
+            else:
+                legs.append(self._walk_leg(step[1], stop, step[2], step[3]))
+                stop = step[1]
+        return legs[::-1]
+
+    def latest_departure(self, source, target, arrival_deadline):
+        """
+        Connection Scan inversé : départ au plus tard de source pour être à target
+        avant arrival_deadline. Retourne la liste des étapes ou None.
+        """
+        (dep_stop, arr_stop, dep_time, arr_time, trip, by_arrival, sorted_arrivals,
+         offsets, foot_targets, foot_seconds) = self._lists()
+        latest = [-INFINITY] * len(self.stop_ids)
+        journey = [None] * len(self.stop_ids)
+        alighting = {}
+
+        latest[target] = arrival_deadline
+        for k in range(offsets[target], offsets[target + 1]):
+            stop, seconds = foot_targets[k], foot_seconds[k]
+            latest[stop] = arrival_deadline - seconds
+            journey[stop] = ('walk', target, arrival_deadline - seconds, seconds)
+
+        transfer = self.min_transfer_seconds
+        for k in range(bisect.bisect_right(sorted_arrivals, arrival_deadline) - 1, -1, -1):
+            i = by_arrival[k]
+            if arr_time[i] <= latest[source]:
+                break
+            trip_index = trip[i]
+            if trip_index not in alighting:
+                if latest[arr_stop[i]] < arr_time[i]:
+                    continue
+                alighting[trip_index] = i
+            stop, departure = dep_stop[i], dep_time[i]
+            # Hors point de départ, il faut être à l'arrêt un battement avant de monter
+            value = departure if stop == source else departure - transfer
+            if value > latest[stop]:
+                latest[stop] = value
+                journey[stop] = ('ride', i, alighting[trip_index])
+                for j in range(offsets[stop], offsets[stop + 1]):
+                    neighbour, seconds = foot_targets[j], foot_seconds[j]
+                    if departure - seconds > latest[neighbour]:
+                        latest[neighbour] = departure - seconds
+                        journey[neighbour] = ('walk', stop, departure - seconds, seconds)
+
+        if journey[source] is None:
+            return None
+
+        legs = []
+        stop = source
+        while stop != target:
+            step = journey[stop]
+            if step[0] == 'ride':
+                legs.append(self._ride_leg(step[1], step[2]))
+                stop = arr_stop[step[2]]
+            else:
+                legs.append(self._walk_leg(stop, step[1], step[2], step[3]))
+                stop = step[1]
+        return legs
+
+    def _ride_leg(self, first, last):
+        trip_index = int(self.trip[first])
+        return {
+            'type': 'ride',
+            'trip_id': int(self.trip_ids[trip_index]),
+            'route_id': int(self.trip_routes[trip_index]),
+            'from_stop': int(self.stop_ids[self.dep_stop[first]]),
+            'to_stop': int(self.stop_ids[self.arr_stop[last]]),
+            'departure': int(self.dep_time[first]),
+            'arrival': int(self.arr_time[last]),
+        }
+
+    def _walk_leg(self, origin, destination, start, seconds):
+        return {
+            'type': 'walk',
+            'from_stop': int(self.stop_ids[origin]),
+            'to_stop': int(self.stop_ids[destination]),
+            'departure': int(start),
+            'arrival': int(start + seconds),
+        }
+
+
+class JourneyPlanner(ServiceBase):
+    """
+    Calcul d'itinéraires arrêt à arrêt sur les trips générés du jour.
+    Les tables de connexions sont conservées en mémoire par processus et mises à jour
+    de façon incrémentale à partir du journal des trips modifiés (partagé via le cache).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.WALK_RADIUS_METERS = 400       # Distance maximale d'une correspondance à pied
+        self.WALK_SPEED_MPS = 1.2           # Vitesse de marche
+        self.WALK_DETOUR_FACTOR = 1.3       # Distance réelle / distance à vol d'oiseau
+        self.MIN_TRANSFER_SECONDS = 60      # Battement minimal entre deux trips au même arrêt
+        self.MAX_CACHED_DAYS = 3            # Jours de service gardés en mémoire
+        self.MAX_INCREMENTAL_CHANGES = 500  # Au-delà, reconstruction complète
+        self.CHANGE_TIMEOUT = 24 * 3600
+        self.EXCLUDED_STATUSES = ['cancelled']
+        self.NETWORK_VERSION_KEY = 'journey_network_version'
+        self.TRIP_VERSION_KEY = 'journey_trip_version_{date}'
+        self.TRIP_CHANGE_KEY = 'journey_trip_change_{date}_{version}'
+        self._timetables = {}
+
+    # ------------------------------------------------------------------
+    # Requêtes
+    # ------------------------------------------------------------------
+
+    def plan(self, from_stop_id, to_stop_id, service_date, depart_at=None, arrive_by=None):
+        """
+        Itinéraire au plus tôt (depart_at) ou au plus tard (arrive_by), heures 'datetime.time'.
+        Retourne None si aucun itinéraire n'existe ce jour-là.
+        """
+        timetable = self.get_timetable(service_date)
+        try:
+            source = timetable.stop_index[int(from_stop_id)]
+            target = timetable.stop_index[int(to_stop_id)]
+        except KeyError:
+            raise ValueError("Arrêt inconnu ou inactif")
+
+        if arrive_by is not None:
+            legs = timetable.latest_departure(source, target, self._seconds(arrive_by))
+        else:
+            legs = timetable.earliest_arrival(
+                source, target, self._seconds(depart_at or timezone.localtime().time())
+            )
+        if legs is None:
+            return None
+        return self._format_journey(service_date, legs)
+
+    def versions(self, service_date):
+        """(version du réseau, version des trips du jour) partagées entre processus"""
+        return (
+            self._shared_version(self.NETWORK_VERSION_KEY),
+            self._shared_version(self.TRIP_VERSION_KEY.format(date=service_date.isoformat())),
+        )
+
+    def get_timetable(self, service_date):
+        """Table du jour de service, construite ou mise à jour si nécessaire"""
+        network_version, trip_version = self.versions(service_date)
+
+        entry = self._timetables.get(service_date)
+        if entry is None or entry['network_version'] != network_version:
+            entry = self._build(service_date, network_version, trip_version)
+        elif entry['trip_version'] != trip_version:
+            self._apply_changes(entry, service_date, trip_version)
+        return entry['timetable']
+
+    # ------------------------------------------------------------------
+    # Invalidation (appelée par les signaux)
+    # ------------------------------------------------------------------
+
+    def record_trip_change(self, trip_id, service_date):
+        """Inscrit un trip modifié au journal partagé du jour de service"""
+        version_key = self.TRIP_VERSION_KEY.format(date=service_date.isoformat())
+        cache.add(version_key, 0, None)
+        try:
+            version = cache.incr(version_key)
+        except ValueError:
+            return
+        cache.set(
+            self.TRIP_CHANGE_KEY.format(date=service_date.isoformat(), version=version),
+            trip_id,
+            self.CHANGE_TIMEOUT
+        )
+
+    def invalidate(self):
+        """Force la reconstruction complète (arrêts, séquences ou création en masse)"""
+        cache.add(self.NETWORK_VERSION_KEY, 0, None)
+        try:
+            cache.incr(self.NETWORK_VERSION_KEY)
+        except ValueError:
+            pass
+        self._timetables.clear()
+
+    # ------------------------------------------------------------------
+    # Construction
+    # ------------------------------------------------------------------
+
+    def _build(self, service_date, network_version, trip_version):
+        stops = list(Stop.objects.filter(is_active=True).values_list('id', 'latitude', 'longitude'))
+        stop_ids = [stop_id for stop_id, _, _ in stops]
+        grid = StopProximityGrid(
+            [float(latitude) for _, latitude, _ in stops],
+            [float(longitude) for _, _, longitude in stops],
+            cell_meters=self.WALK_RADIUS_METERS
+        )
+        sources, targets, meters = grid.pairs(self.WALK_RADIUS_METERS)
+        seconds = np.ceil(meters * self.WALK_DETOUR_FACTOR / self.WALK_SPEED_MPS)
+
+        timetable = ConnectionTimetable(
+            service_date, stop_ids, (sources, targets, seconds),
+            min_transfer_seconds=self.MIN_TRANSFER_SECONDS
+        )
+        entry = {
+            'timetable': timetable,
+            'patterns': self._stop_patterns(timetable),
+            'network_version': network_version,
+            'trip_version': trip_version,
+        }
+        trips = self._trips(service_date)
+        trip_indices = timetable.register_trips(
+            [trip_id for trip_id, _, _ in trips], [route_id for _, route_id, _ in trips]
+        )
+        timetable.set_connections(*self._connections(entry['patterns'], trips, trip_indices))
+
+        if len(self._timetables) >= self.MAX_CACHED_DAYS:
+            self._timetables.pop(min(self._timetables))
+        self._timetables[service_date] = entry
+        self.log_info(
+            f"Journey timetable built for {service_date}: {len(trips)} trips, {len(timetable)} connections"
+        )
+        return entry
+
+    def _apply_changes(self, entry, service_date, trip_version):
+        """Remplace les connexions des seuls trips modifiés depuis la version locale"""
+        first = entry['trip_version'] + 1
+        if trip_version - first + 1 > self.MAX_INCREMENTAL_CHANGES or trip_version < first:
+            self._build(service_date, entry['network_version'], trip_version)
+            return
+
+        keys = [
+            self.TRIP_CHANGE_KEY.format(date=service_date.isoformat(), version=version)
+            for version in range(first, trip_version + 1)
+        ]
+        changes = cache.get_many(keys)
+        if len(changes) != len(keys):
+            # Journal expiré : impossible de savoir ce qui a changé
+            self._build(service_date, entry['network_version'], trip_version)
+            return
+
+        trip_ids = set(changes.values())
+        timetable = entry['timetable']
+        removed = [timetable.trip_index[trip_id] for trip_id in trip_ids if trip_id in timetable.trip_index]
+        trips = self._trips(service_date, trip_ids)
+        trip_indices = timetable.register_trips(
+            [trip_id for trip_id, _, _ in trips], [route_id for _, route_id, _ in trips]
+        )
+        timetable.replace_trips(
+            np.asarray(removed + trip_indices.tolist(), dtype=np.int32),
+            self._connections(entry['patterns'], trips, trip_indices)
+        )
+        entry['trip_version'] = trip_version
+
+    def _stop_patterns(self, timetable):
+        """Séquences d'arrêts en indices denses, décalages en secondes"""
+        patterns = {}
+        for route_id, stops in load_route_patterns().items():
+            stops = [stop for stop in stops if stop['stop_id'] in timetable.stop_index]
+            if len(stops) < 2:
+                continue
+            patterns[route_id] = (
+                np.asarray([timetable.stop_index[stop['stop_id']] for stop in stops], dtype=np.int32),
+                np.asarray([stop['arrival_offset'] for stop in stops], dtype=np.int32),
+                np.asarray([stop['departure_offset'] for stop in stops], dtype=np.int32),
+            )
+        return patterns
+
+    def _trips(self, service_date, trip_ids=None):
+        """(id, route_id, départ en secondes depuis minuit local) des trips du jour"""
+        day_start = timezone.make_aware(datetime.combine(service_date, time.min))
+        trips = Trip.objects.filter(
+            planned_departure__gte=day_start,
+            planned_departure__lt=day_start + timedelta(days=1)
+        ).exclude(status__in=self.EXCLUDED_STATUSES)
+        if trip_ids is not None:
+            trips = trips.filter(id__in=trip_ids)
+        return [
+            (trip_id, route_id, int((departure - day_start).total_seconds()))
+            for trip_id, route_id, departure in trips.values_list('id', 'route_id', 'planned_departure')
+        ]
+
+    def _connections(self, patterns, trips, trip_indices):
+        """Connexions de tous les trips, vectorisées par route"""
+        by_route = {}
+        for (_, route_id, departure), trip_index in zip(trips, trip_indices):
+            if route_id in patterns:
+                by_route.setdefault(route_id, ([], []))
+                by_route[route_id][0].append(departure)
+                by_route[route_id][1].append(trip_index)
+
+        columns = [[], [], [], [], []]
+        for route_id, (departures, indices) in by_route.items():
+            stops, arrival_offsets, departure_offsets = patterns[route_id]
+            departures = np.asarray(departures, dtype=np.int32)
+            count = len(departures)
+            segments = len(stops) - 1
+            columns[0].append(np.tile(stops[:-1], count))
+            columns[1].append(np.tile(stops[1:], count))
+            columns[2].append(np.add.outer(departures, departure_offsets[:-1]).ravel())
+            columns[3].append(np.add.outer(departures, arrival_offsets[1:]).ravel())
+            columns[4].append(np.repeat(np.asarray(indices, dtype=np.int32), segments))
+
+        return tuple(
+            np.concatenate(column) if column else np.empty(0, dtype=np.int32)
+            for column in columns
+        )
+
+    # ------------------------------------------------------------------
+    # Utilitaires
+    # ------------------------------------------------------------------
+
+    def _shared_version(self, key):
+        cache.add(key, 0, None)
+        return cache.get(key, 0)
+
+    def _seconds(self, value):
+        return value.hour * 3600 + value.minute * 60 + value.second
+
+    def _format_journey(self, service_date, legs):
+        day_start = timezone.make_aware(datetime.combine(service_date, time.min))
+        route_codes = dict(Route.objects.filter(
+            id__in={leg['route_id'] for leg in legs if leg['type'] == 'ride'}
+        ).values_list('id', 'route_code'))
+
+        formatted = []
+        for leg in legs:
+            leg = dict(leg)
+            leg['duration_minutes'] = round((leg['arrival'] - leg['departure']) / 60, 1)
+            leg['departure'] = (day_start + timedelta(seconds=leg['departure'])).isoformat()
+            leg['arrival'] = (day_start + timedelta(seconds=leg['arrival'])).isoformat()
+            if leg['type'] == 'ride':
+                leg['route_code'] = route_codes.get(leg['route_id'])
+            formatted.append(leg)
+
+        first, last = legs[0], legs[-1]
+        return {
+            'departure': formatted[0]['departure'],
+            'arrival': formatted[-1]['arrival'],
+            'duration_minutes': round((last['arrival'] - first['departure']) / 60, 1),
+            'transfers': max(0, sum(1 for leg in legs if leg['type'] == 'ride') - 1),
+            'legs': formatted,
+        }
+
+
+journey_planner = JourneyPlanner()
@@ -0,0 +1,66 @@
+# transport_management/services/timetable/stop_grid.py
+
+import math
+import numpy as np
+from ..trip_scheduler.deadhead import haversine_km
+
+METERS_PER_DEGREE = 111320.0
+
+
+class StopProximityGrid:
+    """
+    Grille régulière (cellules de cell_meters) sur les coordonnées des arrêts.
+    Une recherche de voisinage ne compare un point qu'aux arrêts des 9 cellules voisines.
+    """
+
+    def __init__(self, latitudes, longitudes, cell_meters=400):
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.cell_meters = cell_meters
+        mean_latitude = float(self.latitudes.mean()) if len(self.latitudes) else 0.0
+        self._lat_step = cell_meters / METERS_PER_DEGREE
+        self._lon_step = cell_meters / (METERS_PER_DEGREE * max(math.cos(math.radians(mean_latitude)), 0.01))
+
+        self._cells = {}
+        for index, cell in enumerate(zip(*self._cell_of(self.latitudes, self.longitudes))):
+            self._cells.setdefault(cell, []).append(index)
+        self._cells = {cell: np.asarray(indices) for cell, indices in self._cells.items()}
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def _cell_of(self, latitude, longitude):
+        return (np.floor(np.asarray(latitude) / self._lat_step).astype(int),
+                np.floor(np.asarray(longitude) / self._lon_step).astype(int))
+
+    def nearby(self, latitude, longitude, radius_meters):
+        """Indices et distances (m) des arrêts à moins de radius_meters du point, triés par distance"""
+        row, column = (int(value) for value in self._cell_of(latitude, longitude))
+        reach = max(1, int(math.ceil(radius_meters / self.cell_meters)))
+        candidates = [
+            self._cells[(row + dr, column + dc)]
+            for dr in range(-reach, reach + 1)
+            for dc in range(-reach, reach + 1)
+            if (row + dr, column + dc) in self._cells
+        ]
+        if not candidates:
+            return np.empty(0, dtype=int), np.empty(0)
+
+        indices = np.concatenate(candidates)
+        distances = haversine_km(latitude, longitude, self.latitudes[indices], self.longitudes[indices]) * 1000
+        keep = distances <= radius_meters
+        order = np.argsort(distances[keep], kind='stable')
+        return indices[keep][order], distances[keep][order]
+
+    def pairs(self, radius_meters):
+        """Toutes les paires (i, j, distance en m), i != j, à moins de radius_meters"""
+        sources, targets, distances = [], [], []
+        for index in range(len(self)):
+            neighbours, meters = self.nearby(self.latitudes[index], self.longitudes[index], radius_meters)
+            mask = neighbours != index
+            sources.append(np.full(int(mask.sum()), index))
+            targets.append(neighbours[mask])
+            distances.append(meters[mask])
+        if not sources:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0)
+        return np.concatenate(sources), np.concatenate(targets), np.concatenate(distances)
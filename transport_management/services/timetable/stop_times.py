@@ -0,0 +1,79 @@
+# transport_management/services/timetable/stop_times.py
+
+from datetime import time, timedelta
+from ...models import RouteStop
+
+DAY_NAMES = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+def load_route_patterns(route_ids=None):
+    """
+    Séquence ordonnée des arrêts actifs de chaque route avec les décalages
+    depuis le départ du trip (en secondes).
+    Retourne {route_id: [{'stop_id', 'stop_sequence', 'arrival_offset',
+    'departure_offset', 'distance', 'pickup_type', 'drop_off_type', 'is_timepoint'}]}.
+    """
+    rows = RouteStop.objects.filter(is_active=True)
+    if route_ids is not None:
+        rows = rows.filter(route_id__in=route_ids)
+    rows = rows.order_by('route_id', 'order', 'stop_sequence').values_list(
+        'route_id', 'stop_id', 'stop_sequence', 'estimated_time', 'dwell_time',
+        'distance_from_start', 'pickup_type', 'drop_off_type', 'is_timepoint'
+    )
+
+    patterns = {}
+    for (route_id, stop_id, sequence, estimated_time, dwell_time,
+         distance, pickup_type, drop_off_type, is_timepoint) in rows.iterator(chunk_size=2000):
+        arrival = (estimated_time or 0) * 60
+        stops = patterns.setdefault(route_id, [])
+        stops.append({
+            'stop_id': stop_id,
+            'stop_sequence': sequence,
+            'arrival_offset': arrival,
+            # Le départ du terminus d'origine est l'heure de départ du trip
+            'departure_offset': arrival + (dwell_time or 0) if stops else arrival,
+            'distance': float(distance or 0),
+            'pickup_type': pickup_type,
+            'drop_off_type': drop_off_type,
+            'is_timepoint': is_timepoint,
+        })
+    return patterns
+
+
+def current_delay(delay_duration, planned_departure, started=None):
+    """Retard courant d'un trip en secondes : retard mesuré, sinon écart au départ réel"""
+    if delay_duration is not None:
+        return int(delay_duration.total_seconds())
+    if started:
+        return int((started - planned_departure).total_seconds())
+    return 0
+
+
+def parse_timepoint(value):
+    """Convertit 'HH:MM[:SS]' (heures > 23 acceptées) en secondes depuis minuit"""
+    if isinstance(value, time):
+        return value.hour * 3600 + value.minute * 60 + value.second
+    parts = [int(part) for part in str(value).strip().split(':')]
+    while len(parts) < 3:
+        parts.append(0)
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def format_timepoint(seconds):
+    """Formate des secondes depuis minuit en 'HH:MM:SS' (heures > 23 conservées)"""
+    seconds = int(round(seconds))
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def seconds_to_time(seconds):
+    """Secondes depuis minuit vers datetime.time, bornées à la journée"""
+    seconds = max(0, min(int(seconds), 24 * 3600 - 1))
+    return time(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def date_range(start_date, end_date):
+    """Itère sur les dates de start_date à end_date inclus"""
+    current = start_date
+    while current <= end_date:
+        yield current
+        current += timedelta(days=1)
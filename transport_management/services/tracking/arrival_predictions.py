@@ -0,0 +1,277 @@
+# transport_management/services/tracking/arrival_predictions.py
+
+import math
+from datetime import timedelta
+import numpy as np
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.utils import timezone
+from ...models import BusPosition, Stop, Route, Trip
+from ..base.service_base import ServiceBase
+from ..timetable.journey_planner import journey_planner
+from ..timetable.stop_times import load_route_patterns, current_delay
+
+METERS_PER_DEGREE = 111320.0
+
+
+class ArrivalPredictionService(ServiceBase):
+    """
+    Prévisions d'arrivée par arrêt pour tous les trips actifs.
+    Chaque position ou changement de retard d'un trip recalcule uniquement les
+    arrêts restants de ce trip ; chaque prévision a sa propre clé de cache
+    (arrêt, trip) : un trip n'écrit jamais dans l'entrée d'un autre trip et la
+    lecture d'un arrêt est une lecture groupée des clés de ses trips actifs.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ARRIVAL_KEY = 'stop_arrival_{stop_id}_{trip_id}'
+        self.TRIP_KEY = 'trip_arrival_stops_{trip_id}'
+        self.GROUP_NAME = 'stop_arrivals_{stop_id}'
+        self.CACHE_TIMEOUT = 3 * 3600           # Un trip silencieux disparaît de lui-même
+        self.ACTIVE_STATUSES = ['in_progress', 'delayed']
+        self.MAX_SNAP_METERS = 300              # Au-delà, la position n'est pas projetée sur le tracé
+        self.PASSED_GRACE_SECONDS = 60          # Arrivée prévue dépassée : encore affichée ce délai
+        self.NOTIFY_THRESHOLD_SECONDS = 30      # Variation minimale poussée aux abonnés
+        self.POSITION_MAX_AGE_MINUTES = 10
+        self._patterns = {}
+        self._network_version = None
+
+    # ------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------
+
+    def arrivals(self, stop_id, limit=10, now=None):
+        """Prochaines arrivées prévues à l'arrêt, triées par heure prévue"""
+        now = now or timezone.now()
+        threshold = now.timestamp() - self.PASSED_GRACE_SECONDS
+        trip_ids = Trip.objects.filter(
+            status__in=self.ACTIVE_STATUSES, route__routestop__stop_id=stop_id, route__routestop__is_active=True
+        ).values_list('id', flat=True).distinct()
+        entries = cache.get_many([self.ARRIVAL_KEY.format(stop_id=stop_id, trip_id=trip_id) for trip_id in trip_ids])
+
+        arrivals = sorted(
+            (entry for entry in entries.values() if entry['arrival_timestamp'] >= threshold),
+            key=lambda entry: entry['arrival_timestamp']
+        )[:limit]
+        return [
+            {**entry, 'minutes_away': max(0.0, round((entry['arrival_timestamp'] - now.timestamp()) / 60, 1))}
+            for entry in arrivals
+        ]
+
+    # ------------------------------------------------------------------
+    # Mise à jour incrémentale
+    # ------------------------------------------------------------------
+
+    def update_trip(self, trip, position=None, now=None):
+        """
+        Recalcule les prévisions des arrêts restants du trip.
+        Avec une position, le retard est mesuré sur le tracé ; sinon le retard courant du trip est propagé.
+        """
+        try:
+            if trip.status not in self.ACTIVE_STATUSES:
+                self.remove_trip(trip.id)
+                return []
+
+            now = now or timezone.now()
+            pattern = self._pattern(trip.route_id)
+            if pattern is None:
+                return []
+
+            trip_key = self.TRIP_KEY.format(trip_id=trip.id)
+            state = cache.get(trip_key) or {'stops': [], 'segment': 0}
+
+            position = position or self._latest_position(trip.id, now)
+            located = self._locate(pattern, position, state['segment']) if position else None
+            if located:
+                segment, progress = located
+                delay = int((position.timestamp - trip.planned_departure).total_seconds() - progress)
+                upcoming = np.arange(segment + 1, len(pattern['stop_ids']))
+                source = 'position'
+                observed_at = position.timestamp
+            else:
+                segment = state['segment']
+                delay = current_delay(
+                    trip.delay_duration, trip.planned_departure, trip.actual_start_time or trip.departure_time
+                )
+                departures = trip.planned_departure.timestamp() + pattern['departure'] + delay
+                upcoming = np.flatnonzero(departures >= now.timestamp())
+                source = 'schedule'
+                observed_at = now
+                progress = float(np.clip(
+                    (now - trip.planned_departure).total_seconds() - delay, 0, pattern['arrival'][-1]
+                ))
+
+            predictions = self._predictions(trip, pattern, upcoming, delay, source, now)
+            self._store(trip.id, state['stops'], predictions)
+            cache.set(trip_key, {
+                'stops': list(predictions),
+                'segment': segment,
+                # Dernière position connue ramenée au tracé (utilisée par la surveillance des intervalles)
+                'route_id': trip.route_id,
+                'planned_departure': trip.planned_departure.timestamp(),
+                'progress_seconds': progress,
+                'distance': float(np.interp(progress, pattern['arrival'], pattern['distances'])),
+                'delay_seconds': delay,
+                'source': source,
+                'observed_at': observed_at.timestamp(),
+            }, self.CACHE_TIMEOUT)
+            return list(predictions.values())
+
+        except Exception as e:
+            self.log_error(f"Error updating arrival predictions for trip {trip.id}: {str(e)}", exc=e)
+            return []
+
+    def trip_states(self, trip_ids):
+        """Dernier état connu (progression sur le tracé, retard) des trips, en une lecture de cache"""
+        keys = {self.TRIP_KEY.format(trip_id=trip_id): trip_id for trip_id in trip_ids}
+        return {keys[key]: state for key, state in cache.get_many(list(keys)).items() if 'progress_seconds' in state}
+
+    def remove_trip(self, trip_id):
+        """Retire le trip (terminé, annulé) de tous les arrêts où il figurait"""
+        trip_key = self.TRIP_KEY.format(trip_id=trip_id)
+        state = cache.get(trip_key)
+        if state:
+            self._store(trip_id, state['stops'], {})
+            cache.delete(trip_key)
+
+    def _predictions(self, trip, pattern, upcoming, delay, source, now):
+        planned = trip.planned_departure
+        vehicle_id = trip.vehicle_id
+        updated_at = int(now.timestamp())
+        predictions = {}
+        for index in upcoming:
+            scheduled = planned + timedelta(seconds=int(pattern['arrival'][index]))
+            predicted = scheduled + timedelta(seconds=delay)
+            stop_id = int(pattern['stop_ids'][index])
+            predictions[stop_id] = {
+                'trip_id': trip.id,
+                'route_id': trip.route_id,
+                'route_code': pattern['route_code'],
+                'vehicle_id': vehicle_id,
+                'stop_sequence': int(pattern['sequences'][index]),
+                'scheduled_arrival': scheduled.isoformat(),
+                'predicted_arrival': predicted.isoformat(),
+                'arrival_timestamp': int(predicted.timestamp()),
+                'delay_seconds': delay,
+                'source': source,
+                'updated_at': updated_at,
+            }
+        return predictions
+
+    def _store(self, trip_id, previous_stops, predictions):
+        """Écrit les prévisions du trip sous ses clés (arrêt, trip), retire les arrêts dépassés et notifie les abonnés"""
+        stop_ids = set(previous_stops) | set(predictions)
+        if not stop_ids:
+            return
+        keys = {stop_id: self.ARRIVAL_KEY.format(stop_id=stop_id, trip_id=trip_id) for stop_id in stop_ids}
+        current = cache.get_many(list(keys.values()))
+
+        changed = {}
+        removed = []
+        notifications = []
+        for stop_id, key in keys.items():
+            previous = current.get(key)
+            prediction = predictions.get(stop_id)
+            if prediction is None:
+                if previous is None:
+                    continue
+                removed.append(key)
+                notifications.append((stop_id, {'stop_id': stop_id, 'removed_trip_id': trip_id}))
+            else:
+                changed[key] = prediction
+                if previous is None or abs(
+                    previous['arrival_timestamp'] - prediction['arrival_timestamp']
+                ) >= self.NOTIFY_THRESHOLD_SECONDS:
+                    notifications.append((stop_id, {'stop_id': stop_id, 'arrival': prediction}))
+
+        cache.set_many(changed, self.CACHE_TIMEOUT)
+        cache.delete_many(removed)
+        self._notify(notifications)
+
+    def _notify(self, notifications):
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        for stop_id, payload in notifications:
+            try:
+                async_to_sync(channel_layer.group_send)(
+                    self.GROUP_NAME.format(stop_id=stop_id),
+                    {'type': 'send_arrivals', 'arrivals': payload}
+                )
+            except Exception as e:
+                self.log_warning(f"Arrival notification failed for stop {stop_id}: {str(e)}")
+
+    # ------------------------------------------------------------------
+    # Géométrie et tracés
+    # ------------------------------------------------------------------
+
+    def _locate(self, pattern, position, last_segment):
+        """
+        Projette la position sur les segments inter-arrêts ; retourne (segment,
+        secondes prévues depuis le départ au point projeté) ou None hors tracé.
+        Les segments déjà dépassés ne sont considérés que si aucun segment suivant ne convient.
+        """
+        if len(pattern['stop_ids']) < 2:
+            return None
+        latitude, longitude = float(position.latitude), float(position.longitude)
+        scale = METERS_PER_DEGREE * math.cos(math.radians(latitude))
+        x = (pattern['longitudes'] - longitude) * scale
+        y = (pattern['latitudes'] - latitude) * METERS_PER_DEGREE
+
+        ax, ay, bx, by = x[:-1], y[:-1], x[1:], y[1:]
+        dx, dy = bx - ax, by - ay
+        length = dx * dx + dy * dy
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.where(length > 0, -(ax * dx + ay * dy) / length, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        distances = np.hypot(ax + t * dx, ay + t * dy)
+
+        ahead = distances.copy()
+        ahead[:last_segment] = np.inf
+        segment = int(np.argmin(ahead))
+        if ahead[segment] > self.MAX_SNAP_METERS:
+            segment = int(np.argmin(distances))
+            if distances[segment] > self.MAX_SNAP_METERS:
+                return None
+
+        start = pattern['departure'][segment]
+        end = pattern['arrival'][segment + 1]
+        return segment, float(start + t[segment] * (end - start))
+
+    def _pattern(self, route_id):
+        """Séquence d'arrêts de la route (coordonnées et décalages), rechargée si le réseau a changé"""
+        network_version = journey_planner.versions(timezone.localdate())[0]
+        if network_version != self._network_version:
+            self._patterns = {}
+            self._network_version = network_version
+
+        if route_id not in self._patterns:
+            stops = load_route_patterns([route_id]).get(route_id)
+            if not stops:
+                self._patterns[route_id] = None
+                return None
+            coordinates = Stop.objects.in_bulk([stop['stop_id'] for stop in stops])
+            route_code = Route.objects.filter(id=route_id).values_list('route_code', flat=True).first()
+            self._patterns[route_id] = {
+                'route_code': route_code,
+                'stop_ids': np.asarray([stop['stop_id'] for stop in stops], dtype=np.int64),
+                'sequences': np.asarray([stop['stop_sequence'] for stop in stops], dtype=np.int64),
+                'arrival': np.asarray([stop['arrival_offset'] for stop in stops], dtype=float),
+                'departure': np.asarray([stop['departure_offset'] for stop in stops], dtype=float),
+                'distances': np.asarray([stop['distance'] for stop in stops], dtype=float),
+                'latitudes': np.asarray([float(coordinates[stop['stop_id']].latitude) for stop in stops]),
+                'longitudes': np.asarray([float(coordinates[stop['stop_id']].longitude) for stop in stops]),
+            }
+        return self._patterns[route_id]
+
+    def _latest_position(self, trip_id, now):
+        return BusPosition.objects.filter(
+            trip_id=trip_id,
+            is_valid=True,
+            timestamp__gte=now - timedelta(minutes=self.POSITION_MAX_AGE_MINUTES)
+        ).order_by('-timestamp').first()
+
+
+arrival_predictions = ArrivalPredictionService()
@@ -10,10 +10,15 @@ import json
 from math import radians, sin, cos, sqrt, atan2
 from ...models import Trip, BusPosition, Stop
 from ..base.service_base import ServiceBase
+from .arrival_predictions import arrival_predictions
+from ..geofencing.geofence_engine import geofence_engine
+from ..emergency.emergency_manager import emergency_manager
+from ..resource.fleet_manager import FleetManager
 
 class PositionTrackingService(ServiceBase):
     def __init__(self):
         super().__init__()
+        self.fleet_manager = FleetManager()
 
     def process_gps_data(self, raw_data):
         """
@@ -41,6 +46,19 @@ class PositionTrackingService(ServiceBase):
             
             # Mise à jour des métriques et détection des événements
             self._update_trip_metrics(position)
+
+            # Prévisions d'arrivée des arrêts restants
+            arrival_predictions.update_trip(position.trip, position)
+
+            # Échéance de perte de communication du véhicule
+            if position.trip.vehicle_id:
+                self.fleet_manager.record_heartbeat(position.trip.vehicle_id, position)
+
+            # Entrées, sorties et stationnements dans les zones géographiques
+            geofence_engine.process_position(position)
+
+            # Règles d'urgence sur l'état glissant du trip
+            emergency_manager.evaluate_position(position)
             
             return position
 
@@ -0,0 +1,236 @@
+# transport_management/services/tracking/track_analytics.py
+
+from datetime import datetime, time, timedelta
+import numpy as np
+from django.db import connection
+from django.utils import timezone
+from ...models import Trip, BusPosition, RouteStop, TripTrackSummary
+from ..base.service_base import ServiceBase
+from ..trip_scheduler.deadhead import haversine_km, METERS_PER_DEGREE
+
+
+class TrackAnalyticsService(ServiceBase):
+    """
+    Synthèse des traces GPS par trip. Les positions valides d'un lot de trips (un trip, une
+    journée de flotte) sont chargées en une requête sous forme de tableaux NumPy triés par
+    trip puis horodatage ; chaque segment entre deux positions consécutives d'un même trip
+    est qualifié (en mouvement, à l'arrêt, trou de suivi, saut GPS) et les métriques sont
+    sommées par trip avec bincount. Les synthèses sont enregistrées en un upsert groupé.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.MOVING_SPEED_KMH = 3.0  # En dessous, le véhicule est considéré à l'arrêt
+        self.MAX_SEGMENT_SPEED_KMH = 150.0  # Au-delà, saut GPS : position isolée retirée, sinon segment ignoré
+        self.GAP_SECONDS = 60  # Trou de suivi
+        self.STOP_RADIUS_METERS = 50  # Position rattachée à l'arrêt le plus proche dans ce rayon
+        self.SPEED_BANDS = (0, 10, 20, 30, 40, 50, 60, 80)  # km/h, dernière tranche ouverte
+        self.CHUNK_SIZE = 4096  # Positions x arrêts par bloc de calcul des distances
+        self.BATCH_SIZE = 500
+        self.SUMMARY_FIELDS = (
+            'position_count', 'first_position_at', 'last_position_at', 'distance_km', 'duration_seconds',
+            'moving_seconds', 'stopped_seconds', 'average_moving_speed', 'max_speed', 'speed_profile',
+            'stop_dwells', 'total_dwell_seconds', 'gap_count', 'longest_gap_seconds', 'computed_at'
+        )
+
+    # ------------------------------------------------------------------
+    # Entrées
+    # ------------------------------------------------------------------
+
+    def summarize_trip(self, trip_id):
+        return self.summarize(Trip.objects.filter(pk=trip_id))
+
+    def summarize_day(self, service_date):
+        """Synthèse de tous les trips partis (heure prévue) le jour de service donné"""
+        start = timezone.make_aware(datetime.combine(service_date, time.min))
+        return self.summarize(Trip.objects.filter(
+            planned_departure__gte=start, planned_departure__lt=start + timedelta(days=1)
+        ))
+
+    def summarize(self, trips):
+        """Calcule et enregistre la synthèse des trips ; retourne le nombre de synthèses écrites"""
+        rows = list(trips.order_by('id').values_list('id', 'route_id'))
+        if not rows:
+            return 0
+        trip_ids = np.asarray([row[0] for row in rows], dtype=np.int64)
+        route_ids = np.asarray([row[1] for row in rows], dtype=np.int64)
+
+        positions = self.load_positions(trip_ids.tolist())
+        stops = self.load_route_stops(set(route_ids.tolist()))
+        metrics = self.compute(trip_ids, route_ids, positions, stops)
+
+        summaries = [TripTrackSummary(trip_id=int(trip_id), **values) for trip_id, values in zip(trip_ids, metrics)]
+        # MySQL (ON DUPLICATE KEY UPDATE) n'accepte pas de cible de conflit : la clé unique du trip s'applique
+        unique_fields = ['trip'] if connection.features.supports_update_conflicts_with_target else None
+        TripTrackSummary.objects.bulk_create(
+            summaries, batch_size=self.BATCH_SIZE,
+            update_conflicts=True, unique_fields=unique_fields, update_fields=list(self.SUMMARY_FIELDS)
+        )
+        self.log_info(f"Track summaries computed for {len(summaries)} trips ({len(positions['trip_ids'])} positions)")
+        return len(summaries)
+
+    def load_positions(self, trip_ids):
+        """Positions valides en colonnes, triées par trip puis horodatage"""
+        rows = list(BusPosition.objects.filter(trip_id__in=trip_ids, is_valid=True).order_by(
+            'trip_id', 'timestamp', 'position_id'
+        ).values_list('trip_id', 'timestamp', 'latitude', 'longitude', 'speed'))
+        trips, stamps, latitudes, longitudes, speeds = zip(*rows) if rows else ([],) * 5
+        return {
+            'trip_ids': np.asarray(trips, dtype=np.int64),
+            'timestamps': list(stamps),
+            'ts': np.asarray([stamp.timestamp() for stamp in stamps], dtype=float),
+            'latitudes': np.asarray(latitudes, dtype=float),
+            'longitudes': np.asarray(longitudes, dtype=float),
+            'speeds': np.asarray([np.nan if speed is None else float(speed) for speed in speeds], dtype=float),
+        }
+
+    def load_route_stops(self, route_ids):
+        """{route_id: (identifiants d'arrêts, coordonnées (n, 2))} des arrêts actifs"""
+        stops = {}
+        rows = RouteStop.objects.filter(route_id__in=route_ids, is_active=True).order_by(
+            'route_id', 'order'
+        ).values_list('route_id', 'stop_id', 'stop__latitude', 'stop__longitude')
+        for route_id, stop_id, latitude, longitude in rows:
+            stops.setdefault(route_id, []).append((stop_id, float(latitude), float(longitude)))
+        return {
+            route_id: (np.asarray([row[0] for row in items]), np.asarray([row[1:] for row in items], dtype=float))
+            for route_id, items in stops.items()
+        }
+
+    # ------------------------------------------------------------------
+    # Calcul
+    # ------------------------------------------------------------------
+
+    def compute(self, trip_ids, route_ids, positions, stops):
+        """Métriques de chaque trip de trip_ids (triés), dans le même ordre"""
+        count = len(trip_ids)
+        index = np.searchsorted(trip_ids, positions['trip_ids'])
+        position_counts = np.bincount(index, minlength=count)
+
+        index, positions = self._drop_jumps(index, positions)
+        ts = positions['ts']
+        latitudes, longitudes = positions['latitudes'], positions['longitudes']
+        firsts = np.searchsorted(index, np.arange(count), side='left')
+        lasts = np.searchsorted(index, np.arange(count), side='right') - 1
+
+        # Segments entre positions consécutives d'un même trip
+        segment_trips = index[1:]
+        same_trip = index[1:] == index[:-1]
+        durations, distances, speeds = self._segment_speeds(ts, latitudes, longitudes)
+        usable = same_trip & (durations > 0) & (speeds <= self.MAX_SEGMENT_SPEED_KMH)
+        gaps = same_trip & (durations > self.GAP_SECONDS)
+        timed = usable & ~gaps
+        moving = timed & (speeds >= self.MOVING_SPEED_KMH)
+        stopped = timed & ~moving
+
+        def per_trip(mask, values):
+            return np.bincount(segment_trips[mask], weights=values[mask], minlength=count)
+
+        distance = per_trip(usable, distances)
+        moving_distance = per_trip(moving, distances)
+        moving_seconds = per_trip(moving, durations)
+        stopped_seconds = per_trip(stopped, durations)
+        gap_counts = np.bincount(segment_trips[gaps], minlength=count)
+        longest_gaps = np.zeros(count)
+        np.maximum.at(longest_gaps, segment_trips[gaps], durations[gaps])
+
+        # Vitesse maximale rapportée par le GPS (à défaut, vitesse des segments retenus)
+        max_speeds = np.zeros(count)
+        np.fmax.at(max_speeds, index, positions['speeds'])
+        fallback = timed & np.isnan(positions['speeds'][1:])
+        np.maximum.at(max_speeds, segment_trips[fallback], speeds[fallback])
+
+        # Profil de vitesse pondéré par le temps
+        bands = len(self.SPEED_BANDS)
+        band = np.clip(np.digitize(speeds, self.SPEED_BANDS) - 1, 0, bands - 1)
+        profiles = np.bincount(
+            segment_trips[timed] * bands + band[timed], weights=durations[timed], minlength=count * bands
+        ).reshape(count, bands)
+        labels = [
+            f"{low}-{high}" for low, high in zip(self.SPEED_BANDS, self.SPEED_BANDS[1:])
+        ] + [f"{self.SPEED_BANDS[-1]}+"]
+
+        dwells = self._stop_dwells(index, route_ids, positions, stops, timed, durations)
+
+        metrics = []
+        for trip in range(count):
+            has_positions = position_counts[trip] > 0
+            metrics.append({
+                'position_count': int(position_counts[trip]),
+                'first_position_at': positions['timestamps'][firsts[trip]] if has_positions else None,
+                'last_position_at': positions['timestamps'][lasts[trip]] if has_positions else None,
+                'distance_km': float(distance[trip]),
+                'duration_seconds': float(ts[lasts[trip]] - ts[firsts[trip]]) if has_positions else 0.0,
+                'moving_seconds': float(moving_seconds[trip]),
+                'stopped_seconds': float(stopped_seconds[trip]),
+                'average_moving_speed': (
+                    float(moving_distance[trip] / moving_seconds[trip] * 3600) if moving_seconds[trip] else 0.0
+                ),
+                'max_speed': float(max_speeds[trip]),
+                'speed_profile': {label: float(seconds) for label, seconds in zip(labels, profiles[trip]) if seconds},
+                'stop_dwells': dwells.get(trip, []),
+                'total_dwell_seconds': float(sum(dwell['seconds'] for dwell in dwells.get(trip, []))),
+                'gap_count': int(gap_counts[trip]),
+                'longest_gap_seconds': float(longest_gaps[trip]),
+                'computed_at': timezone.now(),
+            })
+        return metrics
+
+    def _segment_speeds(self, ts, latitudes, longitudes):
+        """(durées s, distances km, vitesses km/h) des segments entre positions consécutives"""
+        durations = np.diff(ts)
+        distances = haversine_km(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speeds = np.where(durations > 0, distances / durations * 3600, np.inf)
+        return durations, distances, speeds
+
+    def _drop_jumps(self, index, positions):
+        """Retire les sauts GPS isolés : positions dont les segments entrant et sortant sont irréalistes"""
+        _, _, speeds = self._segment_speeds(positions['ts'], positions['latitudes'], positions['longitudes'])
+        too_fast = (index[1:] == index[:-1]) & (speeds > self.MAX_SEGMENT_SPEED_KMH)
+        jumps = np.zeros(len(index), dtype=bool)
+        jumps[1:-1] = too_fast[:-1] & too_fast[1:]
+        if not jumps.any():
+            return index, positions
+        kept = np.flatnonzero(~jumps)
+        filtered = {name: values[kept] for name, values in positions.items() if name != 'timestamps'}
+        filtered['timestamps'] = [positions['timestamps'][row] for row in kept]
+        return index[kept], filtered
+
+    def _stop_dwells(self, index, route_ids, positions, stops, timed, durations):
+        """
+        Temps passé à chaque arrêt : segments dont les deux extrémités sont rattachées au
+        même arrêt de la route du trip. Retourne {indice du trip: [{'stop_id', 'seconds'}]}.
+        """
+        if not len(index):
+            return {}
+        nearest = np.full(len(index), -1, dtype=np.int64)
+        position_routes = route_ids[index]
+        for route_id, (stop_ids, coordinates) in stops.items():
+            rows = np.flatnonzero(position_routes == route_id)
+            for start in range(0, len(rows), self.CHUNK_SIZE):
+                chunk = rows[start:start + self.CHUNK_SIZE]
+                lat = positions['latitudes'][chunk, None]
+                lon = positions['longitudes'][chunk, None]
+                dy = (coordinates[None, :, 0] - lat) * METERS_PER_DEGREE
+                dx = (coordinates[None, :, 1] - lon) * METERS_PER_DEGREE * np.cos(np.radians(lat))
+                squared = dx * dx + dy * dy
+                closest = squared.argmin(axis=1)
+                near = squared[np.arange(len(chunk)), closest] <= self.STOP_RADIUS_METERS ** 2
+                nearest[chunk[near]] = stop_ids[closest[near]]
+
+        at_stop = timed & (nearest[:-1] >= 0) & (nearest[:-1] == nearest[1:])
+        if not at_stop.any():
+            return {}
+        keys, inverse = np.unique(
+            np.stack([index[1:][at_stop], nearest[1:][at_stop]], axis=1), axis=0, return_inverse=True
+        )
+        seconds = np.bincount(inverse.ravel(), weights=durations[at_stop])
+
+        dwells = {}
+        for (trip, stop_id), total in zip(keys, seconds):
+            dwells.setdefault(int(trip), []).append({'stop_id': int(stop_id), 'seconds': float(total)})
+        return dwells
+
+
+track_analytics = TrackAnalyticsService()
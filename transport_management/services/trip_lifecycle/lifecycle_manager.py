@@ -5,8 +5,9 @@ from django.db import transaction
 from django.utils import timezone
 from datetime import datetime, timedelta
 from django.db.models import Q
-from ...models import Trip, BusPosition, Stop, EventLog
+from ...models import Trip, BusPosition, Stop, RouteStop, EventLog
 from ..base.service_base import ServiceBase
+from ..geofencing.geofence_engine import geofence_engine
 
 class TripLifecycleManager(ServiceBase):
     def __init__(self):
@@ -15,29 +16,18 @@ class TripLifecycleManager(ServiceBase):
     def process_lifecycle_updates(self):
         """
         Vérifie et met à jour le statut des trips en cours
-        Cette méthode sera appelée périodiquement (par ex. toutes les minutes)
+        Cette méthode sera appelée périodiquement (par ex. toutes les minutes).
+        Le démarrage des trips planifiés est déclenché à l'heure par transition_scheduler.
         """
         try:
-            self._start_pending_trips()
             self._update_active_trips()
             self._check_completed_trips()
         except Exception as e:
             self.log_error(f"Error processing lifecycle updates: {str(e)}", exc=e)
 
-    def _start_pending_trips(self):
-        """Démarre les trips qui doivent commencer"""
-        try:
-            # Trouver les trips planifiés qui devraient démarrer
-            pending_trips = Trip.objects.filter(
-                status='planned',
-                planned_departure__lte=timezone.now() + timedelta(minutes=5)
-            )
-
-            for trip in pending_trips:
-                self._check_and_start_trip(trip)
-
-        except Exception as e:
-            self.log_error(f"Error starting pending trips: {str(e)}", exc=e)
+    def try_start_trip(self, trip):
+        """Démarre le trip si le véhicule et le chauffeur sont prêts ; retourne True si démarré"""
+        return self._check_and_start_trip(trip)
 
     def _check_and_start_trip(self, trip):
         """Vérifie les conditions et démarre un trip"""
@@ -46,12 +36,12 @@ class TripLifecycleManager(ServiceBase):
             start_position = self._verify_start_position(trip)
             if not start_position:
                 self.log_warning(f"Trip {trip.id} cannot start - Vehicle not at start position")
-                return
+                return False
 
             # 2. Vérifier que le chauffeur est présent via son mobile
             if not self._verify_driver_presence(trip):
                 self.log_warning(f"Trip {trip.id} cannot start - Driver not present")
-                return
+                return False
 
             # 3. Démarrer le trip
             with transaction.atomic():
@@ -68,12 +58,14 @@ class TripLifecycleManager(ServiceBase):
                 )
 
                 self.log_info(f"Trip {trip.id} started successfully")
+                return True
 
         except Exception as e:
             self.log_error(f"Error starting trip {trip.id}: {str(e)}", exc=e)
+            return False
 
     def _verify_start_position(self, trip):
-        """Vérifie si le bus est à la position de départ"""
+        """Vérifie si le bus est dans la zone de l'arrêt de départ (zone de l'arrêt ou rayon par défaut)"""
         try:
             # Obtenir la dernière position connue
             latest_position = BusPosition.objects.filter(
@@ -83,22 +75,20 @@ class TripLifecycleManager(ServiceBase):
             if not latest_position:
                 return False
 
-            # Vérifier la distance par rapport au point de départ
-            start_stop = trip.route.stops.first()  # Supposons que le premier arrêt est le départ
-            if not start_stop:
+            # Premier arrêt de la séquence de la route
+            start_stop_id = RouteStop.objects.filter(
+                route_id=trip.route_id,
+                is_active=True
+            ).order_by('order').values_list('stop_id', flat=True).first()
+            if not start_stop_id:
                 return False
 
-            # Calculer la distance
-            distance = self._calculate_distance(
-                latest_position.latitude, 
-                latest_position.longitude,
-                start_stop.latitude,
-                start_stop.longitude
+            return geofence_engine.is_at_stop(
+                start_stop_id,
+                latest_position.latitude,
+                latest_position.longitude
             )
 
-            # Tolérance de 100 mètres
-            return distance <= 0.1
-
         except Exception as e:
             self.log_error(f"Error verifying start position: {str(e)}", exc=e)
             return False
@@ -0,0 +1,118 @@
+# transport_management/services/trip_lifecycle/transition_scheduler.py
+
+from datetime import timedelta
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from ...models import Trip
+from ..base.service_base import ServiceBase
+from .lifecycle_manager import TripLifecycleManager
+
+
+class TripTransitionScheduler(ServiceBase):
+    """
+    Transitions horaires des trips déclenchées à l'heure exacte par des tâches Celery
+    à ETA, armées à la création ou à la reprogrammation du trip.
+    Chaque tâche porte un jeton dérivé des heures prévues : une tâche armée avant
+    une reprogrammation ne fait plus rien quand elle se déclenche.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.START_LEAD = timedelta(minutes=5)          # Vérification de démarrage avant le départ
+        self.START_RETRY = timedelta(minutes=1)         # Nouvel essai si le véhicule n'est pas prêt
+        self.START_GRACE = timedelta(minutes=15)        # Plus de tentative de démarrage au-delà
+        # Transitions d'affichage (Trip.update_status) : (nom, repère, décalage)
+        self.DISPLAY_TRANSITIONS = [
+            ('boarding_soon', 'departure', timedelta(minutes=-10)),
+            ('boarding', 'departure', timedelta(minutes=-5)),
+            ('in_transit', 'departure', timedelta(seconds=1)),
+            ('arriving_soon', 'arrival', timedelta(minutes=-5)),
+            ('completed', 'arrival', timedelta(seconds=1)),
+        ]
+        self.DISPLAY_STATUSES = ['scheduled', 'boarding_soon', 'boarding', 'in_transit', 'arriving_soon']
+        # Les ETA lointaines sont armées plus tard par arm_upcoming (délai de visibilité du broker)
+        self.ARM_HORIZON = timedelta(minutes=50)
+        self.ARMED_KEY = 'trip_transition_armed_{trip_id}_{token}_{transition}'
+
+    def token(self, trip):
+        return f"{int(trip.planned_departure.timestamp())}-{int(trip.planned_arrival.timestamp())}"
+
+    def plan(self, trip, now=None):
+        """Échéances [(transition, eta)] à armer pour le trip dans l'horizon courant"""
+        now = now or timezone.now()
+        if trip.status == 'planned':
+            eta = trip.planned_departure - self.START_LEAD
+            if now > trip.planned_departure + self.START_GRACE:
+                return []
+            deadlines = [('start', max(eta, now))]
+        elif trip.status in self.DISPLAY_STATUSES:
+            anchors = {'departure': trip.planned_departure, 'arrival': trip.planned_arrival}
+            deadlines = [(name, anchors[anchor] + offset) for name, anchor, offset in self.DISPLAY_TRANSITIONS]
+            # Échéances déjà passées : un seul rattrapage immédiat, update_status déduit l'état courant
+            due = [name for name, eta in deadlines if eta <= now]
+            deadlines = [(name, eta) for name, eta in deadlines if eta > now]
+            if due:
+                deadlines.insert(0, (due[-1], now))
+        else:
+            return []
+        return [(name, eta) for name, eta in deadlines if eta <= now + self.ARM_HORIZON]
+
+    def arm(self, trip, now=None):
+        """Arme les tâches à ETA du trip (une seule fois par transition et par jeton)"""
+        try:
+            token = self.token(trip)
+            armed = []
+            for transition, eta in self.plan(trip, now):
+                key = self.ARMED_KEY.format(trip_id=trip.id, token=token, transition=transition)
+                if not cache.add(key, True, int(self.ARM_HORIZON.total_seconds() * 2)):
+                    continue
+                self._dispatch(trip.id, transition, token, eta)
+                armed.append((transition, eta))
+            return armed
+
+        except Exception as e:
+            self.log_error(f"Error arming transitions for trip {trip.id}: {str(e)}", exc=e)
+            return []
+
+    def arm_upcoming(self, now=None):
+        """Arme les trips dont une échéance entre dans l'horizon (requête bornée sur les heures prévues)"""
+        now = now or timezone.now()
+        # La première transition d'affichage précède le départ
+        horizon = now + self.ARM_HORIZON - self.DISPLAY_TRANSITIONS[0][2]
+        trips = Trip.objects.filter(
+            Q(planned_departure__gte=now - self.START_GRACE, planned_departure__lte=horizon) |
+            Q(planned_arrival__gte=now, planned_arrival__lte=horizon),
+            status__in=['planned'] + self.DISPLAY_STATUSES
+        ).only('id', 'status', 'planned_departure', 'planned_arrival')
+        return sum(len(self.arm(trip, now)) for trip in trips.iterator())
+
+    def fire(self, trip_id, transition, token):
+        """Applique la transition si le trip n'a pas été reprogrammé entre-temps"""
+        trip = Trip.objects.filter(id=trip_id).first()
+        if trip is None or self.token(trip) != token:
+            return 'stale'
+
+        if transition == 'start':
+            if trip.status != 'planned':
+                return 'skipped'
+            if TripLifecycleManager().try_start_trip(trip):
+                return 'started'
+            # Véhicule ou chauffeur pas encore prêt : nouvel essai jusqu'à la fin du délai de grâce
+            retry = timezone.now() + self.START_RETRY
+            if retry <= trip.planned_departure + self.START_GRACE:
+                self._dispatch(trip.id, 'start', token, retry)
+                return 'retry'
+            return 'not_started'
+
+        if trip.status not in self.DISPLAY_STATUSES:
+            return 'skipped'
+        trip.update_status()
+        return trip.status
+
+    def _dispatch(self, trip_id, transition, token, eta):
+        from ...tasks import fire_trip_transition
+        fire_trip_transition.apply_async(args=[trip_id, transition, token], eta=eta)
+
+
+transition_scheduler = TripTransitionScheduler()
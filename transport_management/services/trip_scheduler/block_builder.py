@@ -0,0 +1,398 @@
+# transport_management/services/trip_scheduler/block_builder.py
+
+from collections import deque
+from datetime import timedelta
+import numpy as np
+from django.db import transaction
+from inventory_management.models import Vehicle
+from ...models import Trip, Driver, DriverVehicleAssignment
+from ..base.service_base import ServiceBase
+from ..resource.conflict_index import IntervalTree, conflict_index
+from .deadhead import haversine_km, load_route_termini
+from .crew_scheduler import CrewSchedulingEngine
+
+
+class VehicleBlockBuilder(ServiceBase):
+    """
+    Enchaîne les trips d'une journée en blocs véhicule.
+    Un bloc est la suite de trips effectués par un même véhicule entre
+    sa sortie et sa rentrée au dépôt.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.DEADHEAD_SPEED_KMH = 25        # Vitesse moyenne haut-le-pied
+        self.DEFAULT_LAYOVER_MINUTES = 5    # Battement minimum au terminus
+        self.MAX_IDLE_MINUTES = 120         # Attente maximale entre deux trips d'un bloc
+        self.IDLE_WEIGHT = 0.1              # Poids d'une minute d'attente vs une minute haut-le-pied
+        self.PULL_OUT_MINUTES = 15          # Sortie / rentrée dépôt
+        self.MAX_LINKS_PER_TRIP = 25        # Enchaînements candidats conservés par trip
+        self.crew_engine = CrewSchedulingEngine()
+
+    def plan_day(self, target_date, only_unassigned=False, with_crew=True):
+        """
+        Construit les blocs de la journée et crée les affectations correspondantes.
+        Avec with_crew, les services chauffeur sont construits sur les blocs qui ont
+        reçu un véhicule et déterminent les relèves dans les affectations.
+        """
+        try:
+            with transaction.atomic():
+                trips = self.load_trips(target_date, only_unassigned)
+                blocks = self.chain_trips(trips)
+                self.assign_vehicles(blocks)
+                # Les blocs sans véhicule restent à planifier : pas de service chauffeur
+                served = [block for block in blocks if block['vehicle_id'] is not None]
+                duties = self.crew_engine.schedule_blocks(served, trips) if with_crew else None
+                assignments = self.assign_blocks(served, trips, duties)
+
+                self.log_info(
+                    f"Built {len(blocks)} vehicle blocks for {len(trips)} trips on {target_date} "
+                    f"({len(assignments)} assignments)"
+                )
+                return {
+                    'date': target_date.isoformat(),
+                    'trips': len(trips),
+                    'blocks': blocks,
+                    'duties': len(duties) if duties is not None else None,
+                    'assignments': [assignment.id for assignment in assignments],
+                    'unassigned_blocks': [block for block in blocks if block.get('vehicle_id') is None]
+                }
+
+        except Exception as e:
+            self.log_error(f"Error planning vehicle blocks: {str(e)}", exc=e)
+            raise
+
+    def load_trips(self, target_date, only_unassigned=False):
+        """Charge les trips planifiés du jour avec leurs terminus"""
+        queryset = Trip.objects.filter(
+            planned_departure__date=target_date,
+            status='planned'
+        )
+        if only_unassigned:
+            queryset = queryset.filter(vehicle__isnull=True)
+
+        rows = list(queryset.values_list(
+            'id', 'route_id', 'planned_departure', 'planned_arrival',
+            'destination__latitude', 'destination__longitude',
+            'schedule__minimum_layover', 'max_capacity'
+        ))
+        termini = load_route_termini({row[1] for row in rows})
+
+        trips = []
+        for (trip_id, route_id, departure, arrival, dest_lat, dest_lon,
+             layover, capacity) in rows:
+            start, end = termini.get(route_id, (None, None))
+            if dest_lat is not None and dest_lon is not None:
+                end = (float(dest_lat), float(dest_lon))
+            trips.append({
+                'id': trip_id,
+                'route_id': route_id,
+                'departure': departure,
+                'arrival': arrival,
+                'start': start,
+                'end': end or start,
+                'layover': layover if layover is not None else self.DEFAULT_LAYOVER_MINUTES,
+                'capacity': capacity,
+            })
+        return trips
+
+    # ------------------------------------------------------------------
+    # Construction des blocs
+    # ------------------------------------------------------------------
+
+    def chain_trips(self, trips):
+        """
+        Construit les blocs : affectation gloutonne puis chemins augmentants
+        (Hopcroft-Karp) pour obtenir une couverture minimale en véhicules.
+        """
+        if not trips:
+            return []
+
+        trips = sorted(trips, key=lambda t: t['departure'])
+        successors = self._feasible_links(trips)
+
+        n = len(trips)
+        next_trip = [-1] * n
+        previous_trip = [-1] * n
+        self._greedy_links(successors, next_trip, previous_trip)
+        self._augment_links(successors, next_trip, previous_trip)
+
+        blocks = []
+        for first in range(n):
+            if previous_trip[first] != -1:
+                continue
+            chain = [first]
+            while next_trip[chain[-1]] != -1:
+                chain.append(next_trip[chain[-1]])
+            blocks.append(self._describe_block(trips, chain, successors))
+
+        blocks.sort(key=lambda b: b['start'])
+        for number, block in enumerate(blocks, start=1):
+            block['block_number'] = number
+        return blocks
+
+    def _feasible_links(self, trips):
+        """
+        Enchaînements réalisables i -> j avec leur coût, triés par coût croissant.
+        Seuls les MAX_LINKS_PER_TRIP moins coûteux sont conservés pour borner le graphe.
+        Retourne une liste de listes [(j, coût, minutes haut-le-pied)].
+        """
+        n = len(trips)
+        departures = np.array([t['departure'].timestamp() for t in trips])
+        arrivals = np.array([t['arrival'].timestamp() for t in trips])
+        layovers = np.array([t['layover'] for t in trips], dtype=float) * 60
+        start = np.array([t['start'] or (np.nan, np.nan) for t in trips], dtype=float)
+        end = np.array([t['end'] or (np.nan, np.nan) for t in trips], dtype=float)
+
+        max_idle = self.MAX_IDLE_MINUTES * 60
+        speed = self.DEADHEAD_SPEED_KMH / 3600.0  # km par seconde
+
+        successors = [[] for _ in range(n)]
+        for i in range(n):
+            lo = np.searchsorted(departures, arrivals[i] + layovers[i], side='left')
+            hi = np.searchsorted(departures, arrivals[i] + max_idle, side='right')
+            if lo >= hi:
+                continue
+            candidates = np.arange(lo, hi)
+            distances = haversine_km(end[i, 0], end[i, 1], start[candidates, 0], start[candidates, 1])
+            # Coordonnées inconnues : enchaînement uniquement sur le même terminus supposé
+            distances = np.where(np.isnan(distances), 0.0, distances)
+            deadhead = distances / speed
+            ready = arrivals[i] + layovers[i] + deadhead
+            feasible = departures[candidates] >= ready
+            if not feasible.any():
+                continue
+
+            candidates = candidates[feasible]
+            deadhead = deadhead[feasible]
+            idle = departures[candidates] - arrivals[i] - deadhead
+            cost = deadhead + self.IDLE_WEIGHT * idle
+            if len(cost) > self.MAX_LINKS_PER_TRIP:
+                keep = np.argpartition(cost, self.MAX_LINKS_PER_TRIP)[:self.MAX_LINKS_PER_TRIP]
+                order = keep[np.argsort(cost[keep], kind='stable')]
+            else:
+                order = np.argsort(cost, kind='stable')
+            successors[i] = [
+                (int(candidates[k]), float(cost[k]), float(deadhead[k]) / 60)
+                for k in order if candidates[k] != i
+            ]
+        return successors
+
+    def _greedy_links(self, successors, next_trip, previous_trip):
+        """Chaque trip reprend le véhicule libre le moins coûteux"""
+        predecessors = [[] for _ in range(len(successors))]
+        for i, links in enumerate(successors):
+            for j, cost, _ in links:
+                predecessors[j].append((cost, i))
+
+        for j in range(len(predecessors)):
+            for _, i in sorted(predecessors[j]):
+                if next_trip[i] == -1:
+                    next_trip[i] = j
+                    previous_trip[j] = i
+                    break
+
+    def _augment_links(self, successors, next_trip, previous_trip):
+        """Hopcroft-Karp à partir de la solution gloutonne"""
+        n = len(successors)
+        adjacency = [[j for j, _, _ in links] for links in successors]
+
+        while True:
+            distance = [-1] * n
+            queue = deque()
+            for i in range(n):
+                if next_trip[i] == -1 and adjacency[i]:
+                    distance[i] = 0
+                    queue.append(i)
+
+            found = False
+            while queue:
+                i = queue.popleft()
+                for j in adjacency[i]:
+                    k = previous_trip[j]
+                    if k == -1:
+                        found = True
+                    elif distance[k] == -1:
+                        distance[k] = distance[i] + 1
+                        queue.append(k)
+            if not found:
+                return
+
+            position = [0] * n
+            for root in range(n):
+                if next_trip[root] != -1 or distance[root] != 0:
+                    continue
+                stack, chosen = [root], []
+                while stack:
+                    i = stack[-1]
+                    advanced = False
+                    while position[i] < len(adjacency[i]):
+                        j = adjacency[i][position[i]]
+                        position[i] += 1
+                        k = previous_trip[j]
+                        if k == -1:
+                            chosen.append(j)
+                            for a, b in zip(stack, chosen):
+                                next_trip[a] = b
+                                previous_trip[b] = a
+                            stack = []
+                            advanced = True
+                            break
+                        if distance[k] == distance[i] + 1:
+                            stack.append(k)
+                            chosen.append(j)
+                            advanced = True
+                            break
+                    if not advanced:
+                        distance[i] = -2
+                        stack.pop()
+                        if chosen:
+                            chosen.pop()
+
+    def _describe_block(self, trips, chain, successors):
+        deadhead_minutes = 0.0
+        idle_minutes = 0.0
+        for a, b in zip(chain, chain[1:]):
+            link = next(link for link in successors[a] if link[0] == b)
+            deadhead_minutes += link[2]
+            idle_minutes += (trips[b]['departure'] - trips[a]['arrival']).total_seconds() / 60 - link[2]
+
+        capacities = [trips[i]['capacity'] for i in chain if trips[i]['capacity']]
+        return {
+            'trip_ids': [trips[i]['id'] for i in chain],
+            'start': trips[chain[0]]['departure'],
+            'end': trips[chain[-1]]['arrival'],
+            'deadhead_minutes': round(deadhead_minutes, 1),
+            'idle_minutes': round(idle_minutes, 1),
+            'required_capacity': max(capacities) if capacities else None,
+        }
+
+    # ------------------------------------------------------------------
+    # Affectation des blocs
+    # ------------------------------------------------------------------
+
+    def assign_vehicles(self, blocks):
+        """Choisit un véhicule libre et de capacité suffisante pour chaque bloc (vehicle_id)"""
+        if not blocks:
+            return blocks
+
+        vehicles = list(Vehicle.objects.filter(status='active').order_by('capacity', 'id').values_list('id', 'capacity'))
+        day_start = min(b['start'] for b in blocks) - timedelta(minutes=self.PULL_OUT_MINUTES)
+        day_end = max(b['end'] for b in blocks) + timedelta(minutes=self.PULL_OUT_MINUTES)
+        vehicle_usage = self._usage_from_index('vehicle', day_start, day_end)
+
+        for block in sorted(blocks, key=lambda b: b['end'] - b['start'], reverse=True):
+            block['vehicle_id'] = self._pick_resource(
+                'vehicle',
+                [vid for vid, capacity in vehicles
+                 if not block['required_capacity'] or capacity >= block['required_capacity']],
+                block['start'] - timedelta(minutes=self.PULL_OUT_MINUTES),
+                block['end'] + timedelta(minutes=self.PULL_OUT_MINUTES),
+                vehicle_usage
+            )
+            if block['vehicle_id'] is None:
+                self.log_warning(f"No vehicle available for block starting {block['start']}")
+        return blocks
+
+    def assign_blocks(self, blocks, trips, duties=None):
+        """
+        Crée une affectation chauffeur-véhicule par bloc ayant reçu un véhicule (ou par
+        portion de bloc si des services chauffeur sont fournis) et met à jour les trips en masse.
+        duties : liste optionnelle de {'driver_id', 'trip_ids'} issue du planning chauffeurs.
+        """
+        blocks = [block for block in blocks if block.get('vehicle_id') is not None]
+        if not blocks:
+            return []
+
+        driver_ids = list(Driver.objects.filter(
+            employment_status='active',
+            availability_status__in=['available', 'on_duty']
+        ).order_by('total_hours').values_list('id', flat=True))
+
+        day_start = min(b['start'] for b in blocks) - timedelta(minutes=self.PULL_OUT_MINUTES)
+        day_end = max(b['end'] for b in blocks) + timedelta(minutes=self.PULL_OUT_MINUTES)
+        driver_usage = self._usage_from_index('driver', day_start, day_end)
+        driver_by_trip = {}
+        for duty in duties or []:
+            if duty['driver_id'] is None:
+                continue
+            for trip_id in duty['trip_ids']:
+                driver_by_trip[trip_id] = duty['driver_id']
+
+        trip_by_id = {trip['id']: trip for trip in trips}
+        assignments = []
+        updated_trips = []
+
+        for block in sorted(blocks, key=lambda b: b['end'] - b['start'], reverse=True):
+            vehicle_id = block['vehicle_id']
+
+            # Découper le bloc par chauffeur (relèves) ou affecter un chauffeur au bloc entier
+            for segment in self._driver_segments(block, trip_by_id, driver_by_trip):
+                driver_id = segment['driver_id'] or self._pick_resource(
+                    'driver', driver_ids, segment['start'], segment['end'], driver_usage
+                )
+                if driver_id is None:
+                    self.log_warning(f"No driver available for block starting {block['start']}")
+                    continue
+
+                assignments.append(DriverVehicleAssignment(
+                    driver_id=driver_id,
+                    vehicle_id=vehicle_id,
+                    assigned_from=segment['start'] - timedelta(minutes=self.PULL_OUT_MINUTES),
+                    assigned_until=segment['end'] + timedelta(minutes=self.PULL_OUT_MINUTES),
+                    assignment_type='regular',
+                    status='pending',
+                    compliance_checks={
+                        'vehicle_block': {
+                            'block_number': block['block_number'],
+                            'trip_ids': segment['trip_ids'],
+                            'deadhead_minutes': block['deadhead_minutes'],
+                        }
+                    },
+                    notes=f"Bloc véhicule {block['block_number']}"
+                ))
+                for trip_id in segment['trip_ids']:
+                    updated_trips.append(Trip(id=trip_id, vehicle_id=vehicle_id, driver_id=driver_id))
+
+        DriverVehicleAssignment.objects.bulk_create(assignments, batch_size=500)
+        Trip.objects.bulk_update(updated_trips, ['vehicle', 'driver'], batch_size=500)
+        conflict_index.invalidate()
+        return assignments
+
+    def _driver_segments(self, block, trip_by_id, driver_by_trip):
+        segments = []
+        for trip_id in block['trip_ids']:
+            driver_id = driver_by_trip.get(trip_id)
+            trip = trip_by_id[trip_id]
+            if segments and segments[-1]['driver_id'] == driver_id:
+                segments[-1]['trip_ids'].append(trip_id)
+                segments[-1]['end'] = trip['arrival']
+            else:
+                segments.append({
+                    'driver_id': driver_id,
+                    'trip_ids': [trip_id],
+                    'start': trip['departure'],
+                    'end': trip['arrival'],
+                })
+        return segments
+
+    def _usage_from_index(self, resource_type, start, end):
+        """Occupation existante des ressources, issue de l'index des conflits"""
+        usage = {}
+        for resource_id, windows in conflict_index.occupied_windows(resource_type, start, end).items():
+            tree = usage[resource_id] = IntervalTree()
+            for key, (window_start, window_end) in enumerate(windows):
+                tree.insert(window_start, window_end, ('existing', key))
+        return usage
+
+    def _pick_resource(self, resource_type, candidates, start, end, usage):
+        """Première ressource libre sur la fenêtre (occupation existante + allocations en cours)"""
+        for resource_id in candidates:
+            tree = usage.get(resource_id)
+            if tree is not None and tree.overlapping(start.timestamp(), end.timestamp()):
+                continue
+            if tree is None:
+                tree = usage[resource_id] = IntervalTree()
+            tree.insert(start.timestamp(), end.timestamp(), len(tree))
+            return resource_id
+        return None
@@ -0,0 +1,358 @@
+# transport_management/services/trip_scheduler/crew_scheduler.py
+
+from bisect import insort, bisect_right
+from datetime import timedelta
+from django.db import transaction
+from ...models import Trip, Driver, DriverSchedule
+from ..base.service_base import ServiceBase
+from ..resource.conflict_index import conflict_index
+
+
+class CrewSchedulingEngine(ServiceBase):
+    """
+    Construit les services chauffeur (duties) à partir des blocs véhicule ou des trips,
+    en respectant la conduite continue maximale, les pauses obligatoires et les
+    volumes horaires journaliers / hebdomadaires des chauffeurs.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.MAX_CONTINUOUS_DRIVING_MINUTES = 270   # 4h30 de conduite sans pause
+        self.MIN_BREAK_MINUTES = 45                 # Pause obligatoire
+        self.MAX_DAILY_DRIVING_MINUTES = 540        # 9h de conduite par jour
+        self.MAX_DUTY_SPREAD_MINUTES = 660          # Amplitude maximale d'un service
+        self.MAX_IDLE_IN_DUTY_MINUTES = 120         # Au-delà : nouveau service
+        self.CHANGEOVER_MINUTES = 5                 # Changement de véhicule en relève
+        self.SIGN_ON_MINUTES = 10                   # Prise / fin de service
+        self.MIN_REST_HOURS = 8                     # Repos entre deux services
+
+    # ------------------------------------------------------------------
+    # Points d'entrée
+    # ------------------------------------------------------------------
+
+    def plan_day(self, target_date):
+        """Construit et enregistre les services chauffeur d'une journée à partir des trips"""
+        try:
+            trips = list(Trip.objects.filter(
+                planned_departure__date=target_date,
+                status='planned'
+            ).values_list('id', 'route_id', 'vehicle_id', 'planned_departure', 'planned_arrival'))
+
+            pieces = [
+                {
+                    'trip_ids': [trip_id],
+                    'route_ids': [route_id],
+                    'block': vehicle_id,
+                    'start': departure,
+                    'end': arrival,
+                }
+                for trip_id, route_id, vehicle_id, departure, arrival in trips
+            ]
+            return self.schedule_pieces(pieces)
+
+        except Exception as e:
+            self.log_error(f"Error planning crew duties: {str(e)}", exc=e)
+            raise
+
+    def schedule_blocks(self, blocks, trips):
+        """Construit les services à partir des blocs véhicule (relève possible entre deux trips)"""
+        trip_by_id = {trip['id']: trip for trip in trips}
+        pieces = []
+        for block in blocks:
+            for trip_id in block['trip_ids']:
+                trip = trip_by_id[trip_id]
+                pieces.append({
+                    'trip_ids': [trip_id],
+                    'route_ids': [trip['route_id']],
+                    'block': block['block_number'],
+                    'start': trip['departure'],
+                    'end': trip['arrival'],
+                })
+        return self.schedule_pieces(pieces)
+
+    def schedule_pieces(self, pieces):
+        """Construit les services, les affecte aux chauffeurs et remplace les plannings précédents"""
+        with transaction.atomic():
+            released = self.release_duties(pieces)
+            duties = self.build_duties(pieces)
+            if not duties:
+                return []
+
+            drivers = self.load_driver_capacity(
+                min(d['start'] for d in duties), max(d['end'] for d in duties)
+            )
+            self.assign_drivers(duties, drivers)
+            self.save_duties(duties)
+
+            # Trips replanifiés restés sans chauffeur : l'ancien service n'existe plus
+            assigned = {trip_id for duty in duties if duty['driver_id'] is not None for trip_id in duty['trip_ids']}
+            if released - assigned:
+                Trip.objects.filter(id__in=released - assigned).update(driver=None)
+
+            unassigned = sum(1 for duty in duties if duty['driver_id'] is None)
+            self.log_info(
+                f"Built {len(duties)} crew duties for {len(pieces)} pieces of work "
+                f"({unassigned} without driver)"
+            )
+            return duties
+
+    # ------------------------------------------------------------------
+    # Construction des services (heuristique best-fit)
+    # ------------------------------------------------------------------
+
+    def build_duties(self, pieces):
+        """
+        Affecte chaque morceau de travail, par ordre de début, au service ouvert
+        compatible qui le laisse avec le moins d'attente. Le service qui conduisait
+        déjà le même bloc est privilégié pour éviter les relèves inutiles.
+        """
+        duties = []
+        open_duties = []        # (fin, index) triés par fin
+        duty_by_block = {}
+        max_idle = timedelta(minutes=self.MAX_IDLE_IN_DUTY_MINUTES)
+
+        for piece in sorted(pieces, key=lambda p: p['start']):
+            # Les services terminés depuis trop longtemps ne peuvent plus être prolongés
+            cutoff = bisect_right(open_duties, (piece['start'] - max_idle, len(duties)))
+            if cutoff:
+                del open_duties[:cutoff]
+
+            chosen = None
+            block_duty = duty_by_block.get(piece['block'])
+            if block_duty is not None and self._can_extend(duties[block_duty], piece):
+                chosen = block_duty
+            else:
+                position = bisect_right(open_duties, (piece['start'], len(duties)))
+                for end, index in reversed(open_duties[:position]):
+                    if self._can_extend(duties[index], piece):
+                        chosen = index
+                        break
+
+            if chosen is None:
+                duties.append(self._new_duty(piece))
+                chosen = len(duties) - 1
+            else:
+                open_duties.remove((duties[chosen]['end'], chosen))
+                self._extend(duties[chosen], piece)
+
+            insort(open_duties, (duties[chosen]['end'], chosen))
+            if piece['block'] is not None:
+                duty_by_block[piece['block']] = chosen
+
+        for number, duty in enumerate(duties, start=1):
+            duty['duty_number'] = number
+        return duties
+
+    def _new_duty(self, piece):
+        driving = self._minutes(piece['end'] - piece['start'])
+        return {
+            'start': piece['start'],
+            'end': piece['end'],
+            'trip_ids': list(piece['trip_ids']),
+            'route_ids': set(piece['route_ids']),
+            'last_block': piece['block'],
+            'driving_minutes': driving,
+            'continuous_minutes': driving,
+            'max_continuous_minutes': driving,
+            'breaks': [],
+            'driver_id': None,
+        }
+
+    def _check_extension(self, duty, piece):
+        """Retourne (conduite continue après ajout, pause éventuelle) ou None si impossible"""
+        gap = self._minutes(piece['start'] - duty['end'])
+        if gap < 0 or gap >= self.MAX_IDLE_IN_DUTY_MINUTES:
+            return None
+        if piece['block'] != duty['last_block'] and gap < self.CHANGEOVER_MINUTES:
+            return None
+
+        duration = self._minutes(piece['end'] - piece['start'])
+        if duty['driving_minutes'] + duration > self.MAX_DAILY_DRIVING_MINUTES:
+            return None
+        if self._minutes(piece['end'] - duty['start']) + 2 * self.SIGN_ON_MINUTES > self.MAX_DUTY_SPREAD_MINUTES:
+            return None
+
+        if gap >= self.MIN_BREAK_MINUTES:
+            return duration, (duty['end'], duty['end'] + timedelta(minutes=gap))
+        continuous = duty['continuous_minutes'] + duration
+        if continuous > self.MAX_CONTINUOUS_DRIVING_MINUTES:
+            return None
+        return continuous, None
+
+    def _can_extend(self, duty, piece):
+        return self._check_extension(duty, piece) is not None
+
+    def _extend(self, duty, piece):
+        continuous, pause = self._check_extension(duty, piece)
+        if pause:
+            duty['breaks'].append(pause)
+        duty['continuous_minutes'] = continuous
+        duty['max_continuous_minutes'] = max(duty['max_continuous_minutes'], continuous)
+        duty['driving_minutes'] += self._minutes(piece['end'] - piece['start'])
+        duty['end'] = piece['end']
+        duty['trip_ids'].extend(piece['trip_ids'])
+        duty['route_ids'].update(piece['route_ids'])
+        duty['last_block'] = piece['block']
+
+    # ------------------------------------------------------------------
+    # Affectation des chauffeurs
+    # ------------------------------------------------------------------
+
+    def load_driver_capacity(self, period_start, period_end):
+        """Capacité horaire restante et plannings existants des chauffeurs actifs"""
+        week_start = period_start - timedelta(days=period_start.weekday())
+        week_start = week_start.replace(hour=0, minute=0, second=0, microsecond=0)
+        week_end = week_start + timedelta(days=7)
+        rest = timedelta(hours=self.MIN_REST_HOURS)
+
+        drivers = {}
+        for driver_id, max_hours, route_restrictions, break_preferences in Driver.objects.filter(
+            employment_status='active'
+        ).exclude(
+            availability_status='unavailable'
+        ).order_by('total_hours').values_list(
+            'id', 'maximum_hours_per_week', 'route_restrictions', 'break_preferences'
+        ):
+            drivers[driver_id] = {
+                'id': driver_id,
+                'remaining_minutes': (max_hours or 0) * 60,
+                'busy': [],
+                'daily_minutes': {},
+                'restricted_routes': set(route_restrictions or []),
+                'min_break_minutes': (break_preferences or {}).get('min_break_minutes', 0),
+            }
+
+        shifts = DriverSchedule.objects.filter(
+            driver_id__in=drivers.keys(),
+            shift_start__lt=max(week_end, period_end + rest),
+            shift_end__gt=min(week_start, period_start - rest)
+        ).exclude(status='cancelled').values_list('driver_id', 'shift_start', 'shift_end')
+        for driver_id, shift_start, shift_end in shifts:
+            driver = drivers[driver_id]
+            driver['busy'].append((shift_start, shift_end))
+            day = shift_start.date()
+            driver['daily_minutes'][day] = driver['daily_minutes'].get(day, 0) + self._minutes(shift_end - shift_start)
+            overlap = min(shift_end, week_end) - max(shift_start, week_start)
+            if overlap > timedelta(0):
+                driver['remaining_minutes'] -= self._minutes(overlap)
+
+        return list(drivers.values())
+
+    def assign_drivers(self, duties, drivers):
+        """
+        Affecte les services les plus longs en premier au chauffeur éligible
+        qui dispose du plus d'heures restantes sur la semaine.
+        """
+        rest = timedelta(hours=self.MIN_REST_HOURS)
+        sign_on = timedelta(minutes=self.SIGN_ON_MINUTES)
+
+        for duty in sorted(duties, key=lambda d: d['end'] - d['start'], reverse=True):
+            shift_start, shift_end = duty['start'] - sign_on, duty['end'] + sign_on
+            length = self._minutes(shift_end - shift_start)
+            day = shift_start.date()
+            shortest_break = min((self._minutes(e - s) for s, e in duty['breaks']), default=None)
+
+            best = None
+            for driver in drivers:
+                if driver['remaining_minutes'] < length:
+                    continue
+                if best is not None and driver['remaining_minutes'] <= best['remaining_minutes']:
+                    continue
+                if duty['route_ids'] & driver['restricted_routes']:
+                    continue
+                if shortest_break is not None and shortest_break < driver['min_break_minutes']:
+                    continue
+                if driver['daily_minutes'].get(day, 0) + duty['driving_minutes'] > self.MAX_DAILY_DRIVING_MINUTES:
+                    continue
+                if any(s < shift_end + rest and shift_start - rest < e for s, e in driver['busy']):
+                    continue
+                best = driver
+
+            if best is None:
+                continue
+            duty['driver_id'] = best['id']
+            best['remaining_minutes'] -= length
+            best['busy'].append((shift_start, shift_end))
+            best['daily_minutes'][day] = best['daily_minutes'].get(day, 0) + duty['driving_minutes']
+
+        return duties
+
+    # ------------------------------------------------------------------
+    # Enregistrement
+    # ------------------------------------------------------------------
+
+    def release_duties(self, pieces):
+        """
+        Supprime les services déjà construits par le planning pour les trips
+        replanifiés, afin qu'une nouvelle exécution les remplace au lieu de les dupliquer.
+        Retourne les trips replanifiés qui étaient couverts par ces services.
+        """
+        trip_ids = {trip_id for piece in pieces for trip_id in piece['trip_ids']}
+        if not trip_ids:
+            return set()
+
+        sign_on = timedelta(minutes=self.SIGN_ON_MINUTES)
+        superseded = []
+        released = set()
+        for schedule_id, notes in DriverSchedule.objects.filter(
+            validation_status__has_key='crew_scheduler',
+            shift_start__lt=max(piece['end'] for piece in pieces) + sign_on,
+            shift_end__gt=min(piece['start'] for piece in pieces) - sign_on
+        ).values_list('id', 'compliance_notes'):
+            covered = trip_ids.intersection((notes or {}).get('trip_ids', []))
+            if covered:
+                superseded.append(schedule_id)
+                released |= covered
+
+        if superseded:
+            DriverSchedule.objects.filter(id__in=superseded).delete()
+            self.log_info(f"Replaced {len(superseded)} previously planned crew duties")
+        return released
+
+    def save_duties(self, duties):
+        """Crée les DriverSchedule en masse et rattache les trips à leur chauffeur"""
+        sign_on = timedelta(minutes=self.SIGN_ON_MINUTES)
+        schedules = []
+        trips = []
+
+        for duty in duties:
+            if duty['driver_id'] is None:
+                continue
+            schedules.append(DriverSchedule(
+                driver_id=duty['driver_id'],
+                shift_start=duty['start'] - sign_on,
+                shift_end=duty['end'] + sign_on,
+                actual_start_time=duty['start'] - sign_on,
+                actual_end_time=duty['end'] + sign_on,
+                rest_time_between_shifts=self.MIN_REST_HOURS,
+                breaks_scheduled={
+                    f'pause{number}': f"{start.strftime('%H:%M')}-{end.strftime('%H:%M')}"
+                    for number, (start, end) in enumerate(duty['breaks'], start=1)
+                },
+                status='scheduled',
+                validation_status={
+                    'crew_scheduler': {
+                        'valid': True,
+                        'driving_minutes': duty['driving_minutes'],
+                        'max_continuous_minutes': duty['max_continuous_minutes'],
+                    }
+                },
+                compliance_notes={
+                    'duty_number': duty['duty_number'],
+                    'trip_ids': duty['trip_ids'],
+                    'max_continuous_driving': self.MAX_CONTINUOUS_DRIVING_MINUTES,
+                    'min_break': self.MIN_BREAK_MINUTES,
+                },
+                notes=f"Service {duty['duty_number']}"
+            ))
+            trips.extend(Trip(id=trip_id, driver_id=duty['driver_id']) for trip_id in duty['trip_ids'])
+
+        DriverSchedule.objects.bulk_create(schedules, batch_size=500)
+        Trip.objects.bulk_update(trips, ['driver'], batch_size=500)
+
+        # Les créations en masse n'émettent pas de signaux
+        conflict_index.invalidate()
+        return schedules
+
+    def _minutes(self, delta):
+        return delta.total_seconds() / 60
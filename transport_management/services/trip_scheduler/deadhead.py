@@ -0,0 +1,100 @@
+# transport_management/services/trip_scheduler/deadhead.py
+
+import numpy as np
+from ...models import Route, RouteStop
+
+EARTH_RADIUS_KM = 6371.0
+METERS_PER_DEGREE = 111320.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distance orthodromique en km (scalaires ou tableaux NumPy)"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def distance_to_polyline_meters(latitudes, longitudes, line, chunk_size=4096):
+    """
+    Distance (m) de chaque point au tracé line ([[lat, lon], ...], au moins 2 points),
+    par projection équirectangulaire locale ; points traités par blocs (points x segments).
+    """
+    latitudes = np.atleast_1d(np.asarray(latitudes, dtype=float))
+    longitudes = np.atleast_1d(np.asarray(longitudes, dtype=float))
+    line = np.asarray(line, dtype=float)
+    distances = np.empty(len(latitudes))
+    for start in range(0, len(latitudes), chunk_size):
+        lat = latitudes[start:start + chunk_size, None]
+        lon = longitudes[start:start + chunk_size, None]
+        scale = np.cos(np.radians(lat))
+        y = (line[None, :, 0] - lat) * METERS_PER_DEGREE
+        x = (line[None, :, 1] - lon) * METERS_PER_DEGREE * scale
+        ax, ay, dx, dy = x[:, :-1], y[:, :-1], np.diff(x, axis=1), np.diff(y, axis=1)
+        length = dx * dx + dy * dy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.clip(np.where(length > 0, -(ax * dx + ay * dy) / length, 0), 0, 1)
+        distances[start:start + chunk_size] = np.hypot(ax + t * dx, ay + t * dy).min(axis=1)
+    return distances
+
+
+def load_route_lines(route_ids):
+    """
+    Tracé de chaque route ([[lat, lon], ...]) : chemin LineString de la route,
+    sinon séquence de ses arrêts. Routes sans tracé exploitable absentes du résultat.
+    """
+    route_ids = set(route_ids)
+    lines = {}
+    for route_id, path in Route.objects.filter(id__in=route_ids).values_list('id', 'path'):
+        if isinstance(path, dict) and path.get('type') == 'LineString' and len(path.get('coordinates', [])) >= 2:
+            lines[route_id] = np.asarray([(float(point[1]), float(point[0])) for point in path['coordinates']])
+
+    missing = route_ids - set(lines)
+    if missing:
+        stops = {}
+        rows = RouteStop.objects.filter(
+            route_id__in=missing,
+            is_active=True
+        ).order_by('route_id', 'order').values_list('route_id', 'stop__latitude', 'stop__longitude')
+        for route_id, latitude, longitude in rows:
+            stops.setdefault(route_id, []).append((float(latitude), float(longitude)))
+        lines.update({route_id: np.asarray(points) for route_id, points in stops.items() if len(points) >= 2})
+    return lines
+
+
+def load_route_termini(route_ids):
+    """
+    Coordonnées (lat, lon) des terminus de départ et d'arrivée de chaque route.
+    Utilise les arrêts ordonnés de la route, sinon ses destinations.
+    Retourne {route_id: ((lat, lon), (lat, lon))}.
+    """
+    route_ids = set(route_ids)
+    termini = {}
+
+    rows = RouteStop.objects.filter(
+        route_id__in=route_ids,
+        is_active=True
+    ).order_by('route_id', 'order').values_list('route_id', 'stop__latitude', 'stop__longitude')
+    for route_id, latitude, longitude in rows:
+        point = (float(latitude), float(longitude))
+        if route_id in termini:
+            termini[route_id] = (termini[route_id][0], point)
+        else:
+            termini[route_id] = (point, point)
+
+    missing = route_ids - set(termini)
+    if missing:
+        rows = Route.destinations.through.objects.filter(
+            route_id__in=missing
+        ).order_by('route_id', 'destination_id').values_list(
+            'route_id', 'destination__latitude', 'destination__longitude'
+        )
+        for route_id, latitude, longitude in rows:
+            point = (float(latitude), float(longitude))
+            if route_id in termini:
+                termini[route_id] = (termini[route_id][0], point)
+            else:
+                termini[route_id] = (point, point)
+
+    return termini
@@ -6,19 +6,25 @@ from datetime import datetime, timedelta
 from ...models import Schedule, Trip, DriverVehicleAssignment, ResourceAvailability
 from ..base.service_base import ServiceBase
 from .resource_manager import ResourceManager
+from .block_builder import VehicleBlockBuilder
 
 class TripGeneratorService(ServiceBase):
     def __init__(self):
         super().__init__()
         self.target_date = timezone.now().date()
         self.resource_manager = ResourceManager()
+        self.block_builder = VehicleBlockBuilder()
+        self.allocate_per_trip = True
 
-    def generate_daily_trips(self, target_date=None):
+    def generate_daily_trips(self, target_date=None, build_blocks=True):
         """
-        Génère les trips pour une journée donnée basée sur les schedules actifs
+        Génère les trips pour une journée donnée basée sur les schedules actifs.
+        Avec build_blocks, les véhicules sont attribués par blocs après la génération
+        au lieu d'une allocation trip par trip.
         """
         if target_date:
             self.target_date = target_date
+        self.allocate_per_trip = not build_blocks
 
         try:
             with transaction.atomic():
@@ -36,6 +42,11 @@ class TripGeneratorService(ServiceBase):
                     generated_trips.extend(trips)
 
                 self.log_info(f"Generated {len(generated_trips)} trips for {self.target_date}")
+
+                # 3. Enchaîner les trips encore libres en blocs véhicule et créer leurs affectations
+                if build_blocks and generated_trips:
+                    self.plan_vehicle_blocks(only_unassigned=True)
+
                 return generated_trips
 
         except Exception as e:
@@ -120,6 +131,22 @@ class TripGeneratorService(ServiceBase):
                     self.log_warning(f"Trip arrival time {arrival_time} exceeds schedule end time {schedule_end_datetime}. Skipping trip.")
                     return None
 
+                if not self.allocate_per_trip:
+                    # Les ressources seront attribuées par blocs véhicule
+                    trip = Trip.objects.create(
+                        schedule=schedule,
+                        route=schedule.route,
+                        destination=schedule.destination,
+                        trip_date=self.target_date,
+                        planned_departure=departure_time,
+                        planned_arrival=arrival_time,
+                        status='planned',
+                        trip_type='regular',
+                        priority='medium',
+                    )
+                    self.log_info(f"Created trip {trip.id} for schedule {schedule.id} at {timepoint}")
+                    return trip
+
                 # 1. Vérifier et allouer les ressources
                 resource_allocation = self.resource_manager.allocate_resources(
                     schedule.route,
@@ -165,6 +192,14 @@ class TripGeneratorService(ServiceBase):
             self.log_error(f"Error creating trip: {str(e)}", exc=e)
             return None
 
+    def plan_vehicle_blocks(self, target_date=None, only_unassigned=False):
+        """Construit les blocs véhicule du jour et crée les affectations associées"""
+        try:
+            return self.block_builder.plan_day(target_date or self.target_date, only_unassigned)
+        except Exception as e:
+            self.log_error(f"Error planning vehicle blocks: {str(e)}", exc=e)
+            return None
+
     def _calculate_trip_duration(self, schedule, is_peak_hour):
         """Calcule la durée estimée du trip en fonction des conditions"""
         # Calcul basé sur la route et les conditions
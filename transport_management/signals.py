@@ -1,8 +1,19 @@
 # transport_api/signals.py
-from django.db.models.signals import post_save, post_delete, pre_save
+import copy
+from django.db.models.signals import post_save, post_delete, pre_save, post_init, m2m_changed
 from django.dispatch import receiver
 from django.db import transaction
-from .models import Schedule, ScheduleException
+from .models import (
+    Schedule, ScheduleException, DriverSchedule, DriverVehicleAssignment, ResourceAvailability,
+    Trip, Stop, RouteStop, Geofence, Incident
+)
+from .services.resource.conflict_index import conflict_index
+from .services.resource.fleet_manager import FleetManager
+from .services.geofencing.geofence_engine import geofence_engine
+from .services.reporting.kpi_rollup import kpi_rollups
+from .services.timetable.journey_planner import journey_planner
+from .services.tracking.arrival_predictions import arrival_predictions
+from .services.trip_lifecycle.transition_scheduler import transition_scheduler
 from django.utils import timezone
 from django.core.cache import cache
 from datetime import timedelta
@@ -92,4 +103,200 @@ def schedule_exception_updated(sender, instance, created, **kwargs):
             instance.save(update_fields=['processed'])
             
     finally:
-        cache.delete(lock_id)
\ No newline at end of file
+        cache.delete(lock_id)
+
+@receiver(post_save, sender=DriverSchedule)
+@receiver(post_save, sender=DriverVehicleAssignment)
+@receiver(post_save, sender=ResourceAvailability)
+def resource_window_saved(sender, instance, **kwargs):
+    """
+    Met à jour l'index des conflits de ressources.
+    """
+    transaction.on_commit(lambda: conflict_index.refresh_instance(instance))
+
+@receiver(post_delete, sender=DriverSchedule)
+@receiver(post_delete, sender=DriverVehicleAssignment)
+@receiver(post_delete, sender=ResourceAvailability)
+def resource_window_deleted(sender, instance, **kwargs):
+    """
+    Retire la fenêtre supprimée de l'index des conflits.
+    """
+    key = conflict_index.instance_key(instance)
+    transaction.on_commit(lambda: conflict_index.remove(key))
+
+@receiver(post_save, sender=DriverVehicleAssignment)
+def assignment_heartbeat_saved(sender, instance, **kwargs):
+    """
+    Suit (ou cesse de suivre) la communication du véhicule de l'affectation.
+    """
+    transaction.on_commit(lambda: FleetManager().watch_assignment(instance))
+
+def _trip_transition_state(trip):
+    fields = trip.__dict__
+    return (fields.get('planned_departure'), fields.get('planned_arrival'), fields.get('status'))
+
+def _trip_prediction_state(trip):
+    fields = trip.__dict__
+    return (fields.get('status'), fields.get('delay_duration'))
+
+def _trip_timetable_state(trip):
+    # Lecture via __dict__ : ne déclenche pas le chargement des champs différés
+    fields = trip.__dict__
+    return (fields.get('route_id'), fields.get('planned_departure'), fields.get('status') == 'cancelled')
+
+@receiver(post_init, sender=Trip)
+def remember_trip_timetable_state(sender, instance, **kwargs):
+    """
+    Mémorise les champs utiles au calcul d'itinéraires pour ne signaler que les vrais changements.
+    """
+    instance._timetable_state = _trip_timetable_state(instance)
+    instance._prediction_state = _trip_prediction_state(instance)
+    instance._transition_state = _trip_transition_state(instance)
+    instance._kpi_state = kpi_rollups.trip_state(instance)
+    instance._track_status = instance.__dict__.get('status')
+
+@receiver(post_save, sender=Trip)
+def trip_timetable_saved(sender, instance, created, **kwargs):
+    """
+    Signale au calculateur d'itinéraires les trips dont l'horaire a changé.
+    """
+    previous = getattr(instance, '_timetable_state', None)
+    current = _trip_timetable_state(instance)
+    if not created and previous == current:
+        return
+    instance._timetable_state = current
+
+    dates = {timezone.localdate(instance.planned_departure)}
+    if previous and previous[1] and not created:
+        dates.add(timezone.localdate(previous[1]))
+    for service_date in dates:
+        transaction.on_commit(
+            lambda service_date=service_date: journey_planner.record_trip_change(instance.pk, service_date)
+        )
+
+@receiver(post_save, sender=Trip)
+def trip_predictions_saved(sender, instance, created, **kwargs):
+    """
+    Recalcule les prévisions d'arrivée quand le statut ou le retard du trip change.
+    """
+    previous = getattr(instance, '_prediction_state', None)
+    current = _trip_prediction_state(instance)
+    if previous == current or 'status' not in instance.__dict__:
+        return
+    instance._prediction_state = current
+    if created and instance.status not in arrival_predictions.ACTIVE_STATUSES:
+        return
+    transaction.on_commit(lambda: arrival_predictions.update_trip(instance))
+
+@receiver(post_save, sender=Trip)
+def trip_transitions_saved(sender, instance, created, **kwargs):
+    """
+    Arme les transitions horaires du trip créé, reprogrammé ou changé de statut.
+    """
+    previous = getattr(instance, '_transition_state', None)
+    current = _trip_transition_state(instance)
+    if (not created and previous == current) or None in current:
+        return
+    instance._transition_state = current
+    transaction.on_commit(lambda: transition_scheduler.arm(instance))
+
+@receiver(post_save, sender=Trip)
+def trip_kpis_saved(sender, instance, created, **kwargs):
+    """
+    Reporte la transition du trip dans les agrégats KPI, dans la même transaction.
+    """
+    previous = None if created else getattr(instance, '_kpi_state', None)
+    current = kpi_rollups.trip_state(instance)
+    if current is None or (previous is None and not created):
+        # État incomplet (champs différés) : les créneaux sont recalculés depuis la base
+        kpi_rollups.refresh_trip(instance.pk, previous)
+    else:
+        kpi_rollups.apply_transition(instance.pk, previous, current)
+    instance._kpi_state = current
+
+@receiver(post_save, sender=Trip)
+def trip_track_completed(sender, instance, created, **kwargs):
+    """
+    Synthétise la trace GPS du trip qui vient de se terminer.
+    """
+    status = instance.__dict__.get('status')
+    if status == getattr(instance, '_track_status', None):
+        return
+    instance._track_status = status
+    if status == 'completed':
+        from .tasks import summarize_trip_track
+        transaction.on_commit(lambda: summarize_trip_track.delay(instance.pk))
+
+@receiver(post_delete, sender=Trip)
+def trip_timetable_deleted(sender, instance, **kwargs):
+    """
+    Retire le trip supprimé des tables de connexions.
+    """
+    trip_id = instance.pk
+    service_date = timezone.localdate(instance.planned_departure)
+    transaction.on_commit(lambda: journey_planner.record_trip_change(trip_id, service_date))
+    transaction.on_commit(lambda: arrival_predictions.remove_trip(trip_id))
+    kpi_rollups.apply_transition(trip_id, getattr(instance, '_kpi_state', None), None)
+
+@receiver(post_save, sender=Incident)
+def incident_kpis_saved(sender, instance, created, **kwargs):
+    """
+    Compte l'incident dans le créneau KPI de son trip.
+    """
+    if created:
+        kpi_rollups.record_incident(instance.trip_id, 1)
+
+@receiver(post_delete, sender=Incident)
+def incident_kpis_deleted(sender, instance, **kwargs):
+    kpi_rollups.record_incident(instance.trip_id, -1)
+
+@receiver(post_save, sender=Stop)
+@receiver(post_save, sender=RouteStop)
+@receiver(post_delete, sender=Stop)
+@receiver(post_delete, sender=RouteStop)
+@receiver(post_delete, sender=Schedule)
+def network_changed(sender, instance, **kwargs):
+    """
+    Un arrêt, une séquence d'arrêts ou un horaire a changé : les index d'horaires sont reconstruits.
+    """
+    transaction.on_commit(journey_planner.invalidate)
+
+# Champs d'un horaire dont dépendent les départs calculés (Schedule.compute_timepoints) et sa sélection par jour
+SCHEDULE_TIMETABLE_FIELDS = (
+    'route_id', 'day_of_week', 'start_date', 'end_date', 'status', 'is_active', 'is_current_version',
+    'start_time', 'end_time', 'frequency', 'peak_hours_frequency', 'off_peak_frequency',
+    'weather_adjustment', 'special_event_adjustment',
+)
+
+def _schedule_timetable_state(schedule):
+    # Copie : les champs JSON modifiés sur place doivent être vus comme des changements
+    fields = schedule.__dict__
+    return copy.deepcopy(tuple(fields.get(name) for name in SCHEDULE_TIMETABLE_FIELDS))
+
+@receiver(post_init, sender=Schedule)
+def remember_schedule_timetable_state(sender, instance, **kwargs):
+    instance._timetable_state = _schedule_timetable_state(instance)
+
+@receiver(post_save, sender=Schedule)
+def schedule_timetable_saved(sender, instance, created, **kwargs):
+    """
+    Reconstruit les index d'horaires seulement si un champ qui détermine les départs a changé
+    (pas pour les sauvegardes de timepoints, validations, notes...).
+    """
+    current = _schedule_timetable_state(instance)
+    if not created and getattr(instance, '_timetable_state', None) == current:
+        return
+    instance._timetable_state = current
+    transaction.on_commit(journey_planner.invalidate)
+
+@receiver(post_save, sender=Geofence)
+@receiver(post_delete, sender=Geofence)
+@receiver(m2m_changed, sender=Geofence.routes.through)
+@receiver(m2m_changed, sender=Geofence.vehicles.through)
+def geofence_changed(sender, instance, **kwargs):
+    """
+    Une zone ou sa portée (routes, véhicules) a changé : l'index spatial est recompilé.
+    """
+    if kwargs.get('action', 'post').startswith('pre'):
+        return
+    transaction.on_commit(geofence_engine.invalidate)
@@ -110,14 +110,119 @@ def activate_pending_schedules():
             schedule.activate()
             logger.info(f"Horaire {schedule.id} activé")
 
-@shared_task
-def update_trip_statuses():
-    """Mise à jour des statuts pour tous les trips actifs."""
-    active_trips = Trip.objects.filter(
-        planned_arrival__gte=timezone.now(),
-        status__in=['scheduled', 'boarding_soon', 'boarding', 'in_transit', 'arriving_soon']
-    )
-    for trip in active_trips:
-        trip.update_status()
-        
-        
+@shared_task(ignore_result=True)
+def build_vehicle_blocks(target_date=None, only_unassigned=True):
+    """Enchaîne les trips du jour en blocs véhicule et crée les affectations des trips encore libres."""
+    from .services.trip_scheduler.trip_generator import TripGeneratorService
+    target = datetime.strptime(target_date, '%Y-%m-%d').date() if target_date else timezone.localdate()
+    result = TripGeneratorService().plan_vehicle_blocks(target, only_unassigned)
+    if result:
+        logger.info(
+            f"Blocs véhicule du {target} : {len(result['blocks'])} blocs, {len(result['assignments'])} affectations, "
+            f"{len(result['unassigned_blocks'])} blocs sans véhicule"
+        )
+
+@shared_task(ignore_result=True)
+def plan_crew_duties(target_date=None):
+    """Reconstruit à la demande les services chauffeur d'une journée (les blocs véhicule les planifient déjà)."""
+    from .services.trip_scheduler.crew_scheduler import CrewSchedulingEngine
+    target = datetime.strptime(target_date, '%Y-%m-%d').date() if target_date else timezone.localdate()
+    duties = CrewSchedulingEngine().plan_day(target)
+    unassigned = sum(1 for duty in duties if duty['driver_id'] is None)
+    logger.info(f"Services chauffeur du {target} : {len(duties)} services, {unassigned} sans chauffeur")
+
+@shared_task(ignore_result=True)
+def fire_trip_transition(trip_id, transition, token):
+    """Transition horaire d'un trip, planifiée à l'heure exacte (ETA) par transition_scheduler."""
+    from .services.trip_lifecycle.transition_scheduler import transition_scheduler
+    result = transition_scheduler.fire(trip_id, transition, token)
+    logger.debug(f"Transition {transition} du trip {trip_id} : {result}")
+
+
+@shared_task(ignore_result=True)
+def arm_trip_transitions():
+    """Arme les transitions des trips entrant dans l'horizon de planification."""
+    from .services.trip_lifecycle.transition_scheduler import transition_scheduler
+    armed = transition_scheduler.arm_upcoming()
+    logger.info(f"{armed} transitions de trips armées")
+
+
+@shared_task(ignore_result=True)
+def detect_vehicle_communication_loss():
+    """Passe inactives les affectations des véhicules silencieux (échéances dépassées uniquement)."""
+    from .services.resource.fleet_manager import FleetManager
+    expired = FleetManager()._update_fleet_status()
+    if expired:
+        logger.warning(f"Perte de communication : véhicules {expired}")
+
+
+@shared_task(ignore_result=True)
+def refresh_gtfs_realtime_feed():
+    """Reconstruit le flux GTFS-Realtime mis en cache (toutes les 5 secondes)."""
+    from .services.gtfs.realtime_feed import gtfs_realtime_feed
+    entry = gtfs_realtime_feed.refresh()
+    logger.debug(f"Flux GTFS-Realtime reconstruit ({entry['entities']} entités)")
+
+
+@shared_task(ignore_result=True)
+def handle_trip_emergencies(trip_id, emergencies):
+    """Enregistre et diffuse les urgences détectées à l'ingestion (file 'emergency' pour les plus graves)."""
+    from .services.emergency.emergency_manager import emergency_manager
+    emergency_manager.handle_emergencies(trip_id, emergencies)
+    logger.warning(f"Urgences du trip {trip_id} : {[emergency['type'] for emergency in emergencies]}")
+
+
+@shared_task(ignore_result=True)
+def check_specific_trip_emergency(trip_id):
+    """Réévalue la dernière position d'un trip (reprise manuelle, hors ingestion)."""
+    from .services.emergency.emergency_manager import emergency_manager
+    emergency_manager.check_emergencies(trip_id)
+
+
+@shared_task(ignore_result=True)
+def reconcile_route_kpi_rollups():
+    """Recalcule les agrégats KPI d'hier et d'aujourd'hui depuis les trips et incidents (chaque nuit)."""
+    from .services.reporting.kpi_rollup import kpi_rollups
+    buckets = kpi_rollups.reconcile_recent()
+    logger.info(f"Agrégats KPI réconciliés : {buckets} créneaux")
+
+
+@shared_task(ignore_result=True)
+def run_report_job(job_pk):
+    """Calcule un rapport demandé et écrit son fichier ; seul le statut est conservé en base."""
+    from .services.reporting.report_jobs import report_jobs
+    job = report_jobs.run(job_pk)
+    if job is not None:
+        logger.info(f"Rapport {job.job_id} : {job.status}")
+
+
+@shared_task(ignore_result=True)
+def generate_daily_reports():
+    """Prépare les rapports de la veille : les demandes suivantes sont servies depuis leurs fichiers."""
+    from .services.reporting.report_jobs import report_jobs
+    yesterday = (timezone.localdate() - timedelta(days=1)).isoformat()
+    for report_type in ('trip_analysis', 'kpi'):
+        report_jobs.request(report_type, {'date_from': yesterday, 'date_to': yesterday})
+
+
+@shared_task(ignore_result=True)
+def purge_report_artifacts():
+    """Supprime les fichiers de rapports expirés."""
+    from .services.reporting.report_jobs import report_jobs
+    report_jobs.purge()
+
+
+@shared_task(ignore_result=True)
+def summarize_trip_track(trip_id):
+    """Synthèse de la trace GPS d'un trip terminé."""
+    from .services.tracking.track_analytics import track_analytics
+    track_analytics.summarize_trip(trip_id)
+
+
+@shared_task(ignore_result=True)
+def summarize_daily_tracks():
+    """Recalcule les synthèses de trace des trips de la veille (positions arrivées en retard comprises)."""
+    from .services.tracking.track_analytics import track_analytics
+    count = track_analytics.summarize_day(timezone.localdate() - timedelta(days=1))
+    logger.info(f"{count} synthèses de trace calculées")
+
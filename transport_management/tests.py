@@ -0,0 +1,1489 @@
+import gzip
+import io
+import itertools
+import json
+import tempfile
+import random
+import numpy as np
+import zipfile
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from openpyxl import load_workbook
+from rest_framework.test import APIClient
+from inventory_management.models import Vehicle
+from .models import (
+    Driver, DriverSchedule, DriverVehicleAssignment, Route, Stop, RouteStop, Schedule, ScheduleException, Trip, BusPosition,
+    EventLog, Geofence, Incident, RouteKPIRollup, ReportJob, TripTrackSummary
+)
+from .services.resource.conflict_index import IntervalTree, overlapping_pairs, conflict_index
+from .services.resource.fleet_manager import FleetManager
+from .services.resource.assignment_optimizer import solve_assignment
+from .services.resource.heartbeat_store import HeartbeatDeadlineStore
+from .services.resource import fleet_manager as fleet_manager_module
+from .services.trip_scheduler.block_builder import VehicleBlockBuilder
+from .services.trip_scheduler.crew_scheduler import CrewSchedulingEngine
+from .services.gtfs.feed_export import GTFSFeedExporter, path_points
+from .services.gtfs.feed_import import GTFSFeedImporter
+from .services.gtfs.protobuf import decode_message
+from .services.gtfs.realtime_feed import GTFSRealtimeFeedBuilder
+from .services.timetable.journey_planner import INFINITY, ConnectionTimetable, JourneyPlanner
+from .services.timetable.departure_index import StopDepartureIndex
+from .services.tracking.arrival_predictions import ArrivalPredictionService, arrival_predictions
+from .services.monitoring.headway_monitor import HeadwayMonitor
+from .services.trip_lifecycle.transition_scheduler import TripTransitionScheduler
+from .services.geofencing.geofence_engine import GeofenceEngine, point_in_polygon
+from .services.emergency.emergency_manager import EmergencyManager
+from .services.reporting.reporting_service import ReportingService
+from .services.reporting.kpi_rollup import kpi_rollups
+from .services.reporting.report_jobs import report_jobs
+from .services.export.tabular_export import TabularExporter
+from .services.tracking.track_analytics import TrackAnalyticsService
+from .services.trip_scheduler.deadhead import haversine_km
+
+User = get_user_model()
+
+
+def create_driver(username, **extra):
+    user = User.objects.create_user(username=username, password='12345')
+    fields = {
+        'user': user,
+        'employee_id': f'EMP-{username}',
+        'first_name': 'Test',
+        'last_name': username,
+        'date_of_birth': date(1985, 1, 1),
+        'phone_number': '0000000000',
+        'emergency_contact': 'Contact',
+        'address': 'Adresse',
+        'email': f'{username}@example.com',
+        'license_number': f'LIC-{username}',
+        'license_type': 'D',
+        'license_expiry_date': date.today() + timedelta(days=365),
+        'experience_years': 5,
+        'employment_status': 'active',
+        'availability_status': 'available',
+        'rating': 4.5,
+        'last_medical_check': date.today() - timedelta(days=30),
+        'next_medical_check': date.today() + timedelta(days=300),
+    }
+    fields.update(extra)
+    return Driver.objects.create(**fields)
+
+
+class IntervalTreeTests(SimpleTestCase):
+    def test_overlapping_query(self):
+        tree = IntervalTree()
+        tree.insert(0, 10, 'a')
+        tree.insert(5, 15, 'b')
+        tree.insert(20, 30, 'c')
+
+        keys = [interval[2] for interval in tree.overlapping(8, 21)]
+        self.assertEqual(keys, ['a', 'b', 'c'])
+        self.assertEqual(tree.overlapping(10, 20)[0][2], 'b')
+        self.assertEqual(len(tree.overlapping(15, 20)), 0)
+
+    def test_remove_and_replace(self):
+        tree = IntervalTree()
+        tree.insert(0, 10, 'a')
+        tree.insert(0, 5, 'a')
+        self.assertEqual(len(tree), 1)
+        self.assertEqual(tree.overlapping(6, 8), [])
+        self.assertTrue(tree.remove('a'))
+        self.assertFalse(tree.remove('a'))
+        self.assertEqual(tree.items(), [])
+
+    def test_pairs_match_brute_force(self):
+        rng = random.Random(42)
+        tree = IntervalTree()
+        intervals = {}
+        for key in range(300):
+            start = rng.randint(0, 5000)
+            end = start + rng.randint(1, 200)
+            tree.insert(start, end, key)
+            intervals[key] = (start, end)
+        for key in range(0, 300, 3):
+            tree.remove(key)
+            del intervals[key]
+
+        found = {
+            frozenset([first[2], second[2]])
+            for first, second in overlapping_pairs(tree.items())
+        }
+        expected = {
+            frozenset([a, b])
+            for a in intervals for b in intervals
+            if a < b and intervals[a][0] < intervals[b][1] and intervals[b][0] < intervals[a][1]
+        }
+        self.assertEqual(found, expected)
+
+
+class ResourceConflictIndexTests(TestCase):
+    def setUp(self):
+        self.driver = create_driver('conflict')
+        self.day_start = timezone.make_aware(datetime.combine(date.today(), datetime.min.time()))
+
+    def test_detects_overlapping_shifts(self):
+        first = DriverSchedule.objects.create(
+            driver=self.driver,
+            shift_start=self.day_start + timedelta(hours=6),
+            shift_end=self.day_start + timedelta(hours=12)
+        )
+        second = DriverSchedule.objects.create(
+            driver=self.driver,
+            shift_start=self.day_start + timedelta(hours=11),
+            shift_end=self.day_start + timedelta(hours=15)
+        )
+        DriverSchedule.objects.create(
+            driver=self.driver,
+            shift_start=self.day_start + timedelta(hours=16),
+            shift_end=self.day_start + timedelta(hours=18)
+        )
+
+        conflict_index.load(self.day_start, self.day_start + timedelta(days=7))
+        conflicts = conflict_index.detect_conflicts(self.day_start, self.day_start + timedelta(days=1))
+
+        self.assertEqual(len(conflicts), 1)
+        self.assertEqual(conflicts[0]['resource_id'], self.driver.id)
+        self.assertEqual(conflicts[0]['overlap_minutes'], 60.0)
+        self.assertEqual({w['id'] for w in conflicts[0]['windows']}, {first.id, second.id})
+
+        second.status = 'cancelled'
+        conflict_index.refresh_instance(second)
+        self.assertEqual(
+            conflict_index.detect_conflicts(self.day_start, self.day_start + timedelta(days=1)), []
+        )
+
+
+class VehicleBlockBuilderTests(SimpleTestCase):
+    def setUp(self):
+        self.builder = VehicleBlockBuilder()
+        self.base = timezone.make_aware(datetime(2024, 3, 4, 8, 0))
+        self.terminus_a = (18.5392, -72.3364)
+        self.terminus_b = (18.5125, -72.2853)
+
+    def make_trip(self, trip_id, start_minute, duration, origin, destination):
+        return {
+            'id': trip_id,
+            'route_id': 1,
+            'departure': self.base + timedelta(minutes=start_minute),
+            'arrival': self.base + timedelta(minutes=start_minute + duration),
+            'start': origin,
+            'end': destination,
+            'layover': 5,
+            'capacity': None,
+        }
+
+    def test_round_trips_share_vehicles(self):
+        a, b = self.terminus_a, self.terminus_b
+        trips = [
+            self.make_trip(1, 0, 30, a, b),
+            self.make_trip(2, 10, 30, a, b),
+            self.make_trip(3, 40, 30, b, a),
+            self.make_trip(4, 50, 30, b, a),
+            self.make_trip(5, 80, 30, a, b),
+        ]
+        blocks = self.builder.chain_trips(trips)
+
+        self.assertEqual(len(blocks), 2)
+        self.assertEqual(blocks[0]['trip_ids'], [1, 3, 5])
+        self.assertEqual(blocks[1]['trip_ids'], [2, 4])
+        self.assertEqual(blocks[0]['deadhead_minutes'], 0)
+
+    def test_deadhead_time_is_respected(self):
+        # Le terminus B est à ~6 km de A : trop loin pour enchaîner en 5 minutes
+        trips = [
+            self.make_trip(1, 0, 30, self.terminus_a, self.terminus_a),
+            self.make_trip(2, 36, 30, self.terminus_b, self.terminus_b),
+            self.make_trip(3, 70, 30, self.terminus_b, self.terminus_b),
+        ]
+        blocks = self.builder.chain_trips(trips)
+
+        covered = sorted(trip_id for block in blocks for trip_id in block['trip_ids'])
+        self.assertEqual(covered, [1, 2, 3])
+        self.assertEqual([block['trip_ids'] for block in blocks], [[1, 3], [2]])
+        self.assertGreater(blocks[0]['deadhead_minutes'], 10)
+
+
+class CrewSchedulingEngineTests(SimpleTestCase):
+    def setUp(self):
+        self.engine = CrewSchedulingEngine()
+        self.base = timezone.make_aware(datetime(2024, 3, 4, 5, 0))
+
+    def piece(self, start_minute, duration, block=1):
+        return {
+            'trip_ids': [start_minute],
+            'route_ids': [1],
+            'block': block,
+            'start': self.base + timedelta(minutes=start_minute),
+            'end': self.base + timedelta(minutes=start_minute + duration),
+        }
+
+    def test_continuous_driving_limit_forces_break_or_relief(self):
+        # Trips de 60 minutes avec 5 minutes de battement toute la journée sur un même bloc
+        pieces = [self.piece(minute, 60) for minute in range(0, 13 * 65, 65)]
+        duties = self.engine.build_duties(pieces)
+
+        covered = sorted(trip_id for duty in duties for trip_id in duty['trip_ids'])
+        self.assertEqual(covered, [p['trip_ids'][0] for p in pieces])
+        for duty in duties:
+            self.assertLessEqual(duty['max_continuous_minutes'], self.engine.MAX_CONTINUOUS_DRIVING_MINUTES)
+            self.assertLessEqual(duty['driving_minutes'], self.engine.MAX_DAILY_DRIVING_MINUTES)
+        self.assertGreater(len(duties), 1)
+
+    def test_break_resets_continuous_driving(self):
+        pieces = [self.piece(0, 120), self.piece(125, 120), self.piece(295, 120)]
+        duties = self.engine.build_duties(pieces)
+
+        self.assertEqual(len(duties), 1)
+        self.assertEqual(len(duties[0]['breaks']), 1)
+        self.assertEqual(duties[0]['max_continuous_minutes'], 240)
+
+    def test_drivers_respect_weekly_hours_and_rest(self):
+        duties = self.engine.build_duties([self.piece(0, 240, block=1), self.piece(600, 240, block=2)])
+        drivers = [
+            {'id': 1, 'remaining_minutes': 300, 'busy': [], 'daily_minutes': {},
+             'restricted_routes': set(), 'min_break_minutes': 0},
+            {'id': 2, 'remaining_minutes': 200, 'busy': [], 'daily_minutes': {},
+             'restricted_routes': set(), 'min_break_minutes': 0},
+        ]
+        self.engine.assign_drivers(duties, drivers)
+
+        # Le chauffeur 1 ne peut couvrir qu'un service, le chauffeur 2 n'a pas assez d'heures
+        self.assertEqual(sorted(str(d['driver_id']) for d in duties), ['1', 'None'])
+
+
+def create_route(code='L1', coordinates=None):
+    coordinates = coordinates or [(18.5392, -72.3364), (18.5300, -72.3200), (18.5125, -72.2853)]
+    route = Route.objects.create(
+        name=f'Ligne {code}', description='Centre - Pétion-Ville', route_code=code, circuit='C1',
+        route_category='local', difficulty_level='easy', type='urban', direction='est',
+        total_distance=Decimal('6.00'), estimated_duration=timedelta(minutes=30),
+        service_hours='06:00-08:00', peak_frequency=30, off_peak_frequency=30, weekend_frequency=30,
+        path={'type': 'LineString', 'coordinates': [[lon, lat] for lat, lon in coordinates]},
+        route_color='#FF0000', status='active'
+    )
+    for index, (latitude, longitude) in enumerate(coordinates):
+        stop = Stop.objects.create(
+            name=f'Arrêt {index}', stop_code=f'{code}S{index}',
+            latitude=Decimal(str(latitude)), longitude=Decimal(str(longitude)),
+            address='Adresse', service_zone='Centre', zone_code='Z1',
+            stop_type='bus_stop', boarding_type='standard', status='operational'
+        )
+        RouteStop.objects.create(
+            route=route, stop=stop, order=index, stop_sequence=index + 1,
+            distance_from_start=Decimal(index * 3), estimated_time=index * 15,
+            stop_announcement=stop.name, pickup_type=0, drop_off_type=0
+        )
+    return route
+
+
+class CrewDutyPlanningTests(TestCase):
+    def setUp(self):
+        self.route = create_route('L1')
+        self.driver = create_driver('crew')
+        self.day = date(2030, 1, 7)
+        start = timezone.make_aware(datetime(2030, 1, 7, 6, 0))
+        self.trips = [
+            Trip.objects.create(
+                route=self.route, planned_departure=start + timedelta(minutes=offset),
+                planned_arrival=start + timedelta(minutes=offset + 30)
+            )
+            for offset in (0, 40, 80)
+        ]
+
+    def test_replanning_replaces_previous_duties(self):
+        engine = CrewSchedulingEngine()
+        engine.plan_day(self.day)
+        first = list(DriverSchedule.objects.values_list('id', flat=True))
+        self.assertEqual(len(first), 1)
+
+        engine.plan_day(self.day)
+        self.assertEqual(DriverSchedule.objects.count(), 1)
+        self.assertNotIn(DriverSchedule.objects.get().id, first)
+        self.assertEqual(
+            sorted(DriverSchedule.objects.get().compliance_notes['trip_ids']),
+            sorted(trip.id for trip in self.trips)
+        )
+        self.assertEqual(set(Trip.objects.values_list('driver_id', flat=True)), {self.driver.id})
+
+        # Plus aucun chauffeur disponible : les trips replanifiés perdent l'ancien service
+        Driver.objects.filter(id=self.driver.id).update(employment_status='on_leave')
+        engine.plan_day(self.day)
+        self.assertFalse(DriverSchedule.objects.exists())
+        self.assertEqual(set(Trip.objects.values_list('driver_id', flat=True)), {None})
+
+
+    def test_blocks_without_vehicle_get_no_crew_duty(self):
+        # Aucun véhicule actif : les blocs restent à planifier, sans service chauffeur
+        for _ in range(2):
+            result = VehicleBlockBuilder().plan_day(self.day, only_unassigned=True)
+            self.assertEqual(len(result['unassigned_blocks']), len(result['blocks']))
+            self.assertEqual(result['duties'], 0)
+
+        self.assertFalse(DriverSchedule.objects.exists())
+        self.assertEqual(set(Trip.objects.values_list('driver_id', flat=True)), {None})
+
+class GTFSFeedTests(TestCase):
+    def setUp(self):
+        self.route = create_route()
+        self.schedule = Schedule.objects.create(
+            route=self.route, schedule_code='L1-LUN', schedule_version='v1', season='regular',
+            day_of_week='monday', start_date=date(2030, 1, 7), end_date=date(2030, 3, 25),
+            start_time=time(6, 0), end_time=time(7, 0), frequency=30,
+            status='active', is_current_version=True
+        )
+        ScheduleException.objects.bulk_create([ScheduleException(
+            schedule=self.schedule, exception_date=date(2030, 1, 14), exception_type='holiday',
+            is_cancelled=True, reason='Férié', impact_level='low'
+        )])
+
+    def export(self):
+        return zipfile.ZipFile(io.BytesIO(b''.join(GTFSFeedExporter().stream())))
+
+    def test_export_contains_schedule_trips(self):
+        archive = self.export()
+        stop_times = archive.read('stop_times.txt').decode().splitlines()
+
+        self.assertIn('trips.txt', archive.namelist())
+        self.assertEqual(len(archive.read('trips.txt').decode().splitlines()), 4)
+        self.assertEqual(len(stop_times), 1 + 3 * 3)
+        self.assertIn('L1-LUN-v1-063000,06:30:00,06:30:00,L1S0', stop_times[4])
+        self.assertIn('L1-LUN-v1,20300114,2', archive.read('calendar_dates.txt').decode())
+        self.assertEqual(len(archive.read('shapes.txt').decode().splitlines()), 4)
+        self.assertEqual(path_points(self.route.path)[0], (18.5392, -72.3364))
+
+    def test_import_round_trip(self):
+        payload = io.BytesIO(b''.join(GTFSFeedExporter().stream()))
+        Schedule.objects.all().delete()
+        Route.objects.all().delete()
+        Stop.objects.all().delete()
+
+        summary = GTFSFeedImporter().import_feed(payload)
+
+        self.assertEqual(summary['stops'], 3)
+        self.assertEqual(summary['routes'], 1)
+        self.assertEqual(summary['route_stops'], 3)
+        route = Route.objects.get(route_code='L1')
+        self.assertEqual(len(route.path), 3)
+        self.assertEqual(list(route.routestop_set.order_by('order').values_list('estimated_time', flat=True)), [0, 15, 30])
+        schedule = Schedule.objects.get(route=route)
+        self.assertEqual((schedule.day_of_week, schedule.frequency), ('monday', 30))
+        self.assertEqual(schedule.timepoints, ['06:00:00', '06:30:00', '07:00:00'])
+        self.assertTrue(schedule.exceptions.filter(exception_date=date(2030, 1, 14), is_cancelled=True).exists())
+
+    def test_import_reports_ids_too_long(self):
+        source = self.export()
+        payload = io.BytesIO()
+        with zipfile.ZipFile(payload, 'w') as archive:
+            for name in source.namelist():
+                content = source.read(name).decode().replace('L1S2', 'STATION-L1S2')
+                if name == 'routes.txt':
+                    header = content.splitlines()[0].split(',')
+                    content += ','.join('EXPRESS-AIRPORT-NORTH' if column == 'route_id' else '' for column in header) + '\n'
+                archive.writestr(name, content)
+        payload.seek(0)
+        Schedule.objects.all().delete()
+        Route.objects.all().delete()
+        Stop.objects.all().delete()
+
+        summary = GTFSFeedImporter().import_feed(payload)
+
+        self.assertEqual(summary['rejected_stops'], ['STATION-L1S2'])
+        self.assertEqual(summary['rejected_routes'], ['EXPRESS-AIRPORT-NORTH'])
+        self.assertEqual((summary['stops'], summary['routes'], summary['route_stops']), (2, 1, 2))
+        self.assertFalse(Stop.objects.filter(stop_code__startswith='STATION').exists())
+
+
+class GTFSRealtimeFeedTests(TestCase):
+    def setUp(self):
+        self.route = create_route()
+        self.vehicle = Vehicle.objects.create(
+            vehicle_number='BUS-01', type='bus', make='Toyota', model='Coaster',
+            capacity=30, fuel_type='diesel', license_plate='AA-0001'
+        )
+        self.now = timezone.now().replace(microsecond=0)
+        self.trip = Trip.objects.create(
+            route=self.route, vehicle=self.vehicle, status='in_progress',
+            planned_departure=self.now - timedelta(minutes=20),
+            planned_arrival=self.now + timedelta(minutes=10),
+            delay_duration=timedelta(minutes=2)
+        )
+        BusPosition.objects.create(
+            trip=self.trip, latitude=Decimal('18.530000'), longitude=Decimal('-72.320000'),
+            speed=Decimal('36.00'), heading=Decimal('90.00'), timestamp=self.now
+        )
+
+    def test_feed_lists_positions_and_remaining_stops(self):
+        feed = GTFSRealtimeFeedBuilder().build(self.now)
+        entities = {entity['id']: entity for entity in feed['entity']}
+
+        update = entities[f'trip-{self.trip.id}']['tripUpdate']
+        self.assertEqual(update['delay'], 120)
+        self.assertEqual(update['trip']['tripId'], f'T{self.trip.id}')
+        self.assertEqual([stop['stopId'] for stop in update['stopTimeUpdate']], ['L1S2'])
+
+        vehicle = entities[f'vehicle-{self.trip.id}']['vehicle']
+        self.assertEqual(vehicle['position']['speed'], 10.0)
+        self.assertEqual(vehicle['vehicle']['licensePlate'], 'AA-0001')
+
+    def test_protobuf_rendering_and_conditional_get(self):
+        entry = GTFSRealtimeFeedBuilder().refresh(self.now)
+        message = decode_message(entry['pb'])
+        header = decode_message(message[1][0])
+        self.assertEqual(header[1], [b'2.0'])
+        self.assertEqual(len(message[2]), 2)
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='consumer', password='12345'))
+        response = client.get('/api/transport/gtfs/realtime.pb')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, entry['pb'])
+
+        response = client.get('/api/transport/gtfs/realtime.json', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_ignores_header_timestamp(self):
+        builder = GTFSRealtimeFeedBuilder()
+        first = builder.refresh(self.now)
+        second = builder.refresh(self.now + timedelta(seconds=5))
+
+        self.assertNotEqual(first['timestamp'], second['timestamp'])
+        self.assertEqual(first['etag'], second['etag'])
+
+    def test_etag_stable_for_trip_without_position(self):
+        BusPosition.objects.all().delete()
+        builder = GTFSRealtimeFeedBuilder()
+        first = builder.refresh(self.now)
+        second = builder.refresh(self.now + timedelta(seconds=5))
+
+        self.assertEqual(first['entities'], 1)
+        self.assertNotIn('timestamp', json.loads(first['json'])['entity'][0]['tripUpdate'])
+        self.assertEqual(first['etag'], second['etag'])
+
+
+class ConnectionTimetableTests(SimpleTestCase):
+    def build(self, connections, footpaths=((), (), ()), stops=6):
+        timetable = ConnectionTimetable(date(2024, 3, 4), list(range(100, 100 + stops)), footpaths)
+        trips = sorted({connection[4] for connection in connections})
+        indices = dict(zip(trips, timetable.register_trips(trips, [1] * len(trips))))
+        timetable.set_connections(*zip(*[connection[:4] + (indices[connection[4]],) for connection in connections]))
+        return timetable
+
+    def test_transfer_with_walk(self):
+        # Trip 0 : 0 -> 1 -> 2 ; marche 2 -> 3 (120 s) ; trip 1 : 3 -> 4
+        timetable = self.build(
+            [(0, 1, 100, 200, 0), (1, 2, 210, 300, 0), (3, 4, 430, 500, 1), (3, 4, 400, 480, 2)],
+            footpaths=([2, 3], [3, 2], [120, 120])
+        )
+        legs = timetable.earliest_arrival(0, 4, 50)
+        self.assertEqual([leg['type'] for leg in legs], ['ride', 'walk', 'ride'])
+        self.assertEqual((legs[-1]['trip_id'], legs[-1]['arrival']), (1, 500))
+
+        legs = timetable.latest_departure(0, 4, 520)
+        self.assertEqual(legs[0]['departure'], 100)
+        self.assertIsNone(timetable.latest_departure(0, 4, 490))
+
+    def test_minimum_transfer_time(self):
+        timetable = self.build([(0, 1, 0, 100, 0), (1, 2, 130, 200, 1), (1, 2, 170, 260, 2)])
+        self.assertEqual(timetable.earliest_arrival(0, 2, 0)[-1]['trip_id'], 2)
+
+    def test_matches_exhaustive_search(self):
+        rng = random.Random(7)
+        stops = 12
+        connections = []
+        for trip in range(60):
+            stop, clock = rng.randrange(stops), rng.randrange(0, 3000)
+            for _ in range(rng.randint(1, 4)):
+                next_stop = rng.randrange(stops)
+                if next_stop == stop:
+                    continue
+                duration = rng.randint(30, 300)
+                connections.append((stop, next_stop, clock, clock + duration, trip))
+                stop, clock = next_stop, clock + duration + rng.randint(0, 60)
+        timetable = self.build(connections, stops=stops)
+
+        for source in range(stops):
+            # Relâchement répété jusqu'au point fixe, sans ordre de parcours
+            ready = {source: 0}
+            arrival = {source: 0}
+            boarded = {}
+            changed = True
+            while changed:
+                changed = False
+                for dep_stop, arr_stop, dep_time, arr_time, trip in connections:
+                    if not (ready.get(dep_stop, INFINITY) <= dep_time or boarded.get(trip, INFINITY) <= dep_time):
+                        continue
+                    if dep_time < boarded.get(trip, INFINITY):
+                        boarded[trip] = dep_time
+                        changed = True
+                    if arr_time < arrival.get(arr_stop, INFINITY):
+                        arrival[arr_stop] = arr_time
+                        ready[arr_stop] = arr_time + timetable.min_transfer_seconds
+                        changed = True
+            for target in range(stops):
+                if target == source:
+                    continue
+                legs = timetable.earliest_arrival(source, target, 0)
+                self.assertEqual(legs[-1]['arrival'] if legs else None, arrival.get(target))
+
+
+class JourneyPlannerTests(TestCase):
+    def setUp(self):
+        self.first = create_route('L1')
+        self.second = create_route('L2', [(18.5130, -72.2850), (18.5000, -72.2700), (18.4900, -72.2600)])
+        self.day_start = timezone.make_aware(datetime.combine(date(2030, 1, 7), time.min))
+        self.planner = JourneyPlanner()
+        self.connecting = self.create_trip(self.second, 8, 35)
+        self.create_trip(self.first, 8, 0)
+        self.create_trip(self.second, 9, 35)
+
+    def create_trip(self, route, hour, minute):
+        departure = self.day_start + timedelta(hours=hour, minutes=minute)
+        return Trip.objects.create(
+            route=route, planned_departure=departure, planned_arrival=departure + timedelta(minutes=30)
+        )
+
+    def stop(self, code):
+        return Stop.objects.get(stop_code=code).id
+
+    def test_plan_with_walking_transfer(self):
+        journey = self.planner.plan(self.stop('L1S0'), self.stop('L2S2'), date(2030, 1, 7), depart_at=time(7, 50))
+
+        self.assertEqual([leg['type'] for leg in journey['legs']], ['ride', 'walk', 'ride'])
+        self.assertEqual(journey['transfers'], 1)
+        self.assertEqual(journey['legs'][-1]['trip_id'], self.connecting.id)
+        self.assertEqual(journey['arrival'], (self.day_start + timedelta(hours=9, minutes=5)).isoformat())
+
+        journey = self.planner.plan(self.stop('L1S0'), self.stop('L2S2'), date(2030, 1, 7), arrive_by=time(9, 10))
+        self.assertEqual(journey['departure'], (self.day_start + timedelta(hours=8)).isoformat())
+
+    def test_cancelled_trip_is_removed_incrementally(self):
+        self.planner.plan(self.stop('L1S0'), self.stop('L2S2'), date(2030, 1, 7), depart_at=time(7, 50))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.connecting.status = 'cancelled'
+            self.connecting.save()
+
+        journey = self.planner.plan(self.stop('L1S0'), self.stop('L2S2'), date(2030, 1, 7), depart_at=time(7, 50))
+        self.assertEqual(journey['arrival'], (self.day_start + timedelta(hours=10, minutes=5)).isoformat())
+
+    def test_schedule_saves_invalidate_only_on_timetable_changes(self):
+        schedule = Schedule.objects.create(
+            route=self.first, schedule_code='L1-LUN', schedule_version='v1', season='regular',
+            day_of_week='monday', start_date=date(2030, 1, 7), end_date=date(2030, 3, 25),
+            start_time=time(6, 0), end_time=time(7, 0), frequency=30, status='draft'
+        )
+        schedule = Schedule.objects.get(pk=schedule.pk)
+        version = cache.get(self.planner.NETWORK_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule.notes = 'Vérifié'
+            schedule.save()
+        self.assertEqual(cache.get(self.planner.NETWORK_VERSION_KEY), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule.frequency = 20
+            schedule.save()
+        self.assertNotEqual(cache.get(self.planner.NETWORK_VERSION_KEY), version)
+
+
+class StopDepartureIndexTests(TestCase):
+    def setUp(self):
+        self.first = create_route('L1')
+        self.second = create_route('L2', [(18.5300, -72.3200), (18.5000, -72.2700), (18.4900, -72.2600)])
+        self.shared_stop = Stop.objects.get(stop_code='L1S1')
+        RouteStop.objects.filter(route=self.second, order=0).update(stop=self.shared_stop)
+        self.day_start = timezone.make_aware(datetime.combine(date(2030, 1, 7), time.min))
+        self.index = StopDepartureIndex()
+
+    def create_trip(self, route, hour, minute, **extra):
+        departure = self.day_start + timedelta(hours=hour, minutes=minute)
+        return Trip.objects.create(
+            route=route, planned_departure=departure,
+            planned_arrival=departure + timedelta(minutes=30), **extra
+        )
+
+    def test_next_departures_across_routes_with_live_delay(self):
+        late = self.create_trip(self.first, 8, 0, status='in_progress', delay_duration=timedelta(minutes=10))
+        on_time = self.create_trip(self.second, 8, 20)
+        self.create_trip(self.first, 9, 0)
+
+        # L1 passe à l'arrêt partagé à 8:15 (+10 min de retard), L2 en part à 8:20
+        departures = self.index.next_departures(
+            self.shared_stop.id, at=self.day_start + timedelta(hours=8, minutes=16), limit=2
+        )
+        self.assertEqual([d['trip_id'] for d in departures], [on_time.id, late.id])
+        self.assertEqual(departures[1]['delay_minutes'], 10.0)
+        self.assertTrue(departures[1]['is_live'])
+
+    def test_schedule_without_generated_trips(self):
+        Schedule.objects.create(
+            route=self.first, schedule_code='L1-LUN', schedule_version='v1', season='regular',
+            day_of_week='monday', start_date=date(2030, 1, 7), end_date=date(2030, 1, 7),
+            start_time=time(6, 0), end_time=time(7, 0), frequency=30,
+            status='active', is_current_version=True
+        )
+        departures = self.index.next_departures(
+            self.shared_stop.id, at=self.day_start + timedelta(hours=6, minutes=20), live=False
+        )
+        self.assertEqual(
+            [d['scheduled_departure'][11:16] for d in departures], ['06:45', '07:15']
+        )
+        self.assertIsNone(departures[0]['trip_id'])
+
+    def test_next_departure_does_not_save(self):
+        schedule = Schedule(
+            route=self.first, start_time=time(6, 0), end_time=time(7, 0), frequency=30,
+            timepoints=['06:00:00', '06:30:00', '07:00:00']
+        )
+        self.assertEqual(schedule.get_next_departure(time(6, 30)), time(7, 0))
+        self.assertIsNone(schedule.get_next_departure(time(7, 0)))
+        schedule.timepoints = []
+        self.assertEqual(schedule.get_next_departure(time(6, 10)), time(6, 30))
+        self.assertIsNone(schedule.pk)
+
+
+class ArrivalPredictionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.route = create_route('L1')
+        self.stops = list(Stop.objects.filter(stop_code__startswith='L1S').order_by('stop_code'))
+        self.departure = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+        self.trip = Trip.objects.create(
+            route=self.route, planned_departure=self.departure,
+            planned_arrival=self.departure + timedelta(minutes=30), status='in_progress'
+        )
+        self.service = ArrivalPredictionService()
+
+    def position_between(self, first, second, minutes):
+        return BusPosition(
+            trip=self.trip,
+            latitude=(first.latitude + second.latitude) / 2,
+            longitude=(first.longitude + second.longitude) / 2,
+            timestamp=self.departure + timedelta(minutes=minutes)
+        )
+
+    def test_position_delay_propagated_to_upcoming_stops(self):
+        # À mi-chemin du premier segment (prévu à 7 min 30) à 8:12 : 4 min 30 de retard
+        position = self.position_between(self.stops[0], self.stops[1], 12)
+        now = position.timestamp
+        self.service.update_trip(self.trip, position, now=now)
+
+        self.assertEqual(self.service.arrivals(self.stops[0].id, now=now), [])
+        arrivals = self.service.arrivals(self.stops[1].id, now=now)
+        self.assertEqual(len(arrivals), 1)
+        self.assertEqual(arrivals[0]['trip_id'], self.trip.id)
+        self.assertEqual(arrivals[0]['source'], 'position')
+        self.assertAlmostEqual(arrivals[0]['delay_seconds'], 270, delta=30)
+        self.assertAlmostEqual(arrivals[0]['minutes_away'], 7.5, delta=0.5)
+        later = self.service.arrivals(self.stops[2].id, now=now)
+        self.assertEqual(later[0]['delay_seconds'], arrivals[0]['delay_seconds'])
+
+        # Le bus dépasse l'arrêt 1 : il n'y est plus annoncé
+        position = self.position_between(self.stops[1], self.stops[2], 25)
+        self.service.update_trip(self.trip, position, now=position.timestamp)
+        self.assertEqual(self.service.arrivals(self.stops[1].id, now=position.timestamp), [])
+        self.assertEqual(len(self.service.arrivals(self.stops[2].id, now=position.timestamp)), 1)
+
+    def test_completed_trip_removed_and_delay_fallback(self):
+        self.trip.delay_duration = timedelta(minutes=5)
+        now = self.departure + timedelta(minutes=10)
+        self.service.update_trip(self.trip, now=now)
+        arrivals = self.service.arrivals(self.stops[1].id, now=now)
+        self.assertEqual(arrivals[0]['source'], 'schedule')
+        self.assertEqual(arrivals[0]['predicted_arrival'][11:16], '08:20')
+
+        self.trip.status = 'completed'
+        self.service.update_trip(self.trip, now=now)
+        for stop in self.stops:
+            self.assertEqual(self.service.arrivals(stop.id, now=now), [])
+
+    def test_trips_at_same_stop_keep_separate_entries(self):
+        other = Trip.objects.create(
+            route=self.route, planned_departure=self.departure + timedelta(minutes=5),
+            planned_arrival=self.departure + timedelta(minutes=35), status='in_progress'
+        )
+        now = self.departure + timedelta(minutes=2)
+        self.service.update_trip(self.trip, now=now)
+        self.service.update_trip(other, now=now)
+        self.assertEqual(
+            [arrival['trip_id'] for arrival in self.service.arrivals(self.stops[1].id, now=now)], [self.trip.id, other.id]
+        )
+
+        self.service.remove_trip(self.trip.id)
+        self.assertEqual([arrival['trip_id'] for arrival in self.service.arrivals(self.stops[1].id, now=now)], [other.id])
+
+    def test_arrivals_endpoint(self):
+        user = User.objects.create_user(username='lecteur', password='12345')
+        client = APIClient()
+        client.force_authenticate(user)
+        now = timezone.now()
+        self.trip.planned_departure = now - timedelta(minutes=5)
+        self.service.update_trip(self.trip, now=now)
+
+        # Les prévisions sont lues dans le cache partagé, sans calcul à la requête
+        response = client.get(f'/api/transport/stops-detail/{self.stops[2].id}/arrivals/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['arrivals'][0]['trip_id'], self.trip.id)
+
+
+class HeadwayMonitorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.route = create_route('L1')
+        self.day_start = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+        self.now = self.day_start + timedelta(minutes=20)
+
+    def run_trips(self, delays):
+        # Trips toutes les 10 minutes, retard en minutes ; état sur le tracé via les prévisions d'arrivée
+        trips = []
+        for index, delay in enumerate(delays):
+            departure = self.day_start + timedelta(minutes=10 * index)
+            trip = Trip.objects.create(
+                route=self.route, planned_departure=departure, planned_arrival=departure + timedelta(minutes=30),
+                status='in_progress', delay_duration=timedelta(minutes=delay)
+            )
+            arrival_predictions.update_trip(trip, now=self.now)
+            trips.append(trip)
+        return trips
+
+    def test_bunching_event_with_holding_suggestion(self):
+        first, second, third = self.run_trips([8, 0, 0])
+        events = HeadwayMonitor().check_routes(now=self.now)
+
+        self.assertEqual(len(events), 1)
+        event = EventLog.objects.get(event_type='bus_bunching')
+        self.assertEqual(event.trip_id, second.id)
+        self.assertEqual(event.severity, 'error')
+        self.assertEqual(event.event_data['leader_trip_id'], first.id)
+        self.assertEqual(event.event_data['actual_headway_seconds'], 120)
+        # Intervalle derrière 10 min, devant 2 min : retenue de 4 min
+        self.assertEqual(event.event_data['suggested_holding'], {'trip_id': second.id, 'seconds': 240})
+
+        # Même paire au cycle suivant : pas de doublon
+        self.assertEqual(HeadwayMonitor().check_routes(now=self.now), [])
+
+    def test_gap_holds_leader(self):
+        first, second, third = self.run_trips([0, 8, 0])
+        HeadwayMonitor().check_routes(now=self.now)
+
+        gap = EventLog.objects.get(event_type='headway_gap')
+        self.assertEqual(gap.trip_id, second.id)
+        self.assertEqual(gap.event_data['suggested_holding']['trip_id'], first.id)
+        self.assertGreater(gap.event_data['suggested_holding']['seconds'], 0)
+        self.assertTrue(EventLog.objects.filter(event_type='bus_bunching', trip=third).exists())
+
+    def test_overtaken_trip_reported_as_bunching(self):
+        # Le trip de 8:00 (12 min de retard) est dépassé par celui de 8:10 : intervalle prévu négatif
+        first, second = self.run_trips([12, 0])
+        HeadwayMonitor().check_routes(now=self.now)
+
+        event = EventLog.objects.get(event_type='bus_bunching')
+        self.assertEqual((event.trip_id, event.event_data['leader_trip_id']), (first.id, second.id))
+        self.assertTrue(event.event_data['out_of_order'])
+        self.assertEqual(event.event_data['scheduled_headway_seconds'], -600)
+        self.assertEqual(event.severity, 'error')
+
+
+class RecordingTransitionScheduler(TripTransitionScheduler):
+    """Enregistre les tâches au lieu de les envoyer au broker"""
+
+    def __init__(self):
+        super().__init__()
+        self.dispatched = []
+
+    def _dispatch(self, trip_id, transition, token, eta):
+        self.dispatched.append((trip_id, transition, eta))
+
+
+class TripTransitionSchedulerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.route = create_route('L1')
+        self.departure = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+        self.scheduler = RecordingTransitionScheduler()
+
+    def create_trip(self, **extra):
+        return Trip.objects.create(
+            route=self.route, planned_departure=self.departure,
+            planned_arrival=self.departure + timedelta(minutes=30), **extra
+        )
+
+    def test_planned_trip_start_armed_once(self):
+        trip = self.create_trip()
+        now = self.departure - timedelta(minutes=30)
+        self.assertEqual(self.scheduler.arm(trip, now), [('start', self.departure - timedelta(minutes=5))])
+        self.assertEqual(self.scheduler.arm(trip, now), [])
+
+        # Trop tôt : hors horizon, armé plus tard par arm_upcoming
+        self.assertEqual(self.scheduler.plan(trip, self.departure - timedelta(hours=2)), [])
+
+    def test_display_transitions_catch_up_and_horizon(self):
+        trip = self.create_trip(status='scheduled')
+        now = self.departure - timedelta(minutes=7)
+        plan = self.scheduler.plan(trip, now)
+        self.assertEqual([name for name, eta in plan], ['boarding_soon', 'boarding', 'in_transit', 'arriving_soon', 'completed'])
+        self.assertEqual(plan[0][1], now)
+        self.assertEqual(plan[2][1], self.departure + timedelta(seconds=1))
+
+    def test_fire_ignores_rescheduled_trip_and_retries_start(self):
+        trip = self.create_trip()
+        token = self.scheduler.token(trip)
+        Trip.objects.filter(id=trip.id).update(planned_departure=self.departure + timedelta(minutes=10))
+        self.assertEqual(self.scheduler.fire(trip.id, 'start', token), 'stale')
+
+        # Départ imminent, aucune position du véhicule : nouvel essai armé
+        departure = timezone.now() + timedelta(minutes=3)
+        Trip.objects.filter(id=trip.id).update(
+            planned_departure=departure, planned_arrival=departure + timedelta(minutes=30)
+        )
+        trip.refresh_from_db()
+        self.assertEqual(self.scheduler.fire(trip.id, 'start', self.scheduler.token(trip)), 'retry')
+        self.assertEqual(self.scheduler.dispatched[0][:2], (trip.id, 'start'))
+
+
+class HeartbeatDeadlineStoreTests(SimpleTestCase):
+    def test_only_expired_vehicles_popped(self):
+        store = HeartbeatDeadlineStore()
+        store.touch(1, 100)
+        store.touch(2, 150)
+        store.touch(1, 200)     # Repoussée : l'ancienne entrée du tas est ignorée
+        store.touch(1, 120)     # Position en retard : l'échéance ne recule pas
+        self.assertEqual(store.pop_expired(160), [2])
+        self.assertEqual(store.pop_expired(160), [])
+        self.assertEqual(store.pop_expired(200), [1])
+
+        # Le véhicule perdu se manifeste à nouveau : communication rétablie
+        self.assertTrue(store.touch(2, 400))
+        self.assertFalse(store.touch(2, 450))
+
+    def test_arm_does_not_override_tracked_vehicle(self):
+        store = HeartbeatDeadlineStore()
+        store.touch(1, 500)
+        store.arm(1, 100)
+        store.arm(2, 100)
+        self.assertEqual(store.pop_expired(300), [2])
+
+
+class FleetCommunicationLossTests(TestCase):
+    def setUp(self):
+        # Tas en mémoire propre au test (pas de Redis ni d'état partagé entre tests)
+        self.store = HeartbeatDeadlineStore()
+        self.addCleanup(setattr, fleet_manager_module, 'vehicle_heartbeats', fleet_manager_module.vehicle_heartbeats)
+        fleet_manager_module.vehicle_heartbeats = self.store
+
+        self.vehicle = Vehicle.objects.create(
+            vehicle_number='BUS-01', type='bus', make='Toyota', model='Coaster',
+            capacity=30, fuel_type='diesel', license_plate='AA-0001'
+        )
+        now = timezone.now()
+        self.assignment = DriverVehicleAssignment.objects.create(
+            driver=create_driver('heartbeat'), vehicle=self.vehicle, status='active',
+            assigned_from=now - timedelta(hours=1), assigned_until=now + timedelta(hours=4)
+        )
+        self.manager = FleetManager()
+
+    def test_silent_vehicle_marked_inactive_then_restored(self):
+        self.manager.watch_assignment(self.assignment)
+        self.assertEqual(self.manager._update_fleet_status(), [])
+
+        # Dernière position il y a plus de ACTIVE_TIMEOUT : échéance dépassée
+        self.store.forget(self.vehicle.id)
+        self.store.touch(self.vehicle.id, timezone.now().timestamp() - 1)
+        self.assertEqual(self.manager._update_fleet_status(), [self.vehicle.id])
+        self.assignment.refresh_from_db()
+        self.assertEqual(self.assignment.status, 'inactive')
+
+        position = BusPosition(latitude=Decimal('18.5'), longitude=Decimal('-72.3'), timestamp=timezone.now())
+        self.assertTrue(self.manager.record_heartbeat(self.vehicle.id, position))
+        self.assignment.refresh_from_db()
+        self.assertEqual(self.assignment.status, 'active')
+        self.assertEqual(self.manager._update_fleet_status(), [])
+
+
+class AssignmentSolverTests(SimpleTestCase):
+    def test_matches_exhaustive_search(self):
+        rng = random.Random(3)
+        for _ in range(100):
+            rows, columns = rng.randint(1, 5), rng.randint(1, 5)
+            cost = [[rng.choice([rng.randint(0, 20), float('inf')]) for _ in range(columns)] for _ in range(rows)]
+            if rows <= columns:
+                candidates = [
+                    sum(cost[row][column] for row, column in enumerate(permutation))
+                    for permutation in itertools.permutations(range(columns), rows)
+                ]
+            else:
+                candidates = [
+                    sum(cost[row][column] for column, row in enumerate(permutation))
+                    for permutation in itertools.permutations(range(rows), columns)
+                ]
+            best = min(candidates)
+            if best == float('inf'):
+                with self.assertRaises(ValueError):
+                    solve_assignment(cost)
+                continue
+            row_indices, column_indices = solve_assignment(cost)
+            self.assertEqual(sum(cost[r][c] for r, c in zip(row_indices, column_indices)), best)
+
+
+class FleetAssignmentOptimizationTests(TestCase):
+    def setUp(self):
+        self.route = create_route('L1')
+        now = timezone.now()
+        self.trip = Trip.objects.create(
+            route=self.route, planned_departure=now + timedelta(hours=1),
+            planned_arrival=now + timedelta(hours=1, minutes=30)
+        )
+        self.assignments = []
+        # Premier couple à l'autre bout de la ville, second au terminus de départ
+        for index, (latitude, longitude) in enumerate([(18.6500, -72.1000), (18.5392, -72.3364)]):
+            vehicle = Vehicle.objects.create(
+                vehicle_number=f'BUS-0{index}', type='bus', make='Toyota', model='Coaster',
+                capacity=30, fuel_type='diesel', license_plate=f'AA-000{index}'
+            )
+            assignment = DriverVehicleAssignment.objects.create(
+                driver=create_driver(f'opt{index}', maximum_hours_per_week=40), vehicle=vehicle, status='active',
+                assigned_from=now - timedelta(hours=1), assigned_until=now + timedelta(hours=1, minutes=10)
+            )
+            past = Trip.objects.create(
+                route=self.route, vehicle=vehicle, status='completed',
+                planned_departure=now - timedelta(hours=2), planned_arrival=now - timedelta(hours=1, minutes=50)
+            )
+            BusPosition.objects.create(
+                trip=past, latitude=Decimal(str(latitude)), longitude=Decimal(str(longitude)),
+                speed=Decimal('0.00'), heading=Decimal('0.00'), timestamp=now - timedelta(minutes=5)
+            )
+            self.assignments.append(assignment)
+
+    def test_nearest_pair_assigned_and_assignment_extended(self):
+        manager = FleetManager()
+        manager._optimize_assignments()
+
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.vehicle_id, self.assignments[1].vehicle_id)
+        self.assertEqual(self.trip.driver_id, self.assignments[1].driver_id)
+        self.assignments[1].refresh_from_db()
+        self.assertEqual(self.assignments[1].assigned_until, self.trip.planned_arrival)
+
+
+class GeofenceEngineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.route = create_route('L1')
+        self.vehicle = Vehicle.objects.create(
+            vehicle_number='BUS-01', type='bus', make='Toyota', model='Coaster',
+            capacity=30, fuel_type='diesel', license_plate='AA-0001'
+        )
+        self.trip = Trip.objects.create(
+            route=self.route, vehicle=self.vehicle, status='in_progress',
+            planned_departure=timezone.now(), planned_arrival=timezone.now() + timedelta(minutes=30)
+        )
+        # Dépôt carré d'environ 1 km autour de (18.5, -72.3) ; zone scolaire circulaire à l'écart
+        self.depot = Geofence.objects.create(
+            name='Dépôt Nord', code='DEP-N', fence_type='depot', shape='polygon', dwell_threshold_seconds=600,
+            polygon=[[18.495, -72.305], [18.495, -72.295], [18.505, -72.295], [18.505, -72.305]]
+        )
+        self.school = Geofence.objects.create(
+            name='École', code='SCH-1', fence_type='school_zone', shape='circle', severity='warning',
+            center_latitude=Decimal('18.520000'), center_longitude=Decimal('-72.300000'), radius_meters=150
+        )
+        self.engine = GeofenceEngine()
+        self.start = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+
+    def fix(self, latitude, longitude, minutes):
+        return self.engine.evaluate(
+            self.vehicle.id, self.trip.id, self.route.id,
+            latitude, longitude, self.start + timedelta(minutes=minutes)
+        )
+
+    def test_point_in_polygon_handles_concave_shapes(self):
+        # Polygone en U : le creux n'appartient pas à la zone
+        shape = np.array([[0, 0], [0, 3], [3, 3], [3, 2], [1, 2], [1, 1], [3, 1], [3, 0]], dtype=float)
+        self.assertTrue(point_in_polygon(0.5, 1.5, shape))
+        self.assertTrue(point_in_polygon(2.5, 2.5, shape))
+        self.assertFalse(point_in_polygon(1.5, 1.5, shape))
+        self.assertFalse(point_in_polygon(4, 1, shape))
+
+    def test_enter_dwell_exit_events(self):
+        self.assertEqual([event.event_type for event in self.fix(18.5, -72.3, 0)], ['geofence_enter'])
+        self.assertEqual(self.fix(18.501, -72.301, 5), [])
+        self.assertEqual([event.event_type for event in self.fix(18.501, -72.301, 11)], ['geofence_dwell'])
+        self.assertEqual(self.fix(18.502, -72.302, 15), [])
+
+        # Position reçue en retard : ignorée
+        self.assertEqual(self.fix(18.6, -72.3, 1), [])
+
+        # Sortie du dépôt directement vers la zone scolaire
+        events = {event.event_type: event for event in self.fix(18.5201, -72.3001, 20)}
+        self.assertEqual(set(events), {'geofence_exit', 'geofence_enter'})
+        self.assertEqual(events['geofence_exit'].event_data['geofence_id'], self.depot.id)
+        self.assertEqual(events['geofence_exit'].event_data['duration_seconds'], 20 * 60)
+        self.assertEqual(events['geofence_enter'].severity, 'warning')
+        self.assertEqual(EventLog.objects.filter(trip=self.trip, source='geofence_engine').count(), 4)
+
+    def test_fences_scoped_to_other_routes_are_ignored(self):
+        self.depot.routes.add(create_route('L2'))
+        self.assertEqual(self.fix(18.5, -72.3, 0), [])
+        self.assertEqual(
+            [fence['code'] for fence in self.engine.fences_at(18.5, -72.3, route_id=self.route.id)], []
+        )
+
+    def test_large_fence_and_many_small_fences(self):
+        Geofence.objects.create(
+            name='Zone interdite', code='RST-1', fence_type='restricted', shape='polygon',
+            polygon=[[17.0, -74.0], [17.0, -71.0], [20.0, -71.0], [20.0, -74.0]]
+        )
+        Geofence.objects.bulk_create([
+            Geofence(
+                name=f'Arrêt {index}', code=f'STA-{index}', fence_type='stop_area', shape='circle',
+                center_latitude=Decimal('18.400000') + Decimal(index) / 1000, center_longitude=Decimal('-72.400000'),
+                radius_meters=50, min_latitude=18.4 + index / 1000 - 0.0005, max_latitude=18.4 + index / 1000 + 0.0005,
+                min_longitude=-72.4006, max_longitude=-72.3994
+            )
+            for index in range(200)
+        ])
+        index = self.engine.get_index()
+        # La zone étendue est hors grille, les petites zones n'occupent que quelques cellules
+        self.assertEqual(len(index.spanning), 1)
+        self.assertLessEqual(len(index.candidates(18.45, -72.4)), 3)
+        codes = {fence['code'] for fence in self.engine.fences_at(18.45, -72.4)}
+        self.assertEqual(codes, {'RST-1', 'STA-50'})
+
+    def test_is_at_stop_uses_stop_fence_or_default_radius(self):
+        stop = RouteStop.objects.filter(route=self.route).order_by('order').first().stop
+        self.assertTrue(self.engine.is_at_stop(stop.id, stop.latitude + Decimal('0.0005'), stop.longitude))
+        self.assertFalse(self.engine.is_at_stop(stop.id, stop.latitude + Decimal('0.002'), stop.longitude))
+
+        Geofence.objects.create(
+            name='Terminus', code='TRM-1', fence_type='terminal', shape='circle', stop=stop,
+            center_latitude=stop.latitude, center_longitude=stop.longitude, radius_meters=300
+        )
+        self.engine.invalidate()
+        self.assertTrue(self.engine.is_at_stop(stop.id, stop.latitude + Decimal('0.002'), stop.longitude))
+
+
+class RecordingEmergencyManager(EmergencyManager):
+    """Enregistre les urgences acheminées au lieu de les envoyer au broker"""
+
+    def __init__(self):
+        super().__init__()
+        self.dispatched = []
+
+    def _dispatch(self, trip_id, emergencies):
+        for emergency in emergencies:
+            queue = self.EMERGENCY_QUEUE if emergency['severity'] in self.URGENT_SEVERITIES else 'celery'
+            self.dispatched.append((queue, emergency['type'], emergency['severity']))
+
+
+class EmergencyRuleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.route = create_route('L1')
+        self.start = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+        self.trip = Trip.objects.create(
+            route=self.route, status='in_progress',
+            planned_departure=self.start, planned_arrival=self.start + timedelta(minutes=30)
+        )
+        self.manager = RecordingEmergencyManager()
+
+    def fix(self, seconds, speed, latitude=18.5346, longitude=-72.3282):
+        # Par défaut : sur le tracé, à mi-chemin entre les deux premiers arrêts
+        position = BusPosition(
+            trip=self.trip, latitude=Decimal(str(latitude)), longitude=Decimal(str(longitude)),
+            speed=Decimal(str(speed)), heading=Decimal('0.00'), timestamp=self.start + timedelta(seconds=seconds)
+        )
+        return [(emergency['type'], emergency['severity']) for emergency in self.manager.evaluate_position(position)]
+
+    def test_unplanned_stop_raised_once_then_escalated(self):
+        self.assertEqual(self.fix(0, 30), [])
+        self.assertEqual(self.fix(10, 3), [])
+        self.assertEqual(self.fix(200, 0), [])
+        self.assertEqual(self.fix(320, 0), [('unplanned_stop', 'low')])
+        self.assertEqual(self.fix(400, 0), [])
+        self.assertEqual(self.fix(620, 0), [('unplanned_stop', 'medium')])
+
+        # Reprise puis nouvel arrêt : nouvel épisode
+        self.assertEqual(self.fix(630, 25), [])
+        self.assertEqual(self.fix(640, 3), [])
+        self.assertEqual(self.fix(950, 0), [('unplanned_stop', 'low')])
+        self.assertEqual([entry[0] for entry in self.manager.dispatched], ['celery'] * 3)
+
+    def test_out_of_order_fix_ignored(self):
+        self.fix(10, 40)
+        self.assertEqual(self.fix(5, 0), [])
+
+    def test_sudden_stop_and_deviation_use_priority_lane(self):
+        self.assertEqual(self.fix(0, 50), [])
+        self.assertEqual(self.fix(1, 0), [('sudden_stop', 'critical')])
+        self.assertEqual(self.manager.dispatched, [('emergency', 'sudden_stop', 'critical')])
+
+        # Plus de 1 km au nord du tracé
+        self.assertEqual(self.fix(30, 20, latitude=18.56), [('major_deviation', 'high')])
+        self.assertEqual(self.fix(40, 20, latitude=18.56), [])
+
+    def test_excessive_speed_against_rolling_average(self):
+        for second, speed in [(0, 30), (10, 32), (20, 31)]:
+            self.assertEqual(self.fix(second, speed), [])
+        self.assertEqual(self.fix(30, 60), [('excessive_speed', 'high')])
+
+    def test_handle_emergencies_records_and_interrupts_trip(self):
+        self.fix(0, 50)
+        emergencies = self.manager.evaluate_position(BusPosition(
+            trip=self.trip, latitude=Decimal('18.5346'), longitude=Decimal('-72.3282'),
+            speed=Decimal('0.00'), timestamp=self.start + timedelta(seconds=1)
+        ))
+        self.manager.handle_emergencies(self.trip.id, emergencies)
+
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.status, 'interrupted')
+        incident = Incident.objects.get(trip=self.trip)
+        self.assertEqual((incident.type, incident.severity, incident.priority), ('accident', 'critical', 'urgent'))
+        event = EventLog.objects.get(trip=self.trip, source='emergency_manager')
+        self.assertEqual(event.event_data['emergency_type'], 'sudden_stop')
+        self.assertTrue(event.requires_action)
+
+
+class TripAnalysisReportTests(TestCase):
+    def setUp(self):
+        self.route = create_route('L1')
+        self.start = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+        self.stops = [route_stop.stop for route_stop in RouteStop.objects.filter(route=self.route).order_by('order')]
+
+    def make_trip(self, delay_minutes, status='completed', off_route=False, gap=False):
+        started = self.start + timedelta(minutes=delay_minutes)
+        trip = Trip.objects.create(
+            route=self.route, status=status, planned_departure=self.start,
+            planned_arrival=self.start + timedelta(minutes=30),
+            actual_start_time=started, actual_end_time=started + timedelta(minutes=5)
+        )
+        # Une position toutes les 30 s le long du tracé, une position invalide, un trou éventuel
+        positions = []
+        for index in range(10):
+            seconds = index * 30 + (120 if gap and index >= 5 else 0)
+            latitude = 18.5392 - 0.0009 * index + (0.01 if off_route and index == 3 else 0)
+            longitude = -72.3364 + 0.0016 * index
+            positions.append(BusPosition(
+                trip=trip, latitude=Decimal(f'{latitude:.6f}'), longitude=Decimal(f'{longitude:.6f}'),
+                speed=Decimal('30.00'), heading=Decimal('0.00'), is_valid=index != 9,
+                timestamp=started + timedelta(seconds=seconds)
+            ))
+        BusPosition.objects.bulk_create(positions)
+        # Arrêt 1 prévu 15 min après le départ
+        EventLog.objects.create(
+            trip=trip, event_type='stop_arrival', description='Arrivée', source='test',
+            timestamp=self.start + timedelta(minutes=15 + delay_minutes), event_data={'stop_id': self.stops[1].id}
+        )
+        return trip
+
+    def test_sections_match_report_structure(self):
+        on_time = self.make_trip(2)
+        late = self.make_trip(12, off_route=True, gap=True)
+        self.make_trip(30, status='cancelled')
+        incident = Incident(trip=late, type='traffic', description='Bouchon')
+        incident.save()
+
+        report = ReportingService().generate_trip_analysis(date_from=date(2000, 1, 1), date_to=date(2100, 1, 1))
+
+        punctuality = report['punctuality']
+        self.assertEqual(
+            [punctuality[category] for category in ['on_time', 'slightly_late', 'late', 'very_late']], [1, 0, 1, 1]
+        )
+        details = {detail['trip_id']: detail for detail in punctuality['details']}
+        self.assertEqual(details[late.id]['delay_minutes'], 12)
+        self.assertEqual(details[late.id]['stops_punctuality'][0]['stop_id'], self.stops[1].id)
+        self.assertEqual(details[late.id]['stops_punctuality'][0]['delay_seconds'], 720)
+        self.assertEqual(details[late.id]['stops_punctuality'][0]['status'], 'late')
+
+        conformity = {detail['trip_id']: detail for detail in report['route_conformity']['details']}
+        self.assertEqual(conformity[on_time.id]['status'], 'compliant')
+        self.assertEqual(conformity[late.id]['total_deviations'], 1)
+        self.assertEqual(conformity[late.id]['status'], 'major_deviations')
+
+        quality = report['service_quality']
+        self.assertEqual((quality['completed_trips'], quality['cancelled_trips'], quality['incidents']), (2, 1, 1))
+        self.assertAlmostEqual(quality['avg_speed'], 30.0)
+
+        history = report['position_history']
+        self.assertEqual((history['total_positions'], history['valid_positions'], history['tracking_gaps']), (30, 27, 1))
+        gaps = {detail['trip_id']: detail['gaps'] for detail in history['details']}
+        self.assertEqual(gaps[late.id][0]['duration_seconds'], 150)
+
+        summary = report['summary']
+        self.assertEqual(summary['total_trips'], 3)
+        self.assertAlmostEqual(summary['average_delay'], (2 + 12 + 30) / 3)
+        self.assertAlmostEqual(summary['route_conformity_rate'], 200 / 3)
+
+    def test_query_count_independent_of_trip_count(self):
+        self.make_trip(0)
+        service = ReportingService()
+        with self.assertNumQueries(7):
+            service.generate_trip_analysis(date_from=date(2000, 1, 1), date_to=date(2100, 1, 1))
+        for delay in range(5):
+            self.make_trip(delay)
+        with self.assertNumQueries(7):
+            report = service.generate_trip_analysis(date_from=date(2000, 1, 1), date_to=date(2100, 1, 1))
+        self.assertEqual(report['summary']['total_trips'], 6)
+
+
+class RouteKPIRollupTests(TestCase):
+    def setUp(self):
+        self.route = create_route('L1')
+        self.day = date(2030, 1, 7)
+        self.start = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+
+    def make_trip(self, minutes=0, **fields):
+        planned = self.start + timedelta(minutes=minutes)
+        return Trip.objects.create(
+            route=self.route, planned_departure=planned, planned_arrival=planned + timedelta(minutes=30), **fields
+        )
+
+    def rollups(self):
+        return {
+            (row['route_id'], row['schedule_id'], row['service_date'], row['hour']): row
+            for row in RouteKPIRollup.objects.values(
+                'route_id', 'schedule_id', 'service_date', 'hour', *kpi_rollups.COUNTERS, 'max_delay_seconds'
+            )
+            if row['trip_count']
+        }
+
+    def test_transitions_match_reconciliation(self):
+        late = self.make_trip(0, status='in_progress', actual_start_time=self.start + timedelta(minutes=12))
+        late.status = 'completed'
+        late.passenger_count = 40
+        late.save()
+
+        punctual = self.make_trip(10)
+        punctual.delay_duration = timedelta(minutes=20)
+        punctual.save()
+        punctual.delay_duration = timedelta(minutes=2)
+        punctual.status = 'completed'
+        punctual.save()
+
+        moved = self.make_trip(20, status='cancelled')
+        incident = Incident(trip=moved, type='traffic', description='Bouchon')
+        incident.save()
+        moved.planned_departure = self.start + timedelta(hours=2)
+        moved.save()
+
+        removed = self.make_trip(30)
+        Incident(trip=removed, type='traffic', description='Panne').save()
+        removed.delete()
+
+        incremental = self.rollups()
+        morning = incremental[(self.route.id, None, self.day, 8)]
+        self.assertEqual((morning['trip_count'], morning['completed_count'], morning['on_time_count']), (2, 2, 1))
+        self.assertEqual((morning['total_delay_seconds'], morning['max_delay_seconds']), (840, 720))
+        self.assertEqual(morning['passenger_count'], 40)
+        later = incremental[(self.route.id, None, self.day, 10)]
+        self.assertEqual((later['cancelled_count'], later['incident_count'], later['delay_sample_count']), (1, 1, 0))
+
+        kpi_rollups.reconcile(self.day)
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_summary_cost_independent_of_period(self):
+        for offset in range(3):
+            trip = self.make_trip(offset * 24 * 60, status='completed')
+            trip.delay_duration = timedelta(minutes=offset * 5)
+            trip.save()
+
+        with self.assertNumQueries(1):
+            by_day = kpi_rollups.summary(self.day, self.day + timedelta(days=365), group_by='day')
+        self.assertEqual([row['day'] for row in by_day], [self.day + timedelta(days=offset) for offset in range(3)])
+        with self.assertNumQueries(1):
+            totals = kpi_rollups.summary(self.day, self.day + timedelta(days=365), route_id=self.route.id)
+        self.assertEqual((totals['trip_count'], totals['on_time_count'], totals['max_delay_seconds']), (3, 2, 600))
+        self.assertAlmostEqual(totals['average_delay_seconds'], 300)
+
+    def test_bucket_without_schedule_is_unique(self):
+        RouteKPIRollup.objects.create(route=self.route, service_date=self.day, hour=8)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            RouteKPIRollup.objects.create(route=self.route, service_date=self.day, hour=8)
+
+
+class ReportJobTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storage = override_settings(REPORT_ARTIFACT_ROOT=directory.name)
+        storage.enable()
+        self.addCleanup(storage.disable)
+        self.route = create_route('L1')
+        start = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+        Trip.objects.create(
+            route=self.route, status='completed', planned_departure=start,
+            planned_arrival=start + timedelta(minutes=30), delay_duration=timedelta(minutes=3)
+        )
+        self.params = {'date_from': '2030-01-07', 'date_to': '2030-01-07'}
+
+    def test_identical_requests_share_job_and_artifact(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            job, created = report_jobs.request('kpi', self.params)
+        self.assertTrue(created)
+        self.assertEqual(len(callbacks), 1)
+
+        # Même demande, paramètres dans un autre ordre et avec une date objet
+        same, created = report_jobs.request('kpi', {'date_to': date(2030, 1, 7), 'date_from': '2030-01-07'})
+        self.assertEqual((same.pk, created), (job.pk, False))
+
+        report_jobs.run(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.in_flight_hash), ('completed', None))
+        # Période à venir : le fichier expire vite, une période révolue est conservée
+        self.assertEqual(job.expires_at - job.completed_at, report_jobs.OPEN_PERIOD_TTL)
+        self.assertEqual(report_jobs.artifact_ttl({'date_to': '2020-01-01'}), report_jobs.CLOSED_PERIOD_TTL)
+        self.assertIsNone(report_jobs.run(job.pk))
+
+        with self.assertNumQueries(2):
+            served, created = report_jobs.request('kpi', self.params)
+        self.assertEqual((served.pk, created), (job.pk, False))
+        with report_jobs.open_artifact(served) as artifact:
+            result = json.loads(gzip.decompress(artifact.read()))
+        self.assertEqual(result['totals']['trip_count'], 1)
+        self.assertEqual(ReportJob.objects.get(pk=job.pk).hit_count, 2)
+
+    def test_single_in_flight_job_per_request(self):
+        job, _ = report_jobs.request('kpi', self.params)
+        self.assertEqual(job.in_flight_hash, job.params_hash)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ReportJob.objects.create(
+                report_type='kpi', params=job.params, params_hash=job.params_hash, in_flight_hash=job.params_hash
+            )
+
+    def test_purge_expires_stale_pending_jobs(self):
+        job, _ = report_jobs.request('kpi', self.params)
+        ReportJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - report_jobs.STALE_AFTER * 2)
+        report_jobs.purge()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.in_flight_hash), ('failed', None))
+        retried, created = report_jobs.request('kpi', self.params)
+        self.assertTrue(created)
+        self.assertNotEqual(retried.pk, job.pk)
+
+    def test_api_polls_and_downloads(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user(username='gestionnaire', password='12345'))
+
+        response = client.post('/api/transport/report-jobs/', {'report_type': 'kpi', 'params': self.params}, format='json')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data['job_id']
+        self.assertEqual(client.get(f'/api/transport/report-jobs/{job_id}/download/').status_code, 409)
+
+        report_jobs.run(ReportJob.objects.get(job_id=job_id).pk)
+        response = client.get(f'/api/transport/report-jobs/{job_id}/')
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertTrue(response.data['download_url'].endswith(f'/report-jobs/{job_id}/download/'))
+
+        response = client.get(f'/api/transport/report-jobs/{job_id}/download/')
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['totals']['completed_count'], 1)
+        response = client.get(f'/api/transport/report-jobs/{job_id}/download/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(b''.join(response.streaming_content)))['totals']['trip_count'], 1)
+
+        response = client.post('/api/transport/report-jobs/', {'report_type': 'kpi', 'params': self.params}, format='json')
+        self.assertEqual((response.status_code, str(response.data['job_id'])), (200, str(job_id)))
+        response = client.post('/api/transport/report-jobs/', {'report_type': 'kpi', 'params': {'date_from': 'hier'}}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class DataExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='exporteur', password='12345'))
+        route = create_route('L1')
+        self.start = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+        self.trip = Trip.objects.create(
+            route=route, planned_departure=self.start, planned_arrival=self.start + timedelta(minutes=30)
+        )
+        BusPosition.objects.bulk_create([
+            BusPosition(
+                trip=self.trip, latitude=Decimal('18.539200'), longitude=Decimal('-72.336400'),
+                speed=Decimal('30.00'), heading=Decimal('0.00'), timestamp=self.start + timedelta(seconds=index * 30)
+            )
+            for index in range(5)
+        ])
+        self.params = {'date_from': '2030-01-07', 'date_to': '2030-01-07'}
+
+    def test_positions_stream_in_chunks(self):
+        exporter = TabularExporter()
+        exporter.CHUNK_SIZE = 2
+        header, rows = exporter.dataset_rows('positions', date(2030, 1, 7), date(2030, 1, 7), trip=self.trip.id)
+        chunks = list(exporter.csv_chunks(header, rows))
+        self.assertEqual(len(chunks), 3)
+        lines = b''.join(chunks).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[0].startswith('position_id,trip_id,trip__vehicle_id,timestamp'))
+
+    def test_export_endpoint_formats(self):
+        response = self.client.get('/api/transport/exports/positions/', self.params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()), 6)
+
+        response = self.client.get('/api/transport/exports/positions/', {**self.params, 'file_format': 'xlsx'})
+        workbook = load_workbook(io.BytesIO(b''.join(response.streaming_content)), read_only=True)
+        rows = list(workbook.active.values)
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1][3], datetime(2030, 1, 7, 8, 0))
+
+        self.assertEqual(self.client.get('/api/transport/exports/unknown/').status_code, 404)
+        self.assertEqual(self.client.get('/api/transport/exports/events/', {'date_from': '07/01/2030'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/transport/exports/events/', {'file_format': 'pdf'}).status_code, 400)
+
+
+class TrackAnalyticsTests(TestCase):
+    def setUp(self):
+        self.route = create_route('L1')
+        self.first_stop = RouteStop.objects.get(route=self.route, order=0).stop
+        self.start = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+
+    def make_trip(self, track):
+        trip = Trip.objects.create(
+            route=self.route, planned_departure=self.start, planned_arrival=self.start + timedelta(minutes=30)
+        )
+        BusPosition.objects.bulk_create([
+            BusPosition(
+                trip=trip, latitude=Decimal(f'{latitude:.6f}'), longitude=Decimal(f'{longitude:.6f}'),
+                speed=Decimal(speed), heading=Decimal('0.00'), timestamp=self.start + timedelta(seconds=seconds)
+            )
+            for seconds, latitude, longitude, speed in track
+        ])
+        return trip
+
+    def test_track_metrics(self):
+        latitude, longitude = float(self.first_stop.latitude), float(self.first_stop.longitude)
+        along = [(latitude, longitude + 0.002 * step) for step in range(5)]
+        trip = self.make_trip([
+            (0, *along[0], '0'), (30, *along[0], '0'), (60, *along[0], '0'),  # Une minute à l'arrêt
+            (90, *along[1], '25'), (120, *along[2], '25'),
+            (125, latitude + 1, longitude, '120'),  # Saut GPS isolé
+            (150, *along[3], '25'),
+            (300, *along[4], '25'),  # Trou de suivi de 150 s
+        ])
+        empty = self.make_trip([])
+
+        with self.assertNumQueries(4):
+            self.assertEqual(TrackAnalyticsService().summarize(Trip.objects.all()), 2)
+
+        summary = TripTrackSummary.objects.get(trip=trip)
+        step_km = haversine_km(latitude, longitude, latitude, longitude + 0.002)
+        self.assertAlmostEqual(summary.distance_km, 4 * step_km, places=6)
+        self.assertEqual((summary.position_count, summary.duration_seconds), (8, 300))
+        self.assertEqual((summary.moving_seconds, summary.stopped_seconds), (90, 60))
+        self.assertAlmostEqual(summary.average_moving_speed, 3 * step_km / 90 * 3600)
+        self.assertEqual(summary.max_speed, 25)
+        self.assertEqual((summary.gap_count, summary.longest_gap_seconds), (1, 150))
+        self.assertEqual(summary.stop_dwells, [{'stop_id': self.first_stop.id, 'seconds': 60.0}])
+        self.assertEqual(summary.speed_profile, {'0-10': 60.0, '20-30': 90.0})
+        self.assertEqual(TripTrackSummary.objects.get(trip=empty).position_count, 0)
+
+        # Recalcul : mise à jour de la ligne existante
+        BusPosition.objects.filter(trip=trip, timestamp=self.start + timedelta(seconds=300)).delete()
+        TrackAnalyticsService().summarize_trip(trip.id)
+        summary.refresh_from_db()
+        self.assertEqual((summary.position_count, summary.gap_count), (7, 0))
+        self.assertEqual(TripTrackSummary.objects.count(), 2)
+
@@ -9,7 +9,15 @@ from .views import (
     DestinationgestionViewSet, RouteintiViewSet, StopViewSet, RouteStopViewSet,ResourceAvailabilityViewSet,SchedulesetupViewSet, ScheduleExceptionsetupViewSet,DriverViewSet,    TripViewSet, 
     TripTrackingViewSet,
     TripEventViewSet,
-    DriverTripViewSet
+    DriverTripViewSet,
+    GTFSFeedExportView,
+    GTFSFeedImportView,
+    GTFSRealtimeFeedView,
+    JourneyPlannerView,
+    RouteKPIView,
+    DataExportView,
+    GeofenceViewSet,
+    ReportJobViewSet
 )
 
 router = DefaultRouter()
@@ -29,6 +37,7 @@ router.register(r'resource-availabilities', ResourcecAvailabilityViewSet, basena
 router.register(r'drivers', DrivercViewSet, basename='driver')
 router.register(r'route-inti', RouteintiViewSet, basename='route-inti')  # Ajout du basename
 router.register(r'route-stops', RouteStopViewSet, basename='route-stop')
+router.register(r'geofences', GeofenceViewSet, basename='geofence')
 router.register(r'Schedulesetup', SchedulesetupViewSet, basename='Schedulesetup')
 router.register(r'ScheduleExceptionsetup', ScheduleExceptionsetupViewSet, basename='ScheduleExceptionsetup')
 router.register(r'driversetup', DriverViewSet, basename='driversetup')
@@ -37,6 +46,14 @@ router.register(r'trips', TripViewSet, basename='trip')
 router.register(r'tracking', TripTrackingViewSet, basename='tracking')
 router.register(r'events', TripEventViewSet, basename='event')
 router.register(r'driver-trips', DriverTripViewSet, basename='driver-trip')
+router.register(r'report-jobs', ReportJobViewSet, basename='report-job')
 urlpatterns = [
     path('', include(router.urls)),
+    path('gtfs/feed.zip', GTFSFeedExportView.as_view(), name='gtfs-feed'),
+    path('gtfs/import/', GTFSFeedImportView.as_view(), name='gtfs-import'),
+    path('gtfs/realtime.pb', GTFSRealtimeFeedView.as_view(), {'rendering': 'pb'}, name='gtfs-realtime'),
+    path('gtfs/realtime.json', GTFSRealtimeFeedView.as_view(), {'rendering': 'json'}, name='gtfs-realtime-json'),
+    path('journeys/', JourneyPlannerView.as_view(), name='journey-planner'),
+    path('kpis/', RouteKPIView.as_view(), name='route-kpis'),
+    path('exports/<str:dataset>/', DataExportView.as_view(), name='data-export'),
 ]
\ No newline at end of file
@@ -2,20 +2,37 @@
 from rest_framework.views import APIView
 from django.db.models import Q, Count, Sum
 from rest_framework import viewsets, filters, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.parsers import MultiPartParser
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse
+from django.utils.http import http_date, parse_http_date_safe
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.core.cache import cache
 from rest_framework.exceptions import ValidationError
 from django.utils import timezone
 from django.db import transaction
+from datetime import datetime, timedelta
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import (
     OperationalRule, RuleExecution, RuleParameter, RuleSet, Destination,
-    Route, Stop, Schedule, ResourceAvailability, Driver, RouteStop, ScheduleException,Trip, BusPosition, EventLog, DisplaySchedule
+    Route, Stop, Schedule, ResourceAvailability, Driver, RouteStop, Geofence, ScheduleException,Trip, BusPosition, EventLog, DisplaySchedule,
+    ReportJob, TripTrackSummary
 )
 from transport_management.services.tracking.position_tracking import PositionTrackingService
 from transport_management.services.event.event_manager import TripEventManager
+from transport_management.services.resource.conflict_index import conflict_index
+from transport_management.services.gtfs.feed_export import GTFSFeedExporter
+from transport_management.services.gtfs.feed_import import GTFSFeedImporter
+from transport_management.services.gtfs.realtime_feed import gtfs_realtime_feed
+from transport_management.services.timetable.journey_planner import journey_planner
+from transport_management.services.timetable.departure_index import departure_index
+from transport_management.services.tracking.arrival_predictions import arrival_predictions
+from transport_management.services.geofencing.geofence_engine import geofence_engine
+from transport_management.services.reporting.kpi_rollup import kpi_rollups
+from transport_management.services.reporting.report_jobs import report_jobs
+from transport_management.services.export.tabular_export import EXPORT_DATASETS, tabular_exporter
+from transport_management.services.tracking.track_analytics import track_analytics
 from inventory_management.serializers import VehicleSerializer
 from inventory_management.models import Vehicle
 from .serializers import (
@@ -26,8 +43,10 @@ from .serializers import (
     ScheduleautomatSerializer, ScheduleExceptionSerializercrud, DriverSerializer, ResourceAvailabilitySerializer,    TripSerializer, 
     TripDetailSerializer, 
     PositionUpdateSerializer,
-    TripEventSerializer, DisplayScheduleSerializer
+    TripEventSerializer, DisplayScheduleSerializer, GeofenceSerializer,
+    ReportJobSerializer, ReportJobRequestSerializer, TripTrackSummarySerializer
 )
+import gzip
 import logging
 
 logger = logging.getLogger(__name__)
@@ -168,6 +187,49 @@ class StopViewSet(viewsets.ModelViewSet):
         stop = self.get_object()
         return Response({'average_waiting_time': stop.average_waiting_time})
 
+    @action(detail=True, methods=['get'])
+    def departures(self, request, pk=None):
+        """
+        Prochains départs à l'arrêt, toutes routes confondues, retards en cours inclus.
+        Paramètres optionnels : at (ISO 8601, défaut maintenant), limit (défaut 10, max 50).
+        """
+        stop = self.get_object()
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+            at = request.query_params.get('at')
+            at = datetime.fromisoformat(at) if at else timezone.now()
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+        except ValueError:
+            return Response(
+                {'error': 'Paramètres invalides (at ISO 8601, limit entier)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({
+            'stop_id': stop.id,
+            'stop_name': stop.name,
+            'departures': departure_index.next_departures(stop.id, at=at, limit=limit),
+        })
+
+    @action(detail=True, methods=['get'])
+    def arrivals(self, request, pk=None):
+        """
+        Arrivées prévues à l'arrêt des trips en cours (prévisions précalculées à chaque position).
+        Paramètre optionnel : limit (défaut 10, max 50).
+        """
+        stop = self.get_object()
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            return Response({'error': 'limit doit être un entier'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'stop_id': stop.id,
+            'stop_name': stop.name,
+            'arrivals': arrival_predictions.arrivals(stop.id, limit=limit),
+        })
+
 # ViewSet for managing RouteStop with additional functionalities
 class RouteStopViewSet(viewsets.ModelViewSet):
     queryset = RouteStop.objects.all()
@@ -177,6 +239,45 @@ class RouteStopViewSet(viewsets.ModelViewSet):
     filterset_fields = ['route', 'stop']
     ordering_fields = ['order', 'stop_sequence']
 
+# ViewSet for managing Geofence (depots, terminals, school zones, restricted areas)
+class GeofenceViewSet(viewsets.ModelViewSet):
+    queryset = Geofence.objects.all()
+    serializer_class = GeofenceSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filterset_fields = ['fence_type', 'shape', 'stop', 'is_active']
+    search_fields = ['name', 'code']
+    ordering_fields = ['name', 'fence_type']
+
+    @action(detail=False, methods=['get'])
+    def locate(self, request):
+        """
+        Zones actives contenant un point.
+        Paramètres : latitude, longitude ; optionnels : route, vehicle (portée des zones).
+        """
+        try:
+            latitude = float(request.query_params['latitude'])
+            longitude = float(request.query_params['longitude'])
+            route_id = request.query_params.get('route')
+            vehicle_id = request.query_params.get('vehicle')
+            route_id = int(route_id) if route_id else None
+            vehicle_id = int(vehicle_id) if vehicle_id else None
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'Paramètres invalides (latitude, longitude requis ; route, vehicle entiers)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fences = geofence_engine.fences_at(latitude, longitude, route_id=route_id, vehicle_id=vehicle_id)
+        return Response({
+            'latitude': latitude,
+            'longitude': longitude,
+            'geofences': [
+                {'id': fence['id'], 'code': fence['code'], 'name': fence['name'], 'fence_type': fence['fence_type']}
+                for fence in fences
+            ],
+        })
+
 # ViewSet for managing Schedule with additional functionalities
 class SchedulesetupViewSet(viewsets.ModelViewSet):
     queryset = Schedule.objects.all()
@@ -521,18 +622,32 @@ class ResourceAvailabilityViewSet(viewsets.ModelViewSet):
     def detect_conflicts(self, request):
         """
         Endpoint to detect resource conflicts.
+        Accepts either `date` or a `date_from`/`date_to` range (e.g. a full week).
         """
-        date = request.query_params.get('date')
-        if not date:
-            return Response({'detail': 'Please provide date.'},
+        date_from = request.query_params.get('date_from') or request.query_params.get('date')
+        date_to = request.query_params.get('date_to') or date_from
+        if not date_from:
+            return Response({'detail': 'Please provide date or date_from/date_to.'},
                             status=status.HTTP_400_BAD_REQUEST)
-        conflicts = ResourceAvailability.objects.filter(
-            date=date,
-            is_available=True
-        ).values('driver', 'vehicle', 'start_time', 'end_time').annotate(
-            count=Count('id')
-        ).filter(count__gt=1)
-        return Response({'conflicts': list(conflicts)}, status=status.HTTP_200_OK)
+        try:
+            start_date = datetime.strptime(date_from, '%Y-%m-%d').date()
+            end_date = datetime.strptime(date_to, '%Y-%m-%d').date()
+        except ValueError:
+            return Response({'detail': 'Dates must use the YYYY-MM-DD format.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if end_date < start_date:
+            return Response({'detail': 'date_to must be after date_from.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        range_start = timezone.make_aware(datetime.combine(start_date, datetime.min.time()))
+        range_end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
+        conflicts = conflict_index.detect_conflicts(range_start, range_end)
+        return Response({
+            'date_from': start_date.isoformat(),
+            'date_to': end_date.isoformat(),
+            'count': len(conflicts),
+            'conflicts': conflicts
+        }, status=status.HTTP_200_OK)
 
 
 
@@ -579,6 +694,16 @@ class TripViewSet(viewsets.ModelViewSet):
         serializer = TripDetailSerializer(trip)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def track(self, request, pk=None):
+        """Synthèse de la trace GPS du trip (calculée à la demande si absente ou si refresh=1)"""
+        trip = self.get_object()
+        summary = TripTrackSummary.objects.filter(trip=trip).first()
+        if summary is None or request.query_params.get('refresh') == '1':
+            track_analytics.summarize_trip(trip.pk)
+            summary = TripTrackSummary.objects.get(trip=trip)
+        return Response(TripTrackSummarySerializer(summary).data)
+
 class TripTrackingViewSet(viewsets.ViewSet):
     """
     API endpoint pour le tracking GPS des trips
@@ -704,4 +829,257 @@ class TodayDisplayScheduleAPIView(APIView):
         ).order_by('scheduled_departure')
 
         serializer = DisplayScheduleSerializer(display_schedules, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+
+class GTFSFeedExportView(APIView):
+    """
+    Flux GTFS statique du réseau, envoyé en streaming (zip construit à la volée).
+    Paramètres optionnels : start_date, end_date (YYYY-MM-DD) pour les trips ponctuels.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            start_date = request.query_params.get('start_date')
+            end_date = request.query_params.get('end_date')
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+        except ValueError:
+            return Response(
+                {'error': 'Format de date invalide (YYYY-MM-DD)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        response = StreamingHttpResponse(
+            GTFSFeedExporter().stream(start_date, end_date),
+            content_type='application/zip'
+        )
+        response['Content-Disposition'] = 'attachment; filename="gtfs.zip"'
+        return response
+
+
+class GTFSFeedImportView(APIView):
+    """
+    Import d'un flux GTFS statique (champ multipart 'file').
+    """
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        feed = request.FILES.get('file')
+        if not feed:
+            return Response({'error': 'Fichier GTFS requis'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            summary = GTFSFeedImporter().import_feed(feed, created_by=request.user)
+            return Response(summary, status=status.HTTP_201_CREATED)
+        except Exception as e:
+            logger.error(f"Error importing GTFS feed: {str(e)}")
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class GTFSRealtimeFeedView(APIView):
+    """
+    Flux GTFS-Realtime (positions véhicules et mises à jour de trips) servi depuis le cache.
+    Rendu protobuf ou JSON selon l'URL ; GET conditionnel via ETag / Last-Modified.
+    """
+    permission_classes = [IsAuthenticated]
+    CONTENT_TYPES = {
+        'pb': 'application/x-protobuf',
+        'json': 'application/json',
+    }
+
+    def get(self, request, rendering='pb'):
+        entry = gtfs_realtime_feed.get_feed()
+        etag = f'"{entry["etag"]}"'
+
+        if_none_match = request.headers.get('If-None-Match')
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        not_modified = (
+            etag in [tag.strip() for tag in if_none_match.split(',')] if if_none_match
+            else if_modified_since is not None and entry['timestamp'] <= if_modified_since
+        )
+
+        response = HttpResponse(
+            status=status.HTTP_304_NOT_MODIFIED if not_modified else status.HTTP_200_OK,
+            content=b'' if not_modified else entry[rendering],
+            content_type=self.CONTENT_TYPES[rendering]
+        )
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(entry['timestamp'])
+        response['Cache-Control'] = 'max-age=5'
+        return response
+
+
+class JourneyPlannerView(APIView):
+    """
+    Itinéraire entre deux arrêts sur les trips du jour.
+    Paramètres : from_stop, to_stop, date (YYYY-MM-DD, défaut aujourd'hui) et
+    depart_at ou arrive_by (HH:MM).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        if not params.get('from_stop') or not params.get('to_stop'):
+            return Response(
+                {'error': 'from_stop et to_stop sont requis'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            service_date = (
+                datetime.strptime(params['date'], '%Y-%m-%d').date()
+                if params.get('date') else timezone.localdate()
+            )
+            depart_at = datetime.strptime(params['depart_at'], '%H:%M').time() if params.get('depart_at') else None
+            arrive_by = datetime.strptime(params['arrive_by'], '%H:%M').time() if params.get('arrive_by') else None
+        except ValueError:
+            return Response(
+                {'error': 'Format invalide (date YYYY-MM-DD, heures HH:MM)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            journey = journey_planner.plan(
+                params['from_stop'], params['to_stop'], service_date,
+                depart_at=depart_at, arrive_by=arrive_by
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+        if journey is None:
+            return Response(
+                {'message': 'Aucun itinéraire trouvé'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        journey.update({
+            'from_stop': int(params['from_stop']),
+            'to_stop': int(params['to_stop']),
+            'date': service_date.isoformat(),
+        })
+        return Response(journey)
+
+
+class RouteKPIView(APIView):
+    """
+    KPI d'exploitation lus dans les agrégats (coût constant quelle que soit la période).
+    Paramètres : date_from, date_to (YYYY-MM-DD, défaut aujourd'hui), route, schedule et
+    group_by (day, hour, route ou schedule).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            today = timezone.localdate()
+            date_from = datetime.strptime(params['date_from'], '%Y-%m-%d').date() if params.get('date_from') else today
+            date_to = datetime.strptime(params['date_to'], '%Y-%m-%d').date() if params.get('date_to') else today
+        except ValueError:
+            return Response(
+                {'error': 'Format de date invalide (YYYY-MM-DD)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        group_by = params.get('group_by') or None
+        if group_by and group_by not in kpi_rollups.GROUP_FIELDS:
+            return Response(
+                {'error': f"group_by doit être l'un de {sorted(kpi_rollups.GROUP_FIELDS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        kpis = kpi_rollups.summary(
+            date_from, date_to,
+            route_id=params.get('route'), schedule_id=params.get('schedule'), group_by=group_by
+        )
+        return Response({
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'group_by': group_by,
+            'kpis': kpis,
+        })
+
+
+class ReportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Rapports calculés en arrière-plan.
+    POST : report_type et params ; une demande identique à un job en cours ou à un
+    rapport encore valide renvoie ce job. GET {job_id}/ : statut. GET {job_id}/download/ :
+    fichier JSON (compressé gzip si le client l'accepte).
+    """
+    queryset = ReportJob.objects.all()
+    serializer_class = ReportJobSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'job_id'
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['report_type', 'status']
+
+    def create(self, request):
+        serializer = ReportJobRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            job, created = report_jobs.request(
+                serializer.validated_data['report_type'], serializer.validated_data['params'], user=request.user
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(
+            self.get_serializer(job).data,
+            status=status.HTTP_200_OK if job.is_available else status.HTTP_202_ACCEPTED
+        )
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, job_id=None):
+        job = self.get_object()
+        if not job.is_available:
+            return Response(
+                {'error': f"Rapport indisponible (statut : {job.status})"},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        artifact = report_jobs.open_artifact(job)
+        filename = f"{job.report_type}-{job.job_id}.json"
+        if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response = FileResponse(artifact, content_type='application/json', filename=filename)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = FileResponse(gzip.GzipFile(fileobj=artifact), content_type='application/json', filename=filename)
+        response['Cache-Control'] = f"private, max-age={max(int((job.expires_at - timezone.now()).total_seconds()), 0)}"
+        return response
+
+
+class DataExportView(APIView):
+    """
+    Export CSV ou XLSX à mémoire constante : positions, events, transaction-scans, passenger-trips.
+    Paramètres : file_format (csv par défaut, ou xlsx), date_from, date_to (YYYY-MM-DD, défaut
+    aujourd'hui) et les filtres du jeu de données (trip, route, vehicle, user, ...).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, dataset):
+        if dataset not in EXPORT_DATASETS:
+            return Response(
+                {'error': f"Jeu de données inconnu ; disponibles : {sorted(EXPORT_DATASETS)}"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        params = request.query_params
+        export_format = params.get('file_format', 'csv')
+        if export_format not in tabular_exporter.FORMATS:
+            return Response(
+                {'error': f"file_format doit être l'un de {list(tabular_exporter.FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            date_from = datetime.strptime(params['date_from'], '%Y-%m-%d').date() if params.get('date_from') else None
+            date_to = datetime.strptime(params['date_to'], '%Y-%m-%d').date() if params.get('date_to') else None
+            filters = {name: params.get(name) for name in EXPORT_DATASETS[dataset]['filters'] if params.get(name)}
+            header, rows = tabular_exporter.dataset_rows(dataset, date_from, date_to, **filters)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        period = f"{date_from or ''}_{date_to or timezone.localdate()}".strip('_')
+        return tabular_exporter.response(export_format, f"{dataset}_{period}", header, rows, title=dataset)
+
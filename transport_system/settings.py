@@ -190,6 +190,9 @@ STATIC_ROOT = os.path.join(BASE_DIR, env('STATIC_ROOT'))
 MEDIA_URL = env('MEDIA_URL')
 MEDIA_ROOT = os.path.join(BASE_DIR, env('MEDIA_ROOT'))
 
+# Rapports calculés en arrière-plan (JSON gzip, hors de MEDIA_ROOT : servis après authentification)
+REPORT_ARTIFACT_ROOT = os.path.join(BASE_DIR, 'report_artifacts')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -234,9 +237,53 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'transport_api.tasks.activate_pending_schedules',
         'schedule': crontab(minute='0', hour='0'),
     },
-    'update-trip-statuses-every-minute': {
-        'task': 'schedule.tasks.update_trip_statuses',
-        'schedule': 60.0,  # Toutes les 60 secondes
+    'build-vehicle-blocks': {
+        'task': 'transport_management.tasks.build_vehicle_blocks',
+        'schedule': crontab(minute='20', hour='0'),  # Après la génération des trips du jour
+    },
+    'age-invoices': {
+        'task': 'financial_management.tasks.age_invoices',
+        'schedule': crontab(minute='30', hour='0'),
+    },
+    'reconcile-fare-revenue': {
+        'task': 'financial_management.tasks.reconcile_fare_revenue',
+        'schedule': crontab(minute='30', hour='1'),  # Avant la réconciliation des soldes mensuels
+    },
+    'reconcile-period-balances': {
+        'task': 'financial_management.tasks.reconcile_period_balances',
+        'schedule': crontab(minute='15', hour='2'),
+    },
+    'snapshot-budget-ledgers': {
+        'task': 'financial_management.tasks.snapshot_budget_ledgers',
+        'schedule': crontab(minute='5'),
+    },
+    'reconcile-route-kpi-rollups': {
+        'task': 'transport_management.tasks.reconcile_route_kpi_rollups',
+        'schedule': crontab(minute='30', hour='2'),
+    },
+    'arm-trip-transitions': {
+        'task': 'transport_management.tasks.arm_trip_transitions',
+        'schedule': 1800.0,  # Toutes les 30 minutes (horizon de 50 minutes)
+    },
+    'detect-vehicle-communication-loss': {
+        'task': 'transport_management.tasks.detect_vehicle_communication_loss',
+        'schedule': 10.0,  # Toutes les 10 secondes
+    },
+    'refresh-gtfs-realtime-feed': {
+        'task': 'transport_management.tasks.refresh_gtfs_realtime_feed',
+        'schedule': 5.0,  # Toutes les 5 secondes
+    },
+    'summarize-daily-tracks': {
+        'task': 'transport_management.tasks.summarize_daily_tracks',
+        'schedule': crontab(minute='45', hour='2'),
+    },
+    'generate-daily-reports': {
+        'task': 'transport_management.tasks.generate_daily_reports',
+        'schedule': crontab(minute='0', hour='3'),  # Après la réconciliation des KPI
+    },
+    'purge-report-artifacts': {
+        'task': 'transport_management.tasks.purge_report_artifacts',
+        'schedule': crontab(minute='15'),
     },
 }
 
@@ -259,6 +306,8 @@ SIMPLE_JWT = {
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+# File prioritaire des urgences détectées à l'ingestion (worker dédié : celery -A transport_system worker -Q emergency)
+CELERY_EMERGENCY_QUEUE = 'emergency'
 
 # settings.py
 if 'test' in sys.argv: